@@ -0,0 +1,6 @@
+"""
+Analytics engines backing the OFW admin dashboard.
+
+The Flask routes in app.py stay thin; the number crunching for the
+dashboard panels lives in the modules of this package.
+"""
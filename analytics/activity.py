@@ -0,0 +1,308 @@
+"""
+Per-day active-user bitmaps.
+
+User activity metrics only had ``lastLoginAt``: "retention" meant "last
+login at least N days after signup", and DAU/WAU rescanned every user. The
+ActivityStore records activity events (the /chat handler produces them) as
+one bitmap per day over dense user indices, so
+
+* DAU is the popcount of a day's bitmap, WAU/MAU the popcount of the OR of
+  the last 7/30 days';
+* N-day retention of a signup cohort is the popcount of the cohort's bitmap
+  AND the bitmap of the day N days after signup.
+
+Bitmaps are Python integers (bit ``i`` set = user ``i`` active), whose
+AND/OR/bit_count run in C over the packed words; at a million users a day is
+125 KB on disk. User ids get their dense index the first time they are
+active, from an append-only ``users.idx`` file (line number = index) shared
+by all workers.
+
+Events are buffered in memory and merged into the day files under a lock
+file at most every ``ACTIVITY_FLUSH_SECONDS``, and before every query.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from .columnar import MISSING, RETENTION_PERIODS, US_PER_DAY
+from .export_jobs import JobLock
+from .timestamps import EPOCH
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_DIR = os.getenv('ACTIVITY_DIR', 'activity_bitmaps')
+ACTIVITY_FLUSH_SECONDS = int(os.getenv('ACTIVITY_FLUSH_SECONDS', '30'))
+# Day bitmaps kept in memory (re-read when their file changes)
+ACTIVITY_CACHE_DAYS = int(os.getenv('ACTIVITY_CACHE_DAYS', '400'))
+
+
+def bitmap(indices):
+    """Bitmap (int) with the given bit positions set"""
+    indices = np.fromiter(indices, dtype=np.int64)
+    if not len(indices):
+        return 0
+    flags = np.zeros(int(indices.max()) + 1, dtype=bool)
+    flags[indices] = True
+    return int.from_bytes(np.packbits(flags, bitorder='little').tobytes(), 'little')
+
+
+def bitmap_bytes(bits):
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+def _day(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value))
+
+
+class ActivityStore:
+    """
+    Daily active-user bitmaps in ``directory``.
+
+    Args:
+        directory (str): holds ``users.idx`` and one ``YYYY-MM-DD.bitmap`` per day
+        flush_seconds (int): how long recorded events may stay buffered
+    """
+
+    def __init__(self, directory=None, flush_seconds=None):
+        self.directory = directory or ACTIVITY_DIR
+        self.flush_seconds = ACTIVITY_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self.uids = []
+        self.index = {}
+        self.events = 0
+        self._index_offset = 0
+        self._pending = {}
+        self._cache = OrderedDict()
+        self._flushed = time.monotonic()
+        self._pending_lock = threading.Lock()
+        self._io = threading.RLock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # ------------------------------------------------------------------
+    # Events
+    # ------------------------------------------------------------------
+
+    def record(self, user_id, when=None):
+        """Mark a user active on the day of ``when`` (default now); never raises"""
+        day = _day(when or datetime.now()).isoformat()
+        with self._pending_lock:
+            self._pending.setdefault(day, set()).add(str(user_id))
+            self.events += 1
+        if time.monotonic() - self._flushed >= self.flush_seconds:
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Activity flush failed: {e}")
+
+    def _read_index(self):
+        """Pick up user ids other workers appended to users.idx"""
+        path = self._path('users.idx')
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return
+        if size == self._index_offset:
+            return
+        with open(path, 'rb') as handle:
+            handle.seek(self._index_offset)
+            data = handle.read(size - self._index_offset)
+        complete = data[:data.rfind(b'\n') + 1]
+        for line in complete.decode('utf-8').splitlines():
+            self.index[line] = len(self.uids)
+            self.uids.append(line)
+        self._index_offset += len(complete)
+
+    def flush(self):
+        """Merge buffered events into the day bitmaps; returns the number of days written"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        self._flushed = time.monotonic()
+        if not pending:
+            return 0
+        with self._io:
+            os.makedirs(self.directory, exist_ok=True)
+            with JobLock(self._path('.lock')):
+                self._read_index()
+                new = sorted(set().union(*pending.values()) - self.index.keys())
+                if new:
+                    with open(self._path('users.idx'), 'a', encoding='utf-8') as handle:
+                        handle.write(''.join(uid + '\n' for uid in new))
+                    self._read_index()
+                for day, uids in pending.items():
+                    bits = self._load(day) | bitmap(self.index[uid] for uid in uids)
+                    temporary = self._path(f'{day}.bitmap.tmp')
+                    with open(temporary, 'wb') as handle:
+                        handle.write(bitmap_bytes(bits))
+                    os.replace(temporary, self._path(f'{day}.bitmap'))
+        return len(pending)
+
+    # ------------------------------------------------------------------
+    # Bitmaps
+    # ------------------------------------------------------------------
+
+    def _load(self, day):
+        """A day's bitmap, from the cache while the file is unchanged; the caller holds _io"""
+        path = self._path(f'{day}.bitmap')
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return 0
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = self._cache.get(day)
+        if cached is not None and cached[0] == version:
+            self._cache.move_to_end(day)
+            return cached[1]
+        with open(path, 'rb') as handle:
+            bits = int.from_bytes(handle.read(), 'little')
+        self._cache[day] = (version, bits)
+        while len(self._cache) > ACTIVITY_CACHE_DAYS:
+            self._cache.popitem(last=False)
+        return bits
+
+    def day(self, day):
+        """Bitmap of the users active on ``day``"""
+        self.flush()
+        with self._io:
+            return self._load(_day(day).isoformat())
+
+    def active(self, end, days):
+        """Bitmap of the users active in the ``days`` days up to and including ``end``"""
+        self.flush()
+        end = _day(end)
+        bits = 0
+        with self._io:
+            for offset in range(days):
+                bits |= self._load((end - timedelta(days=offset)).isoformat())
+        return bits
+
+    def tracked_days(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len('.bitmap')] for name in names if name.endswith('.bitmap'))
+
+    # ------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------
+
+    def counts(self, day=None):
+        """DAU, WAU and MAU as of ``day`` (default today)"""
+        day = _day(day or datetime.now())
+        return {
+            'date': day.isoformat(),
+            'daily_active_users': self.day(day).bit_count(),
+            'weekly_active_users': self.active(day, 7).bit_count(),
+            'monthly_active_users': self.active(day, 30).bit_count(),
+        }
+
+    def series(self, end=None, days=30):
+        """Daily DAU/WAU/MAU for the ``days`` days up to ``end``, oldest first"""
+        self.flush()
+        end = _day(end or datetime.now())
+        with self._io:
+            # Each day is loaded once; the rolling windows are ORs of the loaded bitmaps
+            window = [self._load((end - timedelta(days=offset)).isoformat()) for offset in range(days + 29)]
+        rows = []
+        for offset in range(days - 1, -1, -1):
+            week = 0
+            for bits in window[offset:offset + 7]:
+                week |= bits
+            month = week
+            for bits in window[offset + 7:offset + 30]:
+                month |= bits
+            rows.append({
+                'date': (end - timedelta(days=offset)).isoformat(),
+                'daily_active_users': window[offset].bit_count(),
+                'weekly_active_users': week.bit_count(),
+                'monthly_active_users': month.bit_count(),
+            })
+        return rows
+
+    def retention(self, users, periods=RETENTION_PERIODS, today=None):
+        """
+        True N-day retention of monthly signup cohorts.
+
+        ``users`` are UserColumns (ids and createdAt). A user counts as
+        retained for period N when active on exactly the Nth day after their
+        signup day. Only signup days whose Nth day has been tracked (and is
+        not in the future) are eligible, so each period reports its own
+        eligible cohort size; the rate is None when nobody is eligible yet.
+        """
+        self.flush()
+        today = _day(today or datetime.now())
+        tracked = self.tracked_days()
+        first_tracked = date.fromisoformat(tracked[0]) if tracked else None
+
+        registered = users.created_at != MISSING
+        signup_days = users.created_at[registered] // US_PER_DAY
+        ids = np.asarray(users.ids, dtype=object)[registered]
+        days, inverse = np.unique(signup_days, return_inverse=True)
+        # Members of each signup day are contiguous once sorted by day
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(inverse, minlength=len(days)))))
+
+        cohorts = OrderedDict()
+        overall = {period: [0, 0] for period in periods}
+        with self._io:
+            # flush() returns early with nothing pending; users other workers indexed must still count
+            self._read_index()
+            for position, day_index in enumerate(days):
+                signup = (EPOCH + timedelta(days=int(day_index))).date()
+                members = ids[order[bounds[position]:bounds[position + 1]]]
+                month = cohorts.setdefault(signup.strftime('%Y-%m'), {
+                    'total_users': 0, **{period: [0, 0] for period in periods}})
+                month['total_users'] += len(members)
+                cohort = None
+                for period in periods:
+                    target = signup + timedelta(days=period)
+                    if first_tracked is None or target < first_tracked or target > today:
+                        continue
+                    if cohort is None:
+                        cohort = bitmap(self.index[uid] for uid in members if uid in self.index)
+                    retained = (cohort & self._load(target.isoformat())).bit_count()
+                    for counts in (month[period], overall[period]):
+                        counts[0] += retained
+                        counts[1] += len(members)
+
+        def rate(counts):
+            return round(counts[0] / counts[1] * 100, 2) if counts[1] else None
+
+        rows = []
+        for cohort_month, month in cohorts.items():
+            row = {'cohort_month': cohort_month, 'total_users': month['total_users']}
+            for period in periods:
+                row[f'retention_{period}_day'] = rate(month[period])
+                row[f'eligible_{period}_day'] = month[period][1]
+            rows.append(row)
+        return {
+            'cohorts': rows,
+            'retention_curve': {f'retention_{period}_day': rate(overall[period]) for period in periods},
+            'tracked_since': tracked[0] if tracked else None,
+        }
+
+    def status(self):
+        with self._pending_lock:
+            pending = sum(len(uids) for uids in self._pending.values())
+        tracked = self.tracked_days()
+        with self._io:
+            self._read_index()
+        return {
+            'directory': self.directory,
+            'users_indexed': len(self.uids),
+            'days_tracked': len(tracked),
+            'tracked_since': tracked[0] if tracked else None,
+            'events_recorded': self.events,
+            'pending_events': pending,
+            'bytes': sum(os.path.getsize(self._path(f'{day}.bitmap')) for day in tracked),
+        }
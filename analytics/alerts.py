@@ -0,0 +1,466 @@
+"""
+Incremental business alert rules.
+
+Alert rules are declared as data: a metric expression over named counters
+(``monthly_cancellations / subscriptions_active_at_month_start * 100``), a
+comparison and a threshold. The counters live in a MetricState that is kept
+up to date one document change at a time: each document's contribution to
+every counter is remembered, so a change only subtracts the old contribution
+and adds the new one. Contributions that change with the clock rather than
+the data - a cancelled subscription's expiry passing - are kept in a heap of
+due times and rolled in as evaluation time passes them. A rule is
+re-evaluated only when a counter it reads has changed since its last
+evaluation.
+
+Fired alerts are deduplicated (a rule that keeps breaching its threshold
+stays one open alert) and use hysteresis: an alert opens when the value
+crosses ``threshold`` and only resolves once it is back past
+``clear_threshold``, so a metric hovering at the limit does not flap. Every
+rule reports how often it was evaluated or skipped and what that cost.
+"""
+import ast
+import heapq
+import logging
+import operator
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from .fields import SUBSCRIPTION_STATES
+from .lifecycle import subscription_phases
+from .timestamps import to_epoch_us
+
+logger = logging.getLogger(__name__)
+
+# Closed alerts kept for the history endpoint
+HISTORY_SIZE = 200
+
+
+def month_start(now):
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+# ----------------------------------------------------------------------------
+# Metric expressions
+# ----------------------------------------------------------------------------
+
+_BINARY = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+}
+
+
+def compile_expression(expression):
+    """
+    Compile an arithmetic expression over counter names.
+
+    Returns ``(evaluate, names)`` where ``evaluate(values)`` computes the
+    expression from a counter mapping. Only numbers, names, parentheses,
+    unary minus and + - * / are allowed. As everywhere on the dashboard, a
+    division by zero gives 0 rather than an error.
+    """
+    tree = ast.parse(expression, mode='eval')
+    names = []
+
+    def build(node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            value = node.value
+            return lambda values: value
+        if isinstance(node, ast.Name):
+            name = node.id
+            if name not in names:
+                names.append(name)
+            return lambda values: values.get(name, 0)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            operand = build(node.operand)
+            return lambda values: -operand(values)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Div):
+            left, right = build(node.left), build(node.right)
+
+            def divide(values):
+                denominator = right(values)
+                return left(values) / denominator if denominator else 0
+            return divide
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+            apply, left, right = _BINARY[type(node.op)], build(node.left), build(node.right)
+            return lambda values: apply(left(values), right(values))
+        raise ValueError(f"Unsupported syntax in metric expression '{expression}'")
+
+    return build(tree.body), tuple(names)
+
+
+# ----------------------------------------------------------------------------
+# Incrementally maintained counters
+# ----------------------------------------------------------------------------
+
+def user_counters(data, period, now):
+    return {
+        'users_total': 1,
+        'users_unverified': 0 if data.get('emailVerified') else 1,
+    }
+
+
+def trial_counters(data, period, now):
+    return {'trials_total': 1}
+
+
+def subscription_counters(data, period, now):
+    cancelled = bool(data.get('cancelled'))
+    active = bool(data.get('isActive'))
+    counters = {
+        'subscriptions_total': 1,
+        'subscriptions_active': 1 if active else 0,
+        'subscriptions_cancelled': 1 if cancelled else 0,
+    }
+    phases = subscription_phases(data)
+    if phases is not None:
+        # Same definition as the monthly churn of analytics/lifecycle.py
+        start, _, expires = phases
+        period_start = to_epoch_us(period)
+        if start <= period_start < expires:
+            counters['subscriptions_active_at_month_start'] = 1
+        if period_start < expires <= to_epoch_us(now):
+            counters['monthly_cancellations'] = 1
+    return counters
+
+
+def payment_rollup_counters(data, period, now):
+    """The payment ledger's rollup of the current month (analytics/payments.py); other rollups count nothing"""
+    if data.get('kind') != 'month' or data.get('key') != period.strftime('%Y-%m'):
+        return {}
+    return {
+        'payment_attempts': data.get('attempts') or 0,
+        'payment_failures': data.get('failures') or 0,
+    }
+
+
+def subscription_expiry(data, period, now):
+    """When a subscription's contribution changes without a write: its expiry, if ahead this month"""
+    phases = subscription_phases(data)
+    if phases is None:
+        return None
+    expires = phases[2]
+    # Later months are recounted when the month rolls over
+    next_period = to_epoch_us((period + timedelta(days=32)).replace(day=1))
+    return expires if to_epoch_us(now) < expires < next_period else None
+
+
+# Snapshot source -> (fields each document needs, counters it contributes for a month
+# as of a time, and when that contribution next changes with the clock alone)
+BUSINESS_COUNTERS = {
+    'users': (('emailVerified',), user_counters, None),
+    'trials': ((), trial_counters, None),
+    'subscriptions': (('isActive',) + SUBSCRIPTION_STATES['subscriptions'], subscription_counters,
+                      subscription_expiry),
+    'payment_rollups': (('kind', 'key', 'attempts', 'failures'), payment_rollup_counters, None),
+}
+
+
+class MetricState:
+    """
+    Named counters maintained from document changes.
+
+    Args:
+        sources (dict): source -> ``(fields, counters(data, period, now), due(data, period, now))``;
+            the counter function says what one document adds to each counter in
+            the month starting at ``period`` as of ``now``, and ``due`` (or None)
+            when that next changes on its own (epoch microseconds, None if never)
+        now (datetime): current time (defaults to now); moved on by ``advance``
+    """
+
+    def __init__(self, sources, now=None):
+        self.sources = sources
+        self.now = now or datetime.now()
+        self.period = month_start(self.now)
+        self.values = {}
+        # Bumped whenever a counter's value changes; rules compare these
+        self.versions = {}
+        # source -> doc_id -> (projected data, contribution)
+        self.documents = {name: {} for name in sources}
+        # (due epoch us, source, doc_id) of contributions waiting on the clock
+        self.pending = []
+        self.changes_applied = 0
+        self.update_seconds = 0.0
+
+    def _contribution(self, source, doc_id, projected):
+        _, counters, due = self.sources[source]
+        if due is not None:
+            moment = due(projected, self.period, self.now)
+            if moment is not None:
+                heapq.heappush(self.pending, (moment, source, doc_id))
+        return counters(projected, self.period, self.now)
+
+    def _change(self, old, new):
+        """Move counters from one contribution to another; only net differences count as changes"""
+        for name in set(old) | set(new):
+            delta = new.get(name, 0) - old.get(name, 0)
+            if delta:
+                self.values[name] = self.values.get(name, 0) + delta
+                self.versions[name] = self.versions.get(name, 0) + 1
+
+    def _apply(self, source, doc_id, data):
+        fields = self.sources[source][0]
+        documents = self.documents[source]
+        old = documents.pop(doc_id, None)
+        new_contribution = {}
+        if data is not None:
+            projected = {field: data.get(field) for field in fields}
+            if old is not None and old[0] == projected:
+                documents[doc_id] = old
+                return
+            new_contribution = self._contribution(source, doc_id, projected)
+            documents[doc_id] = (projected, new_contribution)
+        self._change(old[1] if old is not None else {}, new_contribution)
+
+    def apply(self, source, changes):
+        """Apply ``(doc_id, data)`` changes to a source; ``data`` None removes the document"""
+        started = time.perf_counter()
+        count = 0
+        for doc_id, data in changes:
+            self._apply(source, doc_id, data)
+            count += 1
+        self.changes_applied += count
+        self.update_seconds += time.perf_counter() - started
+
+    def sync(self, source, records):
+        """Make a source match a full listing of ``(doc_id, data)`` records (only differences count)"""
+        seen = set()
+
+        def changes():
+            for doc_id, data in records:
+                seen.add(doc_id)
+                yield doc_id, data
+
+        self.apply(source, changes())
+        removed = [(doc_id, None) for doc_id in self.documents[source] if doc_id not in seen]
+        self.apply(source, removed)
+
+    def _recount(self, source, doc_id):
+        documents = self.documents[source]
+        if doc_id not in documents:
+            return
+        projected, old = documents[doc_id]
+        new = self._contribution(source, doc_id, projected)
+        if new != old:
+            self._change(old, new)
+            documents[doc_id] = (projected, new)
+
+    def roll(self, now):
+        """Move to the month containing ``now``, recounting month-relative counters from memory"""
+        period = month_start(now)
+        if period == self.period:
+            return False
+        self.period = period
+        self.now = now
+        self.pending = []
+        for source in self.sources:
+            for doc_id in list(self.documents[source]):
+                self._recount(source, doc_id)
+        return True
+
+    def advance(self, now):
+        """Move the clock to ``now``, rolling in the contributions it has changed; returns how many"""
+        self.roll(now)
+        self.now = max(self.now, now)
+        current = to_epoch_us(self.now)
+        rolled = 0
+        while self.pending and self.pending[0][0] <= current:
+            # Entries of documents changed or removed since are recounted harmlessly
+            _, source, doc_id = heapq.heappop(self.pending)
+            self._recount(source, doc_id)
+            rolled += 1
+        return rolled
+
+
+# ----------------------------------------------------------------------------
+# Rules
+# ----------------------------------------------------------------------------
+
+_COMPARISONS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+
+
+class AlertRule:
+    """
+    One alert: fires when ``expression`` compares true against ``threshold``.
+
+    Args:
+        name (str): unique rule id
+        expression (str): metric expression over counter names
+        comparison (str): one of > >= < <=
+        threshold (float): value that opens the alert
+        clear_threshold (float): value that resolves it (defaults to threshold)
+        requires (tuple): counters that must be non-zero for the rule to apply
+        decimals (int): rounding of the reported value
+        severity, category, title, message, action: alert fields; ``message``
+            is formatted with ``value`` and ``threshold``
+    """
+
+    def __init__(self, name, expression, comparison, threshold, clear_threshold=None, requires=(),
+                 decimals=2, severity='warning', category=None, title=None, message=None, action=None):
+        if comparison not in _COMPARISONS:
+            raise ValueError(f"Unknown comparison '{comparison}' in alert rule {name}")
+        self.name = name
+        self.expression = expression
+        self.comparison = comparison
+        self.threshold = threshold
+        self.clear_threshold = threshold if clear_threshold is None else clear_threshold
+        self.requires = tuple(requires)
+        self.decimals = decimals
+        self.severity = severity
+        self.category = category or name
+        self.title = title or name
+        self.message = message or '{value} (threshold: {threshold})'
+        self.action = action
+        self.evaluate, names = compile_expression(expression)
+        self.inputs = tuple(dict.fromkeys(names + self.requires))
+
+    @classmethod
+    def from_dict(cls, spec):
+        return cls(**spec)
+
+    def breached(self, value):
+        return _COMPARISONS[self.comparison](value, self.threshold)
+
+    def cleared(self, value):
+        # Past the clear threshold on the safe side
+        return not _COMPARISONS[self.comparison](value, self.clear_threshold)
+
+
+class RuleState:
+    """Evaluation bookkeeping and the open alert, if any, for one rule"""
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.seen_versions = None
+        self.value = None
+        self.applies = False
+        self.alert = None
+        self.evaluations = 0
+        self.skipped = 0
+        self.last_seconds = 0.0
+        self.total_seconds = 0.0
+
+    def to_dict(self):
+        return {
+            'rule': self.rule.name,
+            'expression': self.rule.expression,
+            'inputs': list(self.rule.inputs),
+            'value': self.value,
+            'firing': self.alert is not None,
+            'evaluations': self.evaluations,
+            'skipped': self.skipped,
+            'last_us': round(self.last_seconds * 1e6, 1),
+            'total_us': round(self.total_seconds * 1e6, 1),
+            'avg_us': round(self.total_seconds * 1e6 / self.evaluations, 1) if self.evaluations else 0
+        }
+
+
+class AlertEngine:
+    """
+    Evaluates alert rules against a MetricState.
+
+    State changes arrive through ``apply``/``sync`` (from snapshot listeners
+    or a full reload); ``evaluate`` then re-checks the rules whose inputs
+    moved and returns the open alerts.
+    """
+
+    def __init__(self, rules, sources=None, now=None, history_size=None):
+        self.state = MetricState(sources or BUSINESS_COUNTERS, now)
+        self.rules = {rule.name: RuleState(rule) for rule in rules}
+        self.history = deque(maxlen=history_size or HISTORY_SIZE)
+        self.live_sources = set()
+        self._lock = threading.RLock()
+
+    @property
+    def live(self):
+        """True once every source is kept current by a listener"""
+        return self.live_sources >= set(self.state.sources)
+
+    def apply(self, source, changes):
+        with self._lock:
+            self.state.apply(source, changes)
+
+    def sync(self, source, records):
+        with self._lock:
+            self.state.sync(source, records)
+
+    def _check(self, rule_state, now):
+        rule = rule_state.rule
+        values = self.state.values
+        started = time.perf_counter()
+        applies = all(values.get(name) for name in rule.requires)
+        value = round(rule.evaluate(values), rule.decimals) if applies else None
+        rule_state.last_seconds = time.perf_counter() - started
+        rule_state.total_seconds += rule_state.last_seconds
+        rule_state.evaluations += 1
+        rule_state.value = value
+        rule_state.applies = applies
+
+        alert = rule_state.alert
+        if alert is None:
+            if applies and rule.breached(value):
+                rule_state.alert = {
+                    'rule': rule.name,
+                    'type': rule.severity,
+                    'category': rule.category,
+                    'title': rule.title,
+                    'message': rule.message.format(value=value, threshold=rule.threshold),
+                    'value': value,
+                    'threshold': rule.threshold,
+                    'timestamp': now.isoformat(),
+                    'action': rule.action,
+                    'peak_value': value,
+                    'last_evaluated': now.isoformat()
+                }
+                logger.debug(f"Alert {rule.name} fired at {value}")
+        elif not applies or rule.cleared(value):
+            alert['resolved_at'] = now.isoformat()
+            self.history.append(alert)
+            rule_state.alert = None
+            logger.debug(f"Alert {rule.name} resolved at {value}")
+        else:
+            # Still open: update it in place rather than raising a duplicate
+            alert['value'] = value
+            alert['message'] = rule.message.format(value=value, threshold=rule.threshold)
+            alert['last_evaluated'] = now.isoformat()
+            worse = rule.breached(value) and _COMPARISONS[rule.comparison](value, alert['peak_value'])
+            if worse:
+                alert['peak_value'] = value
+
+    def evaluate(self, now=None):
+        """Re-check rules whose inputs changed; returns the open alerts in rule order"""
+        now = now or datetime.now()
+        with self._lock:
+            self.state.advance(now)
+            versions = self.state.versions
+            for rule_state in self.rules.values():
+                current = tuple(versions.get(name, 0) for name in rule_state.rule.inputs)
+                if current == rule_state.seen_versions:
+                    rule_state.skipped += 1
+                    continue
+                rule_state.seen_versions = current
+                self._check(rule_state, now)
+            return [dict(state.alert) for state in self.rules.values() if state.alert is not None]
+
+    def rule_stats(self):
+        with self._lock:
+            return [state.to_dict() for state in self.rules.values()]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'live': self.live,
+                'documents': {source: len(docs) for source, docs in self.state.documents.items()},
+                'changes_applied': self.state.changes_applied,
+                'pending_expiries': len(self.state.pending),
+                'update_ms': round(self.state.update_seconds * 1000, 2),
+                'counters': dict(self.state.values)
+            }
+
+    def recent(self, limit=None):
+        """Resolved alerts, newest first"""
+        with self._lock:
+            resolved = list(self.history)[::-1]
+        return resolved[:limit] if limit else resolved
@@ -0,0 +1,153 @@
+"""
+User behaviour counters: journey patterns, sessions and engagement scores.
+
+calculate_user_behavior_analytics parsed up to five timestamps and scored
+every user in one Python loop, holding the GIL of the worker that also
+serves /chat. The per-user work now lives here as a partial over any slice
+of users, so analytics/executor.py can spread it over processes: a partial
+holds counts only - pattern counters and a histogram of engagement scores -
+and partials of disjoint slices merge by adding them up. behavior_report
+turns the merged counts into the panel exactly as the loop did.
+
+The trial and subscription joins stay in the caller (analytics/identity.py);
+a user is handed over as one BehaviorRecord of the few values scored.
+"""
+from collections import namedtuple
+
+from .timestamps import to_naive_datetime
+
+JOURNEY_PATTERNS = (
+    'quick_converters',     # Trial to subscription within 3 days
+    'trial_completers',     # Used full trial period
+    'trial_abandoners',     # Abandoned trial early
+    'email_verifiers',      # Verified email quickly (within 24h)
+    'delayed_verifiers',    # Verified email after 24h
+    'never_verified',       # Never verified email
+)
+SESSION_PATTERNS = (
+    'single_session',       # Only logged in once
+    'regular_user',         # Multiple logins
+    'power_user',           # Very active
+    'inactive_user',        # Registered but never logged in
+)
+
+BehaviorRecord = namedtuple('BehaviorRecord', (
+    'email_verified', 'created_at', 'email_verified_at', 'last_login_at',
+    'has_trial', 'trial_start', 'has_subscription', 'subscription_active', 'subscription_start',
+))
+
+
+def behavior_record(user_data, trial_data, subscription_data):
+    """The values of a user and its joined trial and subscription documents that are scored"""
+    trial_data = trial_data or {}
+    subscription_data = subscription_data or {}
+    return BehaviorRecord(
+        bool(user_data.get('emailVerified')), user_data.get('createdAt'), user_data.get('emailVerifiedAt'),
+        user_data.get('lastLoginAt'),
+        bool(trial_data), trial_data.get('trialStartDate'),
+        bool(subscription_data), bool(subscription_data.get('isActive')), subscription_data.get('startDate'),
+    )
+
+
+def engagement_score(record, now):
+    """Engagement score of a user (0-100)"""
+    score = 0
+    # Email verification (20 points)
+    if record.email_verified:
+        score += 20
+    # Trial usage (30 points)
+    if record.has_trial:
+        score += 30
+    # Subscription (40 points)
+    if record.has_subscription and record.subscription_active:
+        score += 40
+    # Recent activity (10 points)
+    if record.last_login_at:
+        days_since_login = (now - to_naive_datetime(record.last_login_at)).days
+        if days_since_login <= 7:
+            score += 10
+        elif days_since_login <= 30:
+            score += 5
+    return min(score, 100)
+
+
+def behavior_partial(records, now):
+    """Pattern counts and the engagement score histogram of a slice of BehaviorRecords"""
+    journey = dict.fromkeys(JOURNEY_PATTERNS, 0)
+    sessions = dict.fromkeys(SESSION_PATTERNS, 0)
+    scores = {}
+    for record in records:
+        record = BehaviorRecord(*record)
+        if not record.email_verified:
+            journey['never_verified'] += 1
+        elif record.created_at and record.email_verified_at:
+            verification = to_naive_datetime(record.email_verified_at) - to_naive_datetime(record.created_at)
+            if verification.total_seconds() / 3600 <= 24:
+                journey['email_verifiers'] += 1
+            else:
+                journey['delayed_verifiers'] += 1
+
+        if record.has_trial and record.has_subscription and record.trial_start and record.subscription_start:
+            conversion_days = (to_naive_datetime(record.subscription_start) - to_naive_datetime(record.trial_start)).days
+            if conversion_days <= 3:
+                journey['quick_converters'] += 1
+            elif conversion_days >= 6:  # Used most of trial
+                journey['trial_completers'] += 1
+            else:
+                journey['trial_abandoners'] += 1
+
+        # Simplified - a real app would keep more session data
+        sessions['regular_user' if record.last_login_at else 'inactive_user'] += 1
+
+        score = engagement_score(record, now)
+        scores[score] = scores.get(score, 0) + 1
+    return {'journey_patterns': journey, 'session_patterns': sessions, 'scores': scores}
+
+
+def merge_behavior(partials):
+    """Sum of several behavior_partial results"""
+    merged = {'journey_patterns': dict.fromkeys(JOURNEY_PATTERNS, 0),
+              'session_patterns': dict.fromkeys(SESSION_PATTERNS, 0),
+              'scores': {}}
+    for partial in partials:
+        for group in ('journey_patterns', 'session_patterns', 'scores'):
+            totals = merged[group]
+            for key, count in partial[group].items():
+                totals[key] = totals.get(key, 0) + count
+    return merged
+
+
+def engagement_metrics(scores):
+    """Average, high / low counts and distribution from a ``{score: users}`` histogram"""
+    total = sum(scores.values())
+    count = lambda predicate: sum(users for score, users in scores.items() if predicate(score))
+    distribution = {}
+    if total:
+        distribution = {
+            'high_engagement': round(count(lambda s: s >= 70) / total * 100, 2),
+            'medium_engagement': round(count(lambda s: 30 <= s < 70) / total * 100, 2),
+            'low_engagement': round(count(lambda s: s < 30) / total * 100, 2),
+        }
+    return {
+        'average_engagement_score': round(sum(score * users for score, users in scores.items()) / total, 2) if total else 0,
+        'high_engagement_users': count(lambda s: s >= 70),
+        'low_engagement_users': count(lambda s: s <= 30),
+        'engagement_distribution': distribution,
+    }
+
+
+def behavior_report(merged, total_users, total_trials):
+    """Journey and session patterns, lifecycle rates and engagement metrics from merged counts"""
+    journey = merged['journey_patterns']
+    lifecycle_analysis = {
+        'activation_rate': round((journey['email_verifiers'] + journey['delayed_verifiers']) / total_users * 100, 2),
+        'quick_verification_rate': round(journey['email_verifiers'] / total_users * 100, 2),
+        'trial_completion_rate': round(journey['trial_completers'] / total_trials * 100, 2) if total_trials else 0,
+        'quick_conversion_rate': round(journey['quick_converters'] / total_trials * 100, 2) if total_trials else 0,
+    }
+    return {
+        'journey_patterns': journey,
+        'session_patterns': merged['session_patterns'],
+        'lifecycle_analysis': lifecycle_analysis,
+        'engagement_metrics': engagement_metrics(merged['scores']),
+    }
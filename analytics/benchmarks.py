@@ -0,0 +1,259 @@
+"""
+Benchmark for the columnar analytics engine.
+
+Compares the row-by-row panel calculations (the loops app.py used to run)
+against the vectorised ones in analytics.columnar on the users and
+subscriptions of a seeded analytics.synthetic dataset, and checks that both
+produce identical output. Generating the documents is not timed; it takes
+about a minute and a half per million users.
+
+With --executor it instead times the partitioned computations of
+analytics.executor in-process and on the process pool, and reports the
+speedup against the worker and core counts.
+
+Usage:
+    python -m analytics.benchmarks                  # 10k, 100k and 1M users
+    python -m analytics.benchmarks 10000 50000      # custom sizes
+    python -m analytics.benchmarks --executor 200000
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+from . import columnar
+from .behavior import behavior_partial, behavior_record, merge_behavior
+from .columnar import SubscriptionColumns, UserColumns, plan_price, trailing_month_windows
+from .executor import AnalyticsExecutor
+from .identity import IdentityIndex
+from .synthetic import SyntheticDataset
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+# The collections the panels read
+BENCHMARK_COLLECTIONS = ('users', 'trial_history', 'subscriptions')
+
+
+# ----------------------------------------------------------------------------
+# Synthetic data
+# ----------------------------------------------------------------------------
+
+def synthetic_records(user_count, now, seed=42, profile=None):
+    """
+    ``{collection: [(doc_id, data), ...]}`` of the users, trials and subscriptions
+    of a seeded analytics.synthetic dataset; token usage is not kept
+    """
+    records = {collection: [] for collection in BENCHMARK_COLLECTIONS}
+    for collection, doc_id, data in SyntheticDataset(user_count, seed=seed, now=now, profile=profile).documents():
+        if collection in records:
+            records[collection].append((doc_id, data))
+    return records
+
+
+def column(records, name):
+    """The ``name`` field of every record, None where it is missing"""
+    return [data.get(name) for _, data in records]
+
+
+# ----------------------------------------------------------------------------
+# Row-by-row reference implementations (the historical app.py loops)
+# ----------------------------------------------------------------------------
+
+def rowwise_cohort_analysis(created, last_login, now):
+    cohorts = {}
+    for reg_date, login_date in zip(created, last_login):
+        if not reg_date:
+            continue
+        cohorts.setdefault(reg_date.strftime('%Y-%m'), []).append((reg_date, login_date))
+
+    rows = []
+    for cohort_month, members in cohorts.items():
+        counts = dict.fromkeys(columnar.RETENTION_PERIODS, 0)
+        for reg_date, login_date in members:
+            if not login_date:
+                continue
+            days_since_reg = (login_date - reg_date).days
+            for period in columnar.RETENTION_PERIODS:
+                if days_since_reg >= period:
+                    counts[period] += 1
+        total = len(members)
+        cohort_date = datetime.strptime(cohort_month, '%Y-%m')
+        row = {'cohort_month': cohort_month, 'total_users': total}
+        for period in columnar.RETENTION_PERIODS:
+            row[f'retention_{period}_day'] = round((counts[period] / total) * 100, 2)
+        row['months_since_launch'] = (now.year - cohort_date.year) * 12 + (now.month - cohort_date.month)
+        rows.append(row)
+    rows.sort(key=lambda x: x['cohort_month'])
+
+    result = {'cohorts': rows, 'total_cohorts': len(rows)}
+    for period in columnar.RETENTION_PERIODS:
+        key = f'retention_{period}_day'
+        result[f'average_{key}'] = round(sum(c[key] for c in rows) / len(rows), 2) if rows else 0
+    return result
+
+
+def rowwise_retention_metrics(last_login, now):
+    total = len(last_login)
+    if total == 0:
+        return {'retention_7_day': 0, 'retention_30_day': 0, 'retention_90_day': 0}
+    counts = {7: 0, 30: 0, 90: 0}
+    for login_dt in last_login:
+        if login_dt:
+            days_since_login = (now - login_dt).days
+            for period in counts:
+                if days_since_login <= period:
+                    counts[period] += 1
+    return {f'retention_{p}_day': round((counts[p] / total) * 100, 2) for p in counts}
+
+
+def rowwise_weekly_trend_report(created, starts, prices, now):
+    weekly_data = []
+    for i in range(7):
+        day_date = (now - timedelta(days=i)).date()
+        daily_users = sum(1 for dt in created if dt and dt.date() == day_date)
+        daily_prices = [price for dt, price in zip(starts, prices) if dt and dt.date() == day_date]
+        weekly_data.append({
+            'date': day_date.isoformat(),
+            'new_users': daily_users,
+            'new_subscriptions': len(daily_prices),
+            'revenue': round(sum(daily_prices), 2)
+        })
+    return list(reversed(weekly_data))
+
+
+def rowwise_revenue_trends(starts, is_active, prices, now):
+    trends = []
+    for month_date, _, month_end in trailing_month_windows(now):
+        active_in_month = 0
+        revenue = 0.0
+        for start_dt, active, price in zip(starts, is_active, prices):
+            if active and start_dt and start_dt <= month_end:
+                active_in_month += 1
+                revenue += price
+        trends.append({
+            'month': month_date.strftime('%Y-%m'),
+            'revenue': round(revenue, 2),
+            'active_subscriptions': active_in_month
+        })
+    return list(reversed(trends))
+
+
+def rowwise_subscription_growth_trends(starts, cancelled, will_expire, now):
+    trends = []
+    for month_date, month_start, month_end in trailing_month_windows(now):
+        new_subscriptions = 0
+        cancelled_subscriptions = 0
+        for start_dt, is_cancelled, expire_dt in zip(starts, cancelled, will_expire):
+            if start_dt and month_start <= start_dt <= month_end:
+                new_subscriptions += 1
+            if is_cancelled and expire_dt and month_start <= expire_dt <= month_end:
+                cancelled_subscriptions += 1
+        trends.append({
+            'month': month_date.strftime('%Y-%m'),
+            'new_subscriptions': new_subscriptions,
+            'cancelled_subscriptions': cancelled_subscriptions,
+            'net_growth': new_subscriptions - cancelled_subscriptions
+        })
+    return list(reversed(trends))
+
+
+# ----------------------------------------------------------------------------
+# Runner
+# ----------------------------------------------------------------------------
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def run_benchmark(user_count, now):
+    """Benchmark every panel for one dataset size; returns a list of result rows"""
+    records = synthetic_records(user_count, now)
+    users = UserColumns.from_records(records['users'])
+    subscriptions = SubscriptionColumns.from_records(records['subscriptions'])
+
+    created = column(records['users'], 'createdAt')
+    last_login = column(records['users'], 'lastLoginAt')
+    starts = column(records['subscriptions'], 'startDate')
+    will_expire = column(records['subscriptions'], 'willExpireAt')
+    is_active = [bool(active) for active in column(records['subscriptions'], 'isActive')]
+    cancelled = [bool(value) for value in column(records['subscriptions'], 'cancelled')]
+    prices = [plan_price(plan) for plan in column(records['subscriptions'], 'plan')]
+
+    cases = [
+        ('cohort_analysis',
+         lambda: rowwise_cohort_analysis(created, last_login, now),
+         lambda: columnar.cohort_analysis(users, now)),
+        ('retention_metrics',
+         lambda: rowwise_retention_metrics(last_login, now),
+         lambda: columnar.retention_metrics(users, now)),
+        ('weekly_trend_report',
+         lambda: rowwise_weekly_trend_report(created, starts, prices, now),
+         lambda: columnar.weekly_trend_report(users, subscriptions, now)),
+        ('revenue_trends',
+         lambda: rowwise_revenue_trends(starts, is_active, prices, now),
+         lambda: columnar.revenue_trends(subscriptions, now)),
+        ('subscription_growth_trends',
+         lambda: rowwise_subscription_growth_trends(starts, cancelled, will_expire, now),
+         lambda: columnar.subscription_growth_trends(subscriptions, now)),
+    ]
+
+    rows = []
+    for name, rowwise, vectorised in cases:
+        expected, rowwise_seconds = _timed(rowwise)
+        actual, vectorised_seconds = _timed(vectorised)
+        rows.append({
+            'users': user_count,
+            'panel': name,
+            'rowwise_seconds': rowwise_seconds,
+            'vectorised_seconds': vectorised_seconds,
+            'speedup': rowwise_seconds / vectorised_seconds if vectorised_seconds else float('inf'),
+            'identical': expected == actual,
+        })
+    return rows
+
+
+def run_executor_benchmark(user_count, now, executor):
+    """Time the executor's computations in-process and on the pool for one dataset size"""
+    records = synthetic_records(user_count, now)
+    # Joined the way the user behaviour panel joins them
+    identity = IdentityIndex.from_records(records['users'], records['trial_history'], records['subscriptions'])
+    trials = dict(records['trial_history'])
+    subscriptions = dict(records['subscriptions'])
+    behavior_records = [
+        behavior_record(data, trials.get(identity.trial_id(user_id, data.get('email'))),
+                        subscriptions.get(identity.subscription_id(user_id, data.get('email'))))
+        for user_id, data in records['users']
+    ]
+
+    return [
+        executor.benchmark('cohort', columnar.cohort_partial, columnar.merge_cohort_counts, records['users']),
+        executor.benchmark('user_behavior', behavior_partial, merge_behavior, behavior_records, now),
+    ]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    sizes = [int(arg) for arg in argv if arg != '--executor'] or list(DEFAULT_SIZES)
+    now = datetime.now()
+
+    if '--executor' in argv:
+        executor = AnalyticsExecutor()
+        print(f"{'users':>10} {'computation':<14} {'in-process s':>12} {'pool s':>8} {'speedup':>8} "
+              f"{'workers':>7} {'cores':>5} {'efficiency':>10}  identical")
+        for size in sizes:
+            for row in run_executor_benchmark(size, now, executor):
+                print(f"{row['records']:>10} {row['computation']:<14} {row['in_process_seconds']:>12.3f} "
+                      f"{row['pool_seconds']:>8.3f} {row['speedup']:>7.2f}x {row['workers']:>7} "
+                      f"{row['cpu_count']:>5} {row['efficiency']:>10.2f}  {row['identical']}")
+        executor.shutdown()
+        return
+
+    print(f"{'users':>10} {'panel':<28} {'rowwise s':>10} {'numpy s':>10} {'speedup':>9}  identical")
+    for size in sizes:
+        for row in run_benchmark(size, now):
+            print(f"{row['users']:>10} {row['panel']:<28} {row['rowwise_seconds']:>10.3f} "
+                  f"{row['vectorised_seconds']:>10.4f} {row['speedup']:>8.1f}x  {row['identical']}")
+
+
+if __name__ == '__main__':
+    main()
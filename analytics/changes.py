@@ -0,0 +1,200 @@
+"""
+Change journal for delta sync.
+
+Admin clients used to re-download the whole user list on every refresh. A
+ChangeJournal remembers, for each record key, a fingerprint of the record and
+the sequence number of its last change, so a client holding a sync token can
+be sent just the records that changed after it - and tombstones for the keys
+that were deleted - plus a new token.
+
+The journal is fed full listings (``sync``) or, by listeners, just the
+records that changed (``update``): only records whose fingerprint moved get
+a new sequence number, so a rebuild that changes nothing costs clients
+nothing. Entries are kept in sequence order, which makes answering a
+token proportional to the number of changes since it, not to the number of
+records.
+
+Tokens are ``<epoch>.<seq>``; the epoch is per journal instance, so a token
+from before a restart - like one older than the oldest tombstone still kept -
+gets a full reset instead of a wrong delta.
+"""
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+TOMBSTONE_LIMIT = int(os.getenv('SYNC_TOMBSTONE_LIMIT', '10000'))
+# Delta requests within this many seconds of the last rebuild share it
+REFRESH_SECONDS = int(os.getenv('SYNC_REFRESH_SECONDS', '10'))
+
+
+def fingerprint(record):
+    data = json.dumps(record, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class ChangeJournal:
+    """
+    Sequence-numbered changes to a keyed set of records.
+
+    Args:
+        tombstone_limit (int): deleted keys remembered; tokens from before
+            the oldest forgotten tombstone get a full reset
+    """
+
+    def __init__(self, tombstone_limit=None):
+        self.tombstone_limit = TOMBSTONE_LIMIT if tombstone_limit is None else tombstone_limit
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        # Changes at or below this sequence can no longer be reconstructed
+        self.horizon = 0
+        # key -> (seq, fingerprint, record or None for a tombstone), oldest change first
+        self._entries = OrderedDict()
+        self._tombstones = deque()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.synced_at = None
+        self._synced = None
+
+    # ------------------------------------------------------------------
+    # Tokens
+    # ------------------------------------------------------------------
+
+    def token(self, seq=None):
+        return f'{self.epoch}.{self.seq if seq is None else seq}'
+
+    def parse(self, token):
+        """Sequence number of a token from this journal, else None"""
+        epoch, _, seq = (token or '').partition('.')
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.seq:
+            return None
+        return int(seq)
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+
+    def _record(self, key, record, print_):
+        self.seq += 1
+        self._entries.pop(key, None)
+        self._entries[key] = (self.seq, print_, record)
+        if record is None:
+            self._tombstones.append((self.seq, key))
+
+    def _prune(self):
+        while len(self._tombstones) > self.tombstone_limit:
+            seq, key = self._tombstones.popleft()
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == seq:
+                del self._entries[key]
+            self.horizon = max(self.horizon, seq)
+
+    def _upsert(self, key, record):
+        print_ = fingerprint(record)
+        entry = self._entries.get(key)
+        if entry is None or entry[2] is None or entry[1] != print_:
+            self._record(key, record, print_)
+
+    def sync(self, records):
+        """
+        Make the journal match a full listing of ``(key, record)`` pairs.
+
+        Returns the number of changes recorded (upserts plus deletions).
+        """
+        with self._lock:
+            before = self.seq
+            seen = set()
+            for key, record in records:
+                seen.add(key)
+                self._upsert(key, record)
+            for key in [key for key, entry in self._entries.items() if entry[2] is not None and key not in seen]:
+                self._record(key, None, None)
+            self._prune()
+            self.synced_at = datetime.now()
+            self._synced = time.monotonic()
+            return self.seq - before
+
+    def update(self, records):
+        """
+        Record ``(key, record)`` changes, a None record deleting the key.
+
+        Unlike sync(), keys not listed are left alone. Returns the number of
+        changes recorded.
+        """
+        with self._lock:
+            before = self.seq
+            for key, record in records:
+                if record is not None:
+                    self._upsert(key, record)
+                elif key in self._entries and self._entries[key][2] is not None:
+                    self._record(key, None, None)
+            self._prune()
+            return self.seq - before
+
+    def refresh(self, load, max_age=None, force=False):
+        """
+        ``sync(load())`` unless the journal was synced within ``max_age``
+        seconds; concurrent callers wait for one rebuild instead of each
+        running their own. Returns True if a rebuild ran.
+        """
+        max_age = REFRESH_SECONDS if max_age is None else max_age
+        with self._refresh_lock:
+            if not force and self._synced is not None and time.monotonic() - self._synced < max_age:
+                return False
+            self.sync(load())
+            return True
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+
+    def changes(self, since=None, limit=None):
+        """
+        Records changed after the token ``since``.
+
+        Returns ``{'changes', 'deleted', 'token', 'reset', 'has_more'}``:
+        ``reset`` means the token could not be used and ``changes`` is every
+        current record (the client should replace its copy). With ``limit``,
+        at most that many entries are returned, oldest first, and the token
+        points just after the last one.
+        """
+        with self._lock:
+            seq = self.parse(since)
+            reset = seq is None or seq < self.horizon
+            if reset:
+                entries = [(key, entry) for key, entry in self._entries.items() if entry[2] is not None]
+            else:
+                entries = []
+                for key in reversed(self._entries):
+                    entry = self._entries[key]
+                    if entry[0] <= seq:
+                        break
+                    entries.append((key, entry))
+                entries.reverse()
+
+            has_more = limit is not None and not reset and len(entries) > limit
+            if has_more:
+                entries = entries[:limit]
+            token = self.token(entries[-1][1][0]) if has_more else self.token()
+
+            return {
+                'changes': [entry[2] for _, entry in entries if entry[2] is not None],
+                'deleted': [key for key, entry in entries if entry[2] is None],
+                'token': token,
+                'reset': reset,
+                'has_more': has_more,
+            }
+
+    def status(self):
+        with self._lock:
+            return {
+                'token': self.token(),
+                'records': sum(1 for entry in self._entries.values() if entry[2] is not None),
+                'tombstones': sum(1 for entry in self._entries.values() if entry[2] is None),
+                'horizon': self.horizon,
+                'synced_at': self.synced_at.isoformat() if self.synced_at else None,
+            }
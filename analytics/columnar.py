@@ -0,0 +1,370 @@
+"""
+Columnar analytics engine.
+
+Loads the ``users`` and ``subscriptions`` collections into NumPy column
+arrays (int64 epoch-microsecond timestamps, boolean flags and categorical
+status codes) and computes the cohort, retention and trend panels with
+vectorised bincount/searchsorted operations instead of nested Python loops.
+
+Every calculation returns exactly the same JSON structure (and values) as
+the row-by-row implementations it replaces in app.py.
+"""
+import json
+import os
+from datetime import datetime, time, timedelta
+
+import numpy as np
+
+from .timestamps import EPOCH, to_epoch_us, to_naive_datetime
+
+# Sentinel for missing / unparseable timestamps
+MISSING = np.iinfo(np.int64).min
+
+US_PER_DAY = 86_400 * 1_000_000
+
+# Categorical codes for subscription ``status``; 0 means missing or unknown
+STATUS_CODES = ('active', 'cancelled', 'expired', 'suspended', 'trial')
+STATUS_INDEX = {status: code for code, status in enumerate(STATUS_CODES, start=1)}
+
+RETENTION_PERIODS = (1, 7, 30, 90)
+# Monthly price of a subscription (of plans without their own price in PLAN_PRICES)
+MONTHLY_FEE = float(os.getenv('DEFAULT_PLAN_PRICE', '3.0'))
+
+
+def load_plan_prices(text=None):
+    """Monthly price per plan from PLAN_PRICES; raises ValueError if it is not a JSON object of numbers"""
+    text = os.getenv('PLAN_PRICES', '{}') if text is None else text
+    prices = json.loads(text)
+    if not isinstance(prices, dict):
+        raise ValueError("PLAN_PRICES must be a JSON object of plan -> monthly price")
+    return {str(plan): float(price) for plan, price in prices.items()}
+
+
+PLAN_PRICES = load_plan_prices()
+
+
+def plan_price(plan, prices=None):
+    """Monthly price of a plan (DEFAULT_PLAN_PRICE when it has none configured)"""
+    return (PLAN_PRICES if prices is None else prices).get(plan, MONTHLY_FEE)
+
+
+def _epoch_us_or_missing(value):
+    """Parse a raw Firestore value into epoch microseconds, MISSING if empty or invalid"""
+    try:
+        dt = to_naive_datetime(value)
+    except (TypeError, ValueError):
+        return MISSING
+    return MISSING if dt is None else to_epoch_us(dt)
+
+
+def _iter_records(snapshots):
+    for snapshot in snapshots:
+        yield snapshot.id, snapshot.to_dict() or {}
+
+
+class UserColumns:
+    """Column arrays for the ``users`` collection"""
+
+    def __init__(self, ids, created_at, last_login, email_verified_at, email_verified):
+        self.ids = ids
+        self.created_at = created_at
+        self.last_login = last_login
+        self.email_verified_at = email_verified_at
+        self.email_verified = email_verified
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_records(cls, records):
+        """Build columns from an iterable of ``(doc_id, data)`` pairs"""
+        ids, created_at, last_login, verified_at, verified = [], [], [], [], []
+        for doc_id, data in records:
+            ids.append(doc_id)
+            created_at.append(_epoch_us_or_missing(data.get('createdAt')))
+            last_login.append(_epoch_us_or_missing(data.get('lastLoginAt')))
+            verified_at.append(_epoch_us_or_missing(data.get('emailVerifiedAt')))
+            verified.append(bool(data.get('emailVerified', False)))
+
+        return cls(
+            ids,
+            np.array(created_at, dtype=np.int64),
+            np.array(last_login, dtype=np.int64),
+            np.array(verified_at, dtype=np.int64),
+            np.array(verified, dtype=bool),
+        )
+
+    @classmethod
+    def from_snapshots(cls, snapshots):
+        """Build columns from Firestore DocumentSnapshots"""
+        return cls.from_records(_iter_records(snapshots))
+
+
+class SubscriptionColumns:
+    """Column arrays for the ``subscriptions`` collection"""
+
+    def __init__(self, ids, start, end, will_expire, is_active, cancelled, status, price=None):
+        self.ids = ids
+        self.start = start
+        self.end = end
+        self.will_expire = will_expire
+        self.is_active = is_active
+        self.cancelled = cancelled
+        self.status = status
+        # Monthly price of each subscription's plan
+        self.price = np.full(len(ids), MONTHLY_FEE) if price is None else price
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_records(cls, records):
+        """Build columns from an iterable of ``(doc_id, data)`` pairs"""
+        ids, start, end, will_expire, is_active, cancelled, status, price = [], [], [], [], [], [], [], []
+        for doc_id, data in records:
+            ids.append(doc_id)
+            start.append(_epoch_us_or_missing(data.get('startDate')))
+            end.append(_epoch_us_or_missing(data.get('subscriptionEndDate')))
+            will_expire.append(_epoch_us_or_missing(data.get('willExpireAt')))
+            is_active.append(bool(data.get('isActive')))
+            cancelled.append(bool(data.get('cancelled')))
+            status.append(STATUS_INDEX.get(data.get('status'), 0))
+            price.append(plan_price(data.get('plan')))
+
+        return cls(
+            ids,
+            np.array(start, dtype=np.int64),
+            np.array(end, dtype=np.int64),
+            np.array(will_expire, dtype=np.int64),
+            np.array(is_active, dtype=bool),
+            np.array(cancelled, dtype=bool),
+            np.array(status, dtype=np.int8),
+            np.array(price, dtype=np.float64),
+        )
+
+    @classmethod
+    def from_snapshots(cls, snapshots):
+        """Build columns from Firestore DocumentSnapshots"""
+        return cls.from_records(_iter_records(snapshots))
+
+    def status_is(self, status):
+        """Boolean mask of subscriptions whose ``status`` equals the given value"""
+        return self.status == STATUS_INDEX[status]
+
+
+# ----------------------------------------------------------------------------
+# Bucketing helpers
+# ----------------------------------------------------------------------------
+
+def _day_index(day):
+    """Days since the epoch for a date"""
+    return (datetime.combine(day, time()) - EPOCH).days
+
+
+def _month_label(month_index):
+    year, month = divmod(int(month_index), 12)
+    return f"{1970 + year:04d}-{month + 1:02d}"
+
+
+def _count_in_ranges(sorted_values, lows, highs):
+    """Count sorted values falling in each inclusive [low, high] range"""
+    return (np.searchsorted(sorted_values, highs, side='right')
+            - np.searchsorted(sorted_values, lows, side='left'))
+
+
+def _sum_in_ranges(sorted_values, weights, lows, highs):
+    """Sum of the weights of sorted values falling in each inclusive [low, high] range"""
+    totals = np.concatenate(([0.0], np.cumsum(weights)))
+    return (totals[np.searchsorted(sorted_values, highs, side='right')]
+            - totals[np.searchsorted(sorted_values, lows, side='left')])
+
+
+def trailing_month_windows(now, months=6):
+    """
+    The (month_date, month_start, month_end) windows used by the trend panels.
+
+    Mirrors the historical bucketing exactly: buckets step back 30 days at a
+    time and month_end keeps the time-of-day of ``now``.
+    """
+    windows = []
+    for i in range(months):
+        month_date = now - timedelta(days=30 * i)
+        month_start = month_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+        if month_date.month == 12:
+            next_month = month_date.replace(year=month_date.year + 1, month=1, day=1)
+        else:
+            next_month = month_date.replace(month=month_date.month + 1, day=1)
+
+        windows.append((month_date, month_start, next_month - timedelta(seconds=1)))
+    return windows
+
+
+# ----------------------------------------------------------------------------
+# Panel calculations
+# ----------------------------------------------------------------------------
+
+def cohort_counts(users):
+    """
+    ``{month index: [users, retained per RETENTION_PERIODS...]}`` per registration
+    month; counts of disjoint sets of users add up (see analytics/executor.py)
+    """
+    registered = users.created_at != MISSING
+    reg = users.created_at[registered]
+    login = users.last_login[registered]
+
+    month_index = reg.astype('datetime64[us]').astype('datetime64[M]').astype(np.int64)
+    cohort_months, inverse = np.unique(month_index, return_inverse=True)
+    totals = np.bincount(inverse, minlength=len(cohort_months))
+
+    has_login = login != MISSING
+    days_since_reg = np.full(len(reg), np.iinfo(np.int64).min, dtype=np.int64)
+    days_since_reg[has_login] = (login[has_login] - reg[has_login]) // US_PER_DAY
+
+    retained = [
+        np.bincount(inverse[has_login & (days_since_reg >= period)], minlength=len(cohort_months))
+        for period in RETENTION_PERIODS
+    ]
+    return {
+        int(month): [int(totals[position])] + [int(counts[position]) for counts in retained]
+        for position, month in enumerate(cohort_months)
+    }
+
+
+def merge_cohort_counts(partials):
+    """Sum of several cohort_counts results"""
+    merged = {}
+    for counts in partials:
+        for month, row in counts.items():
+            total = merged.setdefault(month, [0] * len(row))
+            for position, value in enumerate(row):
+                total[position] += value
+    return merged
+
+
+def cohort_report(counts, now):
+    """The cohort panel from cohort_counts"""
+    cohort_rows = []
+    for month, (total_users, *retained) in sorted(counts.items()):
+        year, month_of_year = divmod(month, 12)
+        row = {
+            'cohort_month': _month_label(month),
+            'total_users': total_users,
+        }
+        for period, retained_users in zip(RETENTION_PERIODS, retained):
+            row[f'retention_{period}_day'] = round((retained_users / total_users) * 100, 2)
+        row['months_since_launch'] = (now.year - (1970 + year)) * 12 + (now.month - (month_of_year + 1))
+        cohort_rows.append(row)
+
+    result = {
+        'cohorts': cohort_rows,
+        'total_cohorts': len(cohort_rows),
+    }
+    for period in RETENTION_PERIODS:
+        key = f'retention_{period}_day'
+        result[f'average_{key}'] = round(sum(c[key] for c in cohort_rows) / len(cohort_rows), 2) if cohort_rows else 0
+    return result
+
+
+def cohort_analysis(users, now):
+    """Vectorised equivalent of calculate_cohort_analysis"""
+    return cohort_report(cohort_counts(users), now)
+
+
+def cohort_partial(records):
+    """cohort_counts of ``(doc_id, data)`` user records, for the analytics executor"""
+    return cohort_counts(UserColumns.from_records(records))
+
+
+def retention_metrics(users, now):
+    """Vectorised equivalent of calculate_retention_metrics"""
+    total_users = len(users)
+    if total_users == 0:
+        return {
+            'retention_7_day': 0,
+            'retention_30_day': 0,
+            'retention_90_day': 0
+        }
+
+    login = users.last_login[users.last_login != MISSING]
+    days_since_login = (to_epoch_us(now) - login) // US_PER_DAY
+
+    return {
+        f'retention_{period}_day': round((int(np.count_nonzero(days_since_login <= period)) / total_users) * 100, 2)
+        for period in (7, 30, 90)
+    }
+
+
+def weekly_trend_report(users, subscriptions, now):
+    """Vectorised equivalent of generate_weekly_trend_report"""
+    user_days = np.sort(users.created_at[users.created_at != MISSING] // US_PER_DAY)
+    started = subscriptions.start != MISSING
+    order = np.argsort(subscriptions.start[started], kind='stable')
+    sub_days = (subscriptions.start[started] // US_PER_DAY)[order]
+    sub_prices = subscriptions.price[started][order]
+
+    dates = [(now - timedelta(days=i)).date() for i in range(7)]
+    day_indexes = np.array([_day_index(d) for d in dates], dtype=np.int64)
+
+    new_users = _count_in_ranges(user_days, day_indexes, day_indexes)
+    new_subscriptions = _count_in_ranges(sub_days, day_indexes, day_indexes)
+    new_revenue = _sum_in_ranges(sub_days, sub_prices, day_indexes, day_indexes)
+
+    weekly_data = [
+        {
+            'date': day_date.isoformat(),
+            'new_users': int(new_users[i]),
+            'new_subscriptions': int(new_subscriptions[i]),
+            'revenue': round(float(new_revenue[i]), 2)
+        }
+        for i, day_date in enumerate(dates)
+    ]
+    return list(reversed(weekly_data))
+
+
+def revenue_trends(subscriptions, now):
+    """Vectorised equivalent of calculate_revenue_trends"""
+    mask = subscriptions.is_active & (subscriptions.start != MISSING)
+    order = np.argsort(subscriptions.start[mask], kind='stable')
+    active_starts = subscriptions.start[mask][order]
+    active_prices = subscriptions.price[mask][order]
+
+    windows = trailing_month_windows(now)
+    month_ends = np.array([to_epoch_us(end) for _, _, end in windows], dtype=np.int64)
+    active_counts = np.searchsorted(active_starts, month_ends, side='right')
+    active_revenue = np.concatenate(([0.0], np.cumsum(active_prices)))[active_counts]
+
+    trends = [
+        {
+            'month': month_date.strftime('%Y-%m'),
+            'revenue': round(float(active_revenue[i]), 2),
+            'active_subscriptions': int(active_counts[i])
+        }
+        for i, (month_date, _, _) in enumerate(windows)
+    ]
+    return list(reversed(trends))
+
+
+def subscription_growth_trends(subscriptions, now):
+    """Vectorised equivalent of calculate_subscription_growth_trends"""
+    starts = np.sort(subscriptions.start[subscriptions.start != MISSING])
+    cancelled_mask = subscriptions.cancelled & (subscriptions.will_expire != MISSING)
+    expiries = np.sort(subscriptions.will_expire[cancelled_mask])
+
+    windows = trailing_month_windows(now)
+    lows = np.array([to_epoch_us(start) for _, start, _ in windows], dtype=np.int64)
+    highs = np.array([to_epoch_us(end) for _, _, end in windows], dtype=np.int64)
+
+    new_counts = _count_in_ranges(starts, lows, highs)
+    cancelled_counts = _count_in_ranges(expiries, lows, highs)
+
+    trends = [
+        {
+            'month': month_date.strftime('%Y-%m'),
+            'new_subscriptions': int(new_counts[i]),
+            'cancelled_subscriptions': int(cancelled_counts[i]),
+            'net_growth': int(new_counts[i]) - int(cancelled_counts[i])
+        }
+        for i, (month_date, _, _) in enumerate(windows)
+    ]
+    return list(reversed(trends))
@@ -0,0 +1,180 @@
+"""
+Process-pool execution of CPU-bound analytics over partitioned records.
+
+Once the documents are in memory, scoring users' behaviour or building the
+cohort columns is pure Python that holds the GIL; on a big collection it
+stalls every other request of the gunicorn worker, /chat included. The
+AnalyticsExecutor splits the records into partitions, computes a partial
+result per partition on a pool of processes and merges the partials in the
+calling thread. A computation is a pair of module-level functions:
+
+* ``partial(records, *args)`` - the result for one slice of the records;
+* ``merge(partials)`` - the result for their union.
+
+Partials must merge exactly (counters, histograms) so the answer does not
+depend on how the records were split. Below ANALYTICS_POOL_MIN_RECORDS
+records, with one worker, or if the pool cannot be used, the same two
+functions run in-process - the pool only ever changes where the work runs.
+
+The pool uses the 'spawn' start method: the dashboard runs listener and
+scan threads, and forking a threaded process can deadlock the child.
+Workers start on first use and live as long as the process. Spawned workers
+re-import the main script, which is harmless under gunicorn; set
+ANALYTICS_WORKERS=1 when running ``python app.py`` on big data.
+
+Each run is timed; benchmark() runs a computation both ways and reports the
+speedup against the worker and core counts (python -m analytics.benchmarks
+--executor).
+"""
+import atexit
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pickle import PicklingError
+
+logger = logging.getLogger(__name__)
+
+# Worker processes (0: one per core)
+ANALYTICS_WORKERS = int(os.getenv('ANALYTICS_WORKERS', '0'))
+# Smaller inputs are computed in-process; shipping them to workers costs more than it saves
+ANALYTICS_POOL_MIN_RECORDS = int(os.getenv('ANALYTICS_POOL_MIN_RECORDS', '50000'))
+# Partitions per worker; more than one evens out slow partitions
+ANALYTICS_PARTITIONS_PER_WORKER = int(os.getenv('ANALYTICS_PARTITIONS_PER_WORKER', '2'))
+
+
+def partitions(records, count):
+    """Split a sequence into at most ``count`` contiguous slices of near-equal size"""
+    size = max(1, math.ceil(len(records) / max(1, count)))
+    return [records[start:start + size] for start in range(0, len(records), size)]
+
+
+class AnalyticsExecutor:
+    """
+    Runs partial/merge computations on a process pool, or in-process for small inputs.
+
+    Args:
+        workers (int): worker processes (default ANALYTICS_WORKERS, 0 for one per core)
+        min_records (int): smallest input sent to the pool (default ANALYTICS_POOL_MIN_RECORDS)
+    """
+
+    def __init__(self, workers=None, min_records=None):
+        workers = ANALYTICS_WORKERS if workers is None else workers
+        self.cpu_count = os.cpu_count() or 1
+        self.workers = workers or self.cpu_count
+        self.min_records = ANALYTICS_POOL_MIN_RECORDS if min_records is None else min_records
+        self.runs = {}
+        self._pool = None
+        self._disabled = None
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Pool
+    # ------------------------------------------------------------------
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None and self._disabled is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+                atexit.register(self.shutdown)
+            return self._pool
+
+    def _disable(self, error):
+        """Fall back to in-process execution for good after the pool failed"""
+        logger.warning(f"Analytics process pool unavailable, computing in-process: {error}")
+        with self._lock:
+            self._disabled = str(error)
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def uses_pool(self, record_count):
+        """Whether ``record_count`` records would be computed on the pool"""
+        return self.workers > 1 and record_count >= self.min_records and self._disabled is None
+
+    # ------------------------------------------------------------------
+    # Execution
+    # ------------------------------------------------------------------
+
+    def _run_pool(self, partial, merge, records, args):
+        pool = self._get_pool()
+        if pool is None:
+            return None
+        slices = partitions(records, self.workers * ANALYTICS_PARTITIONS_PER_WORKER)
+        try:
+            futures = [pool.submit(partial, part, *args) for part in slices]
+            return merge([future.result() for future in futures]), len(slices)
+        except (BrokenProcessPool, PicklingError, OSError) as e:
+            # Errors of the computation itself propagate as they would in-process
+            self._disable(e)
+            return None
+
+    def run(self, name, partial, merge, records, *args, use_pool=None):
+        """
+        ``merge`` of ``partial(slice, *args)`` over slices of ``records``. ``use_pool``
+        forces (True) or prevents (False) the pool; by default it depends on the size
+        """
+        records = records if isinstance(records, (list, tuple)) else list(records)
+        if use_pool is None:
+            use_pool = self.uses_pool(len(records))
+        started = time.perf_counter()
+        outcome = self._run_pool(partial, merge, records, args) if use_pool and self.workers > 1 else None
+        if outcome is None:
+            result, mode, partition_count = merge([partial(records, *args)]), 'in-process', 1
+        else:
+            (result, partition_count), mode = outcome, 'pool'
+        seconds = time.perf_counter() - started
+        self.runs[name] = {
+            'mode': mode,
+            'records': len(records),
+            'partitions': partition_count,
+            'seconds': round(seconds, 4),
+            'records_per_second': round(len(records) / seconds) if seconds else None,
+        }
+        return result
+
+    def benchmark(self, name, partial, merge, records, *args):
+        """Time a computation in-process and on the pool; the speedup is against the cores"""
+        records = list(records)
+        self.run(name, partial, merge, records, *args, use_pool=True)  # start the workers
+        started = time.perf_counter()
+        expected = self.run(name, partial, merge, records, *args, use_pool=False)
+        in_process = time.perf_counter() - started
+        started = time.perf_counter()
+        actual = self.run(name, partial, merge, records, *args, use_pool=True)
+        pooled = time.perf_counter() - started
+        speedup = in_process / pooled if pooled else float('inf')
+        return {
+            'computation': name,
+            'records': len(records),
+            'mode': self.runs[name]['mode'],
+            'workers': self.workers,
+            'cpu_count': self.cpu_count,
+            'in_process_seconds': round(in_process, 4),
+            'pool_seconds': round(pooled, 4),
+            'speedup': round(speedup, 2),
+            # Share of the ideal linear speedup achieved
+            'efficiency': round(speedup / min(self.workers, self.cpu_count), 2),
+            'identical': expected == actual,
+        }
+
+    def status(self):
+        return {
+            'workers': self.workers,
+            'cpu_count': self.cpu_count,
+            'min_records': self.min_records,
+            'pool_started': self._pool is not None,
+            'disabled': self._disabled,
+            'runs': dict(self.runs),
+        }
@@ -0,0 +1,455 @@
+"""
+Background export jobs.
+
+A streamed export (analytics/export.py) ties a request up for as long as the
+collection takes to read. An export job runs the same scan on a small worker
+pool instead and writes the rows to an artifact file, so the client gets a
+job id straight away, polls its progress and downloads the finished file
+(with range requests) when it is ready.
+
+Job state lives next to the artifacts as one JSON file per job, so it is
+shared by every gunicorn worker and survives a restart: ``recover()`` picks
+unfinished jobs back up, and CSV/NDJSON jobs continue from the last saved
+scan checkpoint rather than starting over. A per-job file lock keeps two
+processes from running the same job. Asking for an export that is already
+queued, running, or finished within EXPORT_DEDUP_MINUTES returns that job
+instead of starting another.
+
+Finished jobs are kept for EXPORT_ARTIFACT_TTL_HOURS: after that ``cleanup()``
+deletes the artifact and the job record, along with any stray file in the
+directory no job refers to. It runs on startup (``recover()``) and whenever a
+job is created, so the directory stays bounded without a separate sweeper.
+
+Parquet output needs pyarrow (in requirements.txt); without it only CSV and
+NDJSON jobs are offered and a parquet request is rejected when it is made.
+"""
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from .export import csv_chunks, ndjson_chunks
+from .scan import PartitionedScan
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX development machines
+    fcntl = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_DIR = os.getenv('EXPORT_ARTIFACT_DIR', 'export_artifacts')
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', '2'))
+DEDUP_MINUTES = int(os.getenv('EXPORT_DEDUP_MINUTES', '15'))
+# Finished jobs and their artifacts are deleted after this long
+ARTIFACT_TTL_HOURS = float(os.getenv('EXPORT_ARTIFACT_TTL_HOURS', '24'))
+PARQUET_BATCH_ROWS = int(os.getenv('EXPORT_PARQUET_BATCH_ROWS', '10000'))
+
+# Job state (progress and resume checkpoint) is saved at most this often
+PROGRESS_SECONDS = float(os.getenv('EXPORT_PROGRESS_SECONDS', '1.0'))
+
+JOB_FORMATS = ('csv', 'ndjson', 'parquet') if pyarrow is not None else ('csv', 'ndjson')
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+JOB_ID = re.compile(r'[0-9a-f]{32}')
+
+# What a job type exports: the collection, its projection and the row builder
+ExportSource = namedtuple('ExportSource', ['collection', 'fields', 'build_row'])
+
+
+class JobLock:
+    """Exclusive, non-blocking lock on a file; held by at most one process at a time"""
+
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+
+    def acquire(self, blocking=False):
+        self.handle = open(self.path, 'a')
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(self.handle, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            return True
+        except BlockingIOError:
+            self.release()
+            return False
+
+    def release(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+    def __enter__(self):
+        self.acquire(blocking=True)
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class JobProgress:
+    """Saves a running job's progress, at most every ``progress_seconds``"""
+
+    def __init__(self, manager, job, scan, documents_before=0):
+        self.manager = manager
+        self.job = job
+        self.scan = scan
+        self.documents_before = documents_before
+        self.started = time.perf_counter()
+        self.saved = 0.0
+
+    def update(self, handle=None, force=False):
+        """
+        Record documents read so far; with ``handle``, also the bytes on disk
+        and the scan checkpoint they correspond to, so a resumed job can pick
+        up exactly there.
+        """
+        now = time.perf_counter()
+        if not force and now - self.saved < self.manager.progress_seconds:
+            return
+        job = self.job
+        if handle is not None:
+            handle.flush()
+            os.fsync(handle.fileno())
+            job['bytes_written'] = handle.tell()
+            job['checkpoint'] = self.scan.checkpoint()
+        documents = self.scan.stats()['documents']
+        job['documents'] = self.documents_before + documents
+        job['docs_per_second'] = round(documents / (now - self.started), 1) if now > self.started else 0
+        self.manager._save(job)
+        self.saved = now
+
+
+def _parquet_type(value):
+    if isinstance(value, bool):
+        return pyarrow.bool_()
+    if isinstance(value, int):
+        return pyarrow.int64()
+    if isinstance(value, float):
+        return pyarrow.float64()
+    return pyarrow.string()
+
+
+def _parquet_value(value, kind):
+    if value is None or kind != pyarrow.string():
+        return value
+    return value if isinstance(value, str) else str(value)
+
+
+class ExportJobManager:
+    """
+    Creates, runs and tracks export jobs.
+
+    Args:
+        db: Firestore client
+        sources (dict): export type -> ExportSource
+        directory (str): where job state and artifacts are written
+        workers (int): jobs run concurrently in this process
+        dedup_minutes (int): how long a finished export is handed out again
+        progress_seconds (float): minimum time between saved progress updates
+        ttl_hours (float): how long a finished job and its artifact are kept
+    """
+
+    def __init__(self, db, sources, directory=None, workers=None, dedup_minutes=None, progress_seconds=None,
+                 ttl_hours=None):
+        self.db = db
+        self.sources = sources
+        self.directory = directory or ARTIFACT_DIR
+        self.dedup_window = timedelta(minutes=DEDUP_MINUTES if dedup_minutes is None else dedup_minutes)
+        self.ttl = timedelta(hours=ARTIFACT_TTL_HOURS if ttl_hours is None else ttl_hours)
+        self.progress_seconds = PROGRESS_SECONDS if progress_seconds is None else progress_seconds
+        self._pool = ThreadPoolExecutor(max_workers=workers or EXPORT_WORKERS, thread_name_prefix='export-job')
+        self._create_lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # State files
+    # ------------------------------------------------------------------
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _save(self, job):
+        """Write job state atomically, so a reader never sees half a file"""
+        path = self._path(f"{job['id']}.json")
+        with open(path + '.tmp', 'w') as f:
+            json.dump(job, f)
+        os.replace(path + '.tmp', path)
+
+    def get(self, job_id):
+        """Current state of a job, None if there is no such job"""
+        if not JOB_ID.fullmatch(job_id or ''):
+            return None
+        try:
+            with open(self._path(f'{job_id}.json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def jobs(self):
+        """Every known job, newest first"""
+        found = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                job = self.get(name[:-len('.json')])
+                if job is not None:
+                    found.append(job)
+        return sorted(found, key=lambda job: job['created_at'], reverse=True)
+
+    def artifact_path(self, job):
+        return self._path(job['artifact'])
+
+    @staticmethod
+    def job_key(export_type, format_type):
+        """Identical exports share a key; that is what deduplication matches on"""
+        params = json.dumps({'type': export_type, 'format': format_type}, sort_keys=True)
+        return hashlib.sha256(params.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def public(job):
+        """Job state as reported to clients (no resume internals)"""
+        return {key: value for key, value in job.items() if key not in ('key', 'checkpoint')}
+
+    # ------------------------------------------------------------------
+    # Creating jobs
+    # ------------------------------------------------------------------
+
+    def _duplicate_of(self, key):
+        now = datetime.now()
+        for job in self.jobs():
+            if job['key'] != key:
+                continue
+            if job['status'] in (QUEUED, RUNNING):
+                return job
+            if (job['status'] == DONE and now - datetime.fromisoformat(job['finished_at']) <= self.dedup_window
+                    and os.path.exists(self.artifact_path(job))):
+                return job
+        return None
+
+    def create(self, export_type, format_type):
+        """
+        Queue an export, or return the identical one already queued or recently finished.
+
+        Returns:
+            (job, deduplicated)
+
+        Raises:
+            ValueError: unknown export type or unsupported format
+        """
+        if export_type not in self.sources:
+            raise ValueError(f"Unknown export type '{export_type}'")
+        if format_type not in JOB_FORMATS:
+            if format_type == 'parquet':
+                raise ValueError('Parquet exports need pyarrow, which is not installed')
+            raise ValueError(f"Unsupported export format '{format_type}'")
+
+        key = self.job_key(export_type, format_type)
+        # The thread lock covers this process, the file lock the other gunicorn workers
+        with self._create_lock, JobLock(self._path('.create.lock')):
+            self._cleanup()
+            existing = self._duplicate_of(key)
+            if existing is not None:
+                return existing, True
+
+            job_id = uuid.uuid4().hex
+            job = {
+                'id': job_id,
+                'type': export_type,
+                'format': format_type,
+                'key': key,
+                'status': QUEUED,
+                'created_at': datetime.now().isoformat(),
+                'started_at': None,
+                'finished_at': None,
+                'attempts': 0,
+                'documents': 0,
+                'bytes_written': 0,
+                'docs_per_second': 0,
+                'checkpoint': None,
+                'artifact': f"{export_type}_export_{job_id[:8]}.{format_type}",
+                'size': None,
+                'error': None,
+            }
+            self._save(job)
+
+        self._pool.submit(self._run, job_id)
+        return job, False
+
+    def recover(self):
+        """Resubmit jobs left queued or running by a previous process; returns how many"""
+        self.cleanup()
+        unfinished = [job for job in self.jobs() if job['status'] in (QUEUED, RUNNING)]
+        for job in unfinished:
+            self._pool.submit(self._run, job['id'])
+        if unfinished:
+            logger.debug(f"Recovered {len(unfinished)} export jobs")
+        return len(unfinished)
+
+    # ------------------------------------------------------------------
+    # Expiry
+    # ------------------------------------------------------------------
+
+    def _remove(self, name):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def _cleanup(self, now=None):
+        """cleanup() for a caller holding the create locks"""
+        now = now or datetime.now()
+        expired, kept = [], set()
+        for job in self.jobs():
+            if job['status'] in (DONE, FAILED) and now - datetime.fromisoformat(job['finished_at']) > self.ttl:
+                expired.append(job)
+            else:
+                kept.update((f"{job['id']}.json", f"{job['id']}.lock", job['artifact'], job['artifact'] + '.part'))
+
+        for job in expired:
+            lock = JobLock(self._path(f"{job['id']}.lock"))
+            if not lock.acquire():
+                kept.update((f"{job['id']}.json", f"{job['id']}.lock", job['artifact']))
+                continue
+            try:
+                self._remove(job['artifact'])
+                self._remove(f"{job['id']}.json")
+            finally:
+                lock.release()
+            self._remove(f"{job['id']}.lock")
+
+        # Files of jobs whose record is gone: crashed writes, interrupted saves
+        stale = now.timestamp() - self.ttl.total_seconds()
+        for name in os.listdir(self.directory):
+            if name in kept or name == '.create.lock':
+                continue
+            try:
+                if os.path.getmtime(self._path(name)) < stale:
+                    os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+        if expired:
+            logger.debug(f"Deleted {len(expired)} expired export jobs")
+        return len(expired)
+
+    def cleanup(self, now=None):
+        """Delete jobs finished more than ``ttl`` ago and their artifacts; returns how many"""
+        with self._create_lock, JobLock(self._path('.create.lock')):
+            return self._cleanup(now)
+
+    # ------------------------------------------------------------------
+    # Running jobs
+    # ------------------------------------------------------------------
+
+    def _run(self, job_id):
+        lock = JobLock(self._path(f'{job_id}.lock'))
+        if not lock.acquire():
+            return  # another process is running it
+        try:
+            job = self.get(job_id)
+            if job is None or job['status'] not in (QUEUED, RUNNING):
+                return
+            job['status'] = RUNNING
+            job['started_at'] = job['started_at'] or datetime.now().isoformat()
+            job['attempts'] += 1
+            self._save(job)
+
+            try:
+                if job['format'] == 'parquet':
+                    self._write_parquet(job)
+                else:
+                    self._write_text(job)
+                os.replace(self._path(job['artifact'] + '.part'), self.artifact_path(job))
+                job['status'] = DONE
+                job['size'] = os.path.getsize(self.artifact_path(job))
+                job['checkpoint'] = None
+            except Exception as e:
+                logger.error(f"Export job {job_id} failed: {e}")
+                part = self._path(job['artifact'] + '.part')
+                if os.path.exists(part):
+                    os.remove(part)
+                job['status'] = FAILED
+                job['error'] = str(e)
+            job['finished_at'] = datetime.now().isoformat()
+            self._save(job)
+        finally:
+            lock.release()
+
+    def _scan(self, job, checkpoint=None):
+        source = self.sources[job['type']]
+        scan = PartitionedScan(self.db.collection(source.collection), fields=source.fields, checkpoint=checkpoint)
+        return scan, (source.build_row(doc) for doc in scan.stream())
+
+    def _write_text(self, job):
+        """CSV or NDJSON, appended chunk by chunk; resumes from the saved checkpoint"""
+        part = self._path(job['artifact'] + '.part')
+        resuming = job['checkpoint'] is not None and os.path.exists(part)
+        offset = job['bytes_written'] if resuming else 0
+        documents_before = job['documents'] if resuming else 0
+        scan, rows = self._scan(job, job['checkpoint'] if resuming else None)
+        progress = JobProgress(self, job, scan, documents_before)
+
+        with open(part, 'r+b' if resuming else 'wb') as handle:
+            # Drop anything written after the checkpoint was taken
+            handle.truncate(offset)
+            handle.seek(offset)
+            first_row = next(rows, None)
+            if first_row is not None:
+                if job['format'] == 'csv':
+                    chunks = csv_chunks(first_row, rows, header=offset == 0)
+                else:
+                    chunks = ndjson_chunks(itertools.chain([first_row], rows))
+                for chunk in chunks:
+                    handle.write(chunk.encode('utf-8'))
+                    progress.update(handle)
+            progress.update(handle, force=True)
+
+    def _write_parquet(self, job):
+        """Parquet in row groups of PARQUET_BATCH_ROWS; restarts from scratch after a crash"""
+        part = self._path(job['artifact'] + '.part')
+        scan, rows = self._scan(job)
+        progress = JobProgress(self, job, scan)
+
+        first_row = next(rows, None)
+        if first_row is None:
+            schema = pyarrow.schema([])
+            pyarrow.parquet.write_table(schema.empty_table(), part)
+        else:
+            schema = pyarrow.schema([(name, _parquet_type(value)) for name, value in first_row.items()])
+            kinds = [field.type for field in schema]
+            with pyarrow.parquet.ParquetWriter(part, schema) as writer:
+                batch = [first_row]
+                for row in itertools.chain(rows, [None]):
+                    if row is not None:
+                        batch.append(row)
+                    if batch and (row is None or len(batch) >= PARQUET_BATCH_ROWS):
+                        columns = [
+                            [_parquet_value(item.get(name), kind) for item in batch]
+                            for name, kind in zip(schema.names, kinds)
+                        ]
+                        writer.write_batch(pyarrow.record_batch(columns, schema=schema))
+                        batch = []
+                        progress.update()
+        job['bytes_written'] = os.path.getsize(part)
+        progress.update(force=True)
@@ -0,0 +1,121 @@
+"""
+Field manifests for projected Firestore reads.
+
+Each manifest maps a DashboardSnapshot source ('users', 'trials',
+'subscriptions', 'current_token_usage') to the document fields one
+computation reads. Snapshot reads are narrowed with select() to the union of
+the manifests of the panels being built, so a panel that only counts verified
+users downloads ``emailVerified`` instead of whole user documents.
+
+An empty tuple means document ids only (enough for counting). A source that
+appears in no manifest is read in full if a computation touches it anyway.
+Keep the manifests in step with the code they describe: a field missing here
+reads as absent.
+"""
+
+
+def ids_only(*sources):
+    """Manifest for computations that only count documents"""
+    return {source: () for source in sources}
+
+
+def merge(*manifests):
+    """Union of several manifests, keeping first-seen field order"""
+    merged = {}
+    for manifest in manifests:
+        for source, source_fields in manifest.items():
+            merged.setdefault(source, [])
+            merged[source].extend(f for f in source_fields if f not in merged[source])
+    return {source: tuple(source_fields) for source, source_fields in merged.items()}
+
+
+# ----------------------------------------------------------------------------
+# Shared counts
+# ----------------------------------------------------------------------------
+
+VERIFIED_USER_COUNT = {'users': ('emailVerified',)}
+ACTIVE_SUBSCRIPTION_COUNT = {'subscriptions': ('status',)}
+IS_ACTIVE_COUNT = {'subscriptions': ('isActive',)}
+
+# Keys the identity index (analytics/identity.py) joins the collections by
+IDENTITY = {'users': ('email',), 'trials': ('userId', 'email'), 'subscriptions': ('userId', 'email')}
+
+# ----------------------------------------------------------------------------
+# Per-computation manifests
+# ----------------------------------------------------------------------------
+
+USER_JOURNEYS = merge(IDENTITY, {
+    'users': ('email', 'createdAt', 'emailVerified', 'emailVerifiedAt', 'lastLoginAt'),
+    'trials': ('userId', 'trialStartDate', 'trialEndDate'),
+    'subscriptions': ('status', 'isActive', 'cancelled', 'startDate', 'subscriptionEndDate', 'willExpireAt'),
+    'current_token_usage': ('userId', 'totalMonthlyTokens'),
+})
+
+RETENTION_METRICS = {'users': ('lastLoginAt',)}
+COHORT_ANALYSIS = {'users': ('createdAt', 'lastLoginAt')}
+USER_ACTIVITY = {'users': ('lastLoginAt',)}
+
+# Lifecycle intervals for analytics/lifecycle.py
+SUBSCRIPTION_STATES = {
+    'subscriptions': ('startDate', 'cancelled', 'cancelledAt', 'updatedAt', 'subscriptionEndDate', 'willExpireAt'),
+    'trials': ('trialStartDate', 'trialEndDate'),
+}
+CHURN_METRICS = {'subscriptions': SUBSCRIPTION_STATES['subscriptions']}
+REVENUE_TRENDS = {'subscriptions': ('isActive', 'startDate', 'plan')}
+MONTHLY_RECURRING_REVENUE = {'subscriptions': ('status', 'plan')}
+# Priced start/end intervals for analytics/revenue.py
+REVENUE_ENGINE = {'subscriptions': ('plan', 'status', 'startDate', 'subscriptionEndDate', 'cancelled', 'willExpireAt')}
+SUBSCRIPTION_HEALTH = {'subscriptions': ('status', 'plan') + SUBSCRIPTION_STATES['subscriptions']}
+SUBSCRIPTION_GROWTH = {'subscriptions': ('startDate', 'cancelled', 'willExpireAt')}
+# Payment analysis reads the payment ledger rollups (analytics/payments.py), no snapshot source
+PAYMENT_ANALYSIS = {}
+
+# Fields analytics/geo.py classifies a user's country from
+COUNTRY_CLASSIFICATION = {'users': ('email', 'country', 'countryCode')}
+GEOGRAPHIC_DISTRIBUTION = merge(
+    {'users': IDENTITY['users'], 'subscriptions': IDENTITY['subscriptions']},
+    COUNTRY_CLASSIFICATION,
+    {'users': ('emailVerified',), 'subscriptions': ('isActive', 'plan')},
+)
+
+USER_BEHAVIOR = merge(IDENTITY, {
+    'users': ('email', 'createdAt', 'emailVerified', 'emailVerifiedAt', 'lastLoginAt'),
+    'trials': ('trialStartDate',),
+    'subscriptions': ('startDate', 'isActive'),
+})
+
+DAILY_SUMMARY = merge(
+    ids_only('trials'),
+    {'users': ('createdAt',), 'subscriptions': ('startDate', 'isActive', 'plan')},
+)
+WEEKLY_TRENDS = {'users': ('createdAt',), 'subscriptions': ('startDate', 'plan')}
+MONTHLY_BUSINESS = {'subscriptions': ('startDate', 'cancelled', 'willExpireAt', 'isActive', 'plan')}
+
+# The payment_failures rule counts the payment ledger's rollup of the month, read from the ledger
+BUSINESS_ALERTS = merge(
+    ids_only('trials'),
+    CHURN_METRICS,
+    IS_ACTIVE_COUNT,
+    VERIFIED_USER_COUNT,
+)
+
+# ----------------------------------------------------------------------------
+# Exports
+# ----------------------------------------------------------------------------
+
+USERS_EXPORT = ('email', 'username', 'emailVerified', 'createdAt', 'lastLoginAt', 'emailVerifiedAt')
+SUBSCRIPTIONS_EXPORT = ('email', 'plan', 'status', 'cancelled', 'startDate', 'subscriptionEndDate', 'willExpireAt')
+ANALYTICS_EXPORT = merge(VERIFIED_USER_COUNT, ACTIVE_SUBSCRIPTION_COUNT, MONTHLY_RECURRING_REVENUE, REVENUE_TRENDS, CHURN_METRICS)
+
+# ----------------------------------------------------------------------------
+# Daily KPI snapshots
+# ----------------------------------------------------------------------------
+
+KPI_SNAPSHOT = merge(
+    {'users': ('createdAt', 'lastLoginAt', 'emailVerified', 'emailVerifiedAt'),
+     'trials': ('trialStartDate',),
+     'subscriptions': ('status', 'isActive', 'cancelled', 'startDate', 'willExpireAt', 'plan'),
+     'current_token_usage': ('totalMonthlyTokens',)},
+)
+
+ACTIVITY_RETENTION = {'users': ('createdAt',)}
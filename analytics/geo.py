@@ -0,0 +1,195 @@
+"""
+Write-time country classification and per-country rollups.
+
+The geographic panel classified every user's country from scratch on every
+request and re-streamed all subscriptions to find the subscribed emails.
+Now a user's country is classified once and stored on the user document as
+``countryCode``:
+
+* a profile ``country`` (a name, alias or ISO code) wins;
+* then a previously stored ``countryCode``;
+* then the email domain, and UNKNOWN ('ZZ') when nothing tells.
+
+A GeoRollup keeps the per-country counters the panel shows - users,
+verified users, subscribers and their MRR - up to date one document change at a time,
+the way alert counters are (analytics/alerts.py): each user's contribution
+is remembered, and a change only moves the users it re-joins
+(analytics/identity.py finds the owner of a subscription). With snapshot
+listeners feeding it, the panel reads a few dozen numbers and no documents;
+without them it is synced from a narrow read, and only differences count.
+"""
+import threading
+
+from .columnar import plan_price
+from .identity import IdentityIndex
+
+UNKNOWN = 'ZZ'
+
+# The OFW destination markets the dashboard reports on, in display order;
+# every other country is reported as 'Other'
+OFW_COUNTRIES = {
+    'SA': 'Saudi Arabia',
+    'AE': 'United Arab Emirates',
+    'QA': 'Qatar',
+    'KW': 'Kuwait',
+    'HK': 'Hong Kong',
+    'SG': 'Singapore',
+    'TW': 'Taiwan',
+    'JP': 'Japan',
+    'KR': 'South Korea',
+    'MY': 'Malaysia',
+    'IT': 'Italy',
+    'GB': 'United Kingdom',
+    'CA': 'Canada',
+    'US': 'United States',
+    'AU': 'Australia',
+}
+OTHER = 'Other'
+
+COUNTRY_ALIASES = {
+    **{name.lower(): code for code, name in OFW_COUNTRIES.items()},
+    'ksa': 'SA',
+    'uae': 'AE',
+    'korea': 'KR',
+    'republic of korea': 'KR',
+    'uk': 'GB',
+    'great britain': 'GB',
+    'usa': 'US',
+    'united states of america': 'US',
+    'philippines': 'PH',
+}
+
+# Email domains that say where a user is; webmail domains say nothing
+EMAIL_DOMAIN_COUNTRIES = {
+    'gmail.com': UNKNOWN,
+    'yahoo.com': UNKNOWN,
+    'hotmail.com': UNKNOWN,
+    # Add more specific mappings as needed
+}
+
+
+def normalize_country(value):
+    """ISO 3166 alpha-2 code for a country name, alias or code; None if unrecognised"""
+    if not isinstance(value, str):
+        return None
+    text = value.strip()
+    code = COUNTRY_ALIASES.get(text.lower())
+    if code is None and len(text) == 2 and text.isalpha():
+        code = text.upper()
+    return code
+
+
+def classify_country(user_data):
+    """Country code of a user document (UNKNOWN when nothing tells)"""
+    for field in ('country', 'countryCode'):
+        code = normalize_country(user_data.get(field))
+        if code:
+            return code
+    email = (user_data.get('email') or '').lower()
+    if '@' in email:
+        return EMAIL_DOMAIN_COUNTRIES.get(email.split('@')[1], UNKNOWN)
+    return UNKNOWN
+
+
+def country_name(code):
+    """Display name of a country code: an OFW market, or 'Other'"""
+    return OFW_COUNTRIES.get(code, OTHER)
+
+
+class GeoRollup:
+    """Users, verified users, subscribers and MRR per country code, kept from document changes"""
+
+    SOURCES = ('users', 'subscriptions')
+
+    def __init__(self):
+        self.identity = IdentityIndex()
+        self.users = {}
+        self.subscriptions = {}
+        self.contributions = {}
+        self.counts = {}
+        self.live_sources = set()
+        # Bumped after each batch of changes is applied; tells HTTP caches the rollup moved
+        self.version = 0
+        self._lock = threading.RLock()
+
+    @property
+    def live(self):
+        """True once listeners keep every source current"""
+        return self.live_sources.issuperset(self.SOURCES)
+
+    def _recount(self, uid):
+        user = self.users.get(uid)
+        new = None
+        if user is not None:
+            subscription_id = self.identity.subscription_id(uid)
+            # (subscribed, monthly price) of the user's subscription
+            new = user + self.subscriptions.get(subscription_id, (False, 0.0))
+        old = self.contributions.get(uid)
+        if old == new:
+            return
+        for contribution, sign in ((old, -1), (new, 1)):
+            if contribution is None:
+                continue
+            code, verified, subscribed, price = contribution
+            counts = self.counts.setdefault(code, [0, 0, 0, 0.0])
+            counts[0] += sign
+            counts[1] += sign * verified
+            counts[2] += sign * subscribed
+            counts[3] += sign * price
+            if not counts[0]:
+                del self.counts[code]
+        if new is None:
+            del self.contributions[uid]
+        else:
+            self.contributions[uid] = new
+
+    def apply(self, source, changes):
+        """Apply ``(doc_id, data)`` changes of 'users' or 'subscriptions' (data None for a removal)"""
+        changes = list(changes)
+        with self._lock:
+            documents = self.users if source == 'users' else self.subscriptions
+            for doc_id, data in changes:
+                if data is None:
+                    documents.pop(doc_id, None)
+                elif source == 'users':
+                    documents[doc_id] = (classify_country(data), bool(data.get('emailVerified')))
+                else:
+                    active = bool(data.get('isActive'))
+                    documents[doc_id] = (active, plan_price(data.get('plan')) if active else 0.0)
+            for uid in self.identity.apply(source, changes):
+                self._recount(uid)
+            self.version += 1
+
+    def sync(self, source, records):
+        """Make ``source`` match the complete set of ``(doc_id, data)`` records"""
+        records = list(records)
+        with self._lock:
+            known = self.users if source == 'users' else self.subscriptions
+            present = {doc_id for doc_id, _ in records}
+            removed = [(doc_id, None) for doc_id in known if doc_id not in present]
+            self.apply(source, records + removed)
+
+    def user(self, uid):
+        """``(country code, subscribed)`` of one user, None when the rollup does not hold it"""
+        with self._lock:
+            user = self.users.get(uid)
+            if user is None:
+                return None
+            subscription = self.subscriptions.get(self.identity.subscription_id(uid), (False, 0.0))
+            return user[0], subscription[0]
+
+    def rollup(self):
+        """``{code: {'users', 'verified', 'subscribed', 'mrr'}}`` for every country with users"""
+        with self._lock:
+            return {code: {'users': users, 'verified': verified, 'subscribed': subscribed, 'mrr': round(mrr, 2)}
+                    for code, (users, verified, subscribed, mrr) in sorted(self.counts.items())}
+
+    def status(self):
+        with self._lock:
+            return {
+                'live': self.live,
+                'version': self.version,
+                'users': len(self.users),
+                'subscriptions': len(self.subscriptions),
+                'countries': len(self.counts),
+            }
@@ -0,0 +1,215 @@
+"""
+HTTP caching and compression for the admin API.
+
+The dashboards poll the same JSON every 30 seconds and most polls return
+exactly what the previous one did. ResponseCache hooks into Flask's
+after_request and, for buffered GET responses:
+
+* sets a content-hash ``ETag`` and answers a matching ``If-None-Match`` with
+  an empty 304, so an unchanged poll costs a few header bytes;
+* for routes with a data version (``versions``: a function returning, say,
+  a listener-fed rollup's change count, or None when it cannot tell), checks
+  ``If-None-Match`` in before_request: if the version is the one the ETag
+  was served at, the 304 goes out without running the handler at all;
+* sets ``Last-Modified`` to when the route's content last changed;
+* sets ``Cache-Control: private`` with a per-route ``max-age`` (``no-cache``,
+  i.e. always revalidate, when the route has none);
+* compresses bodies of at least ``min_size`` bytes with br (if the brotli
+  package is installed) or gzip, caching the compressed bytes per ETag so a
+  repeated payload is not compressed twice.
+
+Streamed and ``direct_passthrough`` responses (exports, send_file, event
+streams) are left untouched.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_SIZE = int(os.getenv('HTTP_COMPRESS_MIN_BYTES', '1024'))
+DEFAULT_MAX_AGE = int(os.getenv('HTTP_CACHE_MAX_AGE', '0'))
+
+# Compressed bodies kept for reuse, and paths whose Last-Modified is tracked
+COMPRESSED_CACHE_SIZE = 64
+TRACKED_PATHS = 1024
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/x-ndjson',
+                      'image/svg+xml')
+
+
+# Where before_request leaves the route's data version for after_request
+VERSION_KEY = 'response_cache.version'
+
+
+def content_etag(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ResponseCache:
+    """
+    ETag/304, Cache-Control and compression middleware.
+
+    Args:
+        app: Flask app (or call ``init_app`` later)
+        max_age (dict): route rule (as in ``@app.route``) -> max-age seconds
+        versions (dict): route rule -> function returning the version of the data the
+            route serves, None when unknown; it must change whenever the response would
+        default_max_age (int): max-age for routes not in ``max_age``
+        min_size (int): smallest body worth compressing
+        prefixes (tuple): only paths starting with one of these are handled
+    """
+
+    def __init__(self, app=None, max_age=None, versions=None, default_max_age=None, min_size=None,
+                 prefixes=('/api/', '/debug/')):
+        self.max_age = dict(max_age or {})
+        self.versions = dict(versions or {})
+        self.default_max_age = DEFAULT_MAX_AGE if default_max_age is None else default_max_age
+        self.min_size = MIN_COMPRESS_SIZE if min_size is None else min_size
+        self.prefixes = prefixes
+        self._compressed = OrderedDict()
+        # path -> (etag, when that content was first served, data version it was served at)
+        self._modified = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'responses': 0, 'not_modified': 0, 'compressed': 0, 'bytes_in': 0, 'bytes_out': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self.short_circuit)
+        app.after_request(self.process)
+
+    # ------------------------------------------------------------------
+    # Helpers
+    # ------------------------------------------------------------------
+
+    def _route_max_age(self):
+        rule = request.url_rule.rule if request.url_rule is not None else None
+        return self.max_age.get(rule, self.default_max_age)
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                self.stats[name] += count
+
+    def _last_modified(self, etag, version):
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        with self._lock:
+            seen = self._modified.get(request.full_path)
+            if seen is None or seen[0] != etag:
+                seen = (etag, now, version)
+            # The same content at a newer version keeps its Last-Modified
+            seen = self._modified[request.full_path] = seen[:2] + (version,)
+            self._modified.move_to_end(request.full_path)
+            while len(self._modified) > TRACKED_PATHS:
+                self._modified.popitem(last=False)
+        return seen[1]
+
+    @staticmethod
+    def _not_modified(etag, last_modified):
+        return request.if_none_match.contains_weak(etag) or (
+            not request.if_none_match and request.if_modified_since
+            and last_modified <= request.if_modified_since)
+
+    def _set_cache_headers(self, response, etag, last_modified):
+        max_age = self._route_max_age()
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        response.headers['Cache-Control'] = f'private, max-age={max_age}' if max_age else 'private, no-cache'
+        response.vary.add('Accept-Encoding')
+
+    @staticmethod
+    def _encoding():
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            return 'br'
+        if accepted['gzip']:
+            return 'gzip'
+        return None
+
+    def _compress(self, data, etag, encoding):
+        key = (etag, encoding)
+        with self._lock:
+            body = self._compressed.get(key)
+            if body is not None:
+                self._compressed.move_to_end(key)
+                return body
+        body = brotli.compress(data, quality=5) if encoding == 'br' else gzip.compress(data, compresslevel=6)
+        with self._lock:
+            self._compressed[key] = body
+            while len(self._compressed) > COMPRESSED_CACHE_SIZE:
+                self._compressed.popitem(last=False)
+        return body
+
+    def _handles(self, response):
+        return (
+            request.method in ('GET', 'HEAD')
+            and response.status_code == 200
+            and request.path.startswith(self.prefixes)
+            and not response.direct_passthrough
+            and not response.is_streamed
+            and 'Content-Encoding' not in response.headers
+        )
+
+    # ------------------------------------------------------------------
+    # Middleware
+    # ------------------------------------------------------------------
+
+    def short_circuit(self):
+        """Answer a conditional GET with a 304 before the handler runs if the route's data has not moved"""
+        if (request.method not in ('GET', 'HEAD') or request.url_rule is None
+                or not request.path.startswith(self.prefixes)):
+            return None
+        version_of = self.versions.get(request.url_rule.rule)
+        version = version_of() if version_of is not None else None
+        if version is None:
+            return None
+        # Read before the handler: content built from newer data is recorded at the older version
+        request.environ[VERSION_KEY] = version
+        with self._lock:
+            seen = self._modified.get(request.full_path)
+        if seen is None or seen[2] != version or not self._not_modified(seen[0], seen[1]):
+            return None
+
+        response = Response(status=304)
+        self._set_cache_headers(response, seen[0], seen[1])
+        self._count(responses=1, not_modified=1)
+        return response
+
+    def process(self, response):
+        if not self._handles(response):
+            return response
+
+        data = response.get_data()
+        etag = content_etag(data)
+
+        self._set_cache_headers(response, etag, self._last_modified(etag, request.environ.get(VERSION_KEY)))
+        self._count(responses=1, bytes_in=len(data))
+
+        if self._not_modified(etag, response.last_modified):
+            response.status_code = 304
+            response.set_data(b'')
+            response.headers.pop('Content-Type', None)
+            response.headers.pop('Content-Length', None)
+            self._count(not_modified=1)
+            return response
+
+        encoding = self._encoding()
+        if (encoding and len(data) >= self.min_size
+                and (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)):
+            body = self._compress(data, etag, encoding)
+            response.set_data(body)
+            response.headers['Content-Encoding'] = encoding
+            self._count(compressed=1)
+            data = body
+
+        self._count(bytes_out=len(data))
+        return response
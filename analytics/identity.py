@@ -0,0 +1,153 @@
+"""
+Cross-collection identity index: uid <-> email <-> trial / subscription ids.
+
+The collections name their owner in different ways. users are keyed by uid
+and carry an ``email``; trial_history documents carry a ``userId`` but older
+ones are keyed by the user's email; subscriptions are keyed by uid and carry
+``userId`` and ``email``, or (in older data) are keyed by email. Every
+computation used to build its own lookup - by uid, by userId, by email as a
+field or as a document id - so the same user could be joined to different
+documents depending on the panel.
+
+The IdentityIndex records, per trial and subscription document, every key
+it can be found by (its ``userId``, its id, its ``email``) and, per user, its
+email. A user's document in a collection is the first match, in document id
+order, of:
+
+1. ``userId`` == uid
+2. document id == uid
+3. document id == email
+4. ``email`` == email
+
+Each step is a dict lookup, so a join is O(1). The index is built once per
+snapshot and can be kept current from listener changes with apply(), which
+also reports which users a change re-joins.
+"""
+
+SOURCES = ('trials', 'subscriptions')
+
+# Lookup order of the keys a user is matched by: (key kind, user attribute)
+RESOLUTION = (('user', 'uid'), ('id', 'uid'), ('id', 'email'), ('email', 'email'))
+
+
+def _document_keys(doc_id, data):
+    keys = [('id', doc_id)]
+    if data.get('userId'):
+        keys.append(('user', data['userId']))
+    if data.get('email'):
+        keys.append(('email', data['email']))
+    return tuple(keys)
+
+
+class IdentityIndex:
+    """Owners of the trial_history and subscriptions documents, by uid and email"""
+
+    def __init__(self):
+        self.emails = {}
+        self.users_by_email = {}
+        self._keys = {source: {} for source in SOURCES}
+        self._documents = {source: {} for source in SOURCES}
+
+    @classmethod
+    def from_records(cls, users=(), trials=(), subscriptions=()):
+        """Build from ``(doc_id, data)`` pairs of each collection"""
+        index = cls()
+        index.apply('users', users)
+        index.apply('trials', trials)
+        index.apply('subscriptions', subscriptions)
+        return index
+
+    @classmethod
+    def from_snapshots(cls, users=(), trials=(), subscriptions=()):
+        records = lambda snapshots: ((snapshot.id, snapshot.to_dict() or {}) for snapshot in snapshots)
+        return cls.from_records(records(users), records(trials), records(subscriptions))
+
+    # ------------------------------------------------------------------
+    # Updates
+    # ------------------------------------------------------------------
+
+    def _set_email(self, uid, email):
+        old = self.emails.pop(uid, None)
+        if old:
+            owners = self.users_by_email[old]
+            owners.discard(uid)
+            if not owners:
+                del self.users_by_email[old]
+        if email is not None:
+            self.emails[uid] = email
+            if email:
+                self.users_by_email.setdefault(email, set()).add(uid)
+
+    def _users_for(self, keys):
+        users = set()
+        for kind, value in keys:
+            if kind in ('user', 'id') and value in self.emails:
+                users.add(value)
+            if kind in ('id', 'email'):
+                users.update(self.users_by_email.get(value, ()))
+        return users
+
+    def apply(self, source, changes):
+        """
+        Record ``(doc_id, data)`` changes of 'users', 'trials' or 'subscriptions'
+        (data None for a removal); returns the uids whose joins they may move
+        """
+        touched = set()
+        if source == 'users':
+            for uid, data in changes:
+                self._set_email(uid, None if data is None else data.get('email') or '')
+                touched.add(uid)
+            return touched
+
+        keys, documents = self._keys[source], self._documents[source]
+        for doc_id, data in changes:
+            old = documents.pop(doc_id, ())
+            for key in old:
+                owners = keys[key]
+                owners.discard(doc_id)
+                if not owners:
+                    del keys[key]
+            new = _document_keys(doc_id, data) if data is not None else ()
+            for key in new:
+                keys.setdefault(key, set()).add(doc_id)
+            if new:
+                documents[doc_id] = new
+            touched |= self._users_for(old + new)
+        return touched
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+
+    def email_of(self, uid):
+        return self.emails.get(uid) or None
+
+    def uids_for_email(self, email):
+        """Users registered with ``email``, in uid order"""
+        return sorted(self.users_by_email.get(email, ()))
+
+    def document_id(self, source, uid, email=None):
+        """Id of the user's document in ``source`` ('trials' or 'subscriptions'), None if it has none"""
+        if email is None:
+            email = self.emails.get(uid)
+        identity = {'uid': uid, 'email': email}
+        keys = self._keys[source]
+        for kind, attribute in RESOLUTION:
+            value = identity[attribute]
+            if value and (kind, value) in keys:
+                return min(keys[(kind, value)])
+        return None
+
+    def trial_id(self, uid, email=None):
+        return self.document_id('trials', uid, email)
+
+    def subscription_id(self, uid, email=None):
+        return self.document_id('subscriptions', uid, email)
+
+    def owners(self, source, doc_id):
+        """Users whose join in ``source`` resolves to ``doc_id``"""
+        return sorted(uid for uid in self._users_for(self._documents[source].get(doc_id, ()))
+                      if self.document_id(source, uid) == doc_id)
+
+    def __len__(self):
+        return len(self.emails)
@@ -0,0 +1,139 @@
+"""
+User journey rows kept from snapshot listeners, for the change journal.
+
+The delta sync and search endpoints used to rebuild every journey row from a
+read of users, trial_history, subscriptions and the month's token usage
+whenever the journal was older than its refresh interval - a full read of
+four collections every few seconds while an admin kept the page open.
+
+JourneyRows subscribes to the process's shared collection watches
+(analytics/watch.py). It holds the documents in memory, joins them through
+an IdentityIndex (analytics/identity.py) and, for each batch of changes,
+rebuilds only the rows the batch touches and records them in the
+ChangeJournal (analytics/changes.py). Statuses that move with the clock
+(trial expiry, days remaining) are caught by records(), a rebuild of every
+row from memory the journal runs on its usual refresh interval.
+"""
+import threading
+
+from .identity import IdentityIndex
+
+
+class JourneyRows:
+    """
+    Listener-maintained journey rows, recorded in a change journal.
+
+    Args:
+        build_row (callable): ``build_row(user_id, user, trial, subscription,
+            usage)`` -> journey row dict (any of the last three may be None)
+        journal (ChangeJournal): receives the rows that change
+    """
+
+    # 'current_token_usage' is token_usage_history for the current month
+    SOURCES = ('users', 'trials', 'subscriptions', 'current_token_usage')
+
+    def __init__(self, build_row, journal):
+        self.build_row = build_row
+        self.journal = journal
+        self.documents = {source: {} for source in self.SOURCES}
+        self.identity = IdentityIndex()
+        # user id -> ids of its usage documents; the first, by id, counts
+        self.usage_ids = {}
+        self.rows = {}
+        self.live_sources = set()
+        self.changes_applied = 0
+        self._lock = threading.RLock()
+
+    @property
+    def live(self):
+        """True once listeners keep every source current"""
+        return self.live_sources.issuperset(self.SOURCES)
+
+    def _row(self, user_id):
+        user = self.documents['users'].get(user_id)
+        if user is None:
+            return None
+        trial_id = self.identity.trial_id(user_id)
+        subscription_id = self.identity.subscription_id(user_id)
+        usage_ids = self.usage_ids.get(user_id)
+        return self.build_row(
+            user_id, user,
+            self.documents['trials'].get(trial_id) if trial_id is not None else None,
+            self.documents['subscriptions'].get(subscription_id) if subscription_id is not None else None,
+            self.documents['current_token_usage'][min(usage_ids)] if usage_ids else None
+        )
+
+    def _store(self, source, changes):
+        """Store a batch of changes; returns the user ids whose rows they touch"""
+        documents = self.documents[source]
+        if source != 'current_token_usage':
+            for doc_id, data in changes:
+                if data is None:
+                    documents.pop(doc_id, None)
+                else:
+                    documents[doc_id] = data
+            return self.identity.apply(source, changes)
+
+        touched = set()
+        for doc_id, data in changes:
+            old = documents.pop(doc_id, None)
+            if old is not None:
+                user_id = old.get('userId')
+                self.usage_ids[user_id].discard(doc_id)
+                if not self.usage_ids[user_id]:
+                    del self.usage_ids[user_id]
+                touched.add(user_id)
+            if data is not None:
+                documents[doc_id] = data
+                self.usage_ids.setdefault(data.get('userId'), set()).add(doc_id)
+                touched.add(data.get('userId'))
+        return touched
+
+    def _rebuild(self, user_ids):
+        """Rebuild the given rows; returns ``(user_id, row or None)`` for those that moved"""
+        moved = []
+        for user_id in user_ids:
+            row = self._row(user_id)
+            if row == self.rows.get(user_id):
+                continue
+            if row is None:
+                del self.rows[user_id]
+            else:
+                self.rows[user_id] = row
+            moved.append((user_id, row))
+        return moved
+
+    def apply(self, source, changes):
+        """Apply ``(doc_id, data)`` changes of one source (data None for a removal)"""
+        changes = list(changes)
+        with self._lock:
+            touched = self._store(source, changes)
+            self.changes_applied += len(changes)
+            if self.live:
+                self.journal.update(self._rebuild(touched))
+
+    def sync(self, source, records):
+        """Make ``source`` match the complete set of ``(doc_id, data)`` records"""
+        records = list(records)
+        with self._lock:
+            present = {doc_id for doc_id, _ in records}
+            removed = [(doc_id, None) for doc_id in self.documents[source] if doc_id not in present]
+            self._store(source, records + removed)
+            if self.live_sources.union([source]).issuperset(self.SOURCES):
+                # The rows are complete once every source has loaded; the journal takes them as a listing
+                self.journal.sync(self.records())
+
+    def records(self):
+        """``(user_id, row)`` for every user, rebuilt from memory; the journal's refresh loader"""
+        with self._lock:
+            self._rebuild(set(self.documents['users']) | set(self.rows))
+            return list(self.rows.items())
+
+    def status(self):
+        with self._lock:
+            return {
+                'live': self.live,
+                'rows': len(self.rows),
+                'changes_applied': self.changes_applied,
+                **{source: len(documents) for source, documents in self.documents.items()},
+            }
@@ -0,0 +1,311 @@
+"""
+Daily KPI snapshots as an append-only time series.
+
+The trend charts (revenue trends, subscription growth, weekly trends) were
+rebuilt from raw documents on every request, so they cost a full read each
+time and their past values drifted whenever a document was edited. Instead a
+snapshot job appends one compact row of headline KPIs per day - users,
+verified users, trials, active and cancelled subscriptions, MRR, DAU/WAU and
+token totals - to a newline-delimited JSON file, and the trend panels are
+derived from those rows in O(days).
+
+The file is append-only: re-snapshotting a day appends a newer row for it and
+the last row of a day wins. The job runs through the day writing a
+provisional row for today (``final: false``) and, once a day has ended,
+writes its final row. Readers keep the parsed rows in memory and only read
+what other processes appended since (the file is shared by all workers).
+
+Rows for days before the job existed can be backfilled from the documents;
+activity (DAU/WAU) and token totals cannot be reconstructed and are None in
+backfilled rows.
+"""
+import bisect
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from .columnar import MISSING, US_PER_DAY, _epoch_us_or_missing
+from .export_jobs import JobLock
+from .timestamps import to_epoch_us
+
+KPI_SERIES_PATH = os.getenv('KPI_SERIES_PATH', os.path.join('kpi_snapshots', 'daily.ndjson'))
+
+KPI_FIELDS = (
+    'total_users', 'verified_users', 'new_users', 'total_trials', 'new_trials',
+    'active_subscriptions', 'paying_subscriptions', 'cancelled_subscriptions', 'new_subscriptions', 'cancellations',
+    'mrr', 'new_revenue', 'dau', 'wau', 'tokens_month', 'tokens_today',
+)
+
+
+# ----------------------------------------------------------------------------
+# Storage
+# ----------------------------------------------------------------------------
+
+class KpiSeries:
+    """Append-only daily KPI rows with by-day range queries"""
+
+    def __init__(self, path=None):
+        self.path = path or KPI_SERIES_PATH
+        self._rows = {}
+        self._days = []
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        """Read whatever was appended since the last read; the caller holds the lock"""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size < self._offset:
+            # Rewritten by compact(); start over
+            self._rows, self._days, self._offset = {}, [], 0
+        if size == self._offset:
+            return
+        with open(self.path, 'rb') as handle:
+            handle.seek(self._offset)
+            data = handle.read(size - self._offset)
+        # A line still being written by another process is picked up next time
+        complete = data[:data.rfind(b'\n') + 1]
+        for line in complete.splitlines():
+            if line.strip():
+                row = json.loads(line)
+                if row['date'] not in self._rows:
+                    bisect.insort(self._days, row['date'])
+                self._rows[row['date']] = row
+        self._offset += len(complete)
+
+    def append(self, rows):
+        """Append rows (each with a ``date``); a later row for a day supersedes earlier ones"""
+        if not rows:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with JobLock(self.path + '.lock'):
+            with open(self.path, 'a', encoding='utf-8') as handle:
+                for row in rows:
+                    handle.write(json.dumps(row, separators=(',', ':')) + '\n')
+                handle.flush()
+                os.fsync(handle.fileno())
+
+    def get(self, day):
+        with self._lock:
+            self._refresh()
+            return self._rows.get(str(day))
+
+    def range(self, start=None, end=None):
+        """Rows for days in [start, end] (ISO dates or date objects; None leaves a side open)"""
+        with self._lock:
+            self._refresh()
+            low = bisect.bisect_left(self._days, str(start)) if start is not None else 0
+            high = bisect.bisect_right(self._days, str(end)) if end is not None else len(self._days)
+            return [self._rows[day] for day in self._days[low:high]]
+
+    def first_day(self):
+        with self._lock:
+            self._refresh()
+            return self._days[0] if self._days else None
+
+    def latest(self):
+        with self._lock:
+            self._refresh()
+            return self._rows[self._days[-1]] if self._days else None
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._days)
+
+    def compact(self):
+        """Rewrite the file with only the winning row of each day"""
+        with JobLock(self.path + '.lock'):
+            with self._lock:
+                self._refresh()
+                rows = [self._rows[day] for day in self._days]
+                temporary = self.path + '.tmp'
+                with open(temporary, 'w', encoding='utf-8') as handle:
+                    for row in rows:
+                        handle.write(json.dumps(row, separators=(',', ':')) + '\n')
+                os.replace(temporary, self.path)
+                self._rows, self._days, self._offset = {}, [], 0
+                self._refresh()
+        return len(rows)
+
+
+# ----------------------------------------------------------------------------
+# Snapshots
+# ----------------------------------------------------------------------------
+
+def _between(values, low, high):
+    return int(np.count_nonzero((values >= low) & (values <= high)))
+
+
+def day_kpis(users, subscriptions, trial_starts, day, until, tokens_month=None, previous=None):
+    """
+    KPI row for ``day`` as of ``until`` (the end of the day, or now for today).
+
+    ``users``/``subscriptions`` are UserColumns/SubscriptionColumns and
+    ``trial_starts`` the trials' start times in epoch microseconds (MISSING
+    when unknown). Counts are as of ``until`` by creation/start time;
+    statuses are the documents' current ones.
+    """
+    day_start = to_epoch_us(datetime.combine(day, datetime.min.time()))
+    end = to_epoch_us(until)
+
+    existed = users.created_at <= end
+    verified = existed & users.email_verified & (users.email_verified_at <= end)
+    started = subscriptions.start <= end
+    # Billed subscriptions, counted the way the revenue panel counts them
+    paying = subscriptions.is_active & started & (subscriptions.start != MISSING)
+    new = (subscriptions.start >= day_start) & started
+
+    logins = users.last_login[users.last_login != MISSING]
+    tokens_today = None
+    if tokens_month is not None:
+        same_month = previous is not None and previous.get('tokens_month') is not None \
+            and previous['date'][:7] == day.isoformat()[:7]
+        tokens_today = tokens_month - previous['tokens_month'] if same_month else tokens_month
+
+    return {
+        'date': day.isoformat(),
+        'total_users': int(np.count_nonzero(existed)),
+        'verified_users': int(np.count_nonzero(verified)),
+        'new_users': _between(users.created_at, day_start, end),
+        'total_trials': int(np.count_nonzero(trial_starts <= end)),
+        'new_trials': _between(trial_starts, day_start, end),
+        'active_subscriptions': int(np.count_nonzero(started & subscriptions.status_is('active'))),
+        'paying_subscriptions': int(np.count_nonzero(paying)),
+        'cancelled_subscriptions': int(np.count_nonzero(started & subscriptions.cancelled)),
+        'new_subscriptions': _between(subscriptions.start, day_start, end),
+        'cancellations': _between(subscriptions.will_expire[subscriptions.cancelled], day_start, end),
+        'mrr': round(float(subscriptions.price[paying].sum()), 2),
+        # Plan prices of the subscriptions started that day
+        'new_revenue': round(float(subscriptions.price[new].sum()), 2),
+        'dau': _between(logins, day_start, end),
+        'wau': _between(logins, day_start - 6 * US_PER_DAY, end),
+        'tokens_month': tokens_month,
+        'tokens_today': tokens_today,
+    }
+
+
+def _snapshot_inputs(snapshot):
+    trial_starts = np.array([_epoch_us_or_missing(doc.to_dict().get('trialStartDate')) for doc in snapshot.trials],
+                            dtype=np.int64)
+    tokens_month = sum(int(doc.to_dict().get('totalMonthlyTokens', 0) or 0) for doc in snapshot.current_token_usage)
+    return snapshot.user_columns, snapshot.subscription_columns, trial_starts, tokens_month
+
+
+def record_daily_kpis(series, snapshot, now=None):
+    """
+    Append today's provisional row, and yesterday's final row if it has none
+    yet, from one snapshot (see fields.KPI_SNAPSHOT). Returns today's row.
+    """
+    now = now or snapshot.now
+    users, subscriptions, trial_starts, tokens_month = _snapshot_inputs(snapshot)
+    today = now.date()
+    yesterday = today - timedelta(days=1)
+
+    rows = []
+    last_yesterday = series.get(yesterday)
+    if last_yesterday is None or not last_yesterday.get('final'):
+        previous = series.get(yesterday - timedelta(days=1))
+        final = day_kpis(users, subscriptions, trial_starts, yesterday,
+                         datetime.combine(yesterday, datetime.max.time()), None, previous)
+        # Logins since midnight have overwritten lastLoginAt and token totals are
+        # only known at snapshot time: keep yesterday's last reading of those
+        for field in ('dau', 'wau', 'tokens_month', 'tokens_today'):
+            final[field] = last_yesterday.get(field) if last_yesterday else None
+        final['final'] = True
+        rows.append(final)
+        last_yesterday = final
+
+    current = day_kpis(users, subscriptions, trial_starts, today, now, tokens_month, last_yesterday)
+    current['final'] = False
+    current['recorded_at'] = now.isoformat()
+    rows.append(current)
+    series.append(rows)
+    return current
+
+
+def backfill_daily_kpis(series, snapshot, days, now=None):
+    """Reconstruct final rows for the last ``days`` days that have none; returns how many were written"""
+    now = now or snapshot.now
+    users, subscriptions, trial_starts, _ = _snapshot_inputs(snapshot)
+    rows = []
+    for offset in range(days, 0, -1):
+        day = (now - timedelta(days=offset)).date()
+        if series.get(day) is not None:
+            continue
+        row = day_kpis(users, subscriptions, trial_starts, day, datetime.combine(day, datetime.max.time()))
+        row['dau'] = row['wau'] = None
+        row['final'] = True
+        row['backfilled'] = True
+        rows.append(row)
+    series.append(rows)
+    return len(rows)
+
+
+# ----------------------------------------------------------------------------
+# Trends (None when the series does not cover the window)
+# ----------------------------------------------------------------------------
+
+def _month_days(month_start, now):
+    """First and last day of a trend window: its calendar month, up to today"""
+    month_end = (month_start.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return month_start.date(), min(month_end.date(), now.date())
+
+
+def revenue_trends(series, windows, now):
+    """Revenue trend buckets from the last row of each month window"""
+    trends = []
+    for month_date, month_start, _ in windows:
+        rows = series.range(*_month_days(month_start, now))
+        if not rows:
+            return None
+        trends.append({
+            'month': month_date.strftime('%Y-%m'),
+            'revenue': rows[-1]['mrr'],
+            'active_subscriptions': rows[-1]['paying_subscriptions']
+        })
+    return list(reversed(trends))
+
+
+def subscription_growth_trends(series, windows, now):
+    """Subscription growth buckets summed from the daily rows of each month window"""
+    first = series.first_day()
+    if first is None or first > _month_days(windows[-1][1], now)[1].isoformat():
+        return None
+    trends = []
+    for month_date, month_start, _ in windows:
+        rows = series.range(*_month_days(month_start, now))
+        new = sum(row['new_subscriptions'] for row in rows)
+        cancelled = sum(row['cancellations'] for row in rows)
+        trends.append({
+            'month': month_date.strftime('%Y-%m'),
+            'new_subscriptions': new,
+            'cancelled_subscriptions': cancelled,
+            'net_growth': new - cancelled
+        })
+    return list(reversed(trends))
+
+
+def weekly_trends(series, now):
+    """The weekly trend report from the last seven daily rows"""
+    today = now.date()
+    rows = {row['date']: row for row in series.range(today - timedelta(days=6), today)}
+    # Rows written before new_revenue was recorded cannot price the week
+    if len(rows) < 7 or any(row.get('new_revenue') is None for row in rows.values()):
+        return None
+    return [
+        {
+            'date': day,
+            'new_users': rows[day]['new_users'],
+            'new_subscriptions': rows[day]['new_subscriptions'],
+            'revenue': rows[day]['new_revenue']
+        }
+        for day in sorted(rows)
+    ]
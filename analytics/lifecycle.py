@@ -0,0 +1,290 @@
+"""
+Point-in-time subscription state index.
+
+Churn approximated "active at the start of the month" as "started before
+it", which ignores everything that had already expired, and each new
+question about past states meant another scan. A subscription's lifecycle
+is a handful of consecutive intervals:
+
+* active            [startDate, cancellation)  - or until expiry if never cancelled
+* cancelled_pending [cancellation, expiry)     - cancelled, still paid up
+* expired           [expiry, forever)
+
+and a trial_history document is trialing over [trialStartDate, trialEndDate).
+The SubscriptionStateIndex keeps, per state, the sorted interval starts and
+ends: the number of documents in a state at ``t`` is #(starts <= t) -
+#(ends <= t), and the documents entering or leaving it over a range are two
+more binary searches, so every count is O(log n) once built (O(n log n)).
+Listing the members at ``t`` is one pass over the intervals. The dashboard
+keeps one index for the process, fed by snapshot listeners: a document
+change moves only that document's interval bounds.
+
+Expiry is ``subscriptionEndDate``, or ``willExpireAt`` once cancelled, the
+same end the revenue engine uses. The moment of cancellation is
+``cancelledAt`` when the document has one and otherwise its ``updatedAt``
+(the write that set ``cancelled``); without either it is taken to be the
+expiry. A cancelled subscription without any expiry ends when cancelled.
+
+Monthly churn is the subscriptions that expired during the month over the
+paying base (active or cancelled-pending) at its start; the streaming export
+and the alert counters count the same thing per document.
+"""
+import bisect
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from .columnar import MISSING, _epoch_us_or_missing, _iter_records
+from .timestamps import to_epoch_us
+
+STATES = ('trialing', 'active', 'cancelled_pending', 'expired')
+
+# End of an interval that has not ended
+OPEN = np.iinfo(np.int64).max
+
+
+def subscription_phases(data):
+    """
+    ``(start, cancelled_at, expires_at)`` of a subscription document in epoch
+    microseconds: OPEN for an expiry still to be set, cancelled_at None
+    unless cancelled, and None altogether without a start date
+    """
+    start = _epoch_us_or_missing(data.get('startDate'))
+    if start == MISSING:
+        return None
+    cancelled = bool(data.get('cancelled'))
+    expires = _epoch_us_or_missing(data.get('subscriptionEndDate'))
+    if expires == MISSING and cancelled:
+        expires = _epoch_us_or_missing(data.get('willExpireAt'))
+    if not cancelled:
+        return start, None, OPEN if expires == MISSING else max(expires, start)
+
+    cancelled_at = _epoch_us_or_missing(data.get('cancelledAt'))
+    if cancelled_at == MISSING:
+        cancelled_at = _epoch_us_or_missing(data.get('updatedAt'))
+    if expires == MISSING:
+        expires = cancelled_at if cancelled_at != MISSING else start
+    expires = max(expires, start)
+    if cancelled_at == MISSING:
+        cancelled_at = expires
+    return start, min(max(cancelled_at, start), expires), expires
+
+
+def document_intervals(source, data):
+    """``[(state, start, end)]`` of a subscription or trial_history document; None if it has no start date"""
+    if source == 'trials':
+        start = _epoch_us_or_missing(data.get('trialStartDate'))
+        if start == MISSING:
+            return None
+        end = _epoch_us_or_missing(data.get('trialEndDate'))
+        intervals = [('trialing', start, OPEN if end == MISSING else end)]
+    else:
+        phases = subscription_phases(data)
+        if phases is None:
+            return None
+        start, cancelled_at, expires = phases
+        if cancelled_at is None:
+            intervals = [('active', start, expires)]
+        else:
+            intervals = [('active', start, cancelled_at), ('cancelled_pending', cancelled_at, expires)]
+        if expires != OPEN:
+            intervals.append(('expired', expires, OPEN))
+    return [(state, low, high) for state, low, high in intervals if low < high]
+
+
+class _Intervals:
+    """Half-open intervals [start, end) of one state, by document id, with their starts and ends kept sorted"""
+
+    def __init__(self):
+        self.intervals = {}
+        self.sorted_starts = []
+        self.sorted_ends = []
+
+    def load(self, intervals):
+        """Replace the contents with ``{doc_id: (start, end)}`` in one sort"""
+        self.intervals = dict(intervals)
+        self.sorted_starts = sorted(start for start, _ in self.intervals.values())
+        self.sorted_ends = sorted(end for _, end in self.intervals.values())
+
+    def add(self, doc_id, start, end):
+        self.intervals[doc_id] = (start, end)
+        bisect.insort(self.sorted_starts, start)
+        bisect.insort(self.sorted_ends, end)
+
+    def remove(self, doc_id):
+        interval = self.intervals.pop(doc_id, None)
+        if interval is not None:
+            for values, value in ((self.sorted_starts, interval[0]), (self.sorted_ends, interval[1])):
+                del values[bisect.bisect_left(values, value)]
+
+    def count(self, t):
+        return bisect.bisect_right(self.sorted_starts, t) - bisect.bisect_right(self.sorted_ends, t)
+
+    def members(self, t):
+        return [doc_id for doc_id, (start, end) in self.intervals.items() if start <= t < end]
+
+    def entered(self, low, high):
+        """Intervals starting in (low, high]"""
+        return bisect.bisect_right(self.sorted_starts, high) - bisect.bisect_right(self.sorted_starts, low)
+
+    def left(self, low, high):
+        """Intervals ending in (low, high]"""
+        return bisect.bisect_right(self.sorted_ends, high) - bisect.bisect_right(self.sorted_ends, low)
+
+
+class SubscriptionStateIndex:
+    """
+    Lifecycle intervals of subscriptions (and trials) per state.
+
+    Built in one pass by from_records, or kept current one document change at a
+    time with apply() / sync() - a change moves the document's few interval
+    bounds in the sorted lists, nothing is re-read or re-sorted.
+
+    Args:
+        now (datetime): the default moment of queries (default: the time of each query)
+    """
+
+    SOURCES = ('subscriptions', 'trials')
+
+    def __init__(self, now=None):
+        self._now = now
+        self.states = {state: _Intervals() for state in STATES}
+        self.documents = {source: {} for source in self.SOURCES}
+        self.undated_ids = set()
+        self.live_sources = set()
+        self._lock = threading.RLock()
+
+    @property
+    def now(self):
+        return self._now or datetime.now()
+
+    @property
+    def undated(self):
+        """Subscriptions left out for lacking a start date"""
+        return len(self.undated_ids)
+
+    @property
+    def live(self):
+        """True once listeners keep every source current"""
+        return self.live_sources.issuperset(self.SOURCES)
+
+    @classmethod
+    def from_records(cls, subscriptions, trials=(), now=None):
+        """Build from ``(doc_id, data)`` pairs of subscriptions and trial_history"""
+        index = cls(now)
+        per_state = {state: {} for state in STATES}
+        for source, records in (('subscriptions', subscriptions), ('trials', trials)):
+            for doc_id, data in records:
+                intervals = document_intervals(source, data)
+                if intervals is None:
+                    if source == 'subscriptions':
+                        index.undated_ids.add(doc_id)
+                    continue
+                key = (source, doc_id)
+                index.documents[source][doc_id] = intervals
+                for state, start, end in intervals:
+                    per_state[state][key] = (start, end)
+        for state, intervals in per_state.items():
+            index.states[state].load(intervals)
+        return index
+
+    @classmethod
+    def from_snapshots(cls, subscriptions, trials=(), now=None):
+        return cls.from_records(_iter_records(subscriptions), _iter_records(trials), now)
+
+    # ------------------------------------------------------------------
+    # Updates
+    # ------------------------------------------------------------------
+
+    def apply(self, source, changes):
+        """Apply ``(doc_id, data)`` changes of 'subscriptions' or 'trials' (data None for a removal)"""
+        with self._lock:
+            documents = self.documents[source]
+            for doc_id, data in changes:
+                new = document_intervals(source, data) if data is not None else None
+                if source == 'subscriptions':
+                    if data is not None and new is None:
+                        self.undated_ids.add(doc_id)
+                    else:
+                        self.undated_ids.discard(doc_id)
+                old = documents.get(doc_id)
+                if old == new:
+                    continue
+                key = (source, doc_id)
+                for state, _, _ in old or ():
+                    self.states[state].remove(key)
+                for state, start, end in new or ():
+                    self.states[state].add(key, start, end)
+                if new is None:
+                    documents.pop(doc_id, None)
+                else:
+                    documents[doc_id] = new
+
+    def sync(self, source, records):
+        """Make ``source`` match the complete set of ``(doc_id, data)`` records; only differences move"""
+        records = list(records)
+        with self._lock:
+            present = {doc_id for doc_id, _ in records}
+            known = set(self.documents[source])
+            if source == 'subscriptions':
+                known |= self.undated_ids
+            self.apply(source, records + [(doc_id, None) for doc_id in known - present])
+
+    # ------------------------------------------------------------------
+    # Point queries
+    # ------------------------------------------------------------------
+
+    def count(self, state, moment=None):
+        with self._lock:
+            return self.states[state].count(to_epoch_us(moment or self.now))
+
+    def counts(self, moment=None):
+        """Number of documents in each state at ``moment`` (default now)"""
+        t = to_epoch_us(moment or self.now)
+        with self._lock:
+            return {state: intervals.count(t) for state, intervals in self.states.items()}
+
+    def members(self, state, moment=None, limit=None):
+        """Ids of the documents in ``state`` at ``moment``, in id order"""
+        with self._lock:
+            ids = sorted(doc_id for _, doc_id in self.states[state].members(to_epoch_us(moment or self.now)))
+        return ids if limit is None else ids[:limit]
+
+    # ------------------------------------------------------------------
+    # Range queries
+    # ------------------------------------------------------------------
+
+    def entered(self, state, start, end):
+        """Documents that entered ``state`` in (start, end]"""
+        with self._lock:
+            return self.states[state].entered(to_epoch_us(start), to_epoch_us(end))
+
+    def left(self, state, start, end):
+        """Documents that left ``state`` in (start, end]"""
+        with self._lock:
+            return self.states[state].left(to_epoch_us(start), to_epoch_us(end))
+
+    def churn(self, start, end=None):
+        """
+        Subscriptions that expired in (start, end] against the paying base at
+        ``start`` (active or cancelled but not yet expired), as a percentage
+        """
+        end = end or self.now
+        with self._lock:
+            base = self.count('active', start) + self.count('cancelled_pending', start)
+            churned = self.entered('expired', start, end)
+        return {
+            'paying_at_start': base,
+            'churned': churned,
+            'churn_rate': round(churned / base * 100, 2) if base else 0,
+        }
+
+    def status(self):
+        with self._lock:
+            return {
+                'live': self.live,
+                'subscriptions': len(self.documents['subscriptions']),
+                'trials': len(self.documents['trials']),
+                'undated_subscriptions': self.undated,
+            }
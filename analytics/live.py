@@ -0,0 +1,330 @@
+"""
+Live dashboard state pushed to clients as server-sent events.
+
+The user-journey dashboard used to poll ``/api/stats`` and ``/api/users``
+every 30 seconds, and each poll re-read every user plus two documents per
+user - so the backend load grew with every admin who left a tab open.
+
+A LiveDashboard keeps one set of snapshot listeners (analytics/watch.py) on
+users, trial_history and subscriptions, whatever the number of clients. It
+holds the documents in memory, maintains the stats counters incrementally
+(analytics/alerts.py MetricState) and the identity index its rows are joined
+through (analytics/identity.py), and rebuilds only the journey rows a change
+touches. Every change that moves something visible is published once as a
+versioned diff - changed stats, upserted rows, removed user ids - and fanned
+out to the connected clients' queues.
+
+A client starts with a full ``snapshot`` event and then receives ``diff``
+events. Event ids are the state version, prefixed with a per-process epoch so
+ids from before a restart are never taken for current ones. A reconnecting
+EventSource sends the last id it saw as ``Last-Event-ID`` and is replayed the
+diffs it missed while they are still buffered, or sent a fresh snapshot. A
+client that falls too far behind is dropped and recovers the same way.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from .alerts import BUSINESS_COUNTERS, MetricState
+from .identity import IdentityIndex
+from .snapshot import SOURCES
+from .watch import CollectionWatch
+
+logger = logging.getLogger(__name__)
+
+HISTORY_SIZE = int(os.getenv('LIVE_HISTORY_SIZE', '256'))
+CLIENT_QUEUE_SIZE = int(os.getenv('LIVE_CLIENT_QUEUE_SIZE', '256'))
+HEARTBEAT_SECONDS = int(os.getenv('LIVE_HEARTBEAT_SECONDS', '15'))
+# Journey rows with time-dependent statuses (trial expiry) are re-checked this often
+REFRESH_SECONDS = int(os.getenv('LIVE_REFRESH_SECONDS', '60'))
+READY_TIMEOUT_SECONDS = int(os.getenv('LIVE_READY_TIMEOUT_SECONDS', '30'))
+
+LIVE_SOURCES = ('users', 'trials', 'subscriptions')
+
+
+def format_event(event, data, event_id=None):
+    """One server-sent event frame"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, default=str)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+class Subscriber:
+    """One connected client: a bounded queue of ``(version, event, data)``"""
+
+    def __init__(self, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.dropped = False
+
+    def push(self, item):
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped = True
+            return False
+
+
+class LiveDashboard:
+    """
+    Listener-maintained stats and journey rows, published as versioned diffs.
+
+    Args:
+        db: Firestore client
+        build_row (callable): ``build_row(user_id, user, trial, subscription)``
+            -> journey row dict (``trial``/``subscription`` may be None)
+        build_stats (callable): ``build_stats(counters)`` -> stats dict, from
+            the MetricState counter values
+        sort_key (callable): orders the rows of a snapshot
+        history_size (int): diffs kept for replaying to reconnecting clients
+    """
+
+    def __init__(self, db, build_row, build_stats, sort_key=None, history_size=None,
+                 queue_size=None, refresh_seconds=None):
+        self.db = db
+        self.build_row = build_row
+        self.build_stats = build_stats
+        self.sort_key = sort_key
+        self.queue_size = queue_size or CLIENT_QUEUE_SIZE
+        self.refresh_seconds = REFRESH_SECONDS if refresh_seconds is None else refresh_seconds
+        self.ready = threading.Event()
+        self.epoch = format(int(time.time()), 'x')
+        self.version = 0
+        self.stats = {}
+        self.rows = {}
+        self.documents = {source: {} for source in LIVE_SOURCES}
+        self.counters = MetricState({source: BUSINESS_COUNTERS[source] for source in LIVE_SOURCES})
+        self.history = deque(maxlen=history_size or HISTORY_SIZE)
+        self.watches = {}
+        self.published = 0
+        self.clients_dropped = 0
+        self.identity = IdentityIndex()
+        self._loaded = set()
+        self._subscribers = set()
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ------------------------------------------------------------------
+    # State
+    # ------------------------------------------------------------------
+
+    def _row(self, user_id):
+        user = self.documents['users'].get(user_id)
+        if user is None:
+            return None
+        trial_id = self.identity.trial_id(user_id)
+        subscription_id = self.identity.subscription_id(user_id)
+        trial = self.documents['trials'].get(trial_id) if trial_id is not None else None
+        subscription = self.documents['subscriptions'].get(subscription_id) if subscription_id is not None else None
+        return self.build_row(user_id, user, trial, subscription)
+
+    def _apply(self, source, changes):
+        """Store a batch of changes; returns the user ids whose rows they touch"""
+        changes = list(changes)
+        documents = self.documents[source]
+        for doc_id, data in changes:
+            if data is None:
+                documents.pop(doc_id, None)
+            else:
+                documents[doc_id] = data
+        self.counters.apply(source, changes)
+        return self.identity.apply(source, changes)
+
+    def _diff(self, user_ids):
+        """Rebuild the given rows and stats; returns the diff, or None when nothing visible moved"""
+        upserts, removed = [], []
+        for user_id in user_ids:
+            row = self._row(user_id)
+            if row == self.rows.get(user_id):
+                continue
+            if row is None:
+                del self.rows[user_id]
+                removed.append(user_id)
+            else:
+                self.rows[user_id] = row
+                upserts.append(row)
+
+        stats = self.build_stats(self.counters.values)
+        changed = {name: value for name, value in stats.items() if self.stats.get(name) != value}
+        self.stats = stats
+
+        if not (upserts or removed or changed):
+            return None
+        diff = {'upserts': upserts, 'removed': removed}
+        if changed:
+            diff['stats'] = changed
+        return diff
+
+    def _publish(self, diff):
+        self.version += 1
+        diff['version'] = self.version
+        self.history.append(diff)
+        self.published += 1
+        for subscriber in list(self._subscribers):
+            if not subscriber.push((self.version, 'diff', diff)):
+                self._subscribers.discard(subscriber)
+                self.clients_dropped += 1
+
+    def on_changes(self, source, changes):
+        """Listener callback for one source's batch of ``(doc_id, data)`` changes"""
+        with self._lock:
+            touched = self._apply(source, changes)
+            if not self.ready.is_set():
+                # Rows are only built once all three collections have loaded
+                self._loaded.add(source)
+                if self._loaded.issuperset(LIVE_SOURCES):
+                    self._diff(list(self.documents['users']))
+                    self.version = 1
+                    self.ready.set()
+                    logger.debug(f"Live dashboard loaded {len(self.rows)} users")
+                return
+            diff = self._diff(touched)
+            if diff is not None:
+                self._publish(diff)
+
+    def refresh(self):
+        """Re-check every row for changes that come from the clock, not the data"""
+        with self._lock:
+            if not self.ready.is_set():
+                return None
+            self.counters.advance(datetime.now())
+            diff = self._diff(list(self.documents['users']))
+            if diff is not None:
+                self._publish(diff)
+            return diff
+
+    def snapshot(self):
+        with self._lock:
+            rows = list(self.rows.values())
+            if self.sort_key is not None:
+                rows.sort(key=self.sort_key, reverse=True)
+            return {'version': self.version, 'stats': dict(self.stats), 'users': rows}
+
+    # ------------------------------------------------------------------
+    # Clients
+    # ------------------------------------------------------------------
+
+    def subscribe(self, last_version=None):
+        """
+        Register a client; returns ``(subscriber, initial)`` where ``initial``
+        is the missed diffs when ``last_version`` can be replayed, else a snapshot
+        """
+        subscriber = Subscriber(self.queue_size)
+        with self._lock:
+            oldest = self.history[0]['version'] if self.history else self.version + 1
+            if last_version is not None and last_version == self.version:
+                initial = []
+            elif last_version is not None and oldest <= last_version + 1 and last_version < self.version:
+                initial = [(diff['version'], 'diff', diff) for diff in self.history
+                           if diff['version'] > last_version]
+            else:
+                initial = [(self.version, 'snapshot', self.snapshot())]
+            self._subscribers.add(subscriber)
+        return subscriber, initial
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def event_id(self, version):
+        return f'{self.epoch}.{version}'
+
+    def parse_event_id(self, event_id):
+        """The version in an event id of this process, else None"""
+        epoch, _, version = (event_id or '').partition('.')
+        if epoch != self.epoch or not version.isdigit():
+            return None
+        return int(version)
+
+    def events(self, last_event_id=None, heartbeat_seconds=None):
+        """Generator of SSE frames for one client; ends when the client is dropped"""
+        heartbeat_seconds = heartbeat_seconds or HEARTBEAT_SECONDS
+        subscriber, initial = self.subscribe(self.parse_event_id(last_event_id))
+        try:
+            # Tell EventSource how soon to reconnect if the stream drops
+            yield f'retry: {heartbeat_seconds * 1000}\n\n'
+            for version, event, data in initial:
+                yield format_event(event, data, self.event_id(version))
+            while not subscriber.dropped:
+                try:
+                    version, event, data = subscriber.queue.get(timeout=heartbeat_seconds)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield format_event(event, data, self.event_id(version))
+        finally:
+            self.unsubscribe(subscriber)
+
+    @property
+    def clients(self):
+        return len(self._subscribers)
+
+    # ------------------------------------------------------------------
+    # Listeners
+    # ------------------------------------------------------------------
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_seconds):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Live dashboard refresh failed: {e}")
+
+    def start(self, timeout=None):
+        """
+        Start the listeners (once) and wait for the first full load.
+
+        Raises RuntimeError if the collections have not loaded within ``timeout``.
+        """
+        with self._lock:
+            if not self.watches:
+                for source in LIVE_SOURCES:
+                    watch = CollectionWatch(self.db.collection(SOURCES[source]), source)
+                    watch.subscribe(lambda changes, source=source: self.on_changes(source, changes))
+                    self.watches[source] = watch
+                try:
+                    for watch in self.watches.values():
+                        watch.start()
+                except Exception:
+                    self.stop()
+                    raise
+                if self.refresh_seconds:
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._refresh_loop, name='live-dashboard', daemon=True)
+                    self._thread.start()
+        if not self.ready.wait(READY_TIMEOUT_SECONDS if timeout is None else timeout):
+            raise RuntimeError('Live dashboard listeners have not loaded yet')
+        return self
+
+    def stop(self):
+        with self._lock:
+            for watch in self.watches.values():
+                watch.stop()
+            self.watches = {}
+            self._loaded = set()
+            self.ready.clear()
+            self._stop.set()
+            for subscriber in list(self._subscribers):
+                subscriber.dropped = True
+            self._subscribers = set()
+
+    def status(self):
+        with self._lock:
+            return {
+                'ready': self.ready.is_set(),
+                'version': self.version,
+                'users': len(self.rows),
+                'clients': len(self._subscribers),
+                'published': self.published,
+                'clients_dropped': self.clients_dropped,
+                'changes_applied': self.counters.changes_applied,
+            }
@@ -0,0 +1,201 @@
+"""
+Concurrent Firestore reads for the analytics routes.
+
+Panels usually need several independent collections (users, subscriptions,
+trial_history, ...). Streaming them one after another makes a request as
+slow as the sum of the reads; fetch_parallel runs them on a shared, bounded
+thread pool so wall time is set by the slowest read instead.
+
+Every read also records an estimate of the bytes it transferred, and
+record_endpoint_reads() keeps running per-endpoint totals so the effect of
+field projection (see analytics/fields.py) can be watched in production.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Shared across requests so concurrent dashboard loads cannot open an
+# unbounded number of Firestore streams.
+MAX_READ_WORKERS = int(os.getenv('ANALYTICS_READ_WORKERS', '6'))
+_read_pool = ThreadPoolExecutor(max_workers=MAX_READ_WORKERS, thread_name_prefix='analytics-read')
+
+# Documents sized per read when estimating transferred bytes; larger reads
+# are extrapolated from an evenly spaced sample.
+SIZE_SAMPLE = 256
+
+# Firestore's documented storage-size rules
+_DOCUMENT_OVERHEAD = 32
+_NAME_OVERHEAD = 16
+
+
+def project(query, fields):
+    """
+    Narrow a query to the given fields with select().
+
+    An empty field list asks for document names only; Firestore treats an
+    empty projection as "all fields".
+    """
+    return query.select(list(fields) or ['__name__'])
+
+
+def _value_bytes(value):
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float, datetime)):
+        return 8
+    if isinstance(value, str):
+        return len(value.encode('utf-8')) + 1
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(k).encode('utf-8')) + 1 + _value_bytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_value_bytes(v) for v in value)
+    if hasattr(value, 'latitude'):
+        return 16
+    if hasattr(value, 'path'):
+        return len(value.path.encode('utf-8')) + _NAME_OVERHEAD
+    return 8
+
+
+def estimate_document_bytes(document):
+    """Approximate size of a DocumentSnapshot using Firestore's storage-size rules"""
+    reference = getattr(document, 'reference', None)
+    name = getattr(reference, 'path', None) or document.id
+    size = _DOCUMENT_OVERHEAD + _NAME_OVERHEAD + sum(len(part.encode('utf-8')) + 1 for part in name.split('/'))
+    return size + _value_bytes(document.to_dict() or {})
+
+
+def estimate_read_bytes(documents):
+    """Approximate bytes transferred for a list of DocumentSnapshots"""
+    if not documents:
+        return 0
+    step = max(1, len(documents) // SIZE_SAMPLE)
+    sample = documents[::step]
+    return round(sum(estimate_document_bytes(doc) for doc in sample) * len(documents) / len(sample))
+
+
+class ReadTiming:
+    """Timing and volume for one collection or query read"""
+
+    def __init__(self, name, seconds, documents, read_bytes=0):
+        self.name = name
+        self.seconds = seconds
+        self.documents = documents
+        self.bytes = read_bytes
+
+    @property
+    def docs_per_second(self):
+        return round(self.documents / self.seconds, 1) if self.seconds else 0
+
+    def to_dict(self):
+        return {
+            'ms': round(self.seconds * 1000, 1),
+            'documents': self.documents,
+            'bytes': self.bytes,
+            'docs_per_second': self.docs_per_second
+        }
+
+
+def metered_stream(query, name, on_complete):
+    """
+    Yield ``query.stream()`` documents one at a time, then hand a ReadTiming to
+    ``on_complete`` (also when the consumer stops early or the stream fails).
+
+    Nothing is buffered, so bytes are estimated from the first SIZE_SAMPLE
+    documents and every 64th one after that.
+    """
+    sampled = sampled_bytes = documents = 0
+    started = time.perf_counter()
+    try:
+        for doc in query.stream():
+            if documents < SIZE_SAMPLE or documents % 64 == 0:
+                sampled += 1
+                sampled_bytes += estimate_document_bytes(doc)
+            documents += 1
+            yield doc
+    finally:
+        read_bytes = round(sampled_bytes * documents / sampled) if sampled else 0
+        on_complete(ReadTiming(name, time.perf_counter() - started, documents, read_bytes))
+
+
+def _timed_read(name, query):
+    started = time.perf_counter()
+    documents = list(query.stream())
+    seconds = time.perf_counter() - started
+    return documents, ReadTiming(name, seconds, len(documents), estimate_read_bytes(documents))
+
+
+def fetch_parallel(queries):
+    """
+    Stream several independent queries concurrently.
+
+    Args:
+        queries (dict): name -> collection reference or query (anything with ``stream()``)
+
+    Returns:
+        tuple: (results, timings) where results maps name -> list of DocumentSnapshots
+        and timings maps name -> ReadTiming. The first failing read re-raises.
+    """
+    if not queries:
+        return {}, {}
+
+    started = time.perf_counter()
+    if len(queries) == 1:
+        # Nothing to overlap; skip the pool hop
+        (name, query), = queries.items()
+        documents, timing = _timed_read(name, query)
+        results, timings = {name: documents}, {name: timing}
+    else:
+        futures = {name: _read_pool.submit(_timed_read, name, query) for name, query in queries.items()}
+        results, timings = {}, {}
+        for name, future in futures.items():
+            results[name], timings[name] = future.result()
+
+    wall = time.perf_counter() - started
+    logger.debug(
+        "Read %s in %.1f ms (%s)",
+        ', '.join(queries),
+        wall * 1000,
+        ', '.join(f"{t.name}: {t.documents} docs / {t.bytes} B / {t.seconds * 1000:.1f} ms" for t in timings.values())
+    )
+    return results, timings
+
+
+# ----------------------------------------------------------------------------
+# Per-endpoint read volume
+# ----------------------------------------------------------------------------
+
+_endpoint_reads = {}
+_endpoint_lock = threading.Lock()
+
+
+def record_endpoint_reads(endpoint, timings):
+    """Add one request's reads (name -> ReadTiming) to the endpoint's running totals"""
+    documents = sum(t.documents for t in timings.values())
+    read_bytes = sum(t.bytes for t in timings.values())
+    with _endpoint_lock:
+        totals = _endpoint_reads.setdefault(endpoint, {
+            'requests': 0,
+            'documents': 0,
+            'bytes': 0,
+            'last_bytes': 0
+        })
+        totals['requests'] += 1
+        totals['documents'] += documents
+        totals['bytes'] += read_bytes
+        totals['last_bytes'] = read_bytes
+
+
+def endpoint_read_volume():
+    """Running read totals per endpoint, with bytes per request"""
+    with _endpoint_lock:
+        return {
+            endpoint: {**totals, 'bytes_per_request': round(totals['bytes'] / totals['requests'])}
+            for endpoint, totals in _endpoint_reads.items()
+        }
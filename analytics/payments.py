@@ -0,0 +1,267 @@
+"""
+Append-only payment event ledger with incrementally maintained rollups.
+
+Payment analytics used to rescan every subscription, count "cancelled and
+not active" as a failed payment and make up the payment-method and
+failure-reason breakdowns. Payments are now recorded as they happen: every
+attempt, success, failure or refund is one immutable document in
+``payment_events``. The same transaction that creates the event adds its
+counts to two rollup documents in ``payment_rollups``, one for the event's
+month and one for its payment method. Those counts are attempts,
+successes, failures, refunds, recoveries, revenue per currency and failures
+per reason. The analytics read those few dozen rollup documents, however
+long the payment history grows.
+
+An event id is derived from where the payment came from (the payment intent,
+the billing_history document), so re-recording the same payment is a no-op:
+the transaction's create() of an existing event fails and nothing is
+counted twice. A success for a user whose previous attempt failed counts as
+a recovery; each user's last status is kept in ``payment_accounts`` and read
+inside the transaction, so concurrent attempts of one user are serialized.
+
+Firestore specifics (the Increment transform, the transactional decorator,
+the already-exists error) are passed in, so this module does not import the
+client library.
+"""
+import logging
+import os
+import re
+from datetime import datetime
+
+from .timestamps import to_naive_datetime
+
+logger = logging.getLogger(__name__)
+
+EVENTS_COLLECTION = 'payment_events'
+ROLLUPS_COLLECTION = 'payment_rollups'
+ACCOUNTS_COLLECTION = 'payment_accounts'
+
+# Revenue is reported in this currency; other currencies are listed separately
+PAYMENT_REPORTING_CURRENCY = os.getenv('PAYMENT_REPORTING_CURRENCY', 'usd').lower()
+
+PAYMENT_TYPES = ('payment', 'refund')
+PAYMENT_STATUSES = ('succeeded', 'failed', 'pending')
+UNKNOWN_METHOD = 'unknown'
+OTHER_REASON = 'other'
+# Failure reasons and methods become rollup field names and document ids
+KEY_LENGTH = 40
+
+
+def _key(value, default):
+    """A short snake_case key for a free-text method or failure reason"""
+    key = re.sub(r'[^a-z0-9]+', '_', str(value or '').lower()).strip('_')[:KEY_LENGTH].rstrip('_')
+    return key or default
+
+
+def payment_event(user_id, amount, currency='usd', status='succeeded', method=None, failure_reason=None,
+                  event_type='payment', occurred_at=None, source='api', reference=None):
+    """
+    A normalized ledger event; ``amount`` in major currency units (a refund's
+    amount is positive). Raises ValueError on an unknown type or status.
+    """
+    if event_type not in PAYMENT_TYPES:
+        raise ValueError(f"type must be one of {', '.join(PAYMENT_TYPES)}")
+    if status not in PAYMENT_STATUSES:
+        raise ValueError(f"status must be one of {', '.join(PAYMENT_STATUSES)}")
+    return {
+        'type': event_type,
+        'status': status,
+        'userId': user_id,
+        'amount': round(abs(float(amount or 0)), 2),
+        'currency': (currency or 'usd').lower(),
+        'method': _key(method, UNKNOWN_METHOD),
+        'failureReason': _key(failure_reason, OTHER_REASON) if status == 'failed' else None,
+        'occurredAt': occurred_at or datetime.now(),
+        'source': source,
+        'reference': reference,
+    }
+
+
+def billing_history_event(doc_id, data):
+    """
+    ``(event_id, event)`` for a billing_history document written by the app's
+    billing flows; its ``status`` is a PaymentStatus name and ``amount`` is in
+    major units
+    """
+    status = (data.get('status') or '').lower()
+    event_type = 'refund' if status in ('refunded', 'refund') else 'payment'
+    if event_type == 'refund':
+        status = 'succeeded'
+    elif status in ('canceled', 'cancelled', 'requires_payment_method'):
+        status = 'failed'
+    elif status not in PAYMENT_STATUSES:
+        status = 'pending'
+    event = payment_event(
+        data.get('userId'), data.get('amount'), data.get('currency'), status,
+        method=data.get('paymentMethod'), failure_reason=data.get('failureReason'), event_type=event_type,
+        occurred_at=data.get('billingDate') or data.get('createdAt'), source='billing_history',
+        reference=data.get('transactionId'),
+    )
+    # A retried attempt is a new billing_history document, so the id identifies the attempt
+    return f'billing_history-{doc_id}', event
+
+
+def event_counts(event, recovered=False):
+    """The counters one event adds to its month and method rollups"""
+    counts = {}
+    if event['type'] == 'refund':
+        if event['status'] == 'succeeded':
+            counts['refunds'] = 1
+            counts['revenue'] = {event['currency']: -event['amount']}
+        return counts
+    if event['status'] == 'pending':
+        return counts
+    counts['attempts'] = 1
+    if event['status'] == 'succeeded':
+        counts['successes'] = 1
+        counts['revenue'] = {event['currency']: event['amount']}
+        if recovered:
+            counts['recoveries'] = 1
+    else:
+        counts['failures'] = 1
+        counts['failure_reasons'] = {event['failureReason']: 1}
+    return counts
+
+
+def rollup_ids(event):
+    """Ids of the rollup documents an event counts towards"""
+    occurred = to_naive_datetime(event['occurredAt']) or datetime.now()
+    return f"month-{occurred.strftime('%Y-%m')}", f"method-{event['method']}"
+
+
+def _transform(counts, increment):
+    return {name: _transform(value, increment) if isinstance(value, dict) else increment(value)
+            for name, value in counts.items()}
+
+
+def _add(total, counts):
+    for name, value in counts.items():
+        if isinstance(value, dict):
+            _add(total.setdefault(name, {}), value)
+        else:
+            total[name] = total.get(name, 0) + value
+
+
+class PaymentLedger:
+    """
+    Payment events and their rollups in Firestore.
+
+    Args:
+        db: Firestore client
+        increment (callable): the Increment transform (firestore.Increment)
+        transactional (callable): the transaction decorator (firestore.transactional)
+        duplicate_errors (tuple): exceptions a create() of an existing document raises
+    """
+
+    def __init__(self, db, increment, transactional, duplicate_errors=()):
+        self.db = db
+        self.increment = increment
+        self.transactional = transactional
+        self.duplicate_errors = tuple(duplicate_errors)
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    def record(self, event_id, event):
+        """
+        Append ``event`` and count it in its rollups, atomically; returns False
+        if an event with this id was already recorded
+        """
+        account_ref = self.db.collection(ACCOUNTS_COLLECTION).document(event['userId']) if event['userId'] else None
+
+        def write(transaction):
+            # Every read of a transaction comes before its writes
+            recovered = False
+            if account_ref is not None and event['type'] == 'payment' and event['status'] == 'succeeded':
+                account = account_ref.get(transaction=transaction)
+                recovered = bool(account.exists and (account.to_dict() or {}).get('lastStatus') == 'failed')
+
+            transaction.create(self.db.collection(EVENTS_COLLECTION).document(event_id),
+                               {**event, 'recovered': recovered})
+            counts = event_counts(event, recovered)
+            if counts:
+                month_id, method_id = rollup_ids(event)
+                rollups = self.db.collection(ROLLUPS_COLLECTION)
+                transaction.set(rollups.document(month_id), {'kind': 'month', 'key': month_id[len('month-'):],
+                                                             **_transform(counts, self.increment)}, merge=True)
+                transaction.set(rollups.document(method_id), {'kind': 'method', 'key': event['method'],
+                                                              **_transform(counts, self.increment)}, merge=True)
+            if account_ref is not None and event['type'] == 'payment' and event['status'] != 'pending':
+                transaction.set(account_ref, {'lastStatus': event['status'], 'lastEventId': event_id}, merge=True)
+
+        try:
+            self.transactional(write)(self.db.transaction())
+        except self.duplicate_errors:
+            logger.debug(f"Payment event {event_id} already recorded")
+            return False
+        return True
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    def rollup_records(self):
+        """``(doc_id, data)`` of every rollup document"""
+        for rollup_doc in self.db.collection(ROLLUPS_COLLECTION).stream():
+            yield rollup_doc.id, rollup_doc.to_dict() or {}
+
+    def rollups(self):
+        """``(months, methods)``: rollup counters keyed by month (YYYY-MM) and by payment method"""
+        months, methods = {}, {}
+        for _, data in self.rollup_records():
+            target = months if data.get('kind') == 'month' else methods if data.get('kind') == 'method' else None
+            if target is not None:
+                _add(target.setdefault(data['key'], {}),
+                     {name: value for name, value in data.items() if name not in ('kind', 'key')})
+        return months, methods
+
+
+def _rate(part, whole):
+    return round(part / whole * 100, 2) if whole else 0
+
+
+def payment_analysis(months, methods, recent_months=6):
+    """Payment totals, per-method and per-reason breakdowns and monthly trends from the rollups"""
+    totals = {}
+    for counts in months.values():
+        _add(totals, counts)
+    attempts = totals.get('attempts', 0)
+    successes = totals.get('successes', 0)
+    failures = totals.get('failures', 0)
+
+    payment_methods = {}
+    for method, counts in sorted(methods.items()):
+        payment_methods[method] = {
+            'attempts': counts.get('attempts', 0),
+            'successes': counts.get('successes', 0),
+            'failures': counts.get('failures', 0),
+            'success_rate': _rate(counts.get('successes', 0), counts.get('attempts', 0)),
+        }
+
+    monthly_trends = []
+    for month, counts in sorted(months.items())[-recent_months:]:
+        revenue = counts.get('revenue', {})
+        monthly_trends.append({
+            'month': month,
+            'attempts': counts.get('attempts', 0),
+            'successes': counts.get('successes', 0),
+            'failures': counts.get('failures', 0),
+            'success_rate': _rate(counts.get('successes', 0), counts.get('attempts', 0)),
+            'revenue': round(revenue.get(PAYMENT_REPORTING_CURRENCY, 0), 2),
+            'revenue_by_currency': {currency: round(amount, 2) for currency, amount in sorted(revenue.items())},
+            'refunds': counts.get('refunds', 0),
+        })
+
+    return {
+        'total_payment_attempts': attempts,
+        'successful_payments': successes,
+        'failed_payments': failures,
+        'success_rate': _rate(successes, attempts),
+        'failure_rate': _rate(failures, attempts),
+        'payment_methods': payment_methods,
+        'failure_reasons': dict(sorted(totals.get('failure_reasons', {}).items())),
+        'recovery_rate': _rate(totals.get('recoveries', 0), failures),
+        'refunds': totals.get('refunds', 0),
+        'monthly_trends': monthly_trends,
+    }
@@ -0,0 +1,333 @@
+"""
+Scheduled reports and their versioned snapshot store.
+
+The automated reports (daily summary, weekly trends, monthly business) scan
+whole collections, so building them on every request is wasteful: they only
+move as fast as the data does. A ReportScheduler builds each report on its
+own cron-like schedule in a background thread and saves the result to a
+ReportStore as a new numbered version. Requests read the latest version
+straight from the store, can ask for a synchronous refresh, and can page
+through earlier versions to show trends without recomputing anything.
+
+Snapshots are JSON files under REPORT_SNAPSHOT_DIR, so every gunicorn worker
+serves the same versions. Only one process runs the schedule: start() takes
+a file lock in the store and does nothing in the other workers, which just
+read what the scheduling process saves. A per-report file lock still keeps
+a synchronous refresh from building a report twice at once.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from .export_jobs import JobLock
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.getenv('REPORT_SNAPSHOT_DIR', 'report_snapshots')
+
+# Versions kept per report; older ones are deleted
+HISTORY_LIMIT = int(os.getenv('REPORT_HISTORY_LIMIT', '500'))
+
+# After a failed build, or while another worker holds the build, wait this long
+RETRY_SECONDS = int(os.getenv('REPORT_RETRY_SECONDS', '300'))
+
+
+# ----------------------------------------------------------------------------
+# Schedules
+# ----------------------------------------------------------------------------
+
+class CronSchedule:
+    """
+    Five-field cron expression: minute, hour, day of month, month, day of week.
+
+    Each field takes ``*``, numbers, ranges (``1-5``), steps (``*/15``,
+    ``0-30/10``) and comma-separated lists of those. Day of week runs 0-6
+    from Sunday (7 is Sunday too). As in cron, when both day fields are
+    restricted a day matching either of them fires.
+    """
+
+    FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7))
+
+    def __init__(self, expression):
+        self.expression = expression
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Cron expression needs 5 fields, got {len(parts)}: '{expression}'")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(part, low, high) for part, (_, low, high) in zip(parts, self.FIELDS)
+        )
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for item in field.split(','):
+            spec, _, step = item.partition('/')
+            step = int(step) if step else 1
+            if spec == '*':
+                start, end = low, high
+            elif '-' in spec:
+                start, end = (int(bound) for bound in spec.split('-', 1))
+            else:
+                start = end = int(spec)
+                if step > 1:
+                    end = high
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"Invalid cron field '{field}'")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment):
+        in_month = moment.day in self.days
+        # datetime weekday() counts from Monday; cron counts from Sunday
+        in_week = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day and self.any_weekday:
+            return True
+        if self.any_day:
+            return in_week
+        if self.any_weekday:
+            return in_month
+        return in_month or in_week
+
+    def next_after(self, moment):
+        """First time strictly after ``moment`` that the schedule fires"""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                year, month = divmod(moment.year * 12 + moment.month, 12)
+                moment = moment.replace(year=year, month=month + 1, day=1, hour=0, minute=0)
+            elif not self._day_matches(moment):
+                moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+            elif moment.hour not in self.hours:
+                moment = (moment + timedelta(hours=1)).replace(minute=0)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f"Cron expression '{self.expression}' never fires")
+
+    def __repr__(self):
+        return f"CronSchedule({self.expression!r})"
+
+
+# ----------------------------------------------------------------------------
+# Snapshot store
+# ----------------------------------------------------------------------------
+
+class ReportStore:
+    """
+    Numbered versions of each report, one JSON file per version.
+
+    A snapshot is ``{report, version, generated_at, duration_ms, trigger, data}``.
+    """
+
+    def __init__(self, directory=None, history_limit=None):
+        self.directory = directory or SNAPSHOT_DIR
+        self.history_limit = history_limit or HISTORY_LIMIT
+        self._latest = {}
+
+    def _report_dir(self, name):
+        return os.path.join(self.directory, name)
+
+    def _path(self, name, version):
+        return os.path.join(self._report_dir(name), f'{version:08d}.json')
+
+    def scheduler_lock(self):
+        """File lock held by the one process that runs the schedule"""
+        os.makedirs(self.directory, exist_ok=True)
+        return JobLock(os.path.join(self.directory, '.scheduler.lock'))
+
+    def lock(self, name):
+        """File lock serializing builds of one report across processes"""
+        os.makedirs(self._report_dir(name), exist_ok=True)
+        return JobLock(os.path.join(self._report_dir(name), '.build.lock'))
+
+    def versions(self, name):
+        """Stored version numbers, oldest first"""
+        try:
+            names = os.listdir(self._report_dir(name))
+        except FileNotFoundError:
+            return []
+        return sorted(int(entry[:-5]) for entry in names if entry.endswith('.json') and entry[:-5].isdigit())
+
+    def get(self, name, version):
+        try:
+            with open(self._path(name, version)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def latest(self, name):
+        """Newest snapshot of a report, None if it was never built"""
+        versions = self.versions(name)
+        if not versions:
+            return None
+        cached = self._latest.get(name)
+        if cached is not None and cached['version'] == versions[-1]:
+            return cached
+        snapshot = self.get(name, versions[-1])
+        if snapshot is not None:
+            self._latest[name] = snapshot
+        return snapshot
+
+    def history(self, name, limit=None):
+        """Snapshots of a report, newest first"""
+        versions = self.versions(name)[::-1]
+        if limit is not None:
+            versions = versions[:limit]
+        return [snapshot for snapshot in (self.get(name, version) for version in versions) if snapshot is not None]
+
+    def save(self, name, data, generated_at, duration_ms, trigger):
+        """Store ``data`` as the next version; call with the report's lock held"""
+        versions = self.versions(name)
+        snapshot = {
+            'report': name,
+            'version': versions[-1] + 1 if versions else 1,
+            'generated_at': generated_at.isoformat(),
+            'duration_ms': duration_ms,
+            'trigger': trigger,
+            'data': data,
+        }
+        path = self._path(name, snapshot['version'])
+        os.makedirs(self._report_dir(name), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(snapshot, f, default=str)
+        os.replace(path + '.tmp', path)
+        self._latest[name] = snapshot
+
+        for version in versions[:max(0, len(versions) + 1 - self.history_limit)]:
+            try:
+                os.remove(self._path(name, version))
+            except FileNotFoundError:
+                pass
+        return snapshot
+
+
+# ----------------------------------------------------------------------------
+# Scheduler
+# ----------------------------------------------------------------------------
+
+class ReportScheduler:
+    """
+    Builds registered reports when their schedule says they are due.
+
+    A report is due once the first scheduled time after its latest snapshot
+    has passed, so a restart catches up on missed runs with a single build.
+    """
+
+    def __init__(self, store, retry_seconds=None):
+        self.store = store
+        self.retry_after = timedelta(seconds=RETRY_SECONDS if retry_seconds is None else retry_seconds)
+        self.reports = {}
+        self._not_before = {}
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._scheduler_lock = None
+
+    def register(self, name, schedule, build):
+        """Schedule ``build()`` (returns the report data) on a cron expression"""
+        if not isinstance(schedule, CronSchedule):
+            schedule = CronSchedule(schedule)
+        self.reports[name] = (schedule, build)
+        self._wake.set()
+
+    def next_run(self, name, now=None):
+        schedule, _ = self.reports[name]
+        latest = self.store.latest(name)
+        if latest is None:
+            due = now or datetime.now()
+        else:
+            due = schedule.next_after(datetime.fromisoformat(latest['generated_at']))
+        not_before = self._not_before.get(name)
+        return max(due, not_before) if not_before else due
+
+    def _build(self, name, trigger):
+        """Build and store a report; the caller holds its lock"""
+        _, build = self.reports[name]
+        generated_at = datetime.now()
+        started = time.perf_counter()
+        data = build()
+        duration_ms = round((time.perf_counter() - started) * 1000, 1)
+        snapshot = self.store.save(name, data, generated_at, duration_ms, trigger)
+        self._not_before.pop(name, None)
+        logger.debug(f"Built report {name} v{snapshot['version']} in {duration_ms} ms ({trigger})")
+        return snapshot
+
+    def refresh(self, name):
+        """Build a report now, waiting for a build already in progress; returns the new snapshot"""
+        with self.store.lock(name):
+            return self._build(name, 'refresh')
+
+    def latest(self, name):
+        """Latest snapshot of a report, built on the spot if there is none yet"""
+        return self.store.latest(name) or self.refresh(name)
+
+    def run_pending(self, now=None):
+        """Build every report that is due; returns the names built"""
+        now = now or datetime.now()
+        built = []
+        for name in list(self.reports):
+            if self.next_run(name, now) > now:
+                continue
+            lock = self.store.lock(name)
+            if not lock.acquire():
+                # Another worker is building it
+                self._not_before[name] = now + self.retry_after
+                continue
+            try:
+                # ...or has just finished building it
+                if self.next_run(name, now) > now:
+                    continue
+                self._build(name, 'schedule')
+                built.append(name)
+            except Exception as e:
+                logger.error(f"Scheduled report {name} failed: {e}")
+                self._not_before[name] = now + self.retry_after
+            finally:
+                lock.release()
+        return built
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            self.run_pending()
+            now = datetime.now()
+            upcoming = [self.next_run(name, now) for name in self.reports]
+            wait = min((due - now).total_seconds() for due in upcoming) if upcoming else 60
+            self._wake.clear()
+            self._wake.wait(timeout=min(max(wait, 1), 60))
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        """
+        Run the schedule in a daemon thread, unless another process already runs
+        it; returns whether this process does
+        """
+        if self._thread is None:
+            lock = self.store.scheduler_lock()
+            if not lock.acquire():
+                return False
+            self._scheduler_lock = lock
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._loop, name='report-scheduler', daemon=True)
+            self._thread.start()
+        return True
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+        if self._scheduler_lock is not None:
+            self._scheduler_lock.release()
+            self._scheduler_lock = None
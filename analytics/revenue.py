@@ -0,0 +1,162 @@
+"""
+Interval-sweep revenue engine.
+
+Total revenue looped over every subscription parsing dates, and every MRR
+figure was an active count times a hard-coded $3. The RevenueEngine turns
+the subscriptions into priced intervals [start, end) once, sorts their start
+(+price) and end (-price) events, and runs a single sweep with prefix sums:
+
+* MRR and subscriber count at any instant are the prefix sums at the last
+  event before it (one binary search);
+* revenue over any range is the integral of MRR over it, kept as a running
+  area under the step function, prorated by the average month length;
+* new and ended subscriptions in a range are two binary searches each over
+  the sorted starts and ends.
+
+Building costs O(n log n); every query after that is O(log n).
+
+A subscription ends at ``subscriptionEndDate``, or at ``willExpireAt`` once
+cancelled; without either it is still running. Prices come from the
+subscription's ``plan`` through PLAN_PRICES (JSON, e.g. '{"monthly": 3.0}');
+plans without an entry cost DEFAULT_PLAN_PRICE.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Plan prices live with the subscription columns, which carry a price per subscription
+from .columnar import MISSING, PLAN_PRICES, US_PER_DAY, _epoch_us_or_missing, _iter_records, load_plan_prices, plan_price
+from .timestamps import from_epoch_us, to_epoch_us
+
+US_PER_MONTH = 365.25 / 12 * US_PER_DAY
+
+
+def _month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(moment):
+    return (_month_start(moment) + timedelta(days=32)).replace(day=1)
+
+
+class RevenueEngine:
+    """
+    Priced subscription intervals swept into prefix sums.
+
+    Args:
+        starts (np.ndarray): interval starts, epoch microseconds
+        ends (np.ndarray): interval ends, MISSING for still running
+        prices (np.ndarray): monthly price of each interval
+        current_mrr (float): MRR of the subscriptions whose status is 'active'
+    """
+
+    def __init__(self, starts, ends, prices, current_mrr=0.0, now=None):
+        self.now = now or datetime.now()
+        self.current_mrr = float(current_mrr)
+        self.starts = np.sort(starts)
+        self.ends = np.sort(ends[ends != MISSING])
+
+        ended = ends != MISSING
+        times = np.concatenate((starts, ends[ended]))
+        deltas = np.concatenate((prices, -prices[ended]))
+        counts = np.concatenate((np.ones(len(starts)), -np.ones(int(ended.sum()))))
+        order = np.argsort(times, kind='stable')
+        self.times = times[order]
+        self.mrr_levels = np.cumsum(deltas[order])
+        self.subscriber_levels = np.cumsum(counts[order]).astype(np.int64)
+        # Area under the MRR step function from the first event up to each event
+        self.areas = np.concatenate(([0.0], np.cumsum(self.mrr_levels[:-1] * np.diff(self.times))))
+
+    @classmethod
+    def from_records(cls, records, prices=None, now=None):
+        """Build from ``(doc_id, data)`` pairs of the subscriptions collection"""
+        starts, ends, amounts = [], [], []
+        current_mrr = 0.0
+        for _, data in records:
+            price = plan_price(data.get('plan'), prices)
+            if data.get('status') == 'active':
+                current_mrr += price
+            start = _epoch_us_or_missing(data.get('startDate'))
+            if start == MISSING:
+                continue
+            end = _epoch_us_or_missing(data.get('subscriptionEndDate'))
+            if end == MISSING and data.get('cancelled'):
+                end = _epoch_us_or_missing(data.get('willExpireAt'))
+            starts.append(start)
+            # An interval ending before it starts contributes nothing
+            ends.append(max(end, start) if end != MISSING else MISSING)
+            amounts.append(price)
+        return cls(np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64),
+                   np.array(amounts, dtype=np.float64), current_mrr, now)
+
+    @classmethod
+    def from_snapshots(cls, snapshots, prices=None, now=None):
+        return cls.from_records(_iter_records(snapshots), prices, now)
+
+    # ------------------------------------------------------------------
+    # Point queries
+    # ------------------------------------------------------------------
+
+    def _position(self, moment):
+        """Index of the last event at or before ``moment`` (-1 if none)"""
+        return int(np.searchsorted(self.times, to_epoch_us(moment), side='right')) - 1
+
+    def mrr_at(self, moment):
+        """Monthly recurring revenue of the subscriptions running at ``moment``"""
+        position = self._position(moment)
+        return float(self.mrr_levels[position]) if position >= 0 else 0.0
+
+    def subscribers_at(self, moment):
+        position = self._position(moment)
+        return int(self.subscriber_levels[position]) if position >= 0 else 0
+
+    def _area(self, moment):
+        position = self._position(moment)
+        if position < 0:
+            return 0.0
+        return float(self.areas[position] + self.mrr_levels[position] * (to_epoch_us(moment) - self.times[position]))
+
+    # ------------------------------------------------------------------
+    # Range queries
+    # ------------------------------------------------------------------
+
+    def revenue(self, start=None, end=None):
+        """Revenue earned in [start, end] (defaults: the first subscription, now), prorated by month length"""
+        end = end or self.now
+        if start is None:
+            return self._area(end) / US_PER_MONTH
+        return max(0.0, self._area(end) - self._area(start)) / US_PER_MONTH
+
+    def lifetime_revenue(self):
+        return self.revenue(None, self.now)
+
+    def net_growth(self, start, end):
+        """Subscriptions started and ended in [start, end]"""
+        low, high = to_epoch_us(start), to_epoch_us(end)
+        new = int(np.searchsorted(self.starts, high, side='right') - np.searchsorted(self.starts, low, side='left'))
+        ended = int(np.searchsorted(self.ends, high, side='right') - np.searchsorted(self.ends, low, side='left'))
+        return {'new_subscriptions': new, 'ended_subscriptions': ended, 'net_growth': new - ended}
+
+    def history(self, start, end):
+        """
+        Calendar-month periods from ``start``'s month through ``end``'s: MRR
+        and subscribers at the close of each period (or now, for the current
+        one), revenue earned in it and its net growth
+        """
+        periods = []
+        month = _month_start(start)
+        while month <= end:
+            following = _next_month(month)
+            close = min(following - timedelta(microseconds=1), self.now)
+            periods.append({
+                'period': month.strftime('%Y-%m'),
+                'mrr': round(self.mrr_at(close), 2),
+                'subscribers': self.subscribers_at(close),
+                'revenue': round(self.revenue(month, close), 2) if close >= month else 0.0,
+                **self.net_growth(month, following - timedelta(microseconds=1)),
+            })
+            month = following
+        return periods
+
+    def first_start(self):
+        return from_epoch_us(self.starts[0]) if len(self.starts) else None
@@ -0,0 +1,205 @@
+"""
+Parallel partitioned scans of whole Firestore collections.
+
+A plain ``collection.stream()`` is one long sequential RPC stream; on big
+collections it is slow and can run into deadline errors. PartitionedScan
+splits the collection into document-id ranges, reads each range in short
+pages on a shared thread pool, and resumes a failed page from the last
+document it saw, retrying with backoff.
+
+A scan exposes ``stream()`` like a query, so it can be handed to
+fetch_parallel, StreamingAggregation.run or anything else that streams.
+Documents from different partitions are interleaved, not ordered. Buffering
+is bounded, so streaming a scan keeps memory flat.
+
+Split points are spaced evenly over the alphabet Firestore auto-ids and
+Firebase uids are drawn from. Ids outside it (emails in trial_history, for
+example) are still read, but the partitions come out less even.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+SCAN_PARTITIONS = int(os.getenv('ANALYTICS_SCAN_PARTITIONS', '8'))
+SCAN_PAGE_SIZE = int(os.getenv('ANALYTICS_SCAN_PAGE_SIZE', '1000'))
+SCAN_RETRIES = int(os.getenv('ANALYTICS_SCAN_RETRIES', '3'))
+MAX_SCAN_WORKERS = int(os.getenv('ANALYTICS_SCAN_WORKERS', '16'))
+
+# Separate from the loader's read pool: fetch_parallel tasks wait on scans,
+# so sharing one pool could starve it.
+_scan_pool = ThreadPoolExecutor(max_workers=MAX_SCAN_WORKERS, thread_name_prefix='analytics-scan')
+
+DOCUMENT_ID = '__name__'
+ID_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+# End-of-partition marker on the hand-off queue
+_DONE = object()
+
+
+def split_points(partitions):
+    """partitions - 1 document-id boundaries, evenly spaced over two-character id prefixes"""
+    base = len(ID_ALPHABET)
+    points = []
+    for i in range(1, partitions):
+        position = i * base * base // partitions
+        points.append(ID_ALPHABET[position // base] + ID_ALPHABET[position % base])
+    return sorted(set(points))
+
+
+class ScanPartition:
+    """One document-id range [low, high); ``last_id`` is the last document delivered"""
+
+    def __init__(self, low=None, high=None, last_id=None, done=False):
+        self.low = low
+        self.high = high
+        self.last_id = last_id
+        self.done = done
+        self.documents = 0
+        self.pages = 0
+        self.retries = 0
+
+    def to_dict(self):
+        return {'low': self.low, 'high': self.high, 'last_id': self.last_id, 'done': self.done}
+
+
+class PartitionedScan:
+    """
+    Parallel, resumable scan of a whole collection.
+
+    Args:
+        collection: CollectionReference to scan
+        fields (tuple): optional projection (see analytics/fields.py)
+        partitions (int): number of document-id ranges read concurrently
+        page_size (int): documents per RPC; a retry re-reads at most one page
+        retries (int): attempts per page before the scan fails
+        checkpoint (list): ``checkpoint()`` output of an earlier scan to resume
+    """
+
+    def __init__(self, collection, fields=None, partitions=None, page_size=None, retries=None, checkpoint=None):
+        self.collection = collection
+        self.fields = fields
+        self.page_size = page_size or SCAN_PAGE_SIZE
+        self.retries = SCAN_RETRIES if retries is None else retries
+
+        if checkpoint:
+            self.partitions = [ScanPartition(**state) for state in checkpoint]
+        else:
+            bounds = [None] + split_points(partitions or SCAN_PARTITIONS) + [None]
+            self.partitions = [ScanPartition(low, high) for low, high in zip(bounds, bounds[1:])]
+
+        self.seconds = 0.0
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def _page_query(self, partition, cursor):
+        query = self.collection.order_by(DOCUMENT_ID)
+        if cursor is not None:
+            query = query.where(DOCUMENT_ID, '>', self.collection.document(cursor))
+        elif partition.low is not None:
+            query = query.where(DOCUMENT_ID, '>=', self.collection.document(partition.low))
+        if partition.high is not None:
+            query = query.where(DOCUMENT_ID, '<', self.collection.document(partition.high))
+        if self.fields is not None:
+            query = query.select(list(self.fields) or [DOCUMENT_ID])
+        return query.limit(self.page_size)
+
+    def _read_page(self, partition, cursor):
+        """Read the page after ``cursor``, retrying from the same cursor on failure"""
+        attempt = 0
+        while True:
+            try:
+                return list(self._page_query(partition, cursor).stream())
+            except Exception as e:
+                attempt += 1
+                partition.retries += 1
+                if attempt > self.retries:
+                    raise
+                delay = min(0.2 * 2 ** (attempt - 1), 5.0)
+                logger.warning(f"Scan of {self.collection.id} [{partition.low}, {partition.high}) failed "
+                               f"after {cursor!r}: {e}; retry {attempt}/{self.retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    @staticmethod
+    def _put(out, item, stop):
+        """Blocking put that gives up once the consumer has gone away"""
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _scan_partition(self, partition, out, stop):
+        cursor = partition.last_id
+        try:
+            while not stop.is_set():
+                page = self._read_page(partition, cursor)
+                partition.pages += 1
+                for doc in page:
+                    if not self._put(out, (partition, doc), stop):
+                        return
+                if len(page) < self.page_size:
+                    break
+                cursor = page[-1].id
+            self._put(out, (partition, _DONE), stop)
+        except Exception as e:
+            self._put(out, (partition, e), stop)
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def stream(self):
+        """Yield every document in the collection (partitions interleaved)"""
+        pending = [p for p in self.partitions if not p.done]
+        out = queue.Queue(maxsize=self.page_size * 2)
+        stop = threading.Event()
+        started = time.perf_counter()
+
+        for partition in pending:
+            _scan_pool.submit(self._scan_partition, partition, out, stop)
+
+        try:
+            remaining = len(pending)
+            while remaining:
+                partition, item = out.get()
+                if item is _DONE:
+                    partition.done = True
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    # Only documents handed to the caller advance the resume cursor
+                    partition.last_id = item.id
+                    partition.documents += 1
+                    yield item
+        finally:
+            stop.set()
+            self.seconds += time.perf_counter() - started
+            stats = self.stats()
+            logger.debug(f"Scanned {self.collection.id}: {stats['documents']} docs in {stats['seconds']:.2f}s "
+                        f"({stats['docs_per_second']:.0f} docs/s, {len(self.partitions)} partitions, "
+                        f"{stats['retries']} retries)")
+
+    def checkpoint(self):
+        """Resume state for every partition; pass back as ``checkpoint=`` to continue"""
+        return [partition.to_dict() for partition in self.partitions]
+
+    def stats(self):
+        documents = sum(p.documents for p in self.partitions)
+        return {
+            'documents': documents,
+            'seconds': round(self.seconds, 3),
+            'docs_per_second': round(documents / self.seconds, 1) if self.seconds else 0,
+            'pages': sum(p.pages for p in self.partitions),
+            'retries': sum(p.retries for p in self.partitions),
+            'partitions': len(self.partitions)
+        }
@@ -0,0 +1,338 @@
+"""
+In-memory search index over the user journey records.
+
+Finding a user used to mean downloading all of ``/api/users`` and filtering
+in the browser. A UserSearchIndex keeps, per journey record:
+
+* prefix tries on the (lower-cased) email and on the uid, answering
+  "starts with" in time proportional to the prefix plus the results wanted,
+  closest (shortest) completions first;
+* inverted indexes from each status field value to the set of user ids, so
+  filters are set intersections, smallest set first.
+
+The index is built once from a full listing and then kept current from the
+change journal (analytics/changes.py): each delta only re-indexes the
+records that changed and drops the tombstoned ones. Build time and an
+estimate of the memory held are reported by ``stats()``.
+"""
+import heapq
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+SEARCH_LIMIT = int(os.getenv('SEARCH_DEFAULT_LIMIT', '20'))
+SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', '200'))
+
+# Journey fields with an inverted index; filters on anything else are rejected
+STATUS_FIELDS = ('current_status', 'trial_status', 'subscription_status', 'email_verified', 'is_premium')
+
+
+def index_value(value):
+    """Case-insensitive key for an inverted index ('true'/'false' for flags)"""
+    return str(value).strip().lower()
+
+
+class TrieNode:
+    __slots__ = ('children', 'keys', 'count')
+
+    def __init__(self):
+        self.children = {}
+        # Ids whose indexed string ends exactly here
+        self.keys = None
+        # Ids anywhere in this subtree
+        self.count = 0
+
+
+class PrefixTrie:
+    """Strings -> ids, queried by prefix in lexicographic order"""
+
+    def __init__(self):
+        self.root = TrieNode()
+        self.nodes = 1
+
+    def add(self, text, key):
+        node = self.root
+        node.count += 1
+        for char in text:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = TrieNode()
+                self.nodes += 1
+            node = child
+            node.count += 1
+        if node.keys is None:
+            node.keys = set()
+        node.keys.add(key)
+
+    def remove(self, text, key):
+        path = [self.root]
+        for char in text:
+            node = path[-1].children.get(char)
+            if node is None:
+                return False
+            path.append(node)
+        if not path[-1].keys or key not in path[-1].keys:
+            return False
+        path[-1].keys.discard(key)
+        if not path[-1].keys:
+            path[-1].keys = None
+        for node in path:
+            node.count -= 1
+        # Prune the emptied tail of the path
+        for depth in range(len(text), 0, -1):
+            if path[depth].count:
+                break
+            del path[depth - 1].children[text[depth - 1]]
+            self.nodes -= 1
+        return True
+
+    def _find(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def count(self, prefix):
+        node = self._find(prefix)
+        return node.count if node is not None else 0
+
+    def iter_prefix(self, prefix):
+        """Ids under ``prefix``, shortest completions first, then in lexicographic order"""
+        node = self._find(prefix)
+        if node is None:
+            return
+        level = deque([node])
+        while level:
+            node = level.popleft()
+            if node.keys:
+                yield from sorted(node.keys)
+            level.extend(node.children[char] for char in sorted(node.children))
+
+
+class UserSearchIndex:
+    """
+    Prefix and status-field index over journey records keyed by user id.
+
+    Args:
+        fields (tuple): journey fields to keep inverted indexes for
+        key (str): record field holding the user id
+    """
+
+    def __init__(self, fields=STATUS_FIELDS, key='user_id'):
+        self.fields = tuple(fields)
+        self.key = key
+        self.records = {}
+        self.emails = PrefixTrie()
+        self.uids = PrefixTrie()
+        self.inverted = {field: {} for field in self.fields}
+        # Sync token of the change journal this index has caught up to
+        self.token = None
+        self.build_ms = None
+        self.built_at = None
+        self.updates = 0
+        self.queries = 0
+        self.query_ms = 0.0
+        self.lock = threading.RLock()
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _email(record):
+        email = record.get('email') or ''
+        return '' if email == 'N/A' else email.lower()
+
+    def _index(self, user_id, record):
+        email = self._email(record)
+        if email:
+            self.emails.add(email, user_id)
+        self.uids.add(user_id.lower(), user_id)
+        for field in self.fields:
+            self.inverted[field].setdefault(index_value(record.get(field)), set()).add(user_id)
+
+    def _unindex(self, user_id, record):
+        email = self._email(record)
+        if email:
+            self.emails.remove(email, user_id)
+        self.uids.remove(user_id.lower(), user_id)
+        for field in self.fields:
+            values = self.inverted[field]
+            value = index_value(record.get(field))
+            ids = values.get(value)
+            if ids is not None:
+                ids.discard(user_id)
+                if not ids:
+                    del values[value]
+
+    def upsert(self, record):
+        user_id = record[self.key]
+        with self.lock:
+            old = self.records.get(user_id)
+            if old == record:
+                return
+            if old is not None:
+                self._unindex(user_id, old)
+            self.records[user_id] = record
+            self._index(user_id, record)
+            self.updates += 1
+
+    def remove(self, user_id):
+        with self.lock:
+            old = self.records.pop(user_id, None)
+            if old is not None:
+                self._unindex(user_id, old)
+                self.updates += 1
+
+    def build(self, records):
+        """Replace the index with a full listing of journey records"""
+        with self.lock:
+            return self._build(records)
+
+    def _build(self, records):
+        started = time.perf_counter()
+        self.records = {}
+        self.emails = PrefixTrie()
+        self.uids = PrefixTrie()
+        self.inverted = {field: {} for field in self.fields}
+        for record in records:
+            self.records[record[self.key]] = record
+            self._index(record[self.key], record)
+        self.build_ms = round((time.perf_counter() - started) * 1000, 2)
+        self.built_at = time.time()
+        return self
+
+    def apply(self, delta):
+        """
+        Catch up from a ChangeJournal delta (``changes``/``deleted``/``token``/``reset``);
+        a reset rebuilds, anything else only touches the changed records
+        """
+        with self.lock:
+            if delta['reset']:
+                self._build(delta['changes'])
+            else:
+                for record in delta['changes']:
+                    self.upsert(record)
+                for user_id in delta['deleted']:
+                    self.remove(user_id)
+            self.token = delta['token']
+            return self
+
+    def catch_up(self, journal):
+        """Apply everything the journal recorded since this index's token"""
+        with self.lock:
+            while True:
+                delta = journal.changes(self.token)
+                self.apply(delta)
+                if not delta['has_more']:
+                    return self
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def _filtered(self, filters):
+        """Ids matching every ``field: value`` filter, or None when there are none"""
+        if not filters:
+            return None
+        sets = []
+        for field, value in filters.items():
+            if field not in self.inverted:
+                raise ValueError(f"Cannot filter on '{field}'; indexed fields: {', '.join(self.fields)}")
+            sets.append(self.inverted[field].get(index_value(value), set()))
+        sets.sort(key=len)
+        return set.intersection(*sets) if len(sets) > 1 else sets[0]
+
+    def search(self, query=None, filters=None, limit=None):
+        """
+        Top ``limit`` records whose email or uid starts with ``query`` and
+        whose status fields match ``filters``.
+
+        Text matches come back email matches first, each shortest completion
+        first (an exact match leads); filter-only results newest registration
+        first.
+        Raises ValueError for a filter on a field without an index.
+        """
+        with self.lock:
+            return self._search((query or '').strip().lower(), filters,
+                                max(1, min(limit or SEARCH_LIMIT, SEARCH_MAX_LIMIT)))
+
+    def _search(self, query, filters, limit):
+        started = time.perf_counter()
+        allowed = self._filtered(filters)
+
+        if query:
+            results, seen = [], set()
+            for user_id in self._text_matches(query):
+                if user_id in seen or (allowed is not None and user_id not in allowed):
+                    continue
+                seen.add(user_id)
+                results.append(user_id)
+                if len(results) > limit:
+                    break
+            has_more = len(results) > limit
+            results = results[:limit]
+            # Text matches are only enumerated up to the limit
+            total = None if has_more else len(results)
+        else:
+            candidates = self.records.keys() if allowed is None else allowed
+            total = len(candidates)
+            results = heapq.nlargest(
+                limit, candidates,
+                key=lambda user_id: (self.records[user_id].get('registration_date') or '', user_id))
+            has_more = total > limit
+
+        took_ms = (time.perf_counter() - started) * 1000
+        self.queries += 1
+        self.query_ms += took_ms
+        return {
+            'results': [self.records[user_id] for user_id in results],
+            'total': total,
+            'has_more': has_more,
+            'took_ms': round(took_ms, 3),
+        }
+
+    def _text_matches(self, query):
+        yield from self.emails.iter_prefix(query)
+        yield from self.uids.iter_prefix(query)
+
+    # ------------------------------------------------------------------
+    # Reporting
+    # ------------------------------------------------------------------
+
+    def memory_bytes(self):
+        """Estimate of the memory held by the index structures (records excluded)"""
+        total = 0
+        for trie in (self.emails, self.uids):
+            stack = [trie.root]
+            while stack:
+                node = stack.pop()
+                total += sys.getsizeof(node) + sys.getsizeof(node.children)
+                if node.keys is not None:
+                    total += sys.getsizeof(node.keys)
+                stack.extend(node.children.values())
+        for values in self.inverted.values():
+            total += sys.getsizeof(values)
+            total += sum(sys.getsizeof(ids) for ids in values.values())
+        return total
+
+    def stats(self):
+        with self.lock:
+            return self._stats()
+
+    def _stats(self):
+        return {
+            'records': len(self.records),
+            'trie_nodes': self.emails.nodes + self.uids.nodes,
+            'indexed_fields': {field: len(values) for field, values in self.inverted.items()},
+            'build_ms': self.build_ms,
+            'memory_bytes': self.memory_bytes(),
+            'updates': self.updates,
+            'queries': self.queries,
+            'avg_query_ms': round(self.query_ms / self.queries, 3) if self.queries else None,
+            'token': self.token,
+        }
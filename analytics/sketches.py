@@ -0,0 +1,289 @@
+"""
+HyperLogLog sketches for distinct-user counts.
+
+Distinct users over chat activity and token usage - per day, per month, per
+userType, per country - needed a full scan and a Python set per question.
+A HyperLogLog sketch estimates the number of distinct items it has seen in
+a fixed 2**precision bytes, updates in O(1) per event, and two sketches
+merge (register-wise max) into the sketch of the union. So the store keeps
+one sketch per (metric, day, dimension value); any range of days, or a
+month, is the merge of its daily sketches.
+
+The standard error of an estimate is about 1.04 / sqrt(2**precision):
+SKETCH_RELATIVE_ERROR picks the smallest precision meeting it (0.02 -> 4 KB
+per sketch). Sketches are persisted per day as zlib-compressed registers,
+so sparse sketches of small dimensions take a few bytes. Events are
+buffered per worker and merged into the day files under a lock file;
+merging is idempotent, so workers never need to coordinate beyond that.
+"""
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from .export_jobs import JobLock
+
+logger = logging.getLogger(__name__)
+
+SKETCH_DIR = os.getenv('SKETCH_DIR', 'usage_sketches')
+SKETCH_RELATIVE_ERROR = float(os.getenv('SKETCH_RELATIVE_ERROR', '0.02'))
+SKETCH_FLUSH_SECONDS = int(os.getenv('SKETCH_FLUSH_SECONDS', '30'))
+SKETCH_CACHE_DAYS = int(os.getenv('SKETCH_CACHE_DAYS', '400'))
+
+MIN_PRECISION = 4
+MAX_PRECISION = 18
+
+
+def precision_for(relative_error):
+    """Smallest precision whose standard error is at most ``relative_error``"""
+    precision = math.ceil(math.log2((1.04 / relative_error) ** 2))
+    return min(max(precision, MIN_PRECISION), MAX_PRECISION)
+
+
+def _hash64(item):
+    return int.from_bytes(hashlib.blake2b(str(item).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """Distinct-count sketch over 2**precision one-byte registers"""
+
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision=None, registers=None):
+        self.precision = precision or precision_for(SKETCH_RELATIVE_ERROR)
+        if not MIN_PRECISION <= self.precision <= MAX_PRECISION:
+            raise ValueError(f"precision must be between {MIN_PRECISION} and {MAX_PRECISION}")
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << self.precision)
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add(self, item):
+        value = _hash64(item)
+        index = value >> (64 - self.precision)
+        rest = value & ((1 << (64 - self.precision)) - 1)
+        # Position of the first set bit in the remaining bits
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Fold ``other`` into this sketch (afterwards it counts the union)"""
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge sketches of precision {other.precision} and {self.precision}")
+        merged = np.maximum(np.frombuffer(self.registers, dtype=np.uint8),
+                            np.frombuffer(other.registers, dtype=np.uint8))
+        self.registers = bytearray(merged.tobytes())
+        return self
+
+    def estimate(self):
+        registers = np.frombuffer(self.registers, dtype=np.uint8)
+        m = len(registers)
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        raw = alpha * m * m / float(np.sum(np.ldexp(1.0, -registers.astype(np.int32))))
+        zeros = int(np.count_nonzero(registers == 0))
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate while many registers are empty
+            return m * math.log(m / zeros)
+        return raw
+
+    def __len__(self):
+        return int(round(self.estimate()))
+
+    def to_bytes(self):
+        return zlib.compress(bytes(self.registers), 6)
+
+    @classmethod
+    def from_bytes(cls, precision, data):
+        return cls(precision, zlib.decompress(data))
+
+
+def _day(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value))
+
+
+def _key(metric, dimension=None, value=None):
+    return f"{metric}|{dimension or ''}|{'' if value is None else value}"
+
+
+class SketchStore:
+    """
+    Daily HyperLogLog sketches per metric and dimension value.
+
+    Args:
+        directory (str): holds one ``YYYY-MM-DD.json`` of sketches per day
+        precision (int): register count exponent (default from SKETCH_RELATIVE_ERROR)
+        flush_seconds (int): how long updates may stay buffered in this worker
+    """
+
+    def __init__(self, directory=None, precision=None, flush_seconds=None):
+        self.directory = directory or SKETCH_DIR
+        self.precision = precision or precision_for(SKETCH_RELATIVE_ERROR)
+        self.flush_seconds = SKETCH_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self.events = 0
+        self._pending = {}
+        self._cache = OrderedDict()
+        self._flushed = time.monotonic()
+        self._pending_lock = threading.Lock()
+        self._io = threading.RLock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # ------------------------------------------------------------------
+    # Updates
+    # ------------------------------------------------------------------
+
+    def add(self, metric, item, dimensions=None, when=None):
+        """
+        Count ``item`` (a user id) for ``metric`` on the day of ``when``, overall
+        and under each ``dimension: value`` in ``dimensions``; never raises
+        """
+        day = _day(when or datetime.now()).isoformat()
+        keys = [_key(metric)] + [_key(metric, dimension, value)
+                                 for dimension, value in (dimensions or {}).items() if value is not None]
+        with self._pending_lock:
+            sketches = self._pending.setdefault(day, {})
+            for key in keys:
+                sketch = sketches.get(key)
+                if sketch is None:
+                    sketch = sketches[key] = HyperLogLog(self.precision)
+                sketch.add(item)
+            self.events += 1
+        if time.monotonic() - self._flushed >= self.flush_seconds:
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Sketch flush failed: {e}")
+
+    def flush(self):
+        """Merge buffered sketches into the day files; returns the number of days written"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        self._flushed = time.monotonic()
+        if not pending:
+            return 0
+        with self._io:
+            os.makedirs(self.directory, exist_ok=True)
+            with JobLock(self._path('.lock')):
+                for day, sketches in pending.items():
+                    stored = dict(self._load(day))
+                    for key, sketch in sketches.items():
+                        stored[key] = HyperLogLog(self.precision, stored[key].registers).merge(sketch) \
+                            if key in stored else sketch
+                    document = {
+                        'precision': self.precision,
+                        'sketches': {key: base64.b64encode(sketch.to_bytes()).decode('ascii')
+                                     for key, sketch in sorted(stored.items())},
+                    }
+                    temporary = self._path(f'{day}.json.tmp')
+                    with open(temporary, 'w', encoding='utf-8') as handle:
+                        json.dump(document, handle, separators=(',', ':'))
+                    os.replace(temporary, self._path(f'{day}.json'))
+        return len(pending)
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    def _load(self, day):
+        """A day's sketches by key, from the cache while the file is unchanged; the caller holds _io"""
+        path = self._path(f'{day}.json')
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return {}
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = self._cache.get(day)
+        if cached is not None and cached[0] == version:
+            self._cache.move_to_end(day)
+            return cached[1]
+        with open(path, encoding='utf-8') as handle:
+            document = json.load(handle)
+        if document['precision'] != self.precision:
+            raise ValueError(f"Sketches for {day} have precision {document['precision']}, "
+                             f"this store uses {self.precision}")
+        sketches = {key: HyperLogLog.from_bytes(document['precision'], base64.b64decode(data))
+                    for key, data in document['sketches'].items()}
+        self._cache[day] = (version, sketches)
+        while len(self._cache) > SKETCH_CACHE_DAYS:
+            self._cache.popitem(last=False)
+        return sketches
+
+    def _days(self, start, end):
+        start, end = _day(start), _day(end)
+        if end < start:
+            raise ValueError("end is before start")
+        return [(start + timedelta(days=offset)).isoformat() for offset in range((end - start).days + 1)]
+
+    def _merged(self, metric, start, end):
+        """Merged sketch per dimension key of ``metric`` over [start, end]"""
+        self.flush()
+        prefix = f'{metric}|'
+        merged = {}
+        with self._io:
+            for day in self._days(start, end):
+                for key, sketch in self._load(day).items():
+                    if not key.startswith(prefix):
+                        continue
+                    if key in merged:
+                        merged[key].merge(sketch)
+                    else:
+                        merged[key] = HyperLogLog(self.precision, sketch.registers)
+        return merged
+
+    def estimate(self, metric, start, end, dimension=None):
+        """
+        Estimated distinct items of ``metric`` over the days [start, end]:
+        a count, or ``{value: count}`` broken down by ``dimension``
+        """
+        merged = self._merged(metric, start, end)
+        if dimension is None:
+            sketch = merged.get(_key(metric))
+            return len(sketch) if sketch is not None else 0
+        prefix = _key(metric, dimension)
+        return {key[len(prefix):]: len(sketch) for key, sketch in sorted(merged.items()) if key.startswith(prefix)}
+
+    def daily(self, metric, start, end):
+        """Estimated distinct items of ``metric`` per day over [start, end]"""
+        self.flush()
+        key = _key(metric)
+        rows = []
+        with self._io:
+            for day in self._days(start, end):
+                sketch = self._load(day).get(key)
+                rows.append({'date': day, 'estimate': len(sketch) if sketch is not None else 0})
+        return rows
+
+    def status(self):
+        with self._pending_lock:
+            pending = sum(len(sketches) for sketches in self._pending.values())
+        try:
+            files = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        except FileNotFoundError:
+            files = []
+        return {
+            'directory': self.directory,
+            'precision': self.precision,
+            'registers': 1 << self.precision,
+            'relative_error': round(1.04 / math.sqrt(1 << self.precision), 4),
+            'days': len(files),
+            'first_day': files[0][:-len('.json')] if files else None,
+            'events_recorded': self.events,
+            'pending_sketches': pending,
+            'bytes': sum(os.path.getsize(self._path(name)) for name in files),
+        }
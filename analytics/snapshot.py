@@ -0,0 +1,156 @@
+"""
+Per-request snapshot of the collections behind the dashboard panels.
+
+Every panel builder in app.py takes a DashboardSnapshot instead of streaming
+Firestore itself. Collections are read at most once per snapshot - either
+lazily on first access or up front and concurrently via prefetch() - and the
+intermediates several panels share (column arrays, lookups) are cached on it
+too, so a bundle of panels costs one read per collection.
+
+Whole collections are read with parallel partitioned scans (analytics/scan.py).
+Reads can be narrowed with a field manifest (see analytics/fields.py): only
+the listed fields of each source are downloaded.
+"""
+from datetime import datetime
+from functools import cached_property
+
+from .columnar import SubscriptionColumns, UserColumns
+from .identity import SOURCES as IDENTITY_SOURCES, IdentityIndex
+from .loader import fetch_parallel, project
+from .revenue import RevenueEngine
+from .scan import PartitionedScan
+
+# Snapshot attribute -> Firestore collection it is read from
+SOURCES = {
+    'users': 'users',
+    'trials': 'trial_history',
+    'subscriptions': 'subscriptions',
+    'current_token_usage': 'token_usage_history',
+}
+
+
+class DashboardSnapshot:
+    """Lazily loaded collections and shared intermediates for one request"""
+
+    def __init__(self, db, now=None, fields=None):
+        self.db = db
+        self.now = now or datetime.now()
+        self.fields = fields or {}
+        self.read_timings = {}
+
+    # ------------------------------------------------------------------
+    # Raw collections
+    # ------------------------------------------------------------------
+
+    def _query(self, source):
+        """
+        The read behind one of SOURCES, projected to its manifest fields.
+
+        Whole collections are read with a PartitionedScan; filtered sources
+        stream their query directly.
+        """
+        collection = self.db.collection(SOURCES[source])
+        if source != 'current_token_usage':
+            return PartitionedScan(collection, fields=self.fields.get(source))
+
+        utc_now = datetime.utcnow()
+        query = collection.where('month', '==', utc_now.month).where('year', '==', utc_now.year)
+        if source in self.fields:
+            query = project(query, self.fields[source])
+        return query
+
+    def _fetch(self, sources):
+        results, timings = fetch_parallel({source: self._query(source) for source in sources})
+        for documents in results.values():
+            # Scans interleave partitions; restore stream() order (by document id)
+            # so first/last-wins lookups behave as they always have
+            documents.sort(key=lambda doc: doc.id)
+        self.read_timings.update(timings)
+        return results
+
+    def _read(self, source):
+        return self._fetch([source])[source]
+
+    def prefetch(self, *sources):
+        """Read every source not loaded yet, concurrently; returns self"""
+        pending = [source for source in dict.fromkeys(sources) if source not in self.__dict__]
+        self.__dict__.update(self._fetch(pending))
+        return self
+
+    @cached_property
+    def users(self):
+        return self._read('users')
+
+    @cached_property
+    def trials(self):
+        return self._read('trials')
+
+    @cached_property
+    def subscriptions(self):
+        return self._read('subscriptions')
+
+    @cached_property
+    def current_token_usage(self):
+        """token_usage_history documents for the current UTC month"""
+        return self._read('current_token_usage')
+
+    # ------------------------------------------------------------------
+    # Shared intermediates
+    # ------------------------------------------------------------------
+
+    @cached_property
+    def user_columns(self):
+        return UserColumns.from_snapshots(self.users)
+
+    @cached_property
+    def subscription_columns(self):
+        return SubscriptionColumns.from_snapshots(self.subscriptions)
+
+    @cached_property
+    def revenue_engine(self):
+        return RevenueEngine.from_snapshots(self.subscriptions, now=self.now)
+
+    @cached_property
+    def verified_user_count(self):
+        return int(self.user_columns.email_verified.sum())
+
+    @cached_property
+    def active_subscription_count(self):
+        """Subscriptions with status == 'active' (the dashboard's definition of active)"""
+        return int(self.subscription_columns.status_is('active').sum())
+
+    @cached_property
+    def trials_by_doc_id(self):
+        return {trial_doc.id: trial_doc.to_dict() for trial_doc in self.trials}
+
+    @cached_property
+    def subscriptions_by_doc_id(self):
+        return {sub_doc.id: sub_doc.to_dict() for sub_doc in self.subscriptions}
+
+    @cached_property
+    def identity(self):
+        """
+        uid <-> email <-> trial / subscription ids. With a field manifest, only
+        the trial_history and subscriptions it lists are joined (and read)
+        """
+        joined = [getattr(self, source) if not self.fields or source in self.fields else ()
+                  for source in IDENTITY_SOURCES]
+        return IdentityIndex.from_snapshots(self.users, *joined)
+
+    @cached_property
+    def token_usage_by_user_id(self):
+        usage = {}
+        for usage_doc in self.current_token_usage:
+            usage_data = usage_doc.to_dict()
+            usage.setdefault(usage_data.get('userId'), usage_data)
+        return usage
+
+    def trial_for(self, user_id, email=None):
+        """A user's trial_history data, joined through the identity index"""
+        doc_id = self.identity.trial_id(user_id, email)
+        return self.trials_by_doc_id.get(doc_id) if doc_id is not None else None
+
+    def subscription_for(self, user_id, email=None):
+        """A user's subscription data, joined through the identity index"""
+        doc_id = self.identity.subscription_id(user_id, email)
+        return self.subscriptions_by_doc_id.get(doc_id) if doc_id is not None else None
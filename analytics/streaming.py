@@ -0,0 +1,180 @@
+"""
+Constant-memory streaming aggregation.
+
+Each metric is an Accumulator: it folds ``(doc_id, data)`` records one at a
+time with ``update(record)`` and reports with ``result()``, keeping only
+counters (never the documents themselves). A StreamingAggregation feeds every
+registered accumulator from a single pass over ``query.stream()``, so peak
+memory stays flat however large the collection is.
+
+The accumulators return exactly what the corresponding dashboard
+calculations return. They back the analytics export, which streams the
+users and subscriptions collections instead of loading them; only the
+metrics it reports have an accumulator.
+"""
+from .columnar import plan_price, trailing_month_windows
+from .lifecycle import subscription_phases
+from .loader import metered_stream
+from .timestamps import to_epoch_us, to_naive_datetime
+
+
+def _parse(value):
+    """Naive datetime for a raw Firestore value, None if empty or unparseable"""
+    try:
+        return to_naive_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Accumulator:
+    """A metric computed in one pass: update(record) per document, then result()"""
+
+    def update(self, record):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+# ----------------------------------------------------------------------------
+# Counters
+# ----------------------------------------------------------------------------
+
+class Count(Accumulator):
+    """Number of records, optionally only those whose data matches ``predicate``"""
+
+    def __init__(self, predicate=None):
+        self.predicate = predicate
+        self.count = 0
+
+    def update(self, record):
+        if self.predicate is None or self.predicate(record[1]):
+            self.count += 1
+
+    def result(self):
+        return self.count
+
+
+# ----------------------------------------------------------------------------
+# Subscriptions
+# ----------------------------------------------------------------------------
+
+class ChurnMetrics(Accumulator):
+    """Streaming equivalent of calculate_churn_metrics"""
+
+    def __init__(self, now):
+        self.month_start = to_epoch_us(now.replace(day=1, hour=0, minute=0, second=0, microsecond=0))
+        self.now = to_epoch_us(now)
+        self.total = 0
+        self.cancelled = 0
+        self.active_at_month_start = 0
+        self.monthly_cancellations = 0
+
+    def update(self, record):
+        data = record[1]
+        self.total += 1
+        if data.get('cancelled', False):
+            self.cancelled += 1
+
+        phases = subscription_phases(data)
+        if phases is None:
+            return
+        start, _, expires = phases
+        if start <= self.month_start < expires:
+            self.active_at_month_start += 1
+        if self.month_start < expires <= self.now:
+            self.monthly_cancellations += 1
+
+    def result(self):
+        if self.total == 0:
+            return {
+                'overall_churn_rate': 0,
+                'monthly_churn_rate': 0
+            }
+        monthly = (self.monthly_cancellations / self.active_at_month_start) * 100 if self.active_at_month_start else 0
+        return {
+            'overall_churn_rate': round((self.cancelled / self.total) * 100, 2),
+            'monthly_churn_rate': round(monthly, 2)
+        }
+
+
+class MonthlyRecurringRevenue(Accumulator):
+    """Streaming equivalent of RevenueEngine.current_mrr: the plan prices of active subscriptions"""
+
+    def __init__(self):
+        self.mrr = 0.0
+
+    def update(self, record):
+        data = record[1]
+        if data.get('status') == 'active':
+            self.mrr += plan_price(data.get('plan'))
+
+    def result(self):
+        return round(self.mrr, 2)
+
+
+class RevenueTrends(Accumulator):
+    """Streaming equivalent of calculate_revenue_trends"""
+
+    def __init__(self, now):
+        self.windows = trailing_month_windows(now)
+        self.active = [0] * len(self.windows)
+        self.revenue = [0.0] * len(self.windows)
+
+    def update(self, record):
+        data = record[1]
+        if not data.get('isActive'):
+            return
+        start = _parse(data.get('startDate'))
+        if start is None:
+            return
+        price = plan_price(data.get('plan'))
+        for position, (_, _, month_end) in enumerate(self.windows):
+            if start <= month_end:
+                self.active[position] += 1
+                self.revenue[position] += price
+
+    def result(self):
+        trends = [
+            {
+                'month': month_date.strftime('%Y-%m'),
+                'revenue': round(self.revenue[position], 2),
+                'active_subscriptions': self.active[position]
+            }
+            for position, (month_date, _, _) in enumerate(self.windows)
+        ]
+        return list(reversed(trends))
+
+
+# ----------------------------------------------------------------------------
+# Driver
+# ----------------------------------------------------------------------------
+
+class StreamingAggregation:
+    """Feeds every registered accumulator from one pass over a document stream"""
+
+    def __init__(self, **accumulators):
+        self.accumulators = dict(accumulators)
+
+    def register(self, name, accumulator):
+        self.accumulators[name] = accumulator
+        return accumulator
+
+    def consume(self, records):
+        """Fold an iterable of ``(doc_id, data)`` records; returns how many were seen"""
+        accumulators = list(self.accumulators.values())
+        seen = 0
+        for record in records:
+            for accumulator in accumulators:
+                accumulator.update(record)
+            seen += 1
+        return seen
+
+    def run(self, query, name='stream'):
+        """Stream ``query`` once through every accumulator; returns a ReadTiming"""
+        timings = []
+        self.consume((doc.id, doc.to_dict() or {}) for doc in metered_stream(query, name, timings.append))
+        return timings[0]
+
+    def results(self):
+        return {name: accumulator.result() for name, accumulator in self.accumulators.items()}
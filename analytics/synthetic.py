@@ -0,0 +1,477 @@
+"""
+Seedable synthetic dataset of users, trials, subscriptions and token usage.
+
+Every performance feature of the dashboard needs data at production scale to
+be measured on, and the only fixtures were a handful of hand-written
+documents and scripts pointed at one real user. SyntheticDataset generates
+the five collections the analytics read, shaped like the documents the app
+writes (docs/token_tracking_database_schema.md for the token collections):
+
+* ``users`` - signups on an exponentially growing curve with a weekly and
+  daily rhythm, email verification after a log-normal delay, a country;
+* ``trial_history`` - 7-day trials for a share of users, some of them keyed
+  by email the way older documents are;
+* ``subscriptions`` - trial conversions after a skewed delay, monthly
+  renewals and a constant monthly churn hazard, with cancelledAt,
+  willExpireAt and the status vocabulary of the app;
+* ``token_usage_history`` and ``daily_token_usage`` - per-day usage while a
+  user is on a trial or a subscription, log-normal tokens capped at the
+  daily limit; the monthly documents sum the daily ones.
+
+Each user is generated from its own RNG seeded with (seed, index), so a
+dataset is fully determined by its seed, profile and ``now``, and any range
+of users can be generated on its own: shards written by separate processes
+add up to the same dataset. Generation streams ``(collection, doc_id, data)``
+triples, so 5M users never have to fit in memory unless the sink keeps them.
+
+Sinks: MemoryStore (dicts, with snapshot stand-ins for the panel builders),
+FileSink (one NDJSON file per collection, timestamps encoded as in the
+analytics warehouse) and FirestoreSink (batched writes, e.g. to the
+emulator).
+
+Usage:
+    python -m analytics.synthetic 100000 --out synthetic/          # NDJSON files
+    python -m analytics.synthetic 100000 --emulator demo-project    # FIRESTORE_EMULATOR_HOST
+    python -m analytics.synthetic 5000000 --out part3/ --shard 3/8 --seed 7
+"""
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from .warehouse import WarehouseDocument, decode_document, encode_document
+
+COLLECTIONS = ('users', 'trial_history', 'subscriptions', 'token_usage_history', 'daily_token_usage')
+
+TRIAL_DAYS = 7
+BILLING_DAYS = 30
+# Daily token limits of lib/core/config.dart
+TOKEN_LIMITS = {'trial': 10_000, 'subscribed': 100_000}
+
+UID_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+
+# Distribution parameters; any of them can be overridden per dataset
+DEFAULT_PROFILE = {
+    'history_days': 540,                # signups spread over this many days before now
+    'monthly_growth': 0.08,             # signup curve grows this much per month
+    'weekday_weights': (1.0, 1.0, 1.0, 1.0, 1.1, 1.35, 1.3),   # Monday .. Sunday
+    'hour_weights': (2, 1, 1, 1, 1, 2, 3, 4, 5, 5, 5, 5, 6, 6, 5, 5, 5, 6, 7, 8, 9, 9, 7, 4),
+    'verification_rate': 0.72,
+    'verification_hours_median': 2.0,   # log-normal delay between signup and verification
+    'verification_hours_sigma': 1.8,
+    'trial_rate': 0.65,                 # share of users who start a trial
+    'legacy_trial_rate': 0.1,           # share of trials keyed by email without a userId
+    'conversion_rate': 0.22,            # share of trials converting to a subscription
+    'quick_conversion_share': 0.45,     # share of conversions within 3 days of the trial start
+    'monthly_churn': 0.09,              # monthly cancellation hazard of a subscription
+    'plans': {'monthly': 1.0},
+    'payment_methods': {'google_pay': 0.55, 'apple_pay': 0.25, 'credit_card': 0.15, 'paypal': 0.05},
+    'countries': {'SA': 0.2, 'AE': 0.16, 'HK': 0.1, 'SG': 0.08, 'QA': 0.06, 'KW': 0.06, 'TW': 0.05, 'JP': 0.04,
+                  'KR': 0.03, 'MY': 0.03, 'IT': 0.03, 'GB': 0.03, 'CA': 0.04, 'US': 0.04, 'AU': 0.02, 'PH': 0.03},
+    'country_field_rate': 0.6,          # share of profiles that state a country
+    'email_domains': {'gmail.com': 0.68, 'yahoo.com': 0.17, 'hotmail.com': 0.1, 'outlook.com': 0.05},
+    'never_login_rate': 0.12,
+    'activity_alpha': 1.6,              # per-user share of active days ~ Beta(alpha, beta)
+    'activity_beta': 3.0,
+    'subscribed_activity_boost': 1.5,
+    'trial_tokens_median': 1800,        # log-normal tokens on an active day
+    'subscribed_tokens_median': 4200,
+    'tokens_sigma': 0.9,
+    'token_history_months': 3,          # months of token_usage_history, the current one included
+    'daily_usage_days': 14,             # days of daily_token_usage kept before the cleanup
+}
+
+
+def load_profile(overrides=None):
+    """DEFAULT_PROFILE updated with ``overrides`` (a dict, or a JSON file path); raises ValueError on unknown keys"""
+    if isinstance(overrides, str):
+        with open(overrides, encoding='utf-8') as handle:
+            overrides = json.load(handle)
+    overrides = overrides or {}
+    unknown = sorted(set(overrides) - set(DEFAULT_PROFILE))
+    if unknown:
+        raise ValueError(f"Unknown profile settings: {', '.join(unknown)}")
+    return {**DEFAULT_PROFILE, **overrides}
+
+
+def _weighted(rng, weights):
+    """A key of a ``{key: weight}`` dict, drawn by weight"""
+    keys = list(weights)
+    return rng.choices(keys, weights=[weights[key] for key in keys])[0]
+
+
+def _month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _previous_month(month_start):
+    return _month_start(month_start - timedelta(days=1))
+
+
+class SyntheticDataset:
+    """
+    A reproducible dataset of ``user_count`` users.
+
+    Args:
+        user_count (int): number of users
+        seed (int): seed of every distribution
+        now (datetime): end of the history (default: today at midnight, so a day's runs agree)
+        profile (dict): overrides of DEFAULT_PROFILE
+    """
+
+    def __init__(self, user_count, seed=42, now=None, profile=None):
+        self.user_count = user_count
+        self.seed = seed
+        self.now = now or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.profile = load_profile(profile)
+
+        # Signup curve: density proportional to exp(growth * t) over the history window
+        self._growth = math.log1p(self.profile['monthly_growth']) / 30
+        self._history_days = self.profile['history_days']
+        self._hours = list(range(24))
+        self._weekday_peak = max(self.profile['weekday_weights'])
+
+        token_months = [_month_start(self.now)]
+        for _ in range(self.profile['token_history_months'] - 1):
+            token_months.append(_previous_month(token_months[-1]))
+        self.token_window_start = token_months[-1]
+        self.daily_window_start = self.now - timedelta(days=self.profile['daily_usage_days'])
+
+    # ------------------------------------------------------------------
+    # Distributions
+    # ------------------------------------------------------------------
+
+    def _signup(self, rng):
+        days, growth = self._history_days, self._growth
+        while True:
+            u = rng.random()
+            offset = math.log1p(u * math.expm1(growth * days)) / growth if growth else u * days
+            day = self.now - timedelta(days=days - offset)
+            # Thin the curve by weekday (rejection sampling keeps the growth shape)
+            if rng.random() * self._weekday_peak <= self.profile['weekday_weights'][day.weekday()]:
+                break
+        hour = rng.choices(self._hours, weights=self.profile['hour_weights'])[0]
+        signup = day.replace(hour=hour, minute=rng.randrange(60), second=rng.randrange(60), microsecond=0)
+        return min(signup, self.now - timedelta(minutes=1))
+
+    def _lognormal(self, rng, median, sigma):
+        return rng.lognormvariate(math.log(median), sigma)
+
+    # ------------------------------------------------------------------
+    # Documents
+    # ------------------------------------------------------------------
+
+    def user_documents(self, index):
+        """The ``(collection, doc_id, data)`` documents of user ``index``"""
+        profile, now = self.profile, self.now
+        rng = random.Random(self.seed * 10_000_019 + index)
+        uid = ''.join(rng.choices(UID_ALPHABET, k=28))
+        email = f"user{index}.{uid[:5].lower()}@{_weighted(rng, profile['email_domains'])}"
+        created = self._signup(rng)
+        documents = []
+
+        user = {
+            'email': email,
+            'displayName': f'User {index}',
+            'createdAt': created,
+            'emailVerified': False,
+            'emailVerifiedAt': None,
+            'lastLoginAt': None,
+        }
+        if rng.random() < profile['country_field_rate']:
+            user['country'] = _weighted(rng, profile['countries'])
+        if rng.random() < profile['verification_rate']:
+            hours = self._lognormal(rng, profile['verification_hours_median'], profile['verification_hours_sigma'])
+            verified_at = created + timedelta(hours=hours)
+            if verified_at < now:
+                user['emailVerified'], user['emailVerifiedAt'] = True, verified_at
+
+        # Periods on a trial or a subscription: (user type, start, end)
+        periods = []
+        trial_start = None
+        if rng.random() < profile['trial_rate']:
+            trial_start = created + timedelta(minutes=rng.expovariate(1 / 180))
+            if trial_start < now:
+                trial_end = trial_start + timedelta(days=TRIAL_DAYS)
+                trial = {
+                    'email': email,
+                    'trialStartDate': trial_start,
+                    'trialEndDate': trial_end,
+                    'isActive': trial_start <= now < trial_end,
+                    'createdAt': trial_start,
+                }
+                if rng.random() < profile['legacy_trial_rate']:
+                    documents.append(('trial_history', email, trial))
+                else:
+                    trial['userId'] = uid
+                    documents.append(('trial_history', f't_{uid}', trial))
+                periods.append(('trial', trial_start, min(trial_end, now)))
+            else:
+                trial_start = None
+
+        if trial_start is not None and rng.random() < profile['conversion_rate']:
+            if rng.random() < profile['quick_conversion_share']:
+                delay = rng.uniform(0, 3)
+            else:
+                delay = rng.triangular(3, TRIAL_DAYS + 14, TRIAL_DAYS)
+            start = trial_start + timedelta(days=delay)
+            if start < now:
+                documents.append(('subscriptions', uid, self._subscription(rng, uid, email, start)))
+                subscription = documents[-1][2]
+                end = subscription['willExpireAt'] if subscription['cancelled'] else now
+                periods.append(('subscribed', start, min(end, now)))
+
+        usage = self._token_usage(rng, periods)
+        last_activity = max(usage) if usage else None
+        if rng.random() >= profile['never_login_rate']:
+            if last_activity is not None:
+                last_login = last_activity.replace(hour=rng.randrange(24), minute=rng.randrange(60))
+            else:
+                last_login = created + timedelta(hours=rng.expovariate(1 / 48))
+            user['lastLoginAt'] = min(max(last_login, created), now)
+        user['updatedAt'] = max(value for value in (created, user['emailVerifiedAt'], user['lastLoginAt']) if value)
+        documents.insert(0, ('users', uid, user))
+        documents.extend(self._usage_documents(uid, usage))
+        return documents
+
+    def _subscription(self, rng, uid, email, start):
+        profile, now = self.profile, self.now
+        plan = _weighted(rng, profile['plans'])
+        # Months until cancellation under a constant monthly hazard
+        months = rng.expovariate(-math.log(1 - profile['monthly_churn'])) if profile['monthly_churn'] else math.inf
+        cancelled_at = start + timedelta(days=months * BILLING_DAYS) if months != math.inf else None
+        cancelled = cancelled_at is not None and cancelled_at < now
+        if cancelled:
+            # Paid through the end of the billing period the cancellation falls in
+            expires = start + timedelta(days=BILLING_DAYS * (math.floor(months) + 1))
+        else:
+            periods = math.floor((now - start) / timedelta(days=BILLING_DAYS)) + 1
+            expires = start + timedelta(days=BILLING_DAYS * periods)
+        active = expires > now
+        if cancelled:
+            status = 'cancelled' if active else 'expired'
+        else:
+            status = 'active'
+        return {
+            'userId': uid,
+            'email': email,
+            'plan': plan,
+            'status': status,
+            'isActive': active,
+            'cancelled': cancelled,
+            'cancelledAt': cancelled_at if cancelled else None,
+            'willExpireAt': expires if cancelled else None,
+            'startDate': start,
+            'subscriptionEndDate': expires,
+            'autoRenew': not cancelled,
+            'paymentMethod': _weighted(rng, profile['payment_methods']),
+            'updatedAt': cancelled_at if cancelled else expires - timedelta(days=BILLING_DAYS),
+        }
+
+    def _token_usage(self, rng, periods):
+        """``{day: (user type, tokens)}`` for the active days inside the token history window"""
+        profile = self.profile
+        activity = rng.betavariate(profile['activity_alpha'], profile['activity_beta'])
+        usage = {}
+        for user_type, start, end in periods:
+            if user_type == 'trial':
+                chance, median = activity, profile['trial_tokens_median']
+            else:
+                chance = min(1.0, activity * profile['subscribed_activity_boost'])
+                median = profile['subscribed_tokens_median']
+            day = max(start, self.token_window_start).replace(hour=0, minute=0, second=0, microsecond=0)
+            while day <= end:
+                if rng.random() < chance:
+                    tokens = int(self._lognormal(rng, median, profile['tokens_sigma']))
+                    usage[day] = (user_type, max(1, min(tokens, TOKEN_LIMITS[user_type])))
+                day += timedelta(days=1)
+        return usage
+
+    def _usage_documents(self, uid, usage):
+        months = {}
+        for day in sorted(usage):
+            months.setdefault((day.year, day.month), []).append(day)
+            if day >= self.daily_window_start:
+                user_type, tokens = usage[day]
+                yield ('daily_token_usage', f"{uid}_{day.strftime('%Y-%m-%d')}", {
+                    'userId': uid,
+                    'date': day.strftime('%Y-%m-%d'),
+                    'tokensUsed': tokens,
+                    'tokenLimit': TOKEN_LIMITS[user_type],
+                    'userType': user_type,
+                    'lastUpdated': min(day + timedelta(hours=20), self.now),
+                    'resetAt': day + timedelta(days=1),
+                })
+        for (year, month), days in months.items():
+            daily = {day.strftime('%d'): usage[day][1] for day in days}
+            peak = max(days, key=lambda day: usage[day][1])
+            total = sum(daily.values())
+            yield ('token_usage_history', f'{uid}_{year}_{month:02d}', {
+                'userId': uid,
+                'year': year,
+                'month': month,
+                'dailyUsage': daily,
+                'totalMonthlyTokens': total,
+                'averageDailyUsage': round(total / len(days), 2),
+                'peakUsageDate': peak.strftime('%d'),
+                'peakUsageTokens': usage[peak][1],
+                'userType': usage[days[-1]][0],
+                'createdAt': days[0],
+                'updatedAt': min(days[-1] + timedelta(hours=20), self.now),
+            })
+
+    def documents(self, start=0, stop=None):
+        """Stream the ``(collection, doc_id, data)`` documents of users ``start`` to ``stop``"""
+        stop = self.user_count if stop is None else min(stop, self.user_count)
+        for index in range(start, stop):
+            yield from self.user_documents(index)
+
+    def shard(self, number, count):
+        """User index range of shard ``number`` (0-based) of ``count``"""
+        size = math.ceil(self.user_count / count)
+        return number * size, min((number + 1) * size, self.user_count)
+
+    def write(self, sink, start=0, stop=None):
+        """Generate users ``start`` to ``stop`` into ``sink``; returns the number of documents per collection"""
+        counts = dict.fromkeys(COLLECTIONS, 0)
+        for collection, doc_id, data in self.documents(start, stop):
+            sink.write(collection, doc_id, data)
+            counts[collection] += 1
+        sink.close()
+        return counts
+
+
+# ----------------------------------------------------------------------
+# Sinks
+# ----------------------------------------------------------------------
+
+class MemoryStore:
+    """Generated documents kept in dicts, ``{collection: {doc_id: data}}``"""
+
+    def __init__(self):
+        self.collections = {collection: {} for collection in COLLECTIONS}
+
+    def write(self, collection, doc_id, data):
+        self.collections.setdefault(collection, {})[doc_id] = data
+
+    def close(self):
+        pass
+
+    def records(self, collection):
+        """``(doc_id, data)`` pairs, the input of the from_records constructors"""
+        return list(self.collections.get(collection, {}).items())
+
+    def snapshots(self, collection):
+        """DocumentSnapshot stand-ins, the input of the app's panel builders"""
+        return [WarehouseDocument(doc_id, data) for doc_id, data in self.collections.get(collection, {}).items()]
+
+
+class FileSink:
+    """One NDJSON file per collection (``{"id": ..., "data": ...}`` lines) under ``directory``"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._files = {}
+
+    def write(self, collection, doc_id, data):
+        handle = self._files.get(collection)
+        if handle is None:
+            handle = self._files[collection] = open(os.path.join(self.directory, f'{collection}.ndjson'),
+                                                    'w', encoding='utf-8')
+        handle.write(f'{{"id":{json.dumps(doc_id)},"data":{encode_document(data)}}}\n')
+
+    def close(self):
+        for handle in self._files.values():
+            handle.close()
+        self._files.clear()
+
+
+def read_files(directory):
+    """Stream the ``(collection, doc_id, data)`` documents of a FileSink directory"""
+    for collection in COLLECTIONS:
+        path = os.path.join(directory, f'{collection}.ndjson')
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding='utf-8') as handle:
+            for line in handle:
+                document = decode_document(line)
+                yield collection, document['id'], document['data']
+
+
+class FirestoreSink:
+    """Batched writes to a Firestore client (e.g. one pointed at the emulator)"""
+
+    def __init__(self, db, batch_size=500):
+        self.db = db
+        self.batch_size = batch_size
+        self._batch = db.batch()
+        self._pending = 0
+
+    def write(self, collection, doc_id, data):
+        self._batch.set(self.db.collection(collection).document(doc_id), data)
+        self._pending += 1
+        if self._pending == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self._batch.commit()
+            self._batch, self._pending = self.db.batch(), 0
+
+    def close(self):
+        self.flush()
+
+
+# ----------------------------------------------------------------------
+# Command line
+# ----------------------------------------------------------------------
+
+def _option(argv, name, default=None):
+    if name in argv:
+        position = argv.index(name)
+        return argv[position + 1]
+    return default
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or not argv[0].isdigit():
+        print(__doc__)
+        return 2
+    now = _option(argv, '--now')
+    dataset = SyntheticDataset(int(argv[0]), seed=int(_option(argv, '--seed', '42')),
+                               now=datetime.fromisoformat(now) if now else None,
+                               profile=load_profile(_option(argv, '--profile')))
+    start, stop = 0, dataset.user_count
+    if _option(argv, '--shard'):
+        number, count = (int(part) for part in _option(argv, '--shard').split('/'))
+        start, stop = dataset.shard(number - 1, count)
+
+    if _option(argv, '--emulator'):
+        # Only this path needs the client library
+        from google.cloud import firestore
+        if not os.getenv('FIRESTORE_EMULATOR_HOST'):
+            print("FIRESTORE_EMULATOR_HOST is not set; refusing to write synthetic data to a live project")
+            return 2
+        sink = FirestoreSink(firestore.Client(project=_option(argv, '--emulator')))
+    elif _option(argv, '--out'):
+        sink = FileSink(_option(argv, '--out'))
+    else:
+        sink = MemoryStore()
+
+    started = time.perf_counter()
+    counts = dataset.write(sink, start, stop)
+    seconds = time.perf_counter() - started
+    print(f"Users {start}-{stop} of {dataset.user_count} (seed {dataset.seed}, now {dataset.now.isoformat()}) "
+          f"in {seconds:.1f}s")
+    for collection, count in counts.items():
+        print(f"  {collection:<22} {count:>10}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,37 @@
+"""
+Timestamp helpers shared by the analytics engines.
+
+Firestore hands back a mix of DatetimeWithNanoseconds, Timestamp-like
+objects exposing ``seconds`` and plain ISO strings. These helpers normalise
+them exactly the way the dashboard helpers in app.py always have: to naive
+wall-clock datetimes, so results can be compared against ``datetime.now()``.
+"""
+from datetime import datetime, timedelta
+
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def to_naive_datetime(value):
+    """Convert a Firestore timestamp value to a naive datetime (None if empty)"""
+    if not value:
+        return None
+
+    if hasattr(value, 'seconds'):
+        return datetime.fromtimestamp(value.seconds)
+
+    if isinstance(value, datetime):
+        # Same wall-clock result as the ISO round trip below, without the parse
+        return value.replace(tzinfo=None)
+
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00')).replace(tzinfo=None)
+
+
+def to_epoch_us(dt):
+    """Convert a naive datetime to integer microseconds since 1970-01-01"""
+    return (dt - EPOCH) // ONE_MICROSECOND
+
+
+def from_epoch_us(value):
+    """Inverse of to_epoch_us"""
+    return EPOCH + timedelta(microseconds=int(value))
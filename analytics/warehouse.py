@@ -0,0 +1,348 @@
+"""
+Local analytics warehouse mirrored from Firestore.
+
+Historical questions (cohorts, revenue by month, churn) used to be answered
+by scanning live Firestore on every request: every answer cost reads, and
+moved as documents were edited. The Warehouse mirrors the analytics
+collections into an embedded SQLite database (one JSON row per document,
+queryable with SQLite's JSON functions) so panels can run against it with
+``?backend=warehouse`` at no Firestore cost.
+
+Sync is incremental. Each collection keeps a watermark on its own update
+time field (WATERMARK_FIELDS: ``updatedAt``, ``lastUpdated`` for
+daily_token_usage) and a run only reads the documents updated at or after
+it (the boundary is re-read and skipped by fingerprint, so ties are never
+lost). A watermark query cannot see deletions or documents that have no
+update time, so a full reconciliation - a partitioned scan that also
+removes rows whose document is gone - runs first and then every
+``full_sync_hours``. A collection without a watermark (trial_history
+records no update time) is only copied by that reconciliation; the runs in
+between skip it instead of scanning it whole.
+
+Timestamps round-trip as datetimes, so documents read back from the
+warehouse look like the ones Firestore returns to the panel builders.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime, timedelta
+
+from .export_jobs import JobLock
+from .loader import ReadTiming
+from .scan import PartitionedScan
+from .snapshot import SOURCES, DashboardSnapshot
+
+logger = logging.getLogger(__name__)
+
+WAREHOUSE_PATH = os.getenv('WAREHOUSE_PATH', 'analytics_warehouse.sqlite3')
+WAREHOUSE_PAGE_SIZE = int(os.getenv('WAREHOUSE_PAGE_SIZE', '500'))
+FULL_SYNC_HOURS = int(os.getenv('WAREHOUSE_FULL_SYNC_HOURS', '24'))
+SYNC_INTERVAL_SECONDS = int(os.getenv('WAREHOUSE_SYNC_SECONDS', '600'))
+
+WAREHOUSE_COLLECTIONS = ('users', 'subscriptions', 'trial_history', 'token_usage_history', 'daily_token_usage')
+# Update time field of each collection's documents (None: they record none)
+WATERMARK_FIELDS = {
+    'users': 'updatedAt',
+    'subscriptions': 'updatedAt',
+    'trial_history': None,
+    'token_usage_history': 'updatedAt',
+    'daily_token_usage': 'lastUpdated',
+}
+DEFAULT_WATERMARK_FIELD = 'updatedAt'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    collection TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    updated_at TEXT,
+    synced_at TEXT NOT NULL,
+    PRIMARY KEY (collection, doc_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sync_state (
+    collection TEXT PRIMARY KEY,
+    watermark TEXT,
+    last_sync TEXT,
+    last_full_sync TEXT,
+    documents INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+# ----------------------------------------------------------------------
+# Document encoding
+# ----------------------------------------------------------------------
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'$ts': value.isoformat()}
+    if hasattr(value, 'seconds') and hasattr(value, 'nanos'):
+        return {'$ts': datetime.fromtimestamp(value.seconds + value.nanos / 1e9).isoformat()}
+    return str(value)
+
+
+def _decode_object(obj):
+    if len(obj) == 1 and '$ts' in obj:
+        return datetime.fromisoformat(obj['$ts'])
+    return obj
+
+
+def encode_document(data):
+    return json.dumps(data, default=_encode_value, sort_keys=True, separators=(',', ':'))
+
+
+def decode_document(text):
+    return json.loads(text, object_hook=_decode_object)
+
+
+def _watermark(value):
+    """Comparable ISO form of an update time (None if missing)"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if hasattr(value, 'seconds'):
+        return datetime.fromtimestamp(value.seconds).isoformat()
+    return str(value) if value else None
+
+
+class WarehouseDocument:
+    """Read-only stand-in for a DocumentSnapshot, backed by a warehouse row"""
+
+    __slots__ = ('id', '_data')
+
+    exists = True
+
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+    def get(self, field):
+        return self._data.get(field)
+
+
+class Warehouse:
+    """
+    SQLite mirror of the analytics collections.
+
+    Args:
+        path (str): database file; a ``.lock`` file next to it serialises
+            syncs across processes
+        collections (tuple): Firestore collections mirrored
+    """
+
+    def __init__(self, path=None, collections=WAREHOUSE_COLLECTIONS, page_size=None, full_sync_hours=None):
+        self.path = path or WAREHOUSE_PATH
+        self.collections = tuple(collections)
+        self.page_size = page_size or WAREHOUSE_PAGE_SIZE
+        self.full_sync_hours = FULL_SYNC_HOURS if full_sync_hours is None else full_sync_hours
+        self._initialized = False
+        self._thread = None
+        self._stopped = threading.Event()
+        self.last_runs = []
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        if not self._initialized:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+            self._initialized = True
+        return connection
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    def documents(self, collection, fields=None, where=None):
+        """
+        Mirrored documents of a collection in document-id order.
+
+        ``fields`` projects the returned data like a Firestore select;
+        ``where`` is a dict of top-level ``field: value`` equality filters.
+        """
+        sql = 'SELECT doc_id, data FROM documents WHERE collection = ?'
+        params = [collection]
+        for field, value in (where or {}).items():
+            sql += ' AND json_extract(data, ?) = ?'
+            params += [f'$.{field}', value]
+        sql += ' ORDER BY doc_id'
+        with closing(self._connect()) as connection:
+            rows = connection.execute(sql, params).fetchall()
+        documents = []
+        for row in rows:
+            data = decode_document(row['data'])
+            if fields is not None:
+                data = {field: data[field] for field in fields if field in data}
+            documents.append(WarehouseDocument(row['doc_id'], data))
+        return documents
+
+    def query(self, sql, params=()):
+        """Run a read-only SQL query (documents: collection, doc_id, data JSON, updated_at)"""
+        with closing(self._connect()) as connection:
+            connection.execute('PRAGMA query_only = ON')
+            return [dict(row) for row in connection.execute(sql, params).fetchall()]
+
+    def synced(self, collection):
+        with closing(self._connect()) as connection:
+            row = connection.execute('SELECT last_sync FROM sync_state WHERE collection = ?', (collection,)).fetchone()
+        return row is not None and row['last_sync'] is not None
+
+    def status(self):
+        with closing(self._connect()) as connection:
+            states = {row['collection']: dict(row) for row in connection.execute('SELECT * FROM sync_state')}
+        return {
+            'path': self.path,
+            'collections': {name: states.get(name, {'collection': name, 'last_sync': None})
+                            for name in self.collections},
+            'last_runs': self.last_runs,
+        }
+
+    # ------------------------------------------------------------------
+    # Sync
+    # ------------------------------------------------------------------
+
+    def _state(self, connection, collection):
+        row = connection.execute('SELECT * FROM sync_state WHERE collection = ?', (collection,)).fetchone()
+        return dict(row) if row is not None else {'watermark': None, 'last_full_sync': None, 'documents': 0}
+
+    def _needs_full_sync(self, state, now):
+        if state['last_full_sync'] is None:
+            return True
+        return now - datetime.fromisoformat(state['last_full_sync']) >= timedelta(hours=self.full_sync_hours)
+
+    def _incremental_documents(self, collection_ref, field, watermark):
+        """Documents with ``field`` >= watermark, paged in ``field`` order"""
+        query = (collection_ref.where(field, '>=', datetime.fromisoformat(watermark))
+                 .order_by(field).limit(self.page_size))
+        last = None
+        while True:
+            page = list((query.start_after(last) if last is not None else query).stream())
+            yield from page
+            if len(page) < self.page_size:
+                return
+            last = page[-1]
+
+    def sync_collection(self, db, collection, full=False):
+        """Copy what changed in one collection; returns the run's counts"""
+        started = time.perf_counter()
+        now = datetime.now()
+        counts = {'collection': collection, 'read': 0, 'copied': 0, 'unchanged': 0, 'deleted': 0}
+        field = WATERMARK_FIELDS.get(collection, DEFAULT_WATERMARK_FIELD)
+        with closing(self._connect()) as connection:
+            state = self._state(connection, collection)
+            full = full or self._needs_full_sync(state, now)
+            if not full and (field is None or state['watermark'] is None):
+                # Nothing to page from: wait for the scheduled reconciliation
+                counts.update(mode='skipped', watermark=state['watermark'], documents=state['documents'],
+                              seconds=round(time.perf_counter() - started, 3))
+                return counts
+            counts['mode'] = 'full' if full else 'incremental'
+
+            known = dict(connection.execute('SELECT doc_id, fingerprint FROM documents WHERE collection = ?',
+                                            (collection,)).fetchall())
+            collection_ref = db.collection(collection)
+            if full:
+                documents = PartitionedScan(collection_ref).stream()
+            else:
+                documents = self._incremental_documents(collection_ref, field, state['watermark'])
+
+            watermark = state['watermark']
+            seen = set()
+            synced_at = now.isoformat()
+            for doc in documents:
+                data = doc.to_dict() or {}
+                counts['read'] += 1
+                seen.add(doc.id)
+                updated_at = _watermark(data.get(field)) if field else None
+                if updated_at is not None and (watermark is None or updated_at > watermark):
+                    watermark = updated_at
+                text = encode_document(data)
+                fingerprint = hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+                if known.get(doc.id) == fingerprint:
+                    counts['unchanged'] += 1
+                    continue
+                connection.execute(
+                    'INSERT OR REPLACE INTO documents (collection, doc_id, data, fingerprint, updated_at, synced_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (collection, doc.id, text, fingerprint, updated_at, synced_at))
+                counts['copied'] += 1
+
+            if full:
+                gone = [(collection, doc_id) for doc_id in known if doc_id not in seen]
+                connection.executemany('DELETE FROM documents WHERE collection = ? AND doc_id = ?', gone)
+                counts['deleted'] = len(gone)
+
+            total = connection.execute('SELECT COUNT(*) FROM documents WHERE collection = ?',
+                                       (collection,)).fetchone()[0]
+            connection.execute(
+                'INSERT OR REPLACE INTO sync_state (collection, watermark, last_sync, last_full_sync, documents) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (collection, watermark, synced_at, synced_at if full else state['last_full_sync'], total))
+            connection.commit()
+
+        counts['watermark'] = watermark
+        counts['documents'] = total
+        counts['seconds'] = round(time.perf_counter() - started, 3)
+        logger.debug(f"Warehouse sync of {collection}: {counts}")
+        return counts
+
+    def sync(self, db, collections=None, full=False):
+        """Sync every mirrored collection (one process at a time); returns the per-collection counts"""
+        with JobLock(self.path + '.lock'):
+            runs = [self.sync_collection(db, collection, full) for collection in collections or self.collections]
+        self.last_runs = runs
+        return runs
+
+    def _loop(self, db, interval):
+        while not self._stopped.is_set():
+            try:
+                self.sync(db)
+            except Exception as e:
+                logger.error(f"Warehouse sync failed: {e}")
+            self._stopped.wait(interval)
+
+    def start(self, db, interval=None):
+        """Sync every ``interval`` seconds in a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, args=(db, interval or SYNC_INTERVAL_SECONDS),
+                                            name='warehouse-sync', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+
+class WarehouseSnapshot(DashboardSnapshot):
+    """DashboardSnapshot whose collections are read from the warehouse instead of Firestore"""
+
+    def __init__(self, warehouse, now=None, fields=None):
+        super().__init__(None, now=now, fields=fields)
+        self.warehouse = warehouse
+
+    def _read_source(self, source):
+        collection = SOURCES[source]
+        if not self.warehouse.synced(collection):
+            raise RuntimeError(f"Warehouse has no synced copy of {collection} yet")
+        where = None
+        if source == 'current_token_usage':
+            utc_now = datetime.utcnow()
+            where = {'month': utc_now.month, 'year': utc_now.year}
+        return self.warehouse.documents(collection, fields=self.fields.get(source), where=where)
+
+    def _fetch(self, sources):
+        results = {}
+        for source in sources:
+            started = time.perf_counter()
+            results[source] = self._read_source(source)
+            self.read_timings[source] = ReadTiming(f'warehouse:{source}', time.perf_counter() - started,
+                                                   len(results[source]))
+        return results
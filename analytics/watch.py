@@ -0,0 +1,65 @@
+"""
+Firestore snapshot listeners as change feeds.
+
+A CollectionWatch keeps one ``on_snapshot`` listener on a collection and
+hands every batch of document changes to its subscribers as
+``(doc_id, data)`` pairs, ``data`` being None for a removed document. The
+first batch is the whole collection; after that only what changed arrives,
+which is what lets the incremental engines keep their state current without
+re-reading anything.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class CollectionWatch:
+    """One snapshot listener on ``query``, fanned out to any number of subscribers"""
+
+    def __init__(self, query, name):
+        self.query = query
+        self.name = name
+        self.ready = threading.Event()
+        self.changes_seen = 0
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def subscribe(self, callback):
+        """``callback(changes)`` is called with each batch of ``(doc_id, data)`` changes"""
+        with self._lock:
+            self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def _on_snapshot(self, documents, changes, read_time):
+        batch = [
+            (change.document.id, None if change.type.name == 'REMOVED' else (change.document.to_dict() or {}))
+            for change in changes
+        ]
+        self.changes_seen += len(batch)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(batch)
+            except Exception as e:
+                logger.error(f"Subscriber to {self.name} changes failed: {e}")
+        self.ready.set()
+
+    def start(self):
+        """Start listening; the first callback delivers the whole collection"""
+        if self._listener is None:
+            self._listener = self.query.on_snapshot(self._on_snapshot)
+        return self
+
+    def stop(self):
+        if self._listener is not None:
+            self._listener.unsubscribe()
+            self._listener = None
+        self.ready.clear()
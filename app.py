@@ -1,16 +1,47 @@
 # Combined Flask App: OFW Admin Dashboard + Chat/Daily.co API
 # 
 # Main production app.py file for the OFW admin dashboard and chat API
+import json
 import os
+import threading
 import time
-from flask import Flask, request, jsonify, render_template
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, jsonify, render_template, has_request_context, send_file
 from flask_cors import CORS
 from dotenv import load_dotenv
 from openai import OpenAI
 import logging
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core.exceptions import AlreadyExists
 from datetime import datetime, timedelta
+from analytics import columnar, fields, kpi, streaming
+from analytics.activity import ActivityStore
+from analytics.alerts import AlertEngine, AlertRule
+from analytics.behavior import behavior_partial, behavior_record, behavior_report, merge_behavior
+from analytics.changes import ChangeJournal
+from analytics.columnar import SubscriptionColumns, UserColumns, cohort_partial, merge_cohort_counts
+from analytics.executor import AnalyticsExecutor
+from analytics.export import EXPORT_FORMATS, export_response
+from analytics.export_jobs import MIMETYPES as EXPORT_JOB_MIMETYPES, ExportJobManager, ExportSource
+from analytics.geo import OFW_COUNTRIES, OTHER as OTHER_COUNTRY, GeoRollup, classify_country, country_name
+from analytics.http_cache import ResponseCache
+from analytics.identity import IdentityIndex
+from analytics.journeys import JourneyRows
+from analytics.kpi import KpiSeries, backfill_daily_kpis, record_daily_kpis
+from analytics.payments import ROLLUPS_COLLECTION, PaymentLedger, billing_history_event, payment_analysis, payment_event
+from analytics.lifecycle import STATES as SUBSCRIPTION_STATES, SubscriptionStateIndex
+from analytics.loader import endpoint_read_volume, metered_stream, record_endpoint_reads
+from analytics.reports import ReportScheduler, ReportStore
+from analytics.revenue import plan_price
+from analytics.scan import PartitionedScan
+from analytics.search import UserSearchIndex
+from analytics.sketches import SketchStore
+from analytics.snapshot import SOURCES, DashboardSnapshot
+from analytics.streaming import StreamingAggregation
+from analytics.warehouse import Warehouse, WarehouseSnapshot
+from analytics.watch import CollectionWatch
 
 # Load environment variables FIRST
 load_dotenv()
@@ -19,6 +50,14 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
+# ETag/304, Cache-Control and gzip for /api and /debug responses; route -> max-age seconds.
+# Routes fed by listeners or snapshots register a data version below, answering 304s before the handler runs
+response_cache = ResponseCache(app, max_age={
+    '/api/users': 10,
+    '/api/stats': 10,
+    '/debug/trials': 10
+})
+
 # Configure logging AFTER app creation
 for handler in app.logger.handlers:
     app.logger.removeHandler(handler)
@@ -49,7 +88,6 @@ if not firebase_admin._apps:
             # Use environment variable (for production deployment)
             firebase_key_json = os.getenv('FIREBASE_SERVICE_ACCOUNT_KEY')
             if firebase_key_json:
-                import json
                 firebase_key_dict = json.loads(firebase_key_json)
                 cred = credentials.Certificate(firebase_key_dict)
                 firebase_admin.initialize_app(cred)
@@ -103,6 +141,16 @@ def create_payment_intent():
                 'expiresAt': datetime.now() + timedelta(days=30)
             })
             app.logger.info(f"Updated subscription for user {user_id}")
+            
+            # Append the payment to the ledger behind payment analytics; amounts are in minor units
+            try:
+                payment_ledger.record(f'payment_intent-{payment_id}', payment_event(
+                    user_id, amount / 100, data.get('currency', 'usd'),
+                    method=data.get('payment_method') or metadata.get('paymentMethod'),
+                    source='payment_intent', reference=payment_id
+                ))
+            except Exception as e:
+                app.logger.error(f"Error recording payment {payment_id} in the ledger: {e}")
 
         return jsonify({
             'payment_intent_id': payment_id,
@@ -123,119 +171,96 @@ def admin_dashboard():
     """Main admin dashboard page"""
     return render_template('admin_dashboard.html')
 
+def build_journey_row(user_id, user_data, trial_history, subscription, usage_data):
+    """Compile the complete journey row for one user"""
+    email = user_data.get('email', '')
+    
+    # Total monthly tokens from token_usage_history for the current month
+    total_tokens = usage_data.get('totalMonthlyTokens', 0) if usage_data else 0
+    
+    # Calculate days remaining for trial
+    days_remaining = get_trial_days_remaining(trial_history)
+    
+    return {
+        'user_id': user_id,
+        'email': email or 'N/A',
+        'uid': user_id,
+        'registration_date': format_timestamp(user_data.get('createdAt')),
+        'email_verified': user_data.get('emailVerified', False),
+        'email_verification_date': format_timestamp(user_data.get('emailVerifiedAt')),
+        'trial_start_date': format_timestamp(trial_history.get('trialStartDate') if trial_history else None),
+        'trial_end_date': format_timestamp(trial_history.get('trialEndDate') if trial_history else None),
+        'trial_days_remaining': days_remaining,
+        'trial_status': get_trial_status(trial_history),
+        'subscription_start_date': format_timestamp(subscription.get('startDate') if subscription else None),
+        'subscription_end_date': format_timestamp(subscription.get('subscriptionEndDate') if subscription else None),
+        'subscription_status': get_subscription_status(subscription),
+        'cancellation_date': format_timestamp(subscription.get('willExpireAt') if subscription and subscription.get('cancelled') else None),
+        'is_premium': subscription.get('status') == 'active' if subscription else False,
+        'last_login': format_timestamp(user_data.get('lastLoginAt')),
+        'current_status': get_current_user_status(user_data, trial_history, subscription),
+        'total_monthly_tokens': total_tokens
+    }
+
+def build_users_panel(snapshot):
+    """Build the user journey table from one read of each collection"""
+    users_data = []
+    
+    for user in snapshot.users:
+        user_data = user.to_dict()
+        email = user_data.get('email', '')
+        
+        # Trial history and subscription through the identity index (userId, uid or email)
+        users_data.append(build_journey_row(
+            user.id, user_data,
+            snapshot.trial_for(user.id, email),
+            snapshot.subscription_for(user.id, email),
+            snapshot.token_usage_by_user_id.get(user.id)
+        ))
+    
+    # Sort by registration date (newest first)
+    users_data.sort(key=lambda x: x['registration_date'] or '', reverse=True)
+    
+    app.logger.info(f"Built {len(users_data)} user journeys "
+                    f"({len(snapshot.trials)} trials, {len(snapshot.subscriptions)} subscriptions, "
+                    f"{len(snapshot.current_token_usage)} usage records)")
+    
+    return {
+        'users': users_data,
+        'total_users': len(users_data)
+    }
+
+# Journey records by user id, for delta sync; fed by every full user list build
+user_changes = ChangeJournal()
+# Journey rows kept by the shared collection watches; once every source is live they
+# record each change in user_changes, and refreshes rebuild from memory instead of reads
+journey_rows = JourneyRows(build_journey_row, user_changes)
+
+def load_user_journeys():
+    """(user_id, journey) pairs for the change journal"""
+    return ((row['user_id'], row) for row in build_users_panel(panel_snapshot('users'))['users'])
+
+def refresh_user_changes(force=False):
+    """Bring user_changes up to date: from the listener-kept rows when live, else by re-reading the collections"""
+    start_collection_watches()
+    follow_usage_month()
+    if journey_rows.live:
+        # Only statuses that move with the clock can have changed since the listeners recorded them
+        return user_changes.refresh(journey_rows.records, force=force)
+    return user_changes.refresh(load_user_journeys, force=force)
+
 @app.route('/api/users')
 def get_users():
     """Get all users with their journey data"""
     try:
-        users_data = []
-        
-        # Get all users from Firestore
-        users_ref = db.collection('users')
-        users = users_ref.stream()
-        
-        for user in users:
-            user_data = user.to_dict()
-            user_id = user.id
-            email = user_data.get('email', '')
-            
-            # Get trial history for this user
-            trial_history = None
-            
-            # First try by userId (this is how it's actually stored)
-            trial_query = db.collection('trial_history').where('userId', '==', user_id).limit(1)
-            trial_results = list(trial_query.stream())
-            if trial_results:
-                trial_history = trial_results[0].to_dict()
-                app.logger.info(f"Found trial history by userId for {email}: {trial_history}")
-            elif email:
-                # Fallback: try by email as document ID
-                trial_ref = db.collection('trial_history').document(email)
-                trial_doc = trial_ref.get()
-                if trial_doc.exists:
-                    trial_history = trial_doc.to_dict()
-                    app.logger.info(f"Found trial history by email for {email}: {trial_history}")
-                else:
-                    app.logger.info(f"No trial history found for user {user_id} / {email}")
-            
-            # Get subscription data for this user by UID only
-            subscription = None
-            subscription_ref = db.collection('subscriptions').document(user_id)
-            subscription_doc = subscription_ref.get()
-            if subscription_doc.exists:
-                subscription = subscription_doc.to_dict()
-                app.logger.info(f"✅ Found subscription for user {user_id}")
-            else:
-                app.logger.info(f"❌ No subscription found for user {user_id}")
-            
-            # Get total monthly tokens from total_usage_history
-            # Inside your user loop
-            user_id = user.id
-
-            # Get current month/year
-            current_month = datetime.utcnow().month
-            current_year = datetime.utcnow().year
-
-            usage_query = db.collection('token_usage_history') \
-                .where('userId', '==', user_id) \
-                .where('month', '==', current_month) \
-                .where('year', '==', current_year) \
-                .limit(1)
-
-            usage_docs = list(usage_query.stream())
-            total_tokens = 0
-
-            # # Add more debugging:
-            # print(f"Checking token usage for user {user_id} in collection {usage_ref.parent.id}")
-            # usage_doc = usage_ref.get()
-            # print(f"Document exists: {usage_doc.exists}")
-            if usage_docs:
-                usage_data = usage_docs[0].to_dict()
-                total_tokens = usage_data.get('totalMonthlyTokens', 0)
-                app.logger.info(f"Found token usage for user {user_id}: {total_tokens} tokens")
-            else:
-                app.logger.info(f"No token usage found for user {user_id} for {current_month}/{current_year}")
-            
-            # Calculate days remaining for trial
-            days_remaining = get_trial_days_remaining(trial_history)
-            
-            # Compile complete user journey data
-            journey_data = {
-                'user_id': user_id,
-                'email': email or 'N/A',
-                'uid': user_id,
-                'registration_date': format_timestamp(user_data.get('createdAt')),
-                'email_verified': user_data.get('emailVerified', False),
-                'email_verification_date': format_timestamp(user_data.get('emailVerifiedAt')),
-                'trial_start_date': format_timestamp(trial_history.get('trialStartDate') if trial_history else None),
-                'trial_end_date': format_timestamp(trial_history.get('trialEndDate') if trial_history else None),
-                'trial_days_remaining': days_remaining,
-                'trial_status': get_trial_status(trial_history),
-                'subscription_start_date': format_timestamp(subscription.get('startDate') if subscription else None),
-                'subscription_end_date': format_timestamp(subscription.get('subscriptionEndDate') if subscription else None),
-                'subscription_status': get_subscription_status(subscription),
-                'cancellation_date': format_timestamp(subscription.get('willExpireAt') if subscription and subscription.get('cancelled') else None),
-                'is_premium': subscription.get('status') == 'active' if subscription else False,
-                'last_login': format_timestamp(user_data.get('lastLoginAt')),
-                'current_status': get_current_user_status(user_data, trial_history, subscription),
-                'total_monthly_tokens': total_tokens  # Added this field
-            }
-            
-            users_data.append(journey_data)
-            
-            # Debug: log the first user's data to see what fields are being sent
-            if len(users_data) == 1:
-                app.logger.info(f"First user data fields: {list(journey_data.keys())}")
-                app.logger.info(f"UID field value: {journey_data.get('uid')}")
-                app.logger.info(f"Username field (should not exist): {journey_data.get('username', 'NOT_FOUND')}")
-                app.logger.info(f"Total monthly tokens: {journey_data.get('total_monthly_tokens')}")
-
-        # Sort by registration date (newest first)
-        users_data.sort(key=lambda x: x['registration_date'] or '', reverse=True)
+        panel = build_users_panel(panel_snapshot('users'))
+        user_changes.sync((row['user_id'], row) for row in panel['users'])
         
         return jsonify({
             'success': True,
-            'users': users_data,
-            'total_users': len(users_data)
+            **panel,
+            # Pass as ?since= to /api/users/changes to fetch only what changes from here
+            'sync_token': user_changes.token()
         })
         
     except Exception as e:
@@ -245,57 +270,102 @@ def get_users():
             'error': str(e)
         }), 500
 
-@app.route('/api/stats')
-def get_stats():
-    """Get dashboard statistics"""
+@app.route('/api/users/changes')
+def get_user_changes():
+    """Journey records changed since a sync token, with tombstones for deleted users"""
     try:
-        # Get user counts
-        users_ref = db.collection('users')
-        all_users = list(users_ref.stream())
-        total_users = len(all_users)
-        
-        # Count verified users
-        verified_users = sum(1 for user in all_users if user.to_dict().get('emailVerified', False))
-        
-        # Get trial users
-        trial_ref = db.collection('trial_history')
-        total_trials = len(list(trial_ref.stream()))
+        since = request.args.get('since')
+        limit = request.args.get('limit', type=int)
+        rebuilt = refresh_user_changes(force=request.args.get('refresh') == 'true')
         
-        # Get active subscriptions
-        subscription_ref = db.collection('subscriptions')
-        all_subscriptions = list(subscription_ref.stream())
+        delta = user_changes.changes(since, limit)
+        app.logger.info(f"User changes since {since}: {len(delta['changes'])} changed, "
+                        f"{len(delta['deleted'])} deleted{' (reset)' if delta['reset'] else ''}"
+                        f"{' after rebuild' if rebuilt else ''}")
         
-        # Debug: log subscription data
-        app.logger.info(f"aaaaaa: {all_subscriptions}")
-        print("nnnnnnnnnnnnnnnnnnnnnnn")
-        app.logger.info(f"Total subscription documents: {len(all_subscriptions)}")
-        
-        for i, sub in enumerate(all_subscriptions):
-            sub_data = sub.to_dict()
-            app.logger.info(f"Subscription {i+1}: status={sub_data.get('status')}, isActive={sub_data.get('isActive')}, cancelled={sub_data.get('cancelled')}")
-            print(f"Subscription data: {sub_data}")
+        return jsonify({
+            'success': True,
+            'changes': delta['changes'],
+            'tombstones': [{'user_id': user_id, 'deleted': True} for user_id in delta['deleted']],
+            'sync_token': delta['token'],
+            'reset': delta['reset'],
+            'has_more': delta['has_more']
+        })
         
-        active_subscriptions = sum(1 for sub in all_subscriptions if sub.to_dict().get('status') == 'active')
-        app.logger.info(f"Active subscriptions count: {active_subscriptions}")
-        print(f"Active count: {active_subscriptions}")
+    except Exception as e:
+        app.logger.error(f"Error in get_user_changes: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# Email/uid prefix tries and status indexes over the journey records, caught up from user_changes
+user_search = UserSearchIndex()
+
+@app.route('/api/users/search')
+def search_users():
+    """Find users by email or uid prefix and status filters (?q=&current_status=&limit=)"""
+    try:
+        refresh_user_changes()
+        user_search.catch_up(user_changes)
         
-        # Get cancelled subscriptions
-        cancelled_subscriptions = sum(1 for sub in all_subscriptions if sub.to_dict().get('cancelled', False))
+        filters = {field: request.args[field] for field in user_search.fields if field in request.args}
+        if 'status' in request.args:
+            filters['current_status'] = request.args['status']
         
-        # Calculate conversion rate
-        conversion_rate = round((active_subscriptions / total_trials * 100) if total_trials > 0 else 0, 2)
+        return jsonify({
+            'success': True,
+            **user_search.search(request.args.get('q'), filters, request.args.get('limit', type=int))
+        })
         
+    except Exception as e:
+        app.logger.error(f"Error in search_users: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/users/search/stats')
+def get_search_stats():
+    """Search index size, build time and query timings"""
+    return jsonify({
+        'success': True,
+        'index': user_search.stats()
+    })
+
+def build_stats_panel(snapshot):
+    """Headline counts for the dashboard stats cards"""
+    total_users = len(snapshot.users)
+    verified_users = snapshot.verified_user_count
+    total_trials = len(snapshot.trials)
+    
+    active_subscriptions = snapshot.active_subscription_count
+    app.logger.info(f"Active subscriptions count: {active_subscriptions} of {len(snapshot.subscriptions)}")
+    
+    cancelled_subscriptions = int(snapshot.subscription_columns.cancelled.sum())
+    
+    # Calculate conversion rate
+    conversion_rate = round((active_subscriptions / total_trials * 100) if total_trials > 0 else 0, 2)
+    
+    return {
+        'stats': {
+            'total_users': total_users,
+            'verified_users': verified_users,
+            'unverified_users': total_users - verified_users,
+            'total_trials': total_trials,
+            'active_subscriptions': active_subscriptions,
+            'cancelled_subscriptions': cancelled_subscriptions,
+            'conversion_rate': conversion_rate
+        }
+    }
+
+@app.route('/api/stats')
+def get_stats():
+    """Get dashboard statistics"""
+    try:
         return jsonify({
             'success': True,
-            'stats': {
-                'total_users': total_users,
-                'verified_users': verified_users,
-                'unverified_users': total_users - verified_users,
-                'total_trials': total_trials,
-                'active_subscriptions': active_subscriptions,
-                'cancelled_subscriptions': cancelled_subscriptions,
-                'conversion_rate': conversion_rate
-            }
+            **build_stats_panel(panel_snapshot('stats'))
         })
         
     except Exception as e:
@@ -309,42 +379,47 @@ def get_stats():
 # KPI DASHBOARD AND BUSINESS ANALYTICS ROUTES
 # ============================================================================
 
+def build_revenue_panel(snapshot):
+    """Revenue analytics including MRR, ARPU, and revenue trends"""
+    all_subscriptions = snapshot.subscriptions
+    
+    # Calculate MRR (Monthly Recurring Revenue) at each active subscription's plan price
+    active_subscriptions = snapshot.active_subscription_count
+    mrr = snapshot.revenue_engine.current_mrr
+    
+    # Calculate ARPU (Average Revenue Per User)
+    total_users = len(snapshot.users)
+    arpu = mrr / total_users if total_users > 0 else 0
+    
+    # Calculate revenue trends (last 6 months), from the daily KPI series when it covers them
+    now = datetime.now()
+    revenue_trends = kpi_trends(kpi.revenue_trends, columnar.trailing_month_windows(now), now) \
+        or calculate_revenue_trends(all_subscriptions)
+    
+    # Calculate total revenue to date (prorated over each subscription's interval)
+    total_revenue = snapshot.revenue_engine.lifetime_revenue()
+    
+    # Calculate revenue growth rate
+    revenue_growth_rate = calculate_revenue_growth_rate(revenue_trends)
+    
+    return {
+        'revenue_analytics': {
+            'mrr': round(mrr, 2),
+            'arpu': round(arpu, 2),
+            'total_revenue': round(total_revenue, 2),
+            'revenue_growth_rate': round(revenue_growth_rate, 2),
+            'active_subscriptions': active_subscriptions,
+            'revenue_trends': revenue_trends
+        }
+    }
+
 @app.route('/api/analytics/revenue')
 def get_revenue_analytics():
     """Get revenue analytics including MRR, ARPU, and revenue trends"""
     try:
-        # Get all subscriptions
-        subscription_ref = db.collection('subscriptions')
-        all_subscriptions = list(subscription_ref.stream())
-        
-        # Calculate MRR (Monthly Recurring Revenue)
-        active_subscriptions = [sub for sub in all_subscriptions if sub.to_dict().get('status') == 'active']
-        mrr = len(active_subscriptions) * 3.0  # $3/month per subscription
-        
-        # Calculate ARPU (Average Revenue Per User)
-        users_ref = db.collection('users')
-        total_users = len(list(users_ref.stream()))
-        arpu = mrr / total_users if total_users > 0 else 0
-        
-        # Calculate revenue trends (last 6 months)
-        revenue_trends = calculate_revenue_trends(all_subscriptions)
-        
-        # Calculate total revenue to date
-        total_revenue = calculate_total_revenue(all_subscriptions)
-        
-        # Calculate revenue growth rate
-        revenue_growth_rate = calculate_revenue_growth_rate(revenue_trends)
-        
         return jsonify({
             'success': True,
-            'revenue_analytics': {
-                'mrr': round(mrr, 2),
-                'arpu': round(arpu, 2),
-                'total_revenue': round(total_revenue, 2),
-                'revenue_growth_rate': round(revenue_growth_rate, 2),
-                'active_subscriptions': len(active_subscriptions),
-                'revenue_trends': revenue_trends
-            }
+            **build_revenue_panel(panel_snapshot('revenue'))
         })
         
     except Exception as e:
@@ -354,47 +429,39 @@ def get_revenue_analytics():
             'error': str(e)
         }), 500
 
+def build_conversion_panel(snapshot):
+    """Conversion funnel analysis (registration → trial → subscription)"""
+    total_registrations = len(snapshot.users)
+    total_verified = snapshot.verified_user_count
+    total_trials = len(snapshot.trials)
+    total_subscriptions = snapshot.active_subscription_count
+    
+    # Calculate conversion rates
+    verification_rate = (total_verified / total_registrations * 100) if total_registrations > 0 else 0
+    trial_conversion_rate = (total_trials / total_verified * 100) if total_verified > 0 else 0
+    subscription_conversion_rate = (total_subscriptions / total_trials * 100) if total_trials > 0 else 0
+    overall_conversion_rate = (total_subscriptions / total_registrations * 100) if total_registrations > 0 else 0
+    
+    return {
+        'conversion_funnel': {
+            'total_registrations': total_registrations,
+            'total_verified': total_verified,
+            'total_trials': total_trials,
+            'total_subscriptions': total_subscriptions,
+            'verification_rate': round(verification_rate, 2),
+            'trial_conversion_rate': round(trial_conversion_rate, 2),
+            'subscription_conversion_rate': round(subscription_conversion_rate, 2),
+            'overall_conversion_rate': round(overall_conversion_rate, 2)
+        }
+    }
+
 @app.route('/api/analytics/conversion')
 def get_conversion_funnel():
     """Get conversion funnel analysis (registration → trial → subscription)"""
     try:
-        # Get all users
-        users_ref = db.collection('users')
-        all_users = list(users_ref.stream())
-        total_registrations = len(all_users)
-        
-        # Count verified users
-        verified_users = [user for user in all_users if user.to_dict().get('emailVerified', False)]
-        total_verified = len(verified_users)
-        
-        # Get trial users
-        trial_ref = db.collection('trial_history')
-        all_trials = list(trial_ref.stream())
-        total_trials = len(all_trials)
-        
-        # Get active subscriptions
-        subscription_ref = db.collection('subscriptions')
-        all_subscriptions = list(subscription_ref.stream())
-        total_subscriptions = len([sub for sub in all_subscriptions if sub.to_dict().get('status') == 'active'])
-        
-        # Calculate conversion rates
-        verification_rate = (total_verified / total_registrations * 100) if total_registrations > 0 else 0
-        trial_conversion_rate = (total_trials / total_verified * 100) if total_verified > 0 else 0
-        subscription_conversion_rate = (total_subscriptions / total_trials * 100) if total_trials > 0 else 0
-        overall_conversion_rate = (total_subscriptions / total_registrations * 100) if total_registrations > 0 else 0
-        
         return jsonify({
             'success': True,
-            'conversion_funnel': {
-                'total_registrations': total_registrations,
-                'total_verified': total_verified,
-                'total_trials': total_trials,
-                'total_subscriptions': total_subscriptions,
-                'verification_rate': round(verification_rate, 2),
-                'trial_conversion_rate': round(trial_conversion_rate, 2),
-                'subscription_conversion_rate': round(subscription_conversion_rate, 2),
-                'overall_conversion_rate': round(overall_conversion_rate, 2)
-            }
+            **build_conversion_panel(panel_snapshot('conversion'))
         })
         
     except Exception as e:
@@ -404,26 +471,25 @@ def get_conversion_funnel():
             'error': str(e)
         }), 500
 
+def build_retention_panel(snapshot):
+    """User retention and churn rate calculations"""
+    retention_metrics = calculate_retention_metrics(snapshot.users)
+    churn_metrics = calculate_churn_metrics(snapshot.subscriptions, current_subscription_states(snapshot))
+    
+    return {
+        'retention_analytics': {
+            **retention_metrics,
+            **churn_metrics
+        }
+    }
+
 @app.route('/api/analytics/retention')
 def get_retention_analytics():
     """Get user retention and churn rate calculations"""
     try:
-        # Get all users with their data
-        users_ref = db.collection('users')
-        all_users = list(users_ref.stream())
-        
-        # Calculate retention metrics
-        retention_metrics = calculate_retention_metrics(all_users)
-        
-        # Calculate churn rate
-        churn_metrics = calculate_churn_metrics()
-        
         return jsonify({
             'success': True,
-            'retention_analytics': {
-                **retention_metrics,
-                **churn_metrics
-            }
+            **build_retention_panel(panel_snapshot('retention'))
         })
         
     except Exception as e:
@@ -433,26 +499,30 @@ def get_retention_analytics():
             'error': str(e)
         }), 500
 
+def build_subscription_health_panel(snapshot):
+    """Subscription growth and health metrics"""
+    health_metrics = calculate_subscription_health_metrics(snapshot.subscriptions)
+    now = datetime.now()
+    growth_trends = kpi_trends(kpi.subscription_growth_trends, columnar.trailing_month_windows(now), now) \
+        or calculate_subscription_growth_trends(snapshot.subscriptions)
+    
+    states = current_subscription_states(snapshot).counts()
+    
+    return {
+        'subscription_health': {
+            **health_metrics,
+            'subscriptions_by_state': {state: count for state, count in states.items() if state != 'trialing'},
+            'growth_trends': growth_trends
+        }
+    }
+
 @app.route('/api/analytics/subscription-health')
 def get_subscription_health():
     """Get subscription growth and health metrics"""
     try:
-        # Get all subscriptions
-        subscription_ref = db.collection('subscriptions')
-        all_subscriptions = list(subscription_ref.stream())
-        
-        # Calculate subscription health metrics
-        health_metrics = calculate_subscription_health_metrics(all_subscriptions)
-        
-        # Calculate subscription growth trends
-        growth_trends = calculate_subscription_growth_trends(all_subscriptions)
-        
         return jsonify({
             'success': True,
-            'subscription_health': {
-                **health_metrics,
-                'growth_trends': growth_trends
-            }
+            **build_subscription_health_panel(panel_snapshot('subscription-health'))
         })
         
     except Exception as e:
@@ -636,6 +706,11 @@ def chat():
     if not messages:
         app.logger.error("No messages provided")
         return jsonify({"error": "No messages provided"}), 400
+    
+    # Count the user as active today for DAU/WAU/MAU, retention and distinct-user sketches
+    if user_id:
+        activity_bitmaps.record(user_id)
+        count_distinct_user('chat_users', user_id)
 
     # Get the last user message for moderation
     user_messages = [msg for msg in messages if msg.get('role') == 'user']
@@ -806,6 +881,8 @@ def chat():
     app.logger.info("Calling OpenAI LLM")
     llm_response = call_openai_llm(sanitized_messages, max_tokens)
     app.logger.info(f"LLM response: '{llm_response}'")
+    if user_id:
+        count_distinct_user('token_users', user_id)
     
     response_data = {"response": llm_response}
     app.logger.info(f"Returning normal response: {response_data}")
@@ -1166,20 +1243,17 @@ def get_current_user_status(user_data, trial_history, subscription):
 # ADVANCED ANALYTICS ROUTES (Task 10.2)
 # ============================================================================
 
+def build_cohort_panel(snapshot):
+    """Cohort analysis for user retention tracking"""
+    return {'cohort_analysis': calculate_cohort_analysis(snapshot.users)}
+
 @app.route('/api/analytics/cohort')
 def get_cohort_analysis():
     """Get cohort analysis for user retention tracking"""
     try:
-        # Get all users with their registration and activity data
-        users_ref = db.collection('users')
-        all_users = list(users_ref.stream())
-        
-        # Calculate cohort analysis
-        cohort_data = calculate_cohort_analysis(all_users)
-        
         return jsonify({
             'success': True,
-            'cohort_analysis': cohort_data
+            **build_cohort_panel(panel_snapshot('cohort'))
         })
         
     except Exception as e:
@@ -1189,20 +1263,22 @@ def get_cohort_analysis():
             'error': str(e)
         }), 500
 
+def build_geographic_panel(snapshot):
+    """Geographic distribution analysis for OFW markets"""
+    if not geo_rollup.live:
+        # No listeners: bring the rollup up to date from a fresh read (only differences count)
+        for source in GeoRollup.SOURCES:
+            geo_rollup.sync(source, ((doc.id, doc.to_dict() or {}) for doc in getattr(snapshot, source)))
+    return {'geographic_distribution': calculate_geographic_distribution(geo_rollup.rollup())}
+
 @app.route('/api/analytics/geographic')
 def get_geographic_distribution():
     """Get geographic distribution analysis for OFW markets"""
     try:
-        # Get all users and analyze their geographic data
-        users_ref = db.collection('users')
-        all_users = list(users_ref.stream())
-        
-        # Calculate geographic distribution
-        geographic_data = calculate_geographic_distribution(all_users)
-        
+        start_collection_watches()
         return jsonify({
             'success': True,
-            'geographic_distribution': geographic_data
+            **build_geographic_panel(panel_snapshot('geographic'))
         })
         
     except Exception as e:
@@ -1212,27 +1288,18 @@ def get_geographic_distribution():
             'error': str(e)
         }), 500
 
+def build_user_behavior_panel(snapshot):
+    """User behavior and engagement analytics"""
+    return {'user_behavior': calculate_user_behavior_analytics(snapshot.users, snapshot.trials, snapshot.subscriptions,
+                                                               snapshot.identity)}
+
 @app.route('/api/analytics/user-behavior')
 def get_user_behavior_analytics():
     """Get user behavior and engagement analytics"""
     try:
-        # Get user behavior data from multiple collections
-        users_ref = db.collection('users')
-        all_users = list(users_ref.stream())
-        
-        # Get trial and subscription data for behavior analysis
-        trial_ref = db.collection('trial_history')
-        all_trials = list(trial_ref.stream())
-        
-        subscription_ref = db.collection('subscriptions')
-        all_subscriptions = list(subscription_ref.stream())
-        
-        # Calculate user behavior metrics
-        behavior_data = calculate_user_behavior_analytics(all_users, all_trials, all_subscriptions)
-        
         return jsonify({
             'success': True,
-            'user_behavior': behavior_data
+            **build_user_behavior_panel(panel_snapshot('user-behavior'))
         })
         
     except Exception as e:
@@ -1242,20 +1309,17 @@ def get_user_behavior_analytics():
             'error': str(e)
         }), 500
 
+def build_payment_analysis_panel(snapshot):
+    """Payment success rate and failure analysis from the payment ledger rollups"""
+    return {'payment_analysis': calculate_payment_analysis(payment_ledger.rollups())}
+
 @app.route('/api/analytics/payment-analysis')
 def get_payment_analysis():
     """Get payment success rate and failure analysis"""
     try:
-        # Get subscription and payment data
-        subscription_ref = db.collection('subscriptions')
-        all_subscriptions = list(subscription_ref.stream())
-        
-        # Calculate payment analysis metrics
-        payment_data = calculate_payment_analysis(all_subscriptions)
-        
         return jsonify({
             'success': True,
-            'payment_analysis': payment_data
+            **build_payment_analysis_panel(panel_snapshot('payment-analysis'))
         })
         
     except Exception as e:
@@ -1269,15 +1333,21 @@ def get_payment_analysis():
 # ALERTING AND MONITORING SYSTEM ROUTES (Task 10.3)
 # ============================================================================
 
+def build_alerts_panel(snapshot):
+    """Critical business alerts (churn, payment failures, etc.) with per-rule evaluation cost"""
+    return {
+        'alerts': generate_business_alerts(snapshot),
+        'rules': alert_engine.rule_stats()
+    }
+
 @app.route('/api/monitoring/alerts')
 def get_business_alerts():
     """Get critical business alerts (churn, payment failures, etc.)"""
     try:
-        alerts = generate_business_alerts()
-        
+        start_collection_watches()
         return jsonify({
             'success': True,
-            'alerts': alerts
+            **build_alerts_panel(panel_snapshot('alerts'))
         })
         
     except Exception as e:
@@ -1287,15 +1357,37 @@ def get_business_alerts():
             'error': str(e)
         }), 500
 
+@app.route('/api/monitoring/alerts/history')
+def get_alert_history():
+    """Get resolved alerts (newest first), the open ones, and the alert engine's state"""
+    try:
+        limit = request.args.get('limit', 50, type=int)
+        return jsonify({
+            'success': True,
+            'open': alert_engine.evaluate(),
+            'resolved': alert_engine.recent(limit),
+            'rules': alert_engine.rule_stats(),
+            'engine': alert_engine.stats()
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in get_alert_history: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def build_performance_panel(snapshot):
+    """Performance monitoring and error tracking data"""
+    return {'performance': calculate_performance_metrics(snapshot)}
+
 @app.route('/api/monitoring/performance')
 def get_performance_metrics():
     """Get performance monitoring and error tracking data"""
     try:
-        performance_data = calculate_performance_metrics()
-        
         return jsonify({
             'success': True,
-            'performance': performance_data
+            **build_performance_panel(panel_snapshot('performance'))
         })
         
     except Exception as e:
@@ -1305,15 +1397,53 @@ def get_performance_metrics():
             'error': str(e)
         }), 500
 
+# The scheduled reports shown on the reports panel; kpi_snapshot only feeds the KPI series
+PANEL_REPORTS = ('daily_summary', 'weekly_trends', 'monthly_business')
+
+def build_reports_panel(snapshot=None):
+    """Automated reporting and trend analysis, served from the latest scheduled snapshots"""
+    start_report_scheduler()
+    latest = {name: report_scheduler.latest(name) for name in PANEL_REPORTS}
+    reports = {name: snapshot['data'] for name, snapshot in latest.items()}
+    reports['generated_at'] = min(snapshot['generated_at'] for snapshot in latest.values())
+    return {
+        'reports': reports,
+        'snapshots': {
+            name: {
+                'version': snapshot['version'],
+                'generated_at': snapshot['generated_at'],
+                'duration_ms': snapshot['duration_ms'],
+                'next_run': report_scheduler.next_run(name).isoformat()
+            }
+            for name, snapshot in latest.items()
+        }
+    }
+
 @app.route('/api/monitoring/reports')
 def get_automated_reports():
-    """Get automated reporting and trend analysis"""
+    """Get automated reporting and trend analysis (?refresh=true rebuilds the reports first)"""
     try:
-        reports = generate_automated_reports()
+        refresh = request.args.get('refresh', 'false').lower()
+        if refresh in ('1', 'true', 'yes', 'all'):
+            names = list(PANEL_REPORTS)
+        elif refresh in ('', '0', 'false', 'no'):
+            names = []
+        else:
+            names = [name.strip() for name in refresh.split(',') if name.strip()]
+            unknown = [name for name in names if name not in report_scheduler.reports]
+            if unknown:
+                return jsonify({
+                    'success': False,
+                    'error': f"Unknown reports: {', '.join(unknown)}",
+                    'available_reports': list(report_scheduler.reports)
+                }), 400
+        
+        for name in names:
+            report_scheduler.refresh(name)
         
         return jsonify({
             'success': True,
-            'reports': reports
+            **build_reports_panel()
         })
         
     except Exception as e:
@@ -1323,12 +1453,203 @@ def get_automated_reports():
             'error': str(e)
         }), 500
 
+@app.route('/api/monitoring/reports/history')
+def get_report_history():
+    """Get earlier versions of a scheduled report (?report=daily_summary&limit=30)"""
+    try:
+        start_report_scheduler()
+        name = request.args.get('report', 'daily_summary')
+        if name not in report_scheduler.reports:
+            return jsonify({
+                'success': False,
+                'error': f"Unknown report '{name}'",
+                'available_reports': list(report_scheduler.reports)
+            }), 400
+        limit = min(request.args.get('limit', 30, type=int), report_store.history_limit)
+        
+        history = report_store.history(name, limit)
+        return jsonify({
+            'success': True,
+            'report': name,
+            'history': history,
+            'count': len(history)
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in get_report_history: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# ============================================================================
+# DASHBOARD BUNDLE ROUTE
+# ============================================================================
+
+# Panel name -> builder. Names match the individual /api/... routes.
+DASHBOARD_PANELS = {
+    'stats': build_stats_panel,
+    'users': build_users_panel,
+    'revenue': build_revenue_panel,
+    'conversion': build_conversion_panel,
+    'retention': build_retention_panel,
+    'subscription-health': build_subscription_health_panel,
+    'cohort': build_cohort_panel,
+    'geographic': build_geographic_panel,
+    'user-behavior': build_user_behavior_panel,
+    'payment-analysis': build_payment_analysis_panel,
+    'alerts': build_alerts_panel,
+    'performance': build_performance_panel,
+    'reports': build_reports_panel
+}
+
+# Panel name -> field manifest (snapshot source -> fields read), see analytics/fields.py
+PANEL_FIELDS = {
+    'stats': fields.merge(
+        fields.ids_only('users', 'trials'),
+        fields.VERIFIED_USER_COUNT,
+        fields.ACTIVE_SUBSCRIPTION_COUNT,
+        {'subscriptions': ('cancelled',)}
+    ),
+    'users': fields.USER_JOURNEYS,
+    'revenue': fields.merge(
+        fields.ids_only('users'),
+        fields.ACTIVE_SUBSCRIPTION_COUNT,
+        fields.REVENUE_TRENDS,
+        fields.REVENUE_ENGINE
+    ),
+    'conversion': fields.merge(
+        fields.ids_only('users', 'trials'),
+        fields.VERIFIED_USER_COUNT,
+        fields.ACTIVE_SUBSCRIPTION_COUNT
+    ),
+    'retention': fields.merge(fields.RETENTION_METRICS, fields.CHURN_METRICS),
+    'subscription-health': fields.merge(fields.SUBSCRIPTION_HEALTH, fields.SUBSCRIPTION_GROWTH),
+    'cohort': fields.COHORT_ANALYSIS,
+    'geographic': fields.GEOGRAPHIC_DISTRIBUTION,
+    'user-behavior': fields.USER_BEHAVIOR,
+    'payment-analysis': fields.PAYMENT_ANALYSIS,
+    'alerts': fields.BUSINESS_ALERTS,
+    'performance': fields.USER_ACTIVITY,
+    # Served from the report store; the scheduled builds read their own fields
+    'reports': {}
+}
+
+def log_reads(snapshot, label):
+    """Log a snapshot's reads and add them to the per-endpoint read volume"""
+    if has_request_context():
+        record_endpoint_reads(request.path, snapshot.read_timings)
+    reads = ', '.join(f"{name}: {timing.documents} docs / {timing.bytes} B in {timing.seconds * 1000:.0f} ms "
+                      f"({timing.docs_per_second:.0f} docs/s)"
+                      for name, timing in snapshot.read_timings.items())
+    app.logger.info(f"Loaded {reads} for {label}")
+
+def snapshot_backend():
+    """Where panels read from: live Firestore, or the local warehouse with ?backend=warehouse"""
+    backend = request.args.get('backend', 'firestore') if has_request_context() else 'firestore'
+    if backend not in ('firestore', 'warehouse'):
+        raise ValueError(f"Unknown backend '{backend}' (use firestore or warehouse)")
+    return backend
+
+def manifest_snapshot(manifest, label):
+    """Snapshot with the fields in ``manifest`` already loaded in parallel"""
+    if snapshot_backend() == 'warehouse':
+        # No Firestore reads, so nothing is added to the endpoint read volume
+        snapshot = WarehouseSnapshot(warehouse, fields=manifest).prefetch(*manifest)
+        loaded = ', '.join(f"{name}: {timing.documents} docs" for name, timing in snapshot.read_timings.items())
+        app.logger.info(f"Loaded {loaded} from the warehouse for {label}")
+        return snapshot
+    
+    snapshot = DashboardSnapshot(db, fields=manifest).prefetch(*manifest)
+    log_reads(snapshot, label)
+    return snapshot
+
+def panel_fields(name):
+    """Fields a panel needs read for it; none for alerts or geography while listeners keep them current"""
+    if (name == 'alerts' and alert_engine.live) or (name == 'geographic' and geo_rollup.live):
+        return {}
+    return PANEL_FIELDS[name]
+
+def panel_snapshot(*panel_names):
+    """Snapshot with the fields the given panels read already loaded in parallel"""
+    manifest = fields.merge(*(panel_fields(name) for name in panel_names))
+    return manifest_snapshot(manifest, ', '.join(panel_names))
+
+def build_dashboard_bundle(snapshot, panel_names):
+    """Compute the requested panels against one shared snapshot"""
+    panels = {}
+    timings = {}
+    
+    for name in panel_names:
+        started = time.time()
+        try:
+            panels[name] = {'success': True, **DASHBOARD_PANELS[name](snapshot)}
+        except Exception as e:
+            app.logger.error(f"Error building dashboard panel {name}: {e}")
+            panels[name] = {'success': False, 'error': str(e)}
+        timings[name] = round((time.time() - started) * 1000, 1)
+    
+    return panels, timings
+
+@app.route('/api/dashboard/bundle')
+def get_dashboard_bundle():
+    """Get every dashboard panel (or the subset in ?panels=a,b,c) in one request"""
+    try:
+        requested = request.args.get('panels')
+        if requested:
+            panel_names = [name.strip() for name in requested.split(',') if name.strip()]
+            unknown = [name for name in panel_names if name not in DASHBOARD_PANELS]
+            if unknown:
+                return jsonify({
+                    'success': False,
+                    'error': f"Unknown panels: {', '.join(unknown)}",
+                    'available_panels': list(DASHBOARD_PANELS)
+                }), 400
+        else:
+            panel_names = list(DASHBOARD_PANELS)
+        
+        started = time.time()
+        snapshot = panel_snapshot(*panel_names)
+        panels, timings = build_dashboard_bundle(snapshot, panel_names)
+        
+        return jsonify({
+            'success': True,
+            'panels': panels,
+            'timings_ms': timings,
+            'reads_ms': {name: timing.to_dict() for name, timing in snapshot.read_timings.items()},
+            'total_ms': round((time.time() - started) * 1000, 1),
+            'generated_at': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in get_dashboard_bundle: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/monitoring/read-volume')
+def get_read_volume():
+    """Get Firestore documents and estimated bytes read per endpoint since startup"""
+    try:
+        return jsonify({
+            'success': True,
+            'endpoints': endpoint_read_volume()
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in get_read_volume: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/api/export/data')
 def export_data():
     """Export data for detailed analysis"""
     try:
         export_type = request.args.get('type', 'users')  # users, subscriptions, analytics
-        format_type = request.args.get('format', 'csv')  # csv, json
+        format_type = request.args.get('format', 'csv')  # csv, ndjson, json
         
         if export_type == 'users':
             data = export_users_data(format_type)
@@ -1351,88 +1672,664 @@ def export_data():
             'error': str(e)
         }), 500
 
-# ============================================================================
-# ALERTING AND MONITORING SYSTEM HELPER FUNCTIONS (Task 10.3)
-# ============================================================================
-
-def generate_business_alerts():
-    """Generate critical business alerts"""
+@app.route('/api/export/jobs', methods=['POST'])
+def create_export_job():
+    """Queue a background export; an identical recent export is returned instead of a new one"""
     try:
-        alerts = []
+        params = request.get_json(silent=True) or request.args
+        export_type = params.get('type', 'users')  # users, subscriptions
+        format_type = params.get('format', 'csv')  # csv, ndjson, parquet
         
-        # Get current data
-        users_ref = db.collection('users')
-        all_users = list(users_ref.stream())
-        
-        subscription_ref = db.collection('subscriptions')
-        all_subscriptions = list(subscription_ref.stream())
+        try:
+            job, deduplicated = export_jobs.create(export_type, format_type)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
         
-        trial_ref = db.collection('trial_history')
-        all_trials = list(trial_ref.stream())
-        
-        # Alert 1: High Churn Rate
-        churn_metrics = calculate_churn_metrics()
-        if churn_metrics['monthly_churn_rate'] > 15:  # Alert if monthly churn > 15%
-            alerts.append({
-                'type': 'critical',
-                'category': 'churn',
-                'title': 'High Churn Rate Alert',
-                'message': f"Monthly churn rate is {churn_metrics['monthly_churn_rate']}% (threshold: 15%)",
-                'value': churn_metrics['monthly_churn_rate'],
-                'threshold': 15,
-                'timestamp': datetime.now().isoformat(),
-                'action': 'Review user feedback and improve retention strategies'
-            })
+        app.logger.info(f"Export job {job['id']} ({export_type}, {format_type}) "
+                        f"{'reused' if deduplicated else 'queued'}")
+        return jsonify({
+            'success': True,
+            'job': export_jobs.public(job),
+            'deduplicated': deduplicated
+        }), 202
         
-        # Alert 2: Payment Failures
-        payment_data = calculate_payment_analysis(all_subscriptions)
-        if payment_data['failure_rate'] > 10:  # Alert if payment failure rate > 10%
-            alerts.append({
-                'type': 'warning',
-                'category': 'payment',
-                'title': 'High Payment Failure Rate',
-                'message': f"Payment failure rate is {payment_data['failure_rate']}% (threshold: 10%)",
-                'value': payment_data['failure_rate'],
-                'threshold': 10,
-                'timestamp': datetime.now().isoformat(),
-                'action': 'Check payment processor status and user payment methods'
-            })
+    except Exception as e:
+        app.logger.error(f"Error in create_export_job: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/export/jobs')
+def list_export_jobs():
+    """List background export jobs, newest first"""
+    try:
+        return jsonify({
+            'success': True,
+            'jobs': [export_jobs.public(job) for job in export_jobs.jobs()]
+        })
         
-        # Alert 3: Low Trial Conversion
-        if all_trials and all_subscriptions:
-            active_subscriptions = len([sub for sub in all_subscriptions if sub.to_dict().get('isActive')])
-            conversion_rate = (active_subscriptions / len(all_trials)) * 100
-            
-            if conversion_rate < 20:  # Alert if trial conversion < 20%
-                alerts.append({
-                    'type': 'warning',
-                    'category': 'conversion',
-                    'title': 'Low Trial Conversion Rate',
-                    'message': f"Trial to subscription conversion is {conversion_rate:.1f}% (threshold: 20%)",
-                    'value': round(conversion_rate, 1),
-                    'threshold': 20,
-                    'timestamp': datetime.now().isoformat(),
-                    'action': 'Review trial experience and onboarding process'
-                })
+    except Exception as e:
+        app.logger.error(f"Error in list_export_jobs: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/export/jobs/<job_id>')
+def get_export_job(job_id):
+    """Get the status and progress of a background export"""
+    try:
+        job = export_jobs.get(job_id)
+        if job is None:
+            return jsonify({
+                'success': False,
+                'error': 'Export job not found'
+            }), 404
         
-        # Alert 4: High Unverified User Rate
-        if all_users:
-            unverified_users = len([user for user in all_users if not user.to_dict().get('emailVerified')])
-            unverified_rate = (unverified_users / len(all_users)) * 100
-            
-            if unverified_rate > 30:  # Alert if unverified rate > 30%
-                alerts.append({
-                    'type': 'info',
-                    'category': 'verification',
-                    'title': 'High Unverified User Rate',
-                    'message': f"Unverified user rate is {unverified_rate:.1f}% (threshold: 30%)",
-                    'value': round(unverified_rate, 1),
-                    'threshold': 30,
-                    'timestamp': datetime.now().isoformat(),
-                    'action': 'Improve email verification flow and reminders'
-                })
+        return jsonify({
+            'success': True,
+            'job': export_jobs.public(job)
+        })
         
-        return {
+    except Exception as e:
+        app.logger.error(f"Error in get_export_job: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/export/jobs/<job_id>/download')
+def download_export_job(job_id):
+    """Download a finished export (supports Range requests for resumable downloads)"""
+    try:
+        job = export_jobs.get(job_id)
+        if job is None:
+            return jsonify({
+                'success': False,
+                'error': 'Export job not found'
+            }), 404
+        if job['status'] != 'done':
+            return jsonify({
+                'success': False,
+                'error': f"Export job is {job['status']}"
+            }), 409
+        
+        return send_file(
+            os.path.abspath(export_jobs.artifact_path(job)),
+            mimetype=EXPORT_JOB_MIMETYPES[job['format']],
+            as_attachment=True,
+            download_name=job['artifact'],
+            conditional=True
+        )
+        
+    except FileNotFoundError:
+        return jsonify({
+            'success': False,
+            'error': 'Export artifact no longer exists'
+        }), 410
+    except Exception as e:
+        app.logger.error(f"Error in download_export_job: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/warehouse/sync', methods=['POST'])
+def sync_warehouse():
+    """Copy what changed in Firestore into the local analytics warehouse (?full=true reconciles everything)"""
+    try:
+        full = request.args.get('full', 'false').lower() in ('1', 'true', 'yes')
+        collections = [name for name in request.args.get('collections', '').split(',') if name]
+        unknown = [name for name in collections if name not in warehouse.collections]
+        if unknown:
+            return jsonify({
+                'success': False,
+                'error': f"Not mirrored: {', '.join(unknown)}"
+            }), 400
+        
+        runs = warehouse.sync(db, collections or None, full=full)
+        app.logger.info("Warehouse sync: " + ', '.join(
+            f"{run['collection']} {run['mode']} {run['copied']} copied / {run['read']} read" for run in runs))
+        return jsonify({
+            'success': True,
+            'runs': runs
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in sync_warehouse: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/warehouse/status')
+def get_warehouse_status():
+    """Watermarks, document counts and last runs of the analytics warehouse"""
+    try:
+        return jsonify({
+            'success': True,
+            'warehouse': warehouse.status()
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in get_warehouse_status: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/analytics/revenue/history')
+def get_revenue_history():
+    """Monthly MRR, revenue and net growth from ?from= to ?to= (YYYY-MM, default the last 12 months); ?at= gives MRR at an instant"""
+    try:
+        now = datetime.now()
+        try:
+            end = datetime.strptime(request.args['to'], '%Y-%m') if request.args.get('to') else now
+            start = datetime.strptime(request.args['from'], '%Y-%m') if request.args.get('from') \
+                else (end.replace(day=1) - timedelta(days=335)).replace(day=1)
+            at = datetime.fromisoformat(request.args['at']).replace(tzinfo=None) if request.args.get('at') else None
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': f"Invalid date: {e}"
+            }), 400
+        if start > end or (end.year - start.year) * 12 + end.month - start.month >= 120:
+            return jsonify({
+                'success': False,
+                'error': 'from must not be after to, and the range is limited to 120 months'
+            }), 400
+        
+        engine = manifest_snapshot(fields.REVENUE_ENGINE, 'revenue history').revenue_engine
+        result = {
+            'periods': engine.history(start, end),
+            'lifetime_revenue': round(engine.lifetime_revenue(), 2),
+            'current_mrr': round(engine.current_mrr, 2)
+        }
+        if at is not None:
+            result['at'] = {
+                'timestamp': at.isoformat(),
+                'mrr': round(engine.mrr_at(at), 2),
+                'subscribers': engine.subscribers_at(at)
+            }
+        return jsonify({
+            'success': True,
+            **result
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in get_revenue_history: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/analytics/state-at')
+def get_subscription_states_at():
+    """Subscriptions (and trials) active, trialing, cancelled-pending or expired at ?ts= (ISO, default now); ?list=<state> lists ids"""
+    try:
+        try:
+            moment = datetime.fromisoformat(request.args['ts']).replace(tzinfo=None) if request.args.get('ts') \
+                else datetime.now()
+            limit = int(request.args.get('limit', 1000))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': f"Invalid parameter: {e}"
+            }), 400
+        listed = [state for state in request.args.get('list', '').split(',') if state]
+        unknown = [state for state in listed if state not in SUBSCRIPTION_STATES]
+        if unknown or limit < 0:
+            return jsonify({
+                'success': False,
+                'error': f"list takes states from {', '.join(SUBSCRIPTION_STATES)} and limit must not be negative"
+            }), 400
+        
+        states = current_subscription_states()
+        result = {
+            'timestamp': moment.isoformat(),
+            'counts': states.counts(moment),
+            'undated_subscriptions': states.undated,
+            'live': states.live
+        }
+        if listed:
+            result['members'] = {state: states.members(state, moment, limit) for state in listed}
+        return jsonify({
+            'success': True,
+            **result
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in get_subscription_states_at: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/analytics/kpi')
+def get_kpi_series():
+    """Daily KPI rows between ?from= and ?to= (ISO dates, default the last 30 days)"""
+    try:
+        today = datetime.now().date()
+        try:
+            end = datetime.fromisoformat(request.args['to']).date() if request.args.get('to') else today
+            start = datetime.fromisoformat(request.args['from']).date() if request.args.get('from') \
+                else end - timedelta(days=29)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': f"Invalid date: {e}"
+            }), 400
+        
+        start_report_scheduler()
+        rows = kpi_series.range(start, end)
+        return jsonify({
+            'success': True,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'days': len(rows),
+            'kpis': rows
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in get_kpi_series: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/analytics/kpi/backfill', methods=['POST'])
+def backfill_kpi_series():
+    """Reconstruct KPI rows for the last ?days= days (default 180) that have none"""
+    try:
+        days = request.args.get('days', 180, type=int)
+        if days < 1:
+            return jsonify({
+                'success': False,
+                'error': 'days must be positive'
+            }), 400
+        
+        snapshot = manifest_snapshot(fields.KPI_SNAPSHOT, 'kpi backfill')
+        written = backfill_daily_kpis(kpi_series, snapshot, days)
+        app.logger.info(f"Backfilled {written} KPI rows over the last {days} days")
+        return jsonify({
+            'success': True,
+            'backfilled': written,
+            'days': len(kpi_series)
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in backfill_kpi_series: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/analytics/activity')
+def get_activity_metrics():
+    """DAU, WAU and MAU from the activity bitmaps, with a daily series over ?days= (default 30)"""
+    try:
+        days = request.args.get('days', 30, type=int)
+        if not 1 <= days <= 366:
+            return jsonify({
+                'success': False,
+                'error': 'days must be between 1 and 366'
+            }), 400
+        
+        series = activity_bitmaps.series(days=days)
+        return jsonify({
+            'success': True,
+            'activity': {
+                **series[-1],
+                'daily': series,
+                'tracked_since': activity_bitmaps.status()['tracked_since']
+            }
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in get_activity_metrics: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/analytics/activity/retention')
+def get_activity_retention():
+    """True N-day retention of monthly signup cohorts from the activity bitmaps"""
+    try:
+        snapshot = manifest_snapshot(fields.ACTIVITY_RETENTION, 'activity retention')
+        return jsonify({
+            'success': True,
+            'retention': activity_bitmaps.retention(snapshot.user_columns)
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in get_activity_retention: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/analytics/activity/events', methods=['POST'])
+def record_activity_events():
+    """Record users as active from {"user_id"} or {"user_ids": [...]}, at an optional ISO timestamp"""
+    try:
+        data = request.get_json(silent=True) or {}
+        user_ids = data.get('user_ids') or ([data['user_id']] if data.get('user_id') else [])
+        if not user_ids:
+            return jsonify({
+                'success': False,
+                'error': 'No user_id or user_ids provided'
+            }), 400
+        try:
+            when = datetime.fromisoformat(data['timestamp']) if data.get('timestamp') else None
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': f"Invalid timestamp: {e}"
+            }), 400
+        
+        for user_id in user_ids:
+            activity_bitmaps.record(user_id, when)
+        return jsonify({
+            'success': True,
+            'recorded': len(user_ids)
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in record_activity_events: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/analytics/activity/status')
+def get_activity_status():
+    """Indexed users, tracked days and buffered events of the activity bitmaps"""
+    try:
+        return jsonify({
+            'success': True,
+            'activity': activity_bitmaps.status()
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in get_activity_status: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/analytics/distinct-users')
+def get_distinct_users():
+    """Estimated distinct users of ?metric= (chat_users, token_users) over ?from=&to=, optionally ?by=userType|country"""
+    try:
+        metric = request.args.get('metric', 'chat_users')
+        by = request.args.get('by')
+        if metric not in SKETCH_METRICS or (by and by not in SKETCH_DIMENSIONS):
+            return jsonify({
+                'success': False,
+                'error': f"metric must be one of {', '.join(SKETCH_METRICS)} and by one of {', '.join(SKETCH_DIMENSIONS)}"
+            }), 400
+        today = datetime.now().date()
+        try:
+            end = datetime.fromisoformat(request.args['to']).date() if request.args.get('to') else today
+            start = datetime.fromisoformat(request.args['from']).date() if request.args.get('from') \
+                else end.replace(day=1)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': f"Invalid date: {e}"
+            }), 400
+        if not start <= end or (end - start).days > 366:
+            return jsonify({
+                'success': False,
+                'error': 'from must not be after to, and the range is limited to 366 days'
+            }), 400
+        
+        result = {
+            'metric': metric,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'distinct_users': usage_sketches.estimate(metric, start, end),
+            'relative_error': usage_sketches.status()['relative_error'],
+            'daily': usage_sketches.daily(metric, start, end)
+        }
+        if by:
+            result['by'] = {by: usage_sketches.estimate(metric, start, end, dimension=by)}
+        return jsonify({
+            'success': True,
+            **result
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in get_distinct_users: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/analytics/distinct-users/status')
+def get_distinct_users_status():
+    """Precision, error bound and storage of the distinct-user sketches"""
+    try:
+        return jsonify({
+            'success': True,
+            'sketches': usage_sketches.status()
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in get_distinct_users_status: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/analytics/geographic/backfill', methods=['POST'])
+def backfill_country_codes():
+    """Classify every user's country and store it as countryCode where it is missing or stale"""
+    try:
+        scan = PartitionedScan(db.collection('users'), fields=fields.COUNTRY_CLASSIFICATION['users'])
+        users = [(user_doc.id, user_doc.to_dict() or {}) for user_doc in scan.stream()]
+        written = store_country_codes(users)
+        app.logger.info(f"Stored country codes on {written} of {len(users)} users")
+        return jsonify({
+            'success': True,
+            'scanned': len(users),
+            'updated': written
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in backfill_country_codes: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/analytics/geographic/status')
+def get_geographic_rollup_status():
+    """Whether listeners keep the per-country rollup current, and what it holds"""
+    try:
+        return jsonify({
+            'success': True,
+            'rollup': geo_rollup.status()
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in get_geographic_rollup_status: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/payments/events', methods=['POST'])
+def record_payment_event():
+    """Append a payment attempt, failure or refund from the billing flows to the payment ledger"""
+    try:
+        data = request.get_json() or {}
+        event_id = data.get('eventId')
+        if not event_id or '/' in str(event_id):
+            return jsonify({'success': False, 'error': 'eventId is required and may not contain /'}), 400
+        try:
+            event = payment_event(
+                data.get('userId'), data.get('amount', 0), data.get('currency', 'usd'),
+                data.get('status', 'succeeded'), method=data.get('paymentMethod'),
+                failure_reason=data.get('failureReason'), event_type=data.get('type', 'payment'),
+                source=data.get('source', 'api'), reference=data.get('transactionId')
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        recorded = payment_ledger.record(str(event_id), event)
+        return jsonify({
+            'success': True,
+            'event_id': str(event_id),
+            'recorded': recorded
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in record_payment_event: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/analytics/payments/import', methods=['POST'])
+def import_payment_history():
+    """Record billing_history attempts (optionally since an ISO date) in the payment ledger; safe to repeat"""
+    try:
+        data = request.get_json(silent=True) or {}
+        since = data.get('since') or request.args.get('since')
+        try:
+            since = datetime.fromisoformat(since) if since else None
+        except ValueError:
+            return jsonify({'success': False, 'error': 'since must be an ISO date'}), 400
+        
+        recorded, duplicates, pending = import_billing_history(since)
+        app.logger.info(f"Imported {recorded} billing history payments ({duplicates} already recorded, {pending} pending)")
+        return jsonify({
+            'success': True,
+            'recorded': recorded,
+            'already_recorded': duplicates,
+            'pending': pending
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in import_payment_history: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/analytics/executor/status')
+def get_analytics_executor_status():
+    """Analytics process pool size, core count and the timing of each computation's last run"""
+    try:
+        return jsonify({
+            'success': True,
+            'executor': analytics_executor.status()
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error in get_analytics_executor_status: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# ============================================================================
+# ALERTING AND MONITORING SYSTEM HELPER FUNCTIONS (Task 10.3)
+# ============================================================================
+
+# Alert rules: a metric expression over the counters in analytics/alerts.py plus
+# thresholds. An alert opens past `threshold` and resolves past `clear_threshold`.
+# ALERT_RULES_FILE may point at a JSON list of rules to use instead.
+DEFAULT_ALERT_RULES = [
+    {
+        'name': 'high_churn',
+        'expression': 'monthly_cancellations / subscriptions_active_at_month_start * 100',
+        'comparison': '>',
+        'threshold': 15,
+        'clear_threshold': 12,
+        'severity': 'critical',
+        'category': 'churn',
+        'title': 'High Churn Rate Alert',
+        'message': 'Monthly churn rate is {value}% (threshold: {threshold}%)',
+        'action': 'Review user feedback and improve retention strategies'
+    },
+    {
+        'name': 'payment_failures',
+        'expression': 'payment_failures / payment_attempts * 100',
+        'comparison': '>',
+        'threshold': 10,
+        'clear_threshold': 8,
+        'requires': ['payment_attempts'],
+        'severity': 'warning',
+        'category': 'payment',
+        'title': 'High Payment Failure Rate',
+        'message': 'Payment failure rate this month is {value}% (threshold: {threshold}%)',
+        'action': 'Check payment processor status and user payment methods'
+    },
+    {
+        'name': 'low_trial_conversion',
+        'expression': 'subscriptions_active / trials_total * 100',
+        'comparison': '<',
+        'threshold': 20,
+        'clear_threshold': 22,
+        'requires': ['trials_total', 'subscriptions_total'],
+        'decimals': 1,
+        'severity': 'warning',
+        'category': 'conversion',
+        'title': 'Low Trial Conversion Rate',
+        'message': 'Trial to subscription conversion is {value:.1f}% (threshold: {threshold}%)',
+        'action': 'Review trial experience and onboarding process'
+    },
+    {
+        'name': 'unverified_users',
+        'expression': 'users_unverified / users_total * 100',
+        'comparison': '>',
+        'threshold': 30,
+        'clear_threshold': 27,
+        'requires': ['users_total'],
+        'decimals': 1,
+        'severity': 'info',
+        'category': 'verification',
+        'title': 'High Unverified User Rate',
+        'message': 'Unverified user rate is {value:.1f}% (threshold: {threshold}%)',
+        'action': 'Improve email verification flow and reminders'
+    }
+]
+
+def load_alert_rules():
+    """Alert rules from ALERT_RULES_FILE, or the defaults above"""
+    rules_file = os.getenv('ALERT_RULES_FILE')
+    specs = DEFAULT_ALERT_RULES
+    if rules_file:
+        with open(rules_file) as f:
+            specs = json.load(f)
+    return [AlertRule.from_dict(spec) for spec in specs]
+
+alert_engine = AlertEngine(load_alert_rules())
+# The payment failure rule reads the ledger rollups, which are not a snapshot source
+ALERT_COLLECTIONS = {**SOURCES, 'payment_rollups': ROLLUPS_COLLECTION}
+
+def generate_business_alerts(snapshot):
+    """Generate critical business alerts"""
+    try:
+        if snapshot is not None and not alert_engine.live:
+            # No listeners: bring the counters up to date from a fresh read (only differences count)
+            for source in alert_engine.state.sources:
+                if source == 'payment_rollups':
+                    records = payment_ledger.rollup_records()
+                else:
+                    records = ((doc.id, doc.to_dict() or {}) for doc in getattr(snapshot, source))
+                alert_engine.sync(source, records)
+        
+        alerts = alert_engine.evaluate()
+        
+        return {
             'total_alerts': len(alerts),
             'critical_alerts': len([a for a in alerts if a['type'] == 'critical']),
             'warning_alerts': len([a for a in alerts if a['type'] == 'warning']),
@@ -1452,7 +2349,7 @@ def generate_business_alerts():
             'last_updated': datetime.now().isoformat()
         }
 
-def calculate_performance_metrics():
+def calculate_performance_metrics(snapshot):
     """Calculate performance monitoring metrics"""
     try:
         # Simulated performance metrics (in a real app, these would come from monitoring tools)
@@ -1485,7 +2382,7 @@ def calculate_performance_metrics():
         }
         
         # User activity metrics
-        user_activity = calculate_user_activity_metrics()
+        user_activity = calculate_user_activity_metrics(snapshot.users)
         
         return {
             'response_times': response_times,
@@ -1507,73 +2404,50 @@ def calculate_performance_metrics():
             'status': 'unknown'
         }
 
-def generate_automated_reports():
-    """Generate automated reports and trend analysis"""
-    try:
-        # Get data for reports
-        users_ref = db.collection('users')
-        all_users = list(users_ref.stream())
-        
-        subscription_ref = db.collection('subscriptions')
-        all_subscriptions = list(subscription_ref.stream())
-        
-        trial_ref = db.collection('trial_history')
-        all_trials = list(trial_ref.stream())
-        
-        # Daily Summary Report
-        daily_report = generate_daily_summary_report(all_users, all_subscriptions, all_trials)
-        
-        # Weekly Trend Report
-        weekly_report = generate_weekly_trend_report(all_users, all_subscriptions)
-        
-        # Monthly Business Report
-        monthly_report = generate_monthly_business_report(all_subscriptions)
-        
-        return {
-            'daily_summary': daily_report,
-            'weekly_trends': weekly_report,
-            'monthly_business': monthly_report,
-            'generated_at': datetime.now().isoformat()
-        }
-        
-    except Exception as e:
-        app.logger.error(f"Error generating automated reports: {e}")
-        return {
-            'daily_summary': {},
-            'weekly_trends': {},
-            'monthly_business': {},
-            'generated_at': datetime.now().isoformat()
-        }
+def user_export_row(user_doc):
+    """One users export row"""
+    user_data = user_doc.to_dict() or {}
+    return {
+        'user_id': user_doc.id,
+        'email': user_data.get('email', ''),
+        'username': user_data.get('username', ''),
+        'email_verified': user_data.get('emailVerified', False),
+        'created_at': format_timestamp(user_data.get('createdAt')),
+        'last_login': format_timestamp(user_data.get('lastLoginAt')),
+        'email_verified_at': format_timestamp(user_data.get('emailVerifiedAt'))
+    }
+
+def subscription_export_row(sub_doc):
+    """One subscriptions export row"""
+    sub_data = sub_doc.to_dict() or {}
+    return {
+        'subscription_id': sub_doc.id,
+        'email': sub_data.get('email', ''),
+        'is_active': sub_data.get('status') == 'active',
+        'cancelled': sub_data.get('cancelled', False),
+        'subscription_start': format_timestamp(sub_data.get('startDate')),
+        'subscription_end': format_timestamp(sub_data.get('subscriptionEndDate')),
+        'will_expire_at': format_timestamp(sub_data.get('willExpireAt')),
+        'monthly_fee': plan_price(sub_data.get('plan'))
+    }
+
+def stream_collection_export(collection_name, export_fields, build_row, filename, format_type):
+    """Stream a whole collection as an export, straight from the scan to the response"""
+    endpoint = request.path
+    
+    def reads_done(timing):
+        record_endpoint_reads(endpoint, {collection_name: timing})
+        app.logger.info(f"Exported {timing.documents} {collection_name} documents "
+                        f"({timing.bytes} B read, {timing.docs_per_second:.0f} docs/s)")
+    
+    scan = PartitionedScan(db.collection(collection_name), fields=export_fields)
+    rows = (build_row(doc) for doc in metered_stream(scan, collection_name, reads_done))
+    return generate_export_response(rows, filename, format_type)
 
 def export_users_data(format_type):
     """Export users data for analysis"""
     try:
-        users_ref = db.collection('users')
-        all_users = list(users_ref.stream())
-        
-        # Prepare user data for export
-        export_data = []
-        for user_doc in all_users:
-            user_data = user_doc.to_dict()
-            export_data.append({
-                'user_id': user_doc.id,
-                'email': user_data.get('email', ''),
-                'username': user_data.get('username', ''),
-                'email_verified': user_data.get('emailVerified', False),
-                'created_at': format_timestamp(user_data.get('createdAt')),
-                'last_login': format_timestamp(user_data.get('lastLoginAt')),
-                'email_verified_at': format_timestamp(user_data.get('emailVerifiedAt'))
-            })
-        
-        if format_type == 'csv':
-            return generate_csv_response(export_data, 'users_export')
-        else:
-            return jsonify({
-                'success': True,
-                'data': export_data,
-                'count': len(export_data),
-                'exported_at': datetime.now().isoformat()
-            })
+        return stream_collection_export('users', fields.USERS_EXPORT, user_export_row, 'users_export', format_type)
             
     except Exception as e:
         app.logger.error(f"Error exporting users data: {e}")
@@ -1585,33 +2459,8 @@ def export_users_data(format_type):
 def export_subscriptions_data(format_type):
     """Export subscriptions data for analysis"""
     try:
-        subscription_ref = db.collection('subscriptions')
-        all_subscriptions = list(subscription_ref.stream())
-        
-        # Prepare subscription data for export
-        export_data = []
-        for sub_doc in all_subscriptions:
-            sub_data = sub_doc.to_dict()
-            export_data.append({
-                'subscription_id': sub_doc.id,
-                'email': sub_data.get('email', ''),
-                'is_active': sub_data.get('status') == 'active',
-                'cancelled': sub_data.get('cancelled', False),
-                'subscription_start': format_timestamp(sub_data.get('startDate')),
-                'subscription_end': format_timestamp(sub_data.get('subscriptionEndDate')),
-                'will_expire_at': format_timestamp(sub_data.get('willExpireAt')),
-                'monthly_fee': 3.0
-            })
-        
-        if format_type == 'csv':
-            return generate_csv_response(export_data, 'subscriptions_export')
-        else:
-            return jsonify({
-                'success': True,
-                'data': export_data,
-                'count': len(export_data),
-                'exported_at': datetime.now().isoformat()
-            })
+        return stream_collection_export('subscriptions', fields.SUBSCRIPTIONS_EXPORT, subscription_export_row,
+                                        'subscriptions_export', format_type)
             
     except Exception as e:
         app.logger.error(f"Error exporting subscriptions data: {e}")
@@ -1623,20 +2472,37 @@ def export_subscriptions_data(format_type):
 def export_analytics_data(format_type):
     """Export analytics summary data"""
     try:
-        # Get analytics data
-        users_ref = db.collection('users')
-        all_users = list(users_ref.stream())
-        
-        subscription_ref = db.collection('subscriptions')
-        all_subscriptions = list(subscription_ref.stream())
+        # One constant-memory pass over each collection feeds every metric
+        now = datetime.now()
+        user_metrics = StreamingAggregation(
+            total=streaming.Count(),
+            verified=streaming.Count(lambda data: data.get('emailVerified'))
+        )
+        subscription_metrics = StreamingAggregation(
+            # The same predicate as the MRR and the stats panel
+            active=streaming.Count(lambda data: data.get('status') == 'active'),
+            mrr=streaming.MonthlyRecurringRevenue(),
+            revenue_trends=streaming.RevenueTrends(now),
+            churn=streaming.ChurnMetrics(now)
+        )
+        timings = {
+            'users': user_metrics.run(
+                PartitionedScan(db.collection('users'), fields=fields.ANALYTICS_EXPORT['users']), 'users'),
+            'subscriptions': subscription_metrics.run(
+                PartitionedScan(db.collection('subscriptions'), fields=fields.ANALYTICS_EXPORT['subscriptions']),
+                'subscriptions')
+        }
+        record_endpoint_reads(request.path, timings)
         
         # Calculate key metrics
-        total_users = len(all_users)
-        verified_users = len([u for u in all_users if u.to_dict().get('emailVerified')])
-        active_subscriptions = len([s for s in all_subscriptions if s.to_dict().get('isActive')])
+        users = user_metrics.results()
+        subscriptions = subscription_metrics.results()
+        total_users = users['total']
+        verified_users = users['verified']
+        active_subscriptions = subscriptions['active']
         
-        revenue_trends = calculate_revenue_trends(all_subscriptions)
-        churn_metrics = calculate_churn_metrics()
+        revenue_trends = subscriptions['revenue_trends']
+        churn_metrics = subscriptions['churn']
         
         export_data = {
             'summary': {
@@ -1644,16 +2510,15 @@ def export_analytics_data(format_type):
                 'verified_users': verified_users,
                 'active_subscriptions': active_subscriptions,
                 'monthly_churn_rate': churn_metrics['monthly_churn_rate'],
-                'mrr': active_subscriptions * 3.0
+                'mrr': subscriptions['mrr']
             },
             'revenue_trends': revenue_trends,
             'exported_at': datetime.now().isoformat()
         }
         
-        if format_type == 'csv':
-            # For CSV, flatten the summary data
-            csv_data = [export_data['summary']]
-            return generate_csv_response(csv_data, 'analytics_export')
+        if format_type in ('csv', 'ndjson'):
+            # For CSV and NDJSON, flatten the summary data
+            return generate_export_response(iter([export_data['summary']]), 'analytics_export', format_type)
         else:
             return jsonify({
                 'success': True,
@@ -1680,12 +2545,9 @@ def calculate_simulated_errors():
     import random
     return random.randint(15, 45)
 
-def calculate_user_activity_metrics():
+def calculate_user_activity_metrics(all_users):
     """Calculate user activity metrics"""
     try:
-        users_ref = db.collection('users')
-        all_users = list(users_ref.stream())
-        
         now = datetime.now()
         active_today = 0
         active_week = 0
@@ -1740,6 +2602,7 @@ def generate_daily_summary_report(users, subscriptions, trials):
     # Count today's activities
     new_users_today = 0
     new_subscriptions_today = 0
+    daily_revenue = 0
     
     for user_doc in users:
         user_data = user_doc.to_dict()
@@ -1764,62 +2627,24 @@ def generate_daily_summary_report(users, subscriptions, trials):
             
             if start_date_obj == today:
                 new_subscriptions_today += 1
+                daily_revenue += plan_price(sub_data.get('plan'))
     
     return {
         'date': today.isoformat(),
         'new_users': new_users_today,
         'new_subscriptions': new_subscriptions_today,
         'total_users': len(users),
-        'active_subscriptions': len([s for s in subscriptions if s.to_dict().get('isActive')]),
-        'daily_revenue': new_subscriptions_today * 3.0
+        'active_subscriptions': sum(1 for s in subscriptions if s.to_dict().get('isActive')),
+        'daily_revenue': round(daily_revenue, 2)
     }
 
 def generate_weekly_trend_report(users, subscriptions):
     """Generate weekly trend report"""
-    weekly_data = []
-    now = datetime.now()
-    
-    for i in range(7):
-        day = now - timedelta(days=i)
-        day_date = day.date()
-        
-        daily_users = 0
-        daily_subscriptions = 0
-        
-        # Count users for this day
-        for user_doc in users:
-            user_data = user_doc.to_dict()
-            created_at = user_data.get('createdAt')
-            if created_at:
-                if hasattr(created_at, 'seconds'):
-                    created_date = datetime.fromtimestamp(created_at.seconds).date()
-                else:
-                    created_date = datetime.fromisoformat(str(created_at).replace('Z', '+00:00')).date()
-                
-                if created_date == day_date:
-                    daily_users += 1
-        
-        # Count subscriptions for this day
-        for sub_doc in subscriptions:
-            sub_data = sub_doc.to_dict()
-            start_date = sub_data.get('startDate')
-            if start_date:
-                if hasattr(start_date, 'seconds'):
-                    start_date_obj = datetime.fromtimestamp(start_date.seconds).date()
-                else:
-                    start_date_obj = datetime.fromisoformat(str(start_date).replace('Z', '+00:00')).date()
-                
-                if start_date_obj == day_date:
-                    daily_subscriptions += 1
-        
-        weekly_data.append({
-            'date': day_date.isoformat(),
-            'new_users': daily_users,
-            'new_subscriptions': daily_subscriptions,
-            'revenue': daily_subscriptions * 3.0
-        })
-    
-    return list(reversed(weekly_data))
+    return columnar.weekly_trend_report(
+        UserColumns.from_snapshots(users),
+        SubscriptionColumns.from_snapshots(subscriptions),
+        datetime.now()
+    )
 
 def generate_monthly_business_report(subscriptions):
     """Generate monthly business report"""
@@ -1843,7 +2668,7 @@ def generate_monthly_business_report(subscriptions):
             
             if start_dt >= current_month_start:
                 monthly_new_subscriptions += 1
-                monthly_revenue += 3.0
+                monthly_revenue += plan_price(sub_data.get('plan'))
         
         # Check for cancellations this month
         if sub_data.get('cancelled'):
@@ -1862,42 +2687,410 @@ def generate_monthly_business_report(subscriptions):
         'new_subscriptions': monthly_new_subscriptions,
         'cancellations': monthly_cancellations,
         'net_growth': monthly_new_subscriptions - monthly_cancellations,
-        'revenue': monthly_revenue,
-        'active_subscriptions': len([s for s in subscriptions if s.to_dict().get('isActive')])
+        'revenue': round(monthly_revenue, 2),
+        'active_subscriptions': sum(1 for s in subscriptions if s.to_dict().get('isActive'))
     }
 
-def generate_csv_response(data, filename):
-    """Generate CSV response for data export"""
+# ============================================================================
+# SCHEDULED REPORTS
+# ============================================================================
+
+def build_daily_summary_report():
+    """Daily summary report from a fresh snapshot"""
+    snapshot = manifest_snapshot(fields.DAILY_SUMMARY, 'daily_summary report')
+    return generate_daily_summary_report(snapshot.users, snapshot.subscriptions, snapshot.trials)
+
+def build_weekly_trends_report():
+    """Weekly trend report from the daily KPI series, or a fresh snapshot while it has gaps"""
+    weekly_trends = kpi_trends(kpi.weekly_trends, datetime.now())
+    if weekly_trends is not None:
+        return weekly_trends
+    
+    snapshot = manifest_snapshot(fields.WEEKLY_TRENDS, 'weekly_trends report')
+    return generate_weekly_trend_report(snapshot.users, snapshot.subscriptions)
+
+def build_monthly_business_report():
+    """Monthly business report from a fresh snapshot"""
+    snapshot = manifest_snapshot(fields.MONTHLY_BUSINESS, 'monthly_business report')
+    return generate_monthly_business_report(snapshot.subscriptions)
+
+def build_kpi_snapshot():
+    """Today's KPI row, appended to the daily KPI series along with yesterday's final row"""
+    snapshot = manifest_snapshot(fields.KPI_SNAPSHOT, 'kpi_snapshot report')
+    return record_daily_kpis(kpi_series, snapshot)
+
+def kpi_trends(build, *args):
+    """Trend buckets derived from the daily KPI series; None (compute from documents) on gaps or ?trends=documents"""
+    if has_request_context() and request.args.get('trends') == 'documents':
+        return None
     try:
-        import csv
-        import io
-        from flask import make_response
-        
-        if not data:
+        return build(kpi_series, *args)
+    except Exception as e:
+        app.logger.error(f"Error reading the KPI series: {e}")
+        return None
+
+# One row of headline KPIs per day, shared by all workers (analytics/kpi.py)
+kpi_series = KpiSeries()
+
+# Report name -> (default cron schedule, builder); REPORT_SCHEDULE_<NAME> overrides the schedule
+SCHEDULED_REPORTS = {
+    'daily_summary': ('*/15 * * * *', build_daily_summary_report),
+    'weekly_trends': ('0 * * * *', build_weekly_trends_report),
+    'monthly_business': ('0 */6 * * *', build_monthly_business_report),
+    'kpi_snapshot': ('55 * * * *', build_kpi_snapshot)
+}
+
+report_store = ReportStore()
+report_scheduler = ReportScheduler(report_store)
+for report_name, (default_schedule, report_builder) in SCHEDULED_REPORTS.items():
+    report_scheduler.register(report_name, os.getenv(f'REPORT_SCHEDULE_{report_name.upper()}', default_schedule),
+                              report_builder)
+
+def start_report_scheduler():
+    """Build the reports on schedule in the first process to ask; the others read its snapshots"""
+    if report_scheduler.running or os.getenv('REPORT_SCHEDULER_ENABLED', 'true').lower() not in ('1', 'true', 'yes'):
+        return
+    # The store's scheduler lock keeps every other worker from starting a second schedule
+    if report_scheduler.start():
+        app.logger.info(f"Report scheduler started for {', '.join(report_scheduler.reports)}")
+
+def reports_version():
+    """The reports panel's data version for conditional GETs: each report's latest version and next run"""
+    if request.args.get('refresh', 'false').lower() not in ('', '0', 'false', 'no'):
+        return None
+    latest = [report_store.latest(name) for name in PANEL_REPORTS]
+    if None in latest:
+        return None
+    return tuple((snapshot['version'], report_scheduler.next_run(name))
+                 for name, snapshot in zip(PANEL_REPORTS, latest))
+
+response_cache.versions['/api/monitoring/reports'] = reports_version
+
+def generate_export_response(rows, filename, format_type):
+    """Stream export rows as CSV, NDJSON or JSON (?gzip=true compresses on the fly)"""
+    try:
+        format_type = format_type if format_type in EXPORT_FORMATS else 'json'
+        compress = request.args.get('gzip', 'false').lower() in ('1', 'true', 'yes')
+        
+        # Pull the first row up front so an empty export can still get a proper error
+        rows = iter(rows)
+        first_row = next(rows, None)
+        if first_row is None:
+            if format_type == 'json':
+                return jsonify({
+                    'success': True,
+                    'data': [],
+                    'count': 0,
+                    'exported_at': datetime.now().isoformat()
+                })
             return jsonify({'success': False, 'error': 'No data to export'}), 400
         
-        output = io.StringIO()
-        
-        # Get field names from first record
-        fieldnames = data[0].keys()
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
-        
-        writer.writeheader()
-        for row in data:
-            writer.writerow(row)
-        
-        output.seek(0)
-        
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'text/csv'
-        response.headers['Content-Disposition'] = f'attachment; filename={filename}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        
-        return response
+        return export_response(first_row, rows, filename, format_type, compress)
         
     except Exception as e:
-        app.logger.error(f"Error generating CSV response: {e}")
+        app.logger.error(f"Error generating export response: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# ============================================================================
+# BACKGROUND EXPORT JOBS
+# ============================================================================
+
+# Job state and artifacts are files under EXPORT_ARTIFACT_DIR, shared by all workers
+export_jobs = ExportJobManager(db, {
+    'users': ExportSource('users', fields.USERS_EXPORT, user_export_row),
+    'subscriptions': ExportSource('subscriptions', fields.SUBSCRIPTIONS_EXPORT, subscription_export_row),
+})
+export_jobs.recover()
+
+# ============================================================================
+# ANALYTICS WAREHOUSE
+# ============================================================================
+
+# SQLite mirror of the analytics collections behind ?backend=warehouse
+warehouse = Warehouse()
+if os.getenv('WAREHOUSE_SYNC_ENABLED', 'false').lower() in ('1', 'true', 'yes'):
+    warehouse.start(db)
+
+# ============================================================================
+# USER ACTIVITY BITMAPS
+# ============================================================================
+
+# Per-day active-user bitmaps fed by /chat and /api/analytics/activity/events (analytics/activity.py)
+activity_bitmaps = ActivityStore()
+
+# ============================================================================
+# DISTINCT-USER SKETCHES
+# ============================================================================
+
+# Daily HyperLogLog sketches of distinct chat / token users, overall and per dimension
+usage_sketches = SketchStore()
+SKETCH_METRICS = ('chat_users', 'token_users')
+SKETCH_DIMENSIONS = ('userType', 'country')
+
+# user id -> (resolved at, dimensions) of users resolved from reads; bounded, entries
+# refreshed after USAGE_DIMENSION_TTL seconds
+usage_dimension_cache = OrderedDict()
+usage_dimension_cache_lock = threading.Lock()
+USAGE_DIMENSION_TTL = int(os.getenv('USAGE_DIMENSION_TTL', '3600'))
+USAGE_DIMENSION_CACHE_SIZE = int(os.getenv('USAGE_DIMENSION_CACHE_SIZE', '10000'))
+# Dimensions that need reads are resolved here, off the /chat request path
+usage_dimension_lookups = ThreadPoolExecutor(max_workers=2, thread_name_prefix='usage-dimensions')
+
+def live_usage_dimensions(user_id):
+    """userType and country from the listener-kept geographic rollup; None when it cannot tell"""
+    resolved = geo_rollup.user(user_id) if geo_rollup.live else None
+    if resolved is None:
+        return None
+    code, subscribed = resolved
+    return {'userType': 'subscribed' if subscribed else 'trial', 'country': country_name(code)}
+
+def usage_dimensions(user_id):
+    """userType and country of a user for the sketches (two reads per user per TTL, cached)"""
+    with usage_dimension_cache_lock:
+        cached = usage_dimension_cache.get(user_id)
+    if cached is not None and time.time() - cached[0] < USAGE_DIMENSION_TTL:
+        return cached[1]
+    try:
+        user_doc = db.collection('users').document(user_id).get()
+        subscription_doc = db.collection('subscriptions').document(user_id).get()
+        user_data = (user_doc.to_dict() or {}) if user_doc.exists else {}
+        subscription = (subscription_doc.to_dict() or {}) if subscription_doc.exists else {}
+        dimensions = {
+            # Same vocabulary as token_usage_history.userType
+            'userType': 'subscribed' if subscription.get('isActive') else 'trial',
+            'country': extract_country_from_user_data(user_data)
+        }
+    except Exception as e:
+        app.logger.error(f"Error resolving usage dimensions for {user_id}: {e}")
+        return {}
+    with usage_dimension_cache_lock:
+        usage_dimension_cache[user_id] = (time.time(), dimensions)
+        usage_dimension_cache.move_to_end(user_id)
+        while len(usage_dimension_cache) > USAGE_DIMENSION_CACHE_SIZE:
+            usage_dimension_cache.popitem(last=False)
+    return dimensions
+
+def count_distinct_user(metric, user_id):
+    """Count a user in the ``metric`` sketches; never reads Firestore on the caller's thread"""
+    dimensions = live_usage_dimensions(user_id)
+    if dimensions is not None:
+        usage_sketches.add(metric, user_id, dimensions)
+        return
+    when = datetime.now()
+    usage_dimension_lookups.submit(lambda: usage_sketches.add(metric, user_id, usage_dimensions(user_id), when=when))
+
+# ============================================================================
+# SUBSCRIPTION STATE INDEX
+# ============================================================================
+
+# Lifecycle intervals of every subscription and trial (analytics/lifecycle.py): one index
+# per process, kept current by snapshot listeners when they are available and otherwise
+# synced - differences only - from reads at most every STATE_INDEX_SYNC_SECONDS
+subscription_state_index = SubscriptionStateIndex()
+state_index_synced = {}
+state_index_sync_lock = threading.Lock()
+STATE_INDEX_SYNC_SECONDS = int(os.getenv('STATE_INDEX_SYNC_SECONDS', '300'))
+
+def current_subscription_states(snapshot=None):
+    """
+    The process-wide subscription state index. Sources listeners do not keep current
+    are synced from ``snapshot`` when the caller already read it, else re-read once stale
+    """
+    start_collection_watches()
+    with state_index_sync_lock:
+        stale = [source for source in SubscriptionStateIndex.SOURCES
+                 if source not in subscription_state_index.live_sources
+                 and time.time() - state_index_synced.get(source, 0) >= STATE_INDEX_SYNC_SECONDS]
+        if snapshot is not None and 'subscriptions' in stale:
+            # Loaded for the panel anyway; trials are left to the state-at reads
+            subscription_state_index.sync('subscriptions', ((doc.id, doc.to_dict() or {}) for doc in snapshot.subscriptions))
+            state_index_synced['subscriptions'] = time.time()
+        elif snapshot is None and stale:
+            manifest = {source: fields.SUBSCRIPTION_STATES[source] for source in stale}
+            fresh = manifest_snapshot(manifest, 'subscription state index')
+            for source in stale:
+                subscription_state_index.sync(source, ((doc.id, doc.to_dict() or {}) for doc in getattr(fresh, source)))
+                state_index_synced[source] = time.time()
+    return subscription_state_index
+
+# ============================================================================
+# GEOGRAPHIC ROLLUPS
+# ============================================================================
+
+# Users, verified users and subscribers per country code (analytics/geo.py), kept
+# current by snapshot listeners when they are available
+geo_rollup = GeoRollup()
+COUNTRY_CODE_BATCH_SIZE = 500
+
+def store_country_codes(users):
+    """Store the classified countryCode on user documents that lack it or disagree; returns the number written"""
+    batch = db.batch()
+    pending = written = 0
+    for user_id, user_data in users:
+        if user_data is None:
+            continue
+        code = classify_country(user_data)
+        if user_data.get('countryCode') == code:
+            continue
+        batch.update(db.collection('users').document(user_id), {'countryCode': code})
+        pending += 1
+        if pending == COUNTRY_CODE_BATCH_SIZE:
+            batch.commit()
+            written += pending
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+        written += pending
+    return written
+
+def geographic_version():
+    """The geographic panel's data version for conditional GETs; known only while listeners keep the rollup"""
+    return geo_rollup.version if geo_rollup.live else None
+
+response_cache.versions['/api/analytics/geographic'] = geographic_version
+
+# ============================================================================
+# SHARED COLLECTION WATCHES
+# ============================================================================
+
+# One snapshot listener per collection and process, fanned out to every incremental
+# consumer: each listener bills a read of its whole collection when it starts. Keyed by
+# collection name, except 'current_token_usage' (this month's token_usage_history)
+collection_watches = {}
+collection_watches_lock = threading.Lock()
+collection_watches_started = threading.Event()
+
+def listeners_enabled(setting):
+    return os.getenv(setting, 'true').lower() in ('1', 'true', 'yes')
+
+def live_feed(consumer, source, on_apply=None):
+    """Watch callback syncing ``consumer`` from the first batch (the whole collection) and applying later ones"""
+    def on_changes(changes):
+        if source not in consumer.live_sources:
+            consumer.sync(source, changes)
+            consumer.live_sources.add(source)
+            return
+        consumer.apply(source, changes)
+        if on_apply is not None:
+            on_apply(changes)
+    return on_changes
+
+def store_new_country_codes(changes):
+    try:
+        store_country_codes(changes)
+    except Exception as e:
+        app.logger.error(f"Error storing country codes: {e}")
+
+def watch_query(name):
+    """
+    ``(query, label)`` of a shared watch: a whole collection, or for 'current_token_usage'
+    token_usage_history for the current UTC month
+    """
+    if name != 'current_token_usage':
+        return db.collection(name), name
+    utc_now = datetime.utcnow()
+    query = db.collection(SOURCES[name]).where('month', '==', utc_now.month).where('year', '==', utc_now.year)
+    return query, f"{SOURCES[name]} {utc_now.year}-{utc_now.month:02d}"
+
+def watch_name(source):
+    """collection_watches key of a snapshot source"""
+    return source if source == 'current_token_usage' else SOURCES[source]
+
+def watch_feeds():
+    """(watch name, callback) of every enabled listener consumer"""
+    feeds = []
+    if listeners_enabled('ALERT_LISTENERS'):
+        feeds += [(ALERT_COLLECTIONS[source], live_feed(alert_engine, source)) for source in alert_engine.state.sources]
+    if listeners_enabled('STATE_INDEX_LISTENERS'):
+        feeds += [(SOURCES[source], live_feed(subscription_state_index, source))
+                  for source in SubscriptionStateIndex.SOURCES]
+    if listeners_enabled('GEO_LISTENERS'):
+        # The first batch is classified by the backfill; later user writes are classified as they arrive
+        feeds += [(SOURCES[source], live_feed(geo_rollup, source, store_new_country_codes if source == 'users' else None))
+                  for source in GeoRollup.SOURCES]
+    if listeners_enabled('JOURNEY_LISTENERS'):
+        feeds += [(watch_name(source), live_feed(journey_rows, source)) for source in JourneyRows.SOURCES]
+    return feeds
+
+def start_collection_watches():
+    """
+    Start the shared listeners once per process, every consumer subscribed before the
+    first batch arrives; consumers fall back to reads when they cannot be started
+    """
+    with collection_watches_lock:
+        if collection_watches_started.is_set():
+            return
+        collection_watches_started.set()
+        
+        try:
+            for name, callback in watch_feeds():
+                if name not in collection_watches:
+                    collection_watches[name] = CollectionWatch(*watch_query(name))
+                collection_watches[name].subscribe(callback)
+            for watch in collection_watches.values():
+                watch.start()
+            if collection_watches:
+                app.logger.info(f"Collection listeners started on {', '.join(collection_watches)}")
+        except Exception as e:
+            app.logger.warning(f"Collection listeners unavailable, analytics will sync from reads instead: {e}")
+            for watch in collection_watches.values():
+                watch.stop()
+            collection_watches.clear()
+            # A batch that arrived before the failure must not leave a consumer waiting on a stopped listener
+            for consumer in (alert_engine, subscription_state_index, geo_rollup, journey_rows):
+                consumer.live_sources.clear()
+
+def follow_usage_month():
+    """Move the current-month token usage watch to the new month once the month rolls over"""
+    with collection_watches_lock:
+        watch = collection_watches.get('current_token_usage')
+        query, label = watch_query('current_token_usage')
+        if watch is None or watch.name == label:
+            return
+        watch.stop()
+        del collection_watches['current_token_usage']
+        # The new month's first batch replaces the usage documents
+        journey_rows.live_sources.discard('current_token_usage')
+        try:
+            moved = CollectionWatch(query, label)
+            moved.subscribe(live_feed(journey_rows, 'current_token_usage'))
+            collection_watches['current_token_usage'] = moved.start()
+            app.logger.info(f"Token usage listener moved to {label}")
+        except Exception as e:
+            app.logger.warning(f"Token usage listener unavailable, user changes will sync from reads instead: {e}")
+
+# ============================================================================
+# PAYMENT LEDGER
+# ============================================================================
+
+# Append-only payment events with monthly and per-method rollups (analytics/payments.py)
+payment_ledger = PaymentLedger(db, firestore.Increment, firestore.transactional, (AlreadyExists,))
+
+def import_billing_history(since=None):
+    """Record settled billing_history attempts in the payment ledger; returns (recorded, already recorded, pending)"""
+    # Oldest first, so a success after a failed attempt is counted as a recovery
+    query = db.collection('billing_history').order_by('billingDate')
+    if since is not None:
+        query = query.where('billingDate', '>=', since)
+    recorded = duplicates = pending = 0
+    for billing_doc in query.stream():
+        event_id, event = billing_history_event(billing_doc.id, billing_doc.to_dict() or {})
+        if event['status'] == 'pending':
+            # Left for a later import, once the attempt has settled
+            pending += 1
+        elif payment_ledger.record(event_id, event):
+            recorded += 1
+        else:
+            duplicates += 1
+    return recorded, duplicates, pending
+
+# ============================================================================
+# ANALYTICS EXECUTOR
+# ============================================================================
+
+# Process pool for the CPU-bound panel loops (analytics/executor.py); small inputs stay in-process
+analytics_executor = AnalyticsExecutor()
+
 # ============================================================================
 # ADVANCED ANALYTICS HELPER FUNCTIONS (Task 10.2)
 # ============================================================================
@@ -1905,99 +3098,10 @@ def generate_csv_response(data, filename):
 def calculate_cohort_analysis(users):
     """Calculate cohort analysis for user retention tracking"""
     try:
-        cohorts = {}
-        now = datetime.now()
-        
-        # Group users by registration month (cohort)
-        for user_doc in users:
-            user_data = user_doc.to_dict()
-            created_at = user_data.get('createdAt')
-            
-            if not created_at:
-                continue
-                
-            # Parse registration date
-            if hasattr(created_at, 'seconds'):
-                reg_date = datetime.fromtimestamp(created_at.seconds)
-            else:
-                reg_date = datetime.fromisoformat(str(created_at).replace('Z', '+00:00')).replace(tzinfo=None)
-            
-            cohort_month = reg_date.strftime('%Y-%m')
-            
-            if cohort_month not in cohorts:
-                cohorts[cohort_month] = {
-                    'total_users': 0,
-                    'users': [],
-                    'retention_periods': {}
-                }
-            
-            cohorts[cohort_month]['total_users'] += 1
-            cohorts[cohort_month]['users'].append({
-                'user_id': user_doc.id,
-                'registration_date': reg_date,
-                'last_login': user_data.get('lastLoginAt'),
-                'email_verified': user_data.get('emailVerified', False)
-            })
-        
-        # Calculate retention rates for each cohort
-        cohort_analysis = []
-        for cohort_month, cohort_data in cohorts.items():
-            if cohort_data['total_users'] == 0:
-                continue
-                
-            cohort_date = datetime.strptime(cohort_month, '%Y-%m')
-            
-            # Calculate retention for different periods (1, 7, 30, 90 days)
-            retention_1_day = 0
-            retention_7_day = 0
-            retention_30_day = 0
-            retention_90_day = 0
-            
-            for user in cohort_data['users']:
-                last_login = user.get('last_login')
-                if not last_login:
-                    continue
-                    
-                # Parse last login date
-                if hasattr(last_login, 'seconds'):
-                    login_date = datetime.fromtimestamp(last_login.seconds)
-                else:
-                    login_date = datetime.fromisoformat(str(last_login).replace('Z', '+00:00')).replace(tzinfo=None)
-                
-                reg_date = user['registration_date']
-                days_since_reg = (login_date - reg_date).days
-                
-                if days_since_reg >= 1:
-                    retention_1_day += 1
-                if days_since_reg >= 7:
-                    retention_7_day += 1
-                if days_since_reg >= 30:
-                    retention_30_day += 1
-                if days_since_reg >= 90:
-                    retention_90_day += 1
-            
-            total_users = cohort_data['total_users']
-            cohort_analysis.append({
-                'cohort_month': cohort_month,
-                'total_users': total_users,
-                'retention_1_day': round((retention_1_day / total_users) * 100, 2),
-                'retention_7_day': round((retention_7_day / total_users) * 100, 2),
-                'retention_30_day': round((retention_30_day / total_users) * 100, 2),
-                'retention_90_day': round((retention_90_day / total_users) * 100, 2),
-                'months_since_launch': (now.year - cohort_date.year) * 12 + (now.month - cohort_date.month)
-            })
-        
-        # Sort by cohort month
-        cohort_analysis.sort(key=lambda x: x['cohort_month'])
-        
-        return {
-            'cohorts': cohort_analysis,
-            'total_cohorts': len(cohort_analysis),
-            'average_retention_1_day': round(sum(c['retention_1_day'] for c in cohort_analysis) / len(cohort_analysis), 2) if cohort_analysis else 0,
-            'average_retention_7_day': round(sum(c['retention_7_day'] for c in cohort_analysis) / len(cohort_analysis), 2) if cohort_analysis else 0,
-            'average_retention_30_day': round(sum(c['retention_30_day'] for c in cohort_analysis) / len(cohort_analysis), 2) if cohort_analysis else 0,
-            'average_retention_90_day': round(sum(c['retention_90_day'] for c in cohort_analysis) / len(cohort_analysis), 2) if cohort_analysis else 0
-        }
+        # Vectorised over the registration / last-login columns, built per partition on the analytics executor
+        records = [(user_doc.id, user_doc.to_dict() or {}) for user_doc in users]
+        counts = analytics_executor.run('cohort', cohort_partial, merge_cohort_counts, records)
+        return columnar.cohort_report(counts, datetime.now())
         
     except Exception as e:
         app.logger.error(f"Error calculating cohort analysis: {e}")
@@ -2010,58 +3114,19 @@ def calculate_cohort_analysis(users):
             'average_retention_90_day': 0
         }
 
-def calculate_geographic_distribution(users):
-    """Calculate geographic distribution analysis for OFW markets"""
-    try:
-        # Common OFW destination countries
-        ofw_countries = {
-            'Saudi Arabia': {'users': 0, 'verified': 0, 'subscribed': 0},
-            'United Arab Emirates': {'users': 0, 'verified': 0, 'subscribed': 0},
-            'Qatar': {'users': 0, 'verified': 0, 'subscribed': 0},
-            'Kuwait': {'users': 0, 'verified': 0, 'subscribed': 0},
-            'Hong Kong': {'users': 0, 'verified': 0, 'subscribed': 0},
-            'Singapore': {'users': 0, 'verified': 0, 'subscribed': 0},
-            'Taiwan': {'users': 0, 'verified': 0, 'subscribed': 0},
-            'Japan': {'users': 0, 'verified': 0, 'subscribed': 0},
-            'South Korea': {'users': 0, 'verified': 0, 'subscribed': 0},
-            'Malaysia': {'users': 0, 'verified': 0, 'subscribed': 0},
-            'Italy': {'users': 0, 'verified': 0, 'subscribed': 0},
-            'United Kingdom': {'users': 0, 'verified': 0, 'subscribed': 0},
-            'Canada': {'users': 0, 'verified': 0, 'subscribed': 0},
-            'United States': {'users': 0, 'verified': 0, 'subscribed': 0},
-            'Australia': {'users': 0, 'verified': 0, 'subscribed': 0},
-            'Other': {'users': 0, 'verified': 0, 'subscribed': 0}
-        }
+def calculate_geographic_distribution(rollup):
+    """Calculate geographic distribution analysis for OFW markets from the per-country rollup"""
+    try:
+        # Common OFW destination countries; every other country counts as Other
+        ofw_countries = {name: {'users': 0, 'verified': 0, 'subscribed': 0, 'mrr': 0.0}
+                         for name in (*OFW_COUNTRIES.values(), OTHER_COUNTRY)}
         
-        # Get subscription data for cross-referencing
-        subscription_ref = db.collection('subscriptions')
-        all_subscriptions = list(subscription_ref.stream())
-        subscribed_emails = set()
-        for sub_doc in all_subscriptions:
-            sub_data = sub_doc.to_dict()
-            if sub_data.get('isActive'):
-                subscribed_emails.add(sub_data.get('email', ''))
+        for code, counts in rollup.items():
+            market = ofw_countries[country_name(code)]
+            for key in market:
+                market[key] += counts[key]
         
-        # Analyze user geographic data
-        total_users = 0
-        for user_doc in users:
-            user_data = user_doc.to_dict()
-            email = user_data.get('email', '')
-            total_users += 1
-            
-            # Extract country from email domain or user profile
-            country = extract_country_from_user_data(user_data)
-            
-            if country not in ofw_countries:
-                country = 'Other'
-            
-            ofw_countries[country]['users'] += 1
-            
-            if user_data.get('emailVerified'):
-                ofw_countries[country]['verified'] += 1
-            
-            if email in subscribed_emails:
-                ofw_countries[country]['subscribed'] += 1
+        total_users = sum(market['users'] for market in ofw_countries.values())
         
         # Calculate percentages and conversion rates
         geographic_analysis = []
@@ -2079,7 +3144,7 @@ def calculate_geographic_distribution(users):
                     'market_share': round(market_share, 2),
                     'verification_rate': round(verification_rate, 2),
                     'subscription_rate': round(subscription_rate, 2),
-                    'revenue_potential': round(data['subscribed'] * 3.0, 2)  # $3/month per subscription
+                    'revenue_potential': round(data['mrr'], 2)
                 })
         
         # Sort by market share (descending)
@@ -2111,25 +3176,8 @@ def calculate_geographic_distribution(users):
         }
 
 def extract_country_from_user_data(user_data):
-    """Extract country information from user data"""
-    # This is a simplified implementation
-    # In a real app, you might have actual location data or IP geolocation
-    email = user_data.get('email', '').lower()
-    
-    # Common email domains by country for OFWs
-    domain_country_map = {
-        'gmail.com': 'Other',  # Generic
-        'yahoo.com': 'Other',  # Generic
-        'hotmail.com': 'Other',  # Generic
-        # Add more specific mappings as needed
-    }
-    
-    # Extract domain
-    if '@' in email:
-        domain = email.split('@')[1]
-        return domain_country_map.get(domain, 'Other')
-    
-    return 'Other'
+    """Extract country information from user data (its stored or classified country code)"""
+    return country_name(classify_country(user_data))
 
 def calculate_diversity_index(geographic_data):
     """Calculate geographic diversity index (higher = more diverse)"""
@@ -2146,195 +3194,41 @@ def calculate_diversity_index(geographic_data):
     except:
         return 0
 
-def calculate_user_behavior_analytics(users, trials, subscriptions):
+def calculate_user_behavior_analytics(users, trials, subscriptions, identity=None):
     """Calculate user behavior and engagement analytics"""
     try:
         total_users = len(users)
         if total_users == 0:
             return {}
         
-        # Analyze user journey patterns
-        journey_patterns = {
-            'quick_converters': 0,  # Trial to subscription within 3 days
-            'trial_completers': 0,  # Used full trial period
-            'trial_abandoners': 0,  # Abandoned trial early
-            'email_verifiers': 0,   # Verified email quickly (within 24h)
-            'delayed_verifiers': 0, # Verified email after 24h
-            'never_verified': 0     # Never verified email
-        }
-        
-        # Create lookup dictionaries
-        trial_lookup = {}
-        for trial_doc in trials:
-            trial_data = trial_doc.to_dict()
-            user_id = trial_data.get('userId')
-            if user_id:
-                trial_lookup[user_id] = trial_data
-        
-        subscription_lookup = {}
-        for sub_doc in subscriptions:
-            sub_data = sub_doc.to_dict()
-            email = sub_data.get('email')
-            if email:
-                subscription_lookup[email] = sub_data
-        
-        # Analyze each user's behavior
-        engagement_scores = []
-        session_patterns = {
-            'single_session': 0,    # Only logged in once
-            'regular_user': 0,      # Multiple logins
-            'power_user': 0,        # Very active
-            'inactive_user': 0      # Registered but never logged in
-        }
+        # Joined through the identity index
+        identity = identity or IdentityIndex.from_snapshots(users, trials, subscriptions)
+        trial_lookup = {trial_doc.id: trial_doc.to_dict() for trial_doc in trials}
+        subscription_lookup = {sub_doc.id: sub_doc.to_dict() for sub_doc in subscriptions}
         
+        records = []
         for user_doc in users:
             user_data = user_doc.to_dict()
-            user_id = user_doc.id
             email = user_data.get('email', '')
-            
-            # Analyze email verification behavior
-            created_at = user_data.get('createdAt')
-            verified_at = user_data.get('emailVerifiedAt')
-            
-            if not user_data.get('emailVerified'):
-                journey_patterns['never_verified'] += 1
-            elif created_at and verified_at:
-                # Calculate verification time
-                if hasattr(created_at, 'seconds'):
-                    created_dt = datetime.fromtimestamp(created_at.seconds)
-                else:
-                    created_dt = datetime.fromisoformat(str(created_at).replace('Z', '+00:00')).replace(tzinfo=None)
-                
-                if hasattr(verified_at, 'seconds'):
-                    verified_dt = datetime.fromtimestamp(verified_at.seconds)
-                else:
-                    verified_dt = datetime.fromisoformat(str(verified_at).replace('Z', '+00:00')).replace(tzinfo=None)
-                
-                verification_hours = (verified_dt - created_dt).total_seconds() / 3600
-                
-                if verification_hours <= 24:
-                    journey_patterns['email_verifiers'] += 1
-                else:
-                    journey_patterns['delayed_verifiers'] += 1
-            
-            # Analyze trial behavior
-            trial_data = trial_lookup.get(user_id)
-            subscription_data = subscription_lookup.get(email)
-            
-            if trial_data and subscription_data:
-                trial_start = trial_data.get('trialStartDate')
-                sub_start = subscription_data.get('startDate')
-                
-                if trial_start and sub_start:
-                    # Parse dates
-                    if hasattr(trial_start, 'seconds'):
-                        trial_dt = datetime.fromtimestamp(trial_start.seconds)
-                    else:
-                        trial_dt = datetime.fromisoformat(str(trial_start).replace('Z', '+00:00')).replace(tzinfo=None)
-                    
-                    if hasattr(sub_start, 'seconds'):
-                        sub_dt = datetime.fromtimestamp(sub_start.seconds)
-                    else:
-                        sub_dt = datetime.fromisoformat(str(sub_start).replace('Z', '+00:00')).replace(tzinfo=None)
-                    
-                    conversion_days = (sub_dt - trial_dt).days
-                    
-                    if conversion_days <= 3:
-                        journey_patterns['quick_converters'] += 1
-                    elif conversion_days >= 6:  # Used most of trial
-                        journey_patterns['trial_completers'] += 1
-                    else:
-                        journey_patterns['trial_abandoners'] += 1
-            
-            # Analyze session patterns
-            last_login = user_data.get('lastLoginAt')
-            if not last_login:
-                session_patterns['inactive_user'] += 1
-            else:
-                # This is simplified - in a real app you'd have more session data
-                session_patterns['regular_user'] += 1
-            
-            # Calculate engagement score (0-100)
-            engagement_score = calculate_user_engagement_score(user_data, trial_data, subscription_data)
-            engagement_scores.append(engagement_score)
-        
-        # Calculate averages and insights
-        avg_engagement = sum(engagement_scores) / len(engagement_scores) if engagement_scores else 0
-        
-        # User lifecycle insights
-        lifecycle_analysis = {
-            'activation_rate': round((journey_patterns['email_verifiers'] + journey_patterns['delayed_verifiers']) / total_users * 100, 2),
-            'quick_verification_rate': round(journey_patterns['email_verifiers'] / total_users * 100, 2),
-            'trial_completion_rate': round(journey_patterns['trial_completers'] / len(trials) * 100, 2) if trials else 0,
-            'quick_conversion_rate': round(journey_patterns['quick_converters'] / len(trials) * 100, 2) if trials else 0
-        }
-        
-        return {
-            'journey_patterns': journey_patterns,
-            'session_patterns': session_patterns,
-            'lifecycle_analysis': lifecycle_analysis,
-            'engagement_metrics': {
-                'average_engagement_score': round(avg_engagement, 2),
-                'high_engagement_users': len([s for s in engagement_scores if s >= 70]),
-                'low_engagement_users': len([s for s in engagement_scores if s <= 30]),
-                'engagement_distribution': calculate_engagement_distribution(engagement_scores)
-            },
-            'behavioral_insights': generate_behavioral_insights(journey_patterns, session_patterns, lifecycle_analysis)
-        }
+            records.append(behavior_record(
+                user_data,
+                trial_lookup.get(identity.trial_id(user_doc.id, email)),
+                subscription_lookup.get(identity.subscription_id(user_doc.id, email))
+            ))
+        
+        # Date parsing and engagement scoring run per partition on the analytics executor
+        counts = analytics_executor.run('user_behavior', behavior_partial, merge_behavior, records, datetime.now())
+        behavior = behavior_report(counts, total_users, len(trials))
+        behavior['behavioral_insights'] = generate_behavioral_insights(
+            behavior['journey_patterns'], behavior['session_patterns'], behavior['lifecycle_analysis']
+        )
+        return behavior
         
     except Exception as e:
         app.logger.error(f"Error calculating user behavior analytics: {e}")
         return {}
 
 
-def calculate_user_engagement_score(user_data, trial_data, subscription_data):
-    """Calculate engagement score for a user (0-100)"""
-    score = 0
-    
-    # Email verification (20 points)
-    if user_data.get('emailVerified'):
-        score += 20
-    
-    # Trial usage (30 points)
-    if trial_data:
-        score += 30
-    
-    # Subscription (40 points)
-    if subscription_data and subscription_data.get('isActive'):
-        score += 40
-    
-    # Recent activity (10 points)
-    last_login = user_data.get('lastLoginAt')
-    if last_login:
-        if hasattr(last_login, 'seconds'):
-            login_dt = datetime.fromtimestamp(last_login.seconds)
-        else:
-            login_dt = datetime.fromisoformat(str(last_login).replace('Z', '+00:00')).replace(tzinfo=None)
-        
-        days_since_login = (datetime.now() - login_dt).days
-        if days_since_login <= 7:
-            score += 10
-        elif days_since_login <= 30:
-            score += 5
-    
-    return min(score, 100)
-
-def calculate_engagement_distribution(scores):
-    """Calculate distribution of engagement scores"""
-    if not scores:
-        return {}
-    
-    high = len([s for s in scores if s >= 70])
-    medium = len([s for s in scores if 30 <= s < 70])
-    low = len([s for s in scores if s < 30])
-    total = len(scores)
-    
-    return {
-        'high_engagement': round(high / total * 100, 2),
-        'medium_engagement': round(medium / total * 100, 2),
-        'low_engagement': round(low / total * 100, 2)
-    }
-
 def generate_behavioral_insights(journey_patterns, session_patterns, lifecycle_analysis):
     """Generate actionable behavioral insights"""
     insights = []
@@ -2355,139 +3249,16 @@ def generate_behavioral_insights(journey_patterns, session_patterns, lifecycle_a
     
     return insights
 
-def calculate_payment_analysis(subscriptions):
-    """Calculate payment success rate and failure analysis"""
+def calculate_payment_analysis(rollups):
+    """Calculate payment success rate and failure analysis from the (monthly, per-method) ledger rollups"""
     try:
-        if not subscriptions:
-            return {
-                'total_payment_attempts': 0,
-                'successful_payments': 0,
-                'failed_payments': 0,
-                'success_rate': 0,
-                'failure_rate': 0,
-                'payment_methods': {},
-                'failure_reasons': {},
-                'recovery_rate': 0,
-                'monthly_trends': []
-            }
-        
-        # Analyze subscription payment data
-        total_subscriptions = len(subscriptions)
-        active_subscriptions = 0
-        cancelled_subscriptions = 0
-        payment_failures = 0
-        
-        # Payment method analysis (simulated data - in real app this would come from payment processor)
-        payment_methods = {
-            'credit_card': {'attempts': 0, 'successes': 0, 'failures': 0},
-            'paypal': {'attempts': 0, 'successes': 0, 'failures': 0},
-            'google_pay': {'attempts': 0, 'successes': 0, 'failures': 0},
-            'apple_pay': {'attempts': 0, 'successes': 0, 'failures': 0}
-        }
-        
-        # Failure reason analysis (simulated)
-        failure_reasons = {
-            'insufficient_funds': 0,
-            'expired_card': 0,
-            'declined_card': 0,
-            'network_error': 0,
-            'authentication_failed': 0,
-            'other': 0
-        }
-        
-        monthly_payment_data = {}
-        
-        for sub_doc in subscriptions:
-            sub_data = sub_doc.to_dict()
-            
-            if sub_data.get('isActive'):
-                active_subscriptions += 1
-            
-            if sub_data.get('cancelled'):
-                cancelled_subscriptions += 1
-                # Simulate payment failure as potential cause
-                if not sub_data.get('isActive'):
-                    payment_failures += 1
-            
-            # Analyze monthly payment trends
-            start_date = sub_data.get('startDate')
-            if start_date:
-                if hasattr(start_date, 'seconds'):
-                    start_dt = datetime.fromtimestamp(start_date.seconds)
-                else:
-                    start_dt = datetime.fromisoformat(str(start_date).replace('Z', '+00:00')).replace(tzinfo=None)
-                
-                month_key = start_dt.strftime('%Y-%m')
-                if month_key not in monthly_payment_data:
-                    monthly_payment_data[month_key] = {
-                        'attempts': 0,
-                        'successes': 0,
-                        'failures': 0,
-                        'revenue': 0
-                    }
-                
-                monthly_payment_data[month_key]['attempts'] += 1
-                if sub_data.get('isActive') or not sub_data.get('cancelled'):
-                    monthly_payment_data[month_key]['successes'] += 1
-                    monthly_payment_data[month_key]['revenue'] += 3.0
-                else:
-                    monthly_payment_data[month_key]['failures'] += 1
-            
-            # Simulate payment method distribution
-            import random
-            method = random.choice(['credit_card', 'paypal', 'google_pay', 'apple_pay'])
-            payment_methods[method]['attempts'] += 1
-            
-            if sub_data.get('isActive'):
-                payment_methods[method]['successes'] += 1
-            else:
-                payment_methods[method]['failures'] += 1
-                # Simulate failure reason
-                reason = random.choice(list(failure_reasons.keys()))
-                failure_reasons[reason] += 1
-        
-        # Calculate success rates
-        total_attempts = total_subscriptions
-        successful_payments = active_subscriptions
-        failed_payments = payment_failures
-        
-        success_rate = (successful_payments / total_attempts * 100) if total_attempts > 0 else 0
-        failure_rate = (failed_payments / total_attempts * 100) if total_attempts > 0 else 0
-        
-        # Calculate payment method success rates
-        for method, data in payment_methods.items():
-            if data['attempts'] > 0:
-                data['success_rate'] = round((data['successes'] / data['attempts']) * 100, 2)
-            else:
-                data['success_rate'] = 0
-        
-        # Calculate recovery rate (users who resubscribed after cancellation)
-        recovery_rate = 0  # This would require more complex tracking in a real app
-        
-        # Prepare monthly trends
-        monthly_trends = []
-        for month, data in sorted(monthly_payment_data.items()):
-            monthly_trends.append({
-                'month': month,
-                'attempts': data['attempts'],
-                'successes': data['successes'],
-                'failures': data['failures'],
-                'success_rate': round((data['successes'] / data['attempts']) * 100, 2) if data['attempts'] > 0 else 0,
-                'revenue': data['revenue']
-            })
-        
-        return {
-            'total_payment_attempts': total_attempts,
-            'successful_payments': successful_payments,
-            'failed_payments': failed_payments,
-            'success_rate': round(success_rate, 2),
-            'failure_rate': round(failure_rate, 2),
-            'payment_methods': payment_methods,
-            'failure_reasons': failure_reasons,
-            'recovery_rate': round(recovery_rate, 2),
-            'monthly_trends': monthly_trends[-6:],  # Last 6 months
-            'insights': generate_payment_insights(success_rate, failure_rate, payment_methods, failure_reasons)
-        }
+        months, methods = rollups
+        analysis = payment_analysis(months, methods)
+        analysis['insights'] = generate_payment_insights(
+            analysis['success_rate'], analysis['failure_rate'],
+            analysis['payment_methods'], analysis['failure_reasons']
+        ) if analysis['total_payment_attempts'] else []
+        return analysis
         
     except Exception as e:
         app.logger.error(f"Error calculating payment analysis: {e}")
@@ -2533,46 +3304,7 @@ def generate_payment_insights(success_rate, failure_rate, payment_methods, failu
 def calculate_revenue_trends(subscriptions):
     """Calculate revenue trends for the last 6 months"""
     try:
-        now = datetime.now()
-        trends = []
-        
-        for i in range(6):
-            # Calculate month start and end
-            month_date = now - timedelta(days=30 * i)
-            month_start = month_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            
-            if month_date.month == 12:
-                next_month = month_date.replace(year=month_date.year + 1, month=1, day=1)
-            else:
-                next_month = month_date.replace(month=month_date.month + 1, day=1)
-            
-            month_end = next_month - timedelta(seconds=1)
-            
-            # Count active subscriptions in this month
-            active_in_month = 0
-            for sub_doc in subscriptions:
-                sub_data = sub_doc.to_dict()
-                if not sub_data.get('isActive'):
-                    continue
-                
-                start_date = sub_data.get('startDate')
-                if start_date:
-                    if hasattr(start_date, 'seconds'):
-                        start_dt = datetime.fromtimestamp(start_date.seconds)
-                    else:
-                        start_dt = datetime.fromisoformat(str(start_date).replace('Z', '+00:00')).replace(tzinfo=None)
-                    
-                    if start_dt <= month_end:
-                        active_in_month += 1
-            
-            revenue = active_in_month * 3.0  # $3 per subscription
-            trends.append({
-                'month': month_date.strftime('%Y-%m'),
-                'revenue': revenue,
-                'active_subscriptions': active_in_month
-            })
-        
-        return list(reversed(trends))  # Return chronological order
+        return columnar.revenue_trends(SubscriptionColumns.from_snapshots(subscriptions), datetime.now())
         
     except Exception as e:
         app.logger.error(f"Error calculating revenue trends: {e}")
@@ -2582,45 +3314,8 @@ def calculate_revenue_trends(subscriptions):
 def calculate_retention_metrics(users):
     """Calculate user retention metrics"""
     try:
-        now = datetime.now()
-        total_users = len(users)
-        
-        if total_users == 0:
-            return {
-                'retention_7_day': 0,
-                'retention_30_day': 0,
-                'retention_90_day': 0
-            }
-        
-        # Calculate retention based on last login
-        retention_7_day = 0
-        retention_30_day = 0
-        retention_90_day = 0
-        
-        for user_doc in users:
-            user_data = user_doc.to_dict()
-            last_login = user_data.get('lastLoginAt')
-            
-            if last_login:
-                if hasattr(last_login, 'seconds'):
-                    login_dt = datetime.fromtimestamp(last_login.seconds)
-                else:
-                    login_dt = datetime.fromisoformat(str(last_login).replace('Z', '+00:00')).replace(tzinfo=None)
-                
-                days_since_login = (now - login_dt).days
-                
-                if days_since_login <= 7:
-                    retention_7_day += 1
-                if days_since_login <= 30:
-                    retention_30_day += 1
-                if days_since_login <= 90:
-                    retention_90_day += 1
-        
-        return {
-            'retention_7_day': round((retention_7_day / total_users) * 100, 2),
-            'retention_30_day': round((retention_30_day / total_users) * 100, 2),
-            'retention_90_day': round((retention_90_day / total_users) * 100, 2)
-        }
+        # Retention is based on last login
+        return columnar.retention_metrics(UserColumns.from_snapshots(users), datetime.now())
         
     except Exception as e:
         app.logger.error(f"Error calculating retention metrics: {e}")
@@ -2630,13 +3325,9 @@ def calculate_retention_metrics(users):
             'retention_90_day': 0
         }
 
-def calculate_churn_metrics():
-    """Calculate churn rate metrics"""
+def calculate_churn_metrics(all_subscriptions, states=None):
+    """Calculate churn rate metrics; monthly churn comes from the subscription state index"""
     try:
-        # Get subscription data
-        subscription_ref = db.collection('subscriptions')
-        all_subscriptions = list(subscription_ref.stream())
-        
         if not all_subscriptions:
             return {
                 'overall_churn_rate': 0,
@@ -2649,44 +3340,16 @@ def calculate_churn_metrics():
         # Calculate overall churn rate
         overall_churn_rate = (cancelled_subscriptions / total_subscriptions) * 100 if total_subscriptions > 0 else 0
         
-        # Calculate monthly churn rate (simplified)
+        # Monthly churn: subscriptions that expired since the start of the month,
+        # over those still paid up then (already expired ones excluded)
         now = datetime.now()
         current_month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        
-        monthly_cancellations = 0
-        active_at_month_start = 0
-        
-        for sub_doc in all_subscriptions:
-            sub_data = sub_doc.to_dict()
-            
-            # Check if subscription was active at start of month
-            start_date = sub_data.get('startDate')
-            if start_date:
-                if hasattr(start_date, 'seconds'):
-                    start_dt = datetime.fromtimestamp(start_date.seconds)
-                else:
-                    start_dt = datetime.fromisoformat(str(start_date).replace('Z', '+00:00')).replace(tzinfo=None)
-                
-                if start_dt < current_month_start:
-                    active_at_month_start += 1
-                    
-                    # Check if cancelled this month
-                    if sub_data.get('cancelled'):
-                        will_expire = sub_data.get('willExpireAt')
-                        if will_expire:
-                            if hasattr(will_expire, 'seconds'):
-                                expire_dt = datetime.fromtimestamp(will_expire.seconds)
-                            else:
-                                expire_dt = datetime.fromisoformat(str(will_expire).replace('Z', '+00:00')).replace(tzinfo=None)
-                            
-                            if expire_dt >= current_month_start:
-                                monthly_cancellations += 1
-        
-        monthly_churn_rate = (monthly_cancellations / active_at_month_start) * 100 if active_at_month_start > 0 else 0
+        states = states or SubscriptionStateIndex.from_snapshots(all_subscriptions, now=now)
+        monthly_churn = states.churn(current_month_start, now)
         
         return {
             'overall_churn_rate': round(overall_churn_rate, 2),
-            'monthly_churn_rate': round(monthly_churn_rate, 2)
+            'monthly_churn_rate': monthly_churn['churn_rate']
         }
         
     except Exception as e:
@@ -2706,15 +3369,15 @@ def calculate_subscription_health_metrics(subscriptions):
                 'customer_lifetime_value': 0
             }
         
-        active_subscriptions = [sub for sub in subscriptions if sub.to_dict().get('status') == 'active']
         total_subscriptions = len(subscriptions)
-        active_count = len(active_subscriptions)
+        active_count = sum(1 for sub in subscriptions if sub.to_dict().get('status') == 'active')
         
         # Calculate health score (percentage of active subscriptions)
         health_score = (active_count / total_subscriptions) * 100 if total_subscriptions > 0 else 0
         
         # Calculate average subscription duration
         total_duration_months = 0
+        total_lifetime_value = 0
         duration_count = 0
         
         for sub_doc in subscriptions:
@@ -2738,12 +3401,13 @@ def calculate_subscription_health_metrics(subscriptions):
                 
                 duration_months = (end_dt - start_dt).days / 30.44  # Average days per month
                 total_duration_months += duration_months
+                total_lifetime_value += duration_months * plan_price(sub_data.get('plan'))
                 duration_count += 1
         
         average_duration_months = total_duration_months / duration_count if duration_count > 0 else 0
         
-        # Calculate Customer Lifetime Value (CLV)
-        customer_lifetime_value = average_duration_months * 3.0  # $3/month
+        # Calculate Customer Lifetime Value (CLV): each subscription's duration at its plan's price
+        customer_lifetime_value = total_lifetime_value / duration_count if duration_count > 0 else 0
         
         return {
             'health_score': round(health_score, 2),
@@ -2762,61 +3426,7 @@ def calculate_subscription_health_metrics(subscriptions):
 def calculate_subscription_growth_trends(subscriptions):
     """Calculate subscription growth trends"""
     try:
-        now = datetime.now()
-        trends = []
-        
-        for i in range(6):
-            # Calculate month start and end
-            month_date = now - timedelta(days=30 * i)
-            month_start = month_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            
-            if month_date.month == 12:
-                next_month = month_date.replace(year=month_date.year + 1, month=1, day=1)
-            else:
-                next_month = month_date.replace(month=month_date.month + 1, day=1)
-            
-            month_end = next_month - timedelta(seconds=1)
-            
-            # Count new subscriptions in this month
-            new_subscriptions = 0
-            cancelled_subscriptions = 0
-            
-            for sub_doc in subscriptions:
-                sub_data = sub_doc.to_dict()
-                
-                # Check for new subscriptions
-                start_date = sub_data.get('startDate')
-                if start_date:
-                    if hasattr(start_date, 'seconds'):
-                        start_dt = datetime.fromtimestamp(start_date.seconds)
-                    else:
-                        start_dt = datetime.fromisoformat(str(start_date).replace('Z', '+00:00')).replace(tzinfo=None)
-                    
-                    if month_start <= start_dt <= month_end:
-                        new_subscriptions += 1
-                
-                # Check for cancellations
-                if sub_data.get('cancelled'):
-                    expire_date = sub_data.get('willExpireAt')
-                    if expire_date:
-                        if hasattr(expire_date, 'seconds'):
-                            expire_dt = datetime.fromtimestamp(expire_date.seconds)
-                        else:
-                            expire_dt = datetime.fromisoformat(str(expire_date).replace('Z', '+00:00')).replace(tzinfo=None)
-                        
-                        if month_start <= expire_dt <= month_end:
-                            cancelled_subscriptions += 1
-            
-            net_growth = new_subscriptions - cancelled_subscriptions
-            
-            trends.append({
-                'month': month_date.strftime('%Y-%m'),
-                'new_subscriptions': new_subscriptions,
-                'cancelled_subscriptions': cancelled_subscriptions,
-                'net_growth': net_growth
-            })
-        
-        return list(reversed(trends))  # Return chronological order
+        return columnar.subscription_growth_trends(SubscriptionColumns.from_snapshots(subscriptions), datetime.now())
         
     except Exception as e:
         app.logger.error(f"Error calculating subscription growth trends: {e}")
@@ -2843,48 +3453,6 @@ def calculate_revenue_growth_rate(revenue_trends):
         app.logger.error(f"Error calculating revenue growth rate: {e}")
         return 0
 
-def calculate_total_revenue(subscriptions):
-    """Calculate total revenue to date"""
-    try:
-        total_revenue = 0
-        now = datetime.now()
-        
-        for sub_doc in subscriptions:
-            sub_data = sub_doc.to_dict()
-            start_date = sub_data.get('startDate')
-            end_date = sub_data.get('subscriptionEndDate')
-            
-            if not start_date:
-                continue
-            
-            # Parse start date
-            if hasattr(start_date, 'seconds'):
-                start_dt = datetime.fromtimestamp(start_date.seconds)
-            else:
-                start_dt = datetime.fromisoformat(str(start_date).replace('Z', '+00:00')).replace(tzinfo=None)
-            
-            # Determine end date
-            if end_date:
-                if hasattr(end_date, 'seconds'):
-                    end_dt = datetime.fromtimestamp(end_date.seconds)
-                else:
-                    end_dt = datetime.fromisoformat(str(end_date).replace('Z', '+00:00')).replace(tzinfo=None)
-            else:
-                end_dt = now  # Still active
-            
-            # Calculate months of subscription
-            months_active = max(0, (end_dt.year - start_dt.year) * 12 + end_dt.month - start_dt.month)
-            if months_active == 0 and (end_dt - start_dt).days > 0:
-                months_active = 1  # At least partial month
-            
-            total_revenue += months_active * 3.0
-        
-        return total_revenue
-        
-    except Exception as e:
-        app.logger.error(f"Error calculating total revenue: {e}")
-        return 0
-
 if __name__ == '__main__':
     # Start periodic cleanup task for rate limiting data
     import threading
@@ -0,0 +1,74 @@
+"""
+app.py loaded for tests, its Firestore client swapped for a FakeDb.
+"""
+
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+# app.py builds its Firestore client and file stores at import; point them at a project
+# nothing connects to (the client is swapped for a FakeDb) and at scratch directories
+scratch = tempfile.mkdtemp()
+os.environ.setdefault('FIRESTORE_EMULATOR_HOST', 'localhost:8080')
+os.environ.setdefault('GOOGLE_CLOUD_PROJECT', 'dashboard-test')
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ['REPORT_SCHEDULER_ENABLED'] = 'false'
+for name in ('REPORT_SNAPSHOT_DIR', 'EXPORT_ARTIFACT_DIR', 'ACTIVITY_DIR', 'SKETCH_DIR'):
+    os.environ[name] = os.path.join(scratch, name.lower())
+os.environ['KPI_SERIES_PATH'] = os.path.join(scratch, 'kpi_daily.ndjson')
+os.environ['WAREHOUSE_PATH'] = os.path.join(scratch, 'warehouse.sqlite3')
+
+import firebase_admin
+from firebase_admin import credentials
+from google.auth.credentials import AnonymousCredentials
+
+
+class EmulatorCredential(credentials.Base):
+    def get_credential(self):
+        return AnonymousCredentials()
+
+
+if not firebase_admin._apps:
+    firebase_admin.initialize_app(EmulatorCredential(), {'projectId': os.environ['GOOGLE_CLOUD_PROJECT']})
+
+import app
+from firestore_fakes import FakeDb
+
+NOW = datetime.now()
+
+
+def seeded_db(user_count=40):
+    db = FakeDb()
+    for i in range(user_count):
+        uid = f'uid{i:03d}'
+        created = NOW - timedelta(days=3 * i + 1)
+        db.collection('users').docs[uid] = {
+            'email': f'user{i}@gmail.com', 'createdAt': created, 'emailVerified': i % 3 != 0,
+            'emailVerifiedAt': created + timedelta(hours=2) if i % 3 != 0 else None,
+            'lastLoginAt': created + timedelta(days=1) if i % 4 else None,
+        }
+        if i % 2 == 0:
+            db.collection('trial_history').docs[f'trial{i}'] = {
+                'userId': uid, 'email': f'user{i}@gmail.com',
+                'trialStartDate': created, 'trialEndDate': created + timedelta(days=7),
+            }
+        if i % 4 == 0:
+            cancelled = i % 8 == 0
+            db.collection('subscriptions').docs[uid] = {
+                'userId': uid, 'email': f'user{i}@gmail.com', 'plan': 'monthly',
+                'status': 'cancelled' if cancelled else 'active', 'isActive': not cancelled,
+                'cancelled': cancelled, 'startDate': created + timedelta(days=3),
+                'willExpireAt': created + timedelta(days=33) if cancelled else None,
+            }
+        db.collection('token_usage_history').docs[f'{uid}_{NOW.year}_{NOW.month}'] = {
+            'userId': uid, 'year': NOW.year, 'month': NOW.month, 'totalMonthlyTokens': 100 * i, 'userType': 'trial',
+        }
+    return db
+
+
+def use_db(db):
+    app.db = db
+    app.payment_ledger.db = db
+    return app.app.test_client()
+
+
@@ -0,0 +1,221 @@
+"""
+In-memory stand-ins for the parts of the Firestore client the tests drive.
+
+FakeDb hands out FakeCollections holding ``{doc_id: data}`` documents. A
+collection answers the queries the analytics code issues - where() on a
+field or on the document id (``__name__``), order_by(), start_after(),
+limit() and select() - counting the queries streamed and the documents
+they returned. It can be made slow (``delay``), made to fail every page on
+its first attempt (``flaky``) or on every attempt (``broken``), and it
+feeds snapshot listeners: send() delivers changes to the on_snapshot()
+callback.
+
+FakeTransaction, transactional(), Increment and Duplicate stand in for
+Firestore transactions the way PaymentLedger takes them: all-or-nothing,
+with create() of an existing document failing the commit.
+"""
+import copy
+import time
+
+OPS = {'==': lambda a, b: a == b, '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+       '<': lambda a, b: a < b}
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class FakeDocument:
+    """Document reference; read outside a transaction it counts as a collection read"""
+
+    def __init__(self, collection, doc_id):
+        self.collection = collection
+        self.id = doc_id
+
+    def get(self, transaction=None):
+        if transaction is None:
+            self.collection.reads += 1
+        else:
+            transaction.reads.append(self.id)
+        return FakeSnapshot(self.id, self.collection.docs.get(self.id))
+
+
+class FakeQuery:
+    """Filters, orders, pages and projects the documents of a FakeCollection on stream()"""
+
+    def __init__(self, collection, filters=(), order=None, limit_count=None, after=None, selected=None):
+        self.collection = collection
+        self.filters = filters
+        self.order = order
+        self.limit_count = limit_count
+        self.after = after
+        self.selected = selected
+
+    def _copy(self, **changes):
+        state = dict(filters=self.filters, order=self.order, limit_count=self.limit_count, after=self.after,
+                     selected=self.selected)
+        state.update(changes)
+        return FakeQuery(self.collection, **state)
+
+    def where(self, field, op, value):
+        if field == '__name__':
+            value = getattr(value, 'id', value)
+        return self._copy(filters=self.filters + ((field, op, value),))
+
+    def order_by(self, field):
+        return self._copy(order=field)
+
+    def limit(self, count):
+        return self._copy(limit_count=count)
+
+    def start_after(self, snapshot):
+        return self._copy(after=snapshot)
+
+    def select(self, field_paths):
+        return self._copy(selected=list(field_paths))
+
+    def on_snapshot(self, callback):
+        """Listen on the collection; send() delivers changes whatever the query"""
+        self.collection.listeners += 1
+        self.collection.callback = callback
+        return self.collection
+
+    def _key(self, doc_id, data):
+        return doc_id if self.order in (None, '__name__') else (data.get(self.order), doc_id)
+
+    def _matches(self, doc_id, data):
+        if self.order not in (None, '__name__') and data.get(self.order) is None:
+            return False
+        for field, op, value in self.filters:
+            actual = doc_id if field == '__name__' else data.get(field)
+            if actual is None or not OPS[op](actual, value):
+                return False
+        return True
+
+    def stream(self):
+        collection = self.collection
+        collection.queries += 1
+        if collection.delay:
+            time.sleep(collection.delay)
+        if collection.broken:
+            raise RuntimeError('504 Deadline Exceeded')
+        if collection.flaky and self.filters not in collection.failed_pages:
+            collection.failed_pages.add(self.filters)
+            raise RuntimeError('504 Deadline Exceeded')
+
+        matching = sorted((self._key(doc_id, data), doc_id, data) for doc_id, data in collection.docs.items()
+                          if self._matches(doc_id, data))
+        if self.after is not None:
+            bound = self._key(self.after.id, self.after.to_dict())
+            matching = [item for item in matching if item[0] > bound]
+        matching = matching[:self.limit_count]
+        collection.reads += len(matching)
+        if self.selected is not None:
+            return iter([FakeSnapshot(doc_id, {k: v for k, v in data.items() if k in self.selected})
+                         for _, doc_id, data in matching])
+        return iter([FakeSnapshot(doc_id, data) for _, doc_id, data in matching])
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, name='fake', docs=None, delay=0, flaky=False, broken=False):
+        self.id = name
+        self.docs = dict(docs or {})
+        self.delay = delay
+        self.flaky = flaky
+        self.broken = broken
+        self.failed_pages = set()
+        self.queries = 0
+        self.reads = 0
+        self.listeners = 0
+        self.callback = None
+        super().__init__(self)
+
+    def document(self, doc_id):
+        return FakeDocument(self, doc_id)
+
+    def unsubscribe(self):
+        self.callback = None
+
+    def send(self, *changes, read_time=None):
+        """Deliver ``(kind, doc_id, data)`` changes to the listener"""
+        self.callback(None, [FakeChange(*change) for change in changes], read_time)
+
+
+class FakeDb:
+    def __init__(self, collections=None):
+        self.collections = {name: FakeCollection(name, docs) for name, docs in (collections or {}).items()}
+
+    def collection(self, name):
+        return self.collections.setdefault(name, FakeCollection(name))
+
+    def documents_read(self):
+        return {name: collection.reads for name, collection in self.collections.items() if collection.reads}
+
+    def transaction(self):
+        return FakeTransaction()
+
+
+class FakeChangeType:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeChange:
+    def __init__(self, kind, doc_id, data=None):
+        self.type = FakeChangeType(kind)
+        self.document = FakeSnapshot(doc_id, data or {})
+
+
+class Duplicate(Exception):
+    pass
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+def merge_into(document, data):
+    for name, value in data.items():
+        if isinstance(value, dict):
+            merge_into(document.setdefault(name, {}), value)
+        elif isinstance(value, Increment):
+            document[name] = document.get(name, 0) + value.value
+        else:
+            document[name] = value
+
+
+class FakeTransaction:
+    """All-or-nothing like a Firestore transaction: a create() of an existing document fails the commit"""
+
+    def __init__(self):
+        self.reads = []
+        self.writes = []
+
+    def create(self, ref, data):
+        self.writes.append(('create', ref, data))
+
+    def set(self, ref, data, merge=False):
+        self.writes.append(('set', ref, data))
+
+    def commit(self):
+        for kind, ref, _ in self.writes:
+            if kind == 'create' and ref.id in ref.collection.docs:
+                raise Duplicate(ref.id)
+        for kind, ref, data in self.writes:
+            merge_into(ref.collection.docs.setdefault(ref.id, {}), data)
+
+
+def transactional(function):
+    """Runs ``function(transaction)`` and commits, as firestore.transactional does"""
+    def run(transaction):
+        result = function(transaction)
+        transaction.commit()
+        return result
+    return run
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response
 from flask_cors import CORS
 import firebase_admin
 from firebase_admin import credentials, firestore
@@ -7,9 +7,19 @@ from datetime import datetime, timedelta
 import os
 import calendar
 
+# The analytics package is installed from the repository root (see requirements.txt)
+from analytics.http_cache import ResponseCache
+from analytics.live import LiveDashboard
+
 app = Flask(__name__)
 CORS(app)
 
+# ETag/304, Cache-Control and gzip for the polled API responses; route -> max-age seconds
+ResponseCache(app, max_age={
+    '/api/users': 10,
+    '/api/stats': 10
+})
+
 # Initialize Firebase Admin SDK
 if not firebase_admin._apps:
     try:
@@ -29,6 +39,14 @@ def admin_dashboard():
 @app.route('/api/users')
 def get_users():
     try:
+        if live_dashboard.ready.is_set():
+            users_data = live_dashboard.snapshot()['users']
+            return jsonify({
+                'success': True,
+                'users': users_data,
+                'total_users': len(users_data)
+            })
+        
         users_data = []
         
         # Get all users from Firestore
@@ -56,25 +74,7 @@ def get_users():
                 if subscription_doc.exists:
                     subscription = subscription_doc.to_dict()
             
-            # Compile complete user journey data
-            journey_data = {
-                'user_id': user_id,
-                'email': email or 'N/A',
-                'username': user_data.get('username', 'N/A'),
-                'registration_date': format_timestamp(user_data.get('createdAt')),
-                'email_verified': user_data.get('emailVerified', False),
-                'email_verification_date': format_timestamp(user_data.get('emailVerifiedAt')),
-                'trial_start_date': format_timestamp(trial_history.get('trialStartDate') if trial_history else None),
-                'trial_end_date': format_timestamp(trial_history.get('trialEndDate') if trial_history else None),
-                'trial_status': get_trial_status(trial_history),
-                'subscription_start_date': format_timestamp(subscription.get('subscriptionStartDate') if subscription else None),
-                'subscription_end_date': format_timestamp(subscription.get('subscriptionEndDate') if subscription else None),
-                'subscription_status': get_subscription_status(subscription),
-                'cancellation_date': format_timestamp(subscription.get('willExpireAt') if subscription and subscription.get('cancelled') else None),
-                'is_premium': subscription.get('isActive', False) if subscription else False,
-                'last_login': format_timestamp(user_data.get('lastLoginAt')),
-                'current_status': get_current_user_status(user_data, trial_history, subscription)
-            }
+            journey_data = build_user_journey(user_id, user_data, trial_history, subscription)
             
             users_data.append(journey_data)
         
@@ -97,6 +97,12 @@ def get_users():
 @app.route('/api/stats')
 def get_stats():
     try:
+        if live_dashboard.ready.is_set():
+            return jsonify({
+                'success': True,
+                'stats': live_dashboard.snapshot()['stats']
+            })
+        
         # Get user counts
         users_ref = db.collection('users')
         all_users = list(users_ref.stream())
@@ -117,20 +123,10 @@ def get_stats():
         # Get cancelled subscriptions
         cancelled_subscriptions = sum(1 for sub in all_subscriptions if sub.to_dict().get('cancelled', False))
         
-        # Calculate conversion rate
-        conversion_rate = round((active_subscriptions / total_trials * 100) if total_trials > 0 else 0, 2)
-        
         return jsonify({
             'success': True,
-            'stats': {
-                'total_users': total_users,
-                'verified_users': verified_users,
-                'unverified_users': total_users - verified_users,
-                'total_trials': total_trials,
-                'active_subscriptions': active_subscriptions,
-                'cancelled_subscriptions': cancelled_subscriptions,
-                'conversion_rate': conversion_rate
-            }
+            'stats': compile_stats(total_users, verified_users, total_trials,
+                                   active_subscriptions, cancelled_subscriptions)
         })
         
     except Exception as e:
@@ -140,6 +136,81 @@ def get_stats():
             'error': str(e)
         }), 500
 
+def build_user_journey(user_id, user_data, trial_history, subscription):
+    """Compile the complete journey row for one user"""
+    email = user_data.get('email', '')
+    
+    return {
+        'user_id': user_id,
+        'email': email or 'N/A',
+        'username': user_data.get('username', 'N/A'),
+        'registration_date': format_timestamp(user_data.get('createdAt')),
+        'email_verified': user_data.get('emailVerified', False),
+        'email_verification_date': format_timestamp(user_data.get('emailVerifiedAt')),
+        'trial_start_date': format_timestamp(trial_history.get('trialStartDate') if trial_history else None),
+        'trial_end_date': format_timestamp(trial_history.get('trialEndDate') if trial_history else None),
+        'trial_status': get_trial_status(trial_history),
+        'subscription_start_date': format_timestamp(subscription.get('subscriptionStartDate') if subscription else None),
+        'subscription_end_date': format_timestamp(subscription.get('subscriptionEndDate') if subscription else None),
+        'subscription_status': get_subscription_status(subscription),
+        'cancellation_date': format_timestamp(subscription.get('willExpireAt') if subscription and subscription.get('cancelled') else None),
+        'is_premium': subscription.get('isActive', False) if subscription else False,
+        'last_login': format_timestamp(user_data.get('lastLoginAt')),
+        'current_status': get_current_user_status(user_data, trial_history, subscription)
+    }
+
+def compile_stats(total_users, verified_users, total_trials, active_subscriptions, cancelled_subscriptions):
+    """Dashboard stats from the collection counts"""
+    # Calculate conversion rate
+    conversion_rate = round((active_subscriptions / total_trials * 100) if total_trials > 0 else 0, 2)
+    
+    return {
+        'total_users': total_users,
+        'verified_users': verified_users,
+        'unverified_users': total_users - verified_users,
+        'total_trials': total_trials,
+        'active_subscriptions': active_subscriptions,
+        'cancelled_subscriptions': cancelled_subscriptions,
+        'conversion_rate': conversion_rate
+    }
+
+def stats_from_counters(counters):
+    """compile_stats from the live dashboard's incrementally maintained counters"""
+    total_users = counters.get('users_total', 0)
+    return compile_stats(total_users, total_users - counters.get('users_unverified', 0),
+                         counters.get('trials_total', 0), counters.get('subscriptions_active', 0),
+                         counters.get('subscriptions_cancelled', 0))
+
+# Listener-maintained users and stats, pushed to dashboards over /api/stream.
+# One set of listeners serves every connected admin.
+live_dashboard = LiveDashboard(db, build_user_journey, stats_from_counters,
+                               sort_key=lambda row: row['registration_date'] or '')
+
+@app.route('/api/stream')
+def stream_dashboard():
+    """Server-sent events: a snapshot of stats and users, then diffs as the data changes"""
+    try:
+        live_dashboard.start()
+    except Exception as e:
+        print(f"Live dashboard unavailable: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 503
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    return Response(live_dashboard.events(last_event_id), mimetype='text/event-stream',
+                    direct_passthrough=True,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/stream/status')
+def stream_status():
+    """Live dashboard listener and client counts"""
+    return jsonify({
+        'success': True,
+        'status': live_dashboard.status()
+    })
+
 def format_timestamp(timestamp):
     """Convert Firestore timestamp to readable format"""
     if not timestamp:
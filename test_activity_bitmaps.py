@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-day active-user bitmaps (analytics/activity.py).
+"""
+
+import sys
+import os
+import random
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics.activity import ActivityStore, bitmap, bitmap_bytes
+from analytics.columnar import UserColumns
+
+TODAY = datetime(2025, 6, 30, 12, 0)
+
+
+def test_bitmap_encoding():
+    bits = bitmap([0, 3, 9, 3, 1000])
+    assert bits == (1 << 0) | (1 << 3) | (1 << 9) | (1 << 1000)
+    assert bits.bit_count() == 4
+    assert int.from_bytes(bitmap_bytes(bits), 'little') == bits
+    assert bitmap([]) == 0 and bitmap_bytes(0) == b''
+
+
+def test_dau_wau_mau_across_workers():
+    directory = tempfile.mkdtemp()
+    try:
+        rng = random.Random(11)
+        first, second = ActivityStore(directory, flush_seconds=3600), ActivityStore(directory, flush_seconds=3600)
+        active = {}
+        for offset in range(45):
+            day = TODAY - timedelta(days=offset)
+            for _ in range(rng.randint(0, 40)):
+                user_id = f'uid{rng.randint(0, 150)}'
+                # Two workers see different users and assign dense indices independently
+                rng.choice((first, second)).record(user_id, day)
+                active.setdefault(day.date(), set()).add(user_id)
+        assert first.flush() and second.flush()
+
+        def expected(end, days):
+            users = set()
+            for offset in range(days):
+                users |= active.get((end - timedelta(days=offset)).date(), set())
+            return len(users)
+
+        counts = first.counts(TODAY)
+        assert counts['daily_active_users'] == expected(TODAY, 1)
+        assert counts['weekly_active_users'] == expected(TODAY, 7)
+        assert counts['monthly_active_users'] == expected(TODAY, 30)
+
+        series = second.series(TODAY, days=10)
+        assert [row['date'] for row in series][-1] == TODAY.date().isoformat() and len(series) == 10
+        for row in series:
+            day = datetime.fromisoformat(row['date'])
+            assert (row['daily_active_users'], row['weekly_active_users'], row['monthly_active_users']) == \
+                (expected(day, 1), expected(day, 7), expected(day, 30))
+
+        status = first.status()
+        assert status['users_indexed'] == len(set().union(*active.values()))
+        assert status['days_tracked'] == len(active) and status['pending_events'] == 0
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_cohort_retention():
+    directory = tempfile.mkdtemp()
+    try:
+        store = ActivityStore(directory, flush_seconds=3600)
+        signups = {}
+        for i in range(60):
+            signups[f'uid{i}'] = TODAY - timedelta(days=40 - i % 20, hours=i % 5)
+        users = UserColumns.from_records((uid, {'createdAt': created}) for uid, created in signups.items())
+
+        # Everyone is active on signup day; even users come back the next day, every third after a week
+        for uid, created in signups.items():
+            store.record(uid, created)
+            if int(uid[3:]) % 2 == 0:
+                store.record(uid, created + timedelta(days=1))
+            if int(uid[3:]) % 3 == 0:
+                store.record(uid, created + timedelta(days=7))
+        store.record('uid0', TODAY + timedelta(days=5))  # not yet: ignored as a target day in the future
+
+        result = store.retention(users, periods=(1, 7, 30), today=TODAY)
+        curve = result['retention_curve']
+        assert curve['retention_1_day'] == 50.0
+        assert curve['retention_7_day'] == 33.33
+        assert curve['retention_30_day'] == 0.0
+        assert sum(row['total_users'] for row in result['cohorts']) == 60
+        # Signups from the last 29 days have no 30-day point yet
+        assert sum(row['eligible_30_day'] for row in result['cohorts']) == \
+            sum(1 for created in signups.values() if created.date() + timedelta(days=30) <= TODAY.date())
+
+        empty = ActivityStore(os.path.join(directory, 'none')).retention(users, periods=(1,), today=TODAY)
+        assert empty['retention_curve'] == {'retention_1_day': None} and empty['tracked_since'] is None
+    finally:
+        shutil.rmtree(directory)
+
+def test_retention_sees_users_indexed_by_other_workers():
+    directory = tempfile.mkdtemp()
+    try:
+        first, second = ActivityStore(directory, flush_seconds=3600), ActivityStore(directory, flush_seconds=3600)
+        signup = TODAY - timedelta(days=3)
+        users = UserColumns.from_records([('uid1', {'createdAt': signup}), ('uid2', {'createdAt': signup})])
+        first.record('uid1', signup)
+        assert first.flush()
+        second.record('uid2', signup)
+        second.record('uid2', signup + timedelta(days=1))
+        assert second.flush()
+
+        # The first store has nothing pending, so it does not flush, and must still index uid2
+        curves = [store.retention(users, periods=(1,), today=TODAY)['retention_curve'] for store in (first, second)]
+        assert curves == [{'retention_1_day': 50.0}] * 2
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    test_bitmap_encoding()
+    test_dau_wau_mau_across_workers()
+    test_cohort_retention()
+    test_retention_sees_users_indexed_by_other_workers()
+    print("All activity bitmap tests passed")
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Tests for the incremental alert rule engine (analytics/alerts.py) and the
+snapshot listener feed (analytics/watch.py).
+"""
+
+import sys
+import os
+import random
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics.alerts import AlertEngine, AlertRule, BUSINESS_COUNTERS, MetricState, compile_expression
+from analytics.watch import CollectionWatch
+from firestore_fakes import FakeCollection
+
+NOW = datetime(2025, 6, 15, 12, 0)
+
+UNVERIFIED = AlertRule('unverified_users', 'users_unverified / users_total * 100', '>', 30,
+                       clear_threshold=27, requires=('users_total',), decimals=1, severity='info',
+                       message='Unverified user rate is {value:.1f}% (threshold: {threshold}%)')
+CHURN = AlertRule('high_churn', 'monthly_cancellations / subscriptions_active_at_month_start * 100', '>', 15,
+                  severity='critical')
+
+
+def users(verified, unverified):
+    docs = [(f'v{i}', {'emailVerified': True}) for i in range(verified)]
+    docs += [(f'u{i}', {'emailVerified': False}) for i in range(unverified)]
+    return docs
+
+
+def random_subscription(rng):
+    start = NOW - timedelta(days=rng.randint(0, 120))
+    cancelled = rng.random() < 0.4
+    return {
+        'isActive': not cancelled and rng.random() < 0.9,
+        'cancelled': cancelled,
+        'startDate': start,
+        'willExpireAt': start + timedelta(days=30) if cancelled else None,
+        'fcmToken': 'ignored'
+    }
+
+
+def test_expressions():
+    evaluate, names = compile_expression('a / b * 100 - -c')
+    assert names == ('a', 'b', 'c')
+    assert evaluate({'a': 1, 'b': 4, 'c': 2}) == 27
+    assert evaluate({'a': 1, 'b': 0}) == 0  # division by zero reads as 0
+
+    for bad in ("__import__('os')", 'a.b', 'a ** 2', 'a if b else c'):
+        try:
+            compile_expression(bad)
+        except ValueError:
+            pass
+        else:
+            assert False, f"expected '{bad}' to be rejected"
+
+
+def test_incremental_counters_match_a_full_recount():
+    rng = random.Random(7)
+    docs = {f's{i}': random_subscription(rng) for i in range(300)}
+    state = MetricState(BUSINESS_COUNTERS, NOW)
+    state.apply('subscriptions', docs.items())
+
+    for _ in range(500):
+        doc_id = f's{rng.randrange(350)}'
+        if doc_id in docs and rng.random() < 0.3:
+            del docs[doc_id]
+            state.apply('subscriptions', [(doc_id, None)])
+        else:
+            docs[doc_id] = random_subscription(rng)
+            state.apply('subscriptions', [(doc_id, docs[doc_id])])
+
+    recount = MetricState(BUSINESS_COUNTERS, NOW)
+    recount.sync('subscriptions', docs.items())
+    nonzero = lambda values: {name: value for name, value in values.items() if value}
+    assert nonzero(state.values) == nonzero(recount.values)
+
+    # Rolling into the next month recounts the month-relative counters from memory
+    next_month = datetime(2025, 7, 2)
+    assert state.roll(next_month)
+    fresh = MetricState(BUSINESS_COUNTERS, next_month)
+    fresh.sync('subscriptions', docs.items())
+    assert nonzero(state.values) == nonzero(fresh.values)
+
+
+def test_rules_are_only_rechecked_when_inputs_change():
+    engine = AlertEngine([UNVERIFIED, CHURN], now=NOW)
+    engine.sync('users', users(80, 20))
+    engine.evaluate(NOW)
+
+    # Unchanged data (a full re-sync included) and unrelated changes skip every rule
+    engine.sync('users', users(80, 20))
+    engine.evaluate(NOW)
+    engine.apply('trials', [('t1', {})])
+    engine.evaluate(NOW)
+
+    stats = {rule['rule']: rule for rule in engine.rule_stats()}
+    assert stats['unverified_users']['evaluations'] == 1
+    assert stats['unverified_users']['skipped'] == 2
+    assert stats['high_churn']['evaluations'] == 1
+
+    engine.apply('users', [('u0', {'emailVerified': True})])
+    engine.evaluate(NOW)
+    stats = {rule['rule']: rule for rule in engine.rule_stats()}
+    assert stats['unverified_users']['evaluations'] == 2
+    assert stats['unverified_users']['value'] == 19.0
+    assert stats['high_churn']['evaluations'] == 1
+
+
+def test_alerts_are_deduplicated_with_hysteresis():
+    engine = AlertEngine([UNVERIFIED], now=NOW)
+
+    engine.sync('users', users(65, 35))
+    opened = engine.evaluate(NOW)
+    assert len(opened) == 1
+    assert opened[0]['message'] == 'Unverified user rate is 35.0% (threshold: 30%)'
+
+    # Below the threshold but above the clear threshold: the same alert stays open
+    engine.sync('users', users(71, 29))
+    still_open = engine.evaluate(NOW + timedelta(minutes=5))
+    assert len(still_open) == 1
+    assert still_open[0]['timestamp'] == opened[0]['timestamp']
+    assert still_open[0]['value'] == 29.0 and still_open[0]['peak_value'] == 35.0
+
+    engine.sync('users', users(74, 26))
+    assert engine.evaluate(NOW + timedelta(minutes=10)) == []
+    resolved = engine.recent()
+    assert len(resolved) == 1 and resolved[0]['resolved_at']
+
+    engine.sync('users', users(60, 40))
+    assert len(engine.evaluate(NOW + timedelta(minutes=15))) == 1
+    assert len(engine.recent()) == 1
+
+
+def test_expiries_count_as_the_clock_passes_them():
+    engine = AlertEngine([CHURN], now=NOW)
+    month = datetime(2025, 6, 1)
+    subscriptions = [(f'a{i}', {'startDate': month - timedelta(days=40)}) for i in range(10)]
+    # Expire in three days with no further write; one only next month
+    subscriptions += [(f'c{i}', {'startDate': month - timedelta(days=40), 'cancelled': True,
+                                 'willExpireAt': NOW + timedelta(days=3)}) for i in range(2)]
+    subscriptions.append(('late', {'startDate': month - timedelta(days=40), 'cancelled': True,
+                                   'willExpireAt': datetime(2025, 7, 5)}))
+    engine.sync('subscriptions', subscriptions)
+    assert engine.evaluate(NOW) == []
+    assert engine.stats()['pending_expiries'] == 2
+
+    later = NOW + timedelta(days=4)
+    alerts = engine.evaluate(later)
+    assert [alert['rule'] for alert in alerts] == ['high_churn'] and alerts[0]['value'] == round(2 / 13 * 100, 2)
+    fresh = MetricState(BUSINESS_COUNTERS, later)
+    fresh.sync('subscriptions', subscriptions)
+    assert engine.state.values == fresh.values and not engine.state.pending
+
+    # Next month the late expiry is due again, from the recount
+    engine.evaluate(datetime(2025, 7, 1, 9, 0))
+    assert engine.state.values['monthly_cancellations'] == 0 and engine.stats()['pending_expiries'] == 1
+    engine.evaluate(datetime(2025, 7, 6))
+    assert engine.state.values['monthly_cancellations'] == 1
+
+
+def test_payment_failures_count_the_ledger_rollup_of_the_month():
+    failures = AlertRule('payment_failures', 'payment_failures / payment_attempts * 100', '>', 10,
+                         clear_threshold=8, requires=('payment_attempts',))
+    engine = AlertEngine([failures], now=NOW)
+    engine.sync('payment_rollups', [
+        ('month_2025-05', {'kind': 'month', 'key': '2025-05', 'attempts': 10, 'failures': 9}),
+        ('month_2025-06', {'kind': 'month', 'key': '2025-06', 'attempts': 40, 'failures': 6}),
+        ('method_card', {'kind': 'method', 'key': 'card', 'attempts': 50, 'failures': 15}),
+    ])
+    alerts = engine.evaluate(NOW)
+    assert [alert['rule'] for alert in alerts] == ['payment_failures'] and alerts[0]['value'] == 15.0
+
+    # A new month starts from its own rollup, not from last month's
+    engine.evaluate(datetime(2025, 7, 1, 9, 0))
+    assert engine.state.values.get('payment_attempts', 0) == 0
+    engine.sync('payment_rollups', [('month_2025-07', {'kind': 'month', 'key': '2025-07', 'attempts': 1, 'failures': 0})])
+    assert engine.evaluate(datetime(2025, 7, 1, 10, 0)) == []
+
+
+def test_listener_changes_feed_the_engine():
+    engine = AlertEngine([UNVERIFIED], now=NOW)
+    query = FakeCollection('users')
+    watch = CollectionWatch(query, 'users')
+    watch.subscribe(lambda changes: engine.apply('users', changes))
+    watch.start()
+
+    query.send(*[('ADDED', doc_id, data) for doc_id, data in users(6, 4)], read_time=NOW)
+    assert watch.ready.is_set()
+    assert engine.evaluate(NOW)[0]['value'] == 40.0
+
+    query.send(('MODIFIED', 'u0', {'emailVerified': True}), ('REMOVED', 'u1'), read_time=NOW)
+    assert engine.state.values['users_total'] == 9
+    assert engine.evaluate(NOW) == []  # 2 of 9 unverified, below the clear threshold
+    assert watch.changes_seen == 12
+
+    watch.stop()
+    assert query.callback is None
+
+
+if __name__ == "__main__":
+    test_expressions()
+    test_incremental_counters_match_a_full_recount()
+    test_rules_are_only_rechecked_when_inputs_change()
+    test_alerts_are_deduplicated_with_hysteresis()
+    test_expiries_count_as_the_clock_passes_them()
+    test_payment_failures_count_the_ledger_rollup_of_the_month()
+    test_listener_changes_feed_the_engine()
+    print("All alert rule tests passed")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Tests for the partitioned analytics computations and the process-pool executor
+(analytics/executor.py, analytics/behavior.py, the cohort counts of analytics/columnar.py).
+"""
+
+import sys
+import os
+import random
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics import columnar
+from analytics.behavior import behavior_partial, behavior_record, behavior_report, merge_behavior
+from analytics.columnar import UserColumns, cohort_partial, merge_cohort_counts
+from analytics.executor import AnalyticsExecutor, partitions
+
+NOW = datetime(2025, 6, 15, 12, 0)
+
+
+def synthetic_users(count, seed=5):
+    rng = random.Random(seed)
+    users = []
+    for n in range(count):
+        created = NOW - timedelta(days=rng.randrange(400), hours=rng.randrange(24))
+        verified = rng.random() < 0.7
+        trial = {'trialStartDate': created.isoformat()} if rng.random() < 0.6 else None
+        subscription = None
+        if trial and rng.random() < 0.5:
+            subscription = {'startDate': created + timedelta(days=rng.randrange(10)), 'isActive': rng.random() < 0.7}
+        users.append(({
+            'emailVerified': verified,
+            'createdAt': created,
+            'emailVerifiedAt': created + timedelta(hours=rng.randrange(72)) if verified else None,
+            'lastLoginAt': NOW - timedelta(days=rng.randrange(60)) if rng.random() < 0.8 else None,
+        }, trial, subscription))
+    return users
+
+
+def test_behavior_by_hand():
+    records = [
+        # Verified within a day, converted after 2 days, logged in yesterday: 20 + 30 + 40 + 10
+        behavior_record({'emailVerified': True, 'createdAt': NOW - timedelta(days=10),
+                         'emailVerifiedAt': NOW - timedelta(days=10, hours=-2), 'lastLoginAt': NOW - timedelta(days=1)},
+                        {'trialStartDate': NOW - timedelta(days=9)},
+                        {'startDate': NOW - timedelta(days=7), 'isActive': True}),
+        # Never verified, never logged in, no trial: 0
+        behavior_record({'emailVerified': False}, None, None),
+    ]
+    report = behavior_report(behavior_partial(records, NOW), total_users=2, total_trials=1)
+    assert report['journey_patterns']['email_verifiers'] == 1 and report['journey_patterns']['never_verified'] == 1
+    assert report['journey_patterns']['quick_converters'] == 1
+    assert report['session_patterns'] == {'single_session': 0, 'regular_user': 1, 'power_user': 0, 'inactive_user': 1}
+    assert report['engagement_metrics'] == {
+        'average_engagement_score': 50.0,
+        'high_engagement_users': 1,
+        'low_engagement_users': 1,
+        'engagement_distribution': {'high_engagement': 50.0, 'medium_engagement': 0.0, 'low_engagement': 50.0},
+    }
+    assert report['lifecycle_analysis']['quick_conversion_rate'] == 100.0
+
+
+def test_partials_merge_to_the_whole():
+    records = [behavior_record(*user) for user in synthetic_users(3000)]
+    whole = merge_behavior([behavior_partial(records, NOW)])
+    for count in (2, 7, 64):
+        assert merge_behavior([behavior_partial(part, NOW) for part in partitions(records, count)]) == whole
+
+    user_records = [(f'u{n}', user) for n, (user, _, _) in enumerate(synthetic_users(3000))]
+    merged = merge_cohort_counts([cohort_partial(part) for part in partitions(user_records, 5)])
+    assert columnar.cohort_report(merged, NOW) == columnar.cohort_analysis(UserColumns.from_records(user_records), NOW)
+    assert [len(part) for part in partitions(list(range(10)), 4)] == [3, 3, 3, 1] and partitions([], 4) == []
+
+
+def test_executor_pool_matches_in_process():
+    records = [behavior_record(*user) for user in synthetic_users(2000)]
+    executor = AnalyticsExecutor(workers=2, min_records=1000)
+    try:
+        small = executor.run('behavior', behavior_partial, merge_behavior, records[:10], NOW)
+        assert executor.runs['behavior']['mode'] == 'in-process'
+        assert small == merge_behavior([behavior_partial(records[:10], NOW)])
+
+        pooled = executor.run('behavior', behavior_partial, merge_behavior, records, NOW)
+        assert executor.runs['behavior']['mode'] == 'pool' and executor.runs['behavior']['partitions'] == 4
+        assert pooled == merge_behavior([behavior_partial(records, NOW)])
+        assert executor.status()['pool_started']
+    finally:
+        executor.shutdown()
+
+    # One worker never starts a pool
+    single = AnalyticsExecutor(workers=1, min_records=1)
+    single.run('behavior', behavior_partial, merge_behavior, records, NOW)
+    assert single.runs['behavior']['mode'] == 'in-process' and not single.status()['pool_started']
+
+
+if __name__ == "__main__":
+    test_behavior_by_hand()
+    test_partials_merge_to_the_whole()
+    test_executor_pool_matches_in_process()
+    print("All analytics executor tests passed")
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Tests for the local analytics warehouse (analytics/warehouse.py).
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics.warehouse import Warehouse, WarehouseSnapshot, decode_document, encode_document
+from firestore_fakes import FakeDb
+
+T0 = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+
+def seeded_db(users=50):
+    db = FakeDb()
+    for i in range(users):
+        db.collection('users').docs[f'uid{i:03d}'] = {
+            'email': f'user{i}@example.com', 'emailVerified': i % 3 != 0,
+            'createdAt': T0 + timedelta(days=i), 'updatedAt': T0 + timedelta(days=i)}
+        if i % 5 == 0:
+            db.collection('subscriptions').docs[f'uid{i:03d}'] = {
+                'status': 'active', 'startDate': T0 + timedelta(days=i), 'updatedAt': T0 + timedelta(days=i)}
+    # trial_history documents carry no updatedAt
+    for i in range(0, users, 2):
+        db.collection('trial_history').docs[f't{i}'] = {'userId': f'uid{i:03d}', 'trialStartDate': T0}
+    return db
+
+
+def test_documents_round_trip_with_timestamps():
+    data = {'createdAt': T0, 'nested': {'at': T0.replace(tzinfo=None)}, 'tags': ['a', 1], 'none': None}
+    decoded = decode_document(encode_document(data))
+    assert decoded == data
+    assert decoded['createdAt'].tzinfo is not None
+
+
+def test_incremental_sync_copies_only_changes():
+    directory = tempfile.mkdtemp()
+    try:
+        db = seeded_db()
+        warehouse = Warehouse(os.path.join(directory, 'wh.sqlite3'), page_size=7)
+        first = {run['collection']: run for run in warehouse.sync(db)}
+        assert first['users']['mode'] == 'full' and first['users']['copied'] == 50
+        assert first['users']['watermark'] == (T0 + timedelta(days=49)).isoformat()
+
+        users = db.collection('users')
+        users.docs['uid010'] = {**users.docs['uid010'], 'emailVerified': False, 'updatedAt': T0 + timedelta(days=60)}
+        users.docs['uid050'] = {'email': 'new@example.com', 'updatedAt': T0 + timedelta(days=61)}
+        users.reads = 0
+        second = {run['collection']: run for run in warehouse.sync(db, ['users', 'subscriptions'])}
+        assert second['users']['mode'] == 'incremental'
+        # Only the boundary document (re-read and skipped) and the two changes
+        assert users.reads == 3
+        assert (second['users']['copied'], second['users']['unchanged']) == (2, 1)
+        assert second['subscriptions']['copied'] == 0
+
+        docs = {doc.id: doc.to_dict() for doc in warehouse.documents('users')}
+        assert len(docs) == 51 and docs['uid010']['emailVerified'] is False
+        projected = warehouse.documents('users', fields=('email',), where={'email': 'new@example.com'})
+        assert [(doc.id, doc.to_dict()) for doc in projected] == [('uid050', {'email': 'new@example.com'})]
+
+        # Deletions are only visible to the periodic full reconciliation
+        del users.docs['uid000']
+        assert warehouse.sync(db, ['users'])[0]['deleted'] == 0
+        full = warehouse.sync(db, ['users'], full=True)[0]
+        assert full['deleted'] == 1 and full['documents'] == 50
+
+        verified = warehouse.query(
+            "SELECT COUNT(*) AS n FROM documents WHERE collection = 'users' "
+            "AND json_extract(data, '$.emailVerified') = 1")
+        assert verified[0]['n'] == sum(1 for doc in users.docs.values() if doc.get('emailVerified'))
+        status = warehouse.status()['collections']
+        assert status['users']['documents'] == 50 and status['daily_token_usage']['last_sync'] is not None
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_collections_sync_on_their_own_watermark():
+    directory = tempfile.mkdtemp()
+    try:
+        db = seeded_db()
+        daily = db.collection('daily_token_usage')
+        for i in range(50):
+            daily.docs[f'uid{i:03d}_2025-06-{i % 28 + 1:02d}'] = {
+                'userId': f'uid{i:03d}', 'tokensUsed': i, 'lastUpdated': T0 + timedelta(hours=i)}
+        warehouse = Warehouse(os.path.join(directory, 'wh.sqlite3'))
+        first = {run['collection']: run for run in warehouse.sync(db, ['daily_token_usage', 'trial_history'])}
+        assert first['daily_token_usage']['watermark'] == (T0 + timedelta(hours=49)).isoformat()
+
+        daily.docs['uid001_2025-06-30'] = {'userId': 'uid001', 'tokensUsed': 7, 'lastUpdated': T0 + timedelta(days=3)}
+        trials = db.collection('trial_history')
+        daily.reads = trials.reads = 0
+        for _ in range(3):
+            runs = {run['collection']: run for run in warehouse.sync(db, ['daily_token_usage', 'trial_history'])}
+            assert runs['daily_token_usage']['mode'] == 'incremental'
+            # A collection without an update time waits for the scheduled reconciliation
+            assert runs['trial_history']['mode'] == 'skipped'
+        # The new document once, then only the boundary document per run
+        assert daily.reads == 2 + 1 + 1 and trials.reads == 0
+        assert warehouse.status()['collections']['daily_token_usage']['documents'] == 51
+
+        assert warehouse.sync(db, ['trial_history'], full=True)[0]['mode'] == 'full'
+        assert trials.reads == 25
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_snapshot_reads_from_the_warehouse():
+    directory = tempfile.mkdtemp()
+    try:
+        db = seeded_db()
+        warehouse = Warehouse(os.path.join(directory, 'wh.sqlite3'))
+        try:
+            WarehouseSnapshot(warehouse).users
+        except RuntimeError:
+            pass
+        else:
+            assert False, 'expected an unsynced warehouse to be refused'
+
+        warehouse.sync(db)
+        reads = db.documents_read()
+        snapshot = WarehouseSnapshot(warehouse, fields={'users': ('emailVerified',)}).prefetch('users', 'subscriptions')
+        assert db.documents_read() == reads
+        assert len(snapshot.users) == 50 and snapshot.users[0].to_dict() == {'emailVerified': False}
+        assert snapshot.verified_user_count == 33
+        assert snapshot.active_subscription_count == 10
+        assert snapshot.read_timings['users'].documents == 50
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    test_documents_round_trip_with_timestamps()
+    test_incremental_sync_copies_only_changes()
+    test_collections_sync_on_their_own_watermark()
+    test_snapshot_reads_from_the_warehouse()
+    print("All analytics warehouse tests passed")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared snapshot listeners of app.py (start_collection_watches) and
+the consumers they feed, the journey rows behind /api/users/changes among them.
+"""
+
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app_fixture import NOW, app, seeded_db, use_db
+from firestore_fakes import FakeCollection
+
+CONSUMERS = (app.alert_engine, app.subscription_state_index, app.geo_rollup, app.journey_rows)
+
+
+def restart_watches(db):
+    client = use_db(db)
+    app.collection_watches.clear()
+    app.collection_watches_started.clear()
+    for consumer in CONSUMERS:
+        consumer.live_sources.clear()
+    app.start_collection_watches()
+    return client
+
+
+def first_batches(db):
+    for name, collection in db.collections.items():
+        if collection.callback is not None:
+            collection.send(*[('ADDED', doc_id, data) for doc_id, data in collection.docs.items()])
+
+
+def test_one_listener_per_collection_feeds_every_consumer():
+    db = seeded_db()
+    restart_watches(db)
+    app.start_collection_watches()
+
+    # users, subscriptions and trial_history are each wanted by several consumers
+    assert set(app.collection_watches) == {'users', 'trial_history', 'subscriptions', 'payment_rollups',
+                                           'current_token_usage'}
+    assert all(collection.listeners == 1 for collection in db.collections.values() if collection.listeners)
+
+    first_batches(db)
+    assert all(consumer.live for consumer in CONSUMERS)
+    assert app.alert_engine.state.values['users_total'] == 40
+    assert sum(row['users'] for row in app.geo_rollup.rollup().values()) == 40
+
+    # Later changes reach every consumer through the same listener
+    db.collection('users').send(('ADDED', 'uid999', {'email': 'new@example.com', 'emailVerified': True,
+                                                     'country': 'Japan'}))
+    assert app.alert_engine.state.values['users_total'] == 41
+    assert sum(row['users'] for row in app.geo_rollup.rollup().values()) == 41
+    assert 'uid999' in app.journey_rows.rows
+
+
+def test_user_changes_are_fed_by_the_listeners():
+    db = seeded_db()
+    client = restart_watches(db)
+    first_batches(db)
+
+    full = client.get('/api/users/changes?refresh=true').get_json()
+    assert full['success'] and full['reset'] and len(full['changes']) == 40
+    assert db.documents_read() == {}
+    # The same rows a rebuild from reads gives
+    assert {row['user_id']: row for row in full['changes']} == dict(app.load_user_journeys())
+
+    db.collection('users').send(('MODIFIED', 'uid000', {**db.collection('users').docs['uid000'],
+                                                        'emailVerified': True}))
+    db.collection('token_usage_history').send(('MODIFIED', f'uid002_{NOW.year}_{NOW.month}',
+                                               {'userId': 'uid002', 'totalMonthlyTokens': 5000}))
+    db.collection('users').send(('REMOVED', 'uid003'))
+    db.collection('users').send(('ADDED', 'uid777', {'email': 'newcomer@example.com'}))
+
+    reads = db.documents_read()
+    delta = client.get(f"/api/users/changes?since={full['sync_token']}").get_json()
+    assert not delta['reset']
+    changed = {row['user_id']: row for row in delta['changes']}
+    assert set(changed) == {'uid000', 'uid002', 'uid777'}
+    assert changed['uid000']['email_verified'] is True
+    assert changed['uid002']['total_monthly_tokens'] == 5000
+    assert delta['tombstones'] == [{'user_id': 'uid003', 'deleted': True}]
+
+    found = client.get('/api/users/search?q=newcomer').get_json()
+    assert [row['user_id'] for row in found['results']] == ['uid777']
+    assert db.documents_read() == reads
+
+
+def test_usage_listener_follows_the_month():
+    db = seeded_db()
+    restart_watches(db)
+    first_batches(db)
+    assert app.journey_rows.live
+
+    # As if the watch had been started last month
+    app.collection_watches['current_token_usage'].name = 'token_usage_history 2000-01'
+    app.follow_usage_month()
+    usage = db.collection('token_usage_history')
+    assert usage.listeners == 2
+    assert not app.journey_rows.live
+
+    usage.send(('ADDED', 'uid001_next', {'userId': 'uid001', 'totalMonthlyTokens': 7}))
+    assert app.journey_rows.live
+    assert app.journey_rows.rows['uid001']['total_monthly_tokens'] == 7
+    assert app.journey_rows.rows['uid004']['total_monthly_tokens'] == 0
+
+
+def test_distinct_users_are_counted_without_reads_on_the_request_path():
+    db = seeded_db()
+    restart_watches(db)
+    first_batches(db)
+
+    # uid004 has an active subscription, uid002 only a trial
+    app.count_distinct_user('listener_users', 'uid004')
+    app.count_distinct_user('listener_users', 'uid002')
+    assert db.documents_read() == {}
+    assert app.usage_sketches.estimate('listener_users', NOW, NOW, 'userType') == {'subscribed': 1, 'trial': 1}
+
+    # Without the rollup the reads move to a background lookup
+    app.geo_rollup.live_sources.clear()
+    app.usage_dimension_cache.clear()
+    app.count_distinct_user('lookup_users', 'uid004')
+    deadline = time.time() + 5
+    while not app.usage_sketches.estimate('lookup_users', NOW, NOW) and time.time() < deadline:
+        time.sleep(0.01)
+    assert app.usage_sketches.estimate('lookup_users', NOW, NOW, 'userType') == {'subscribed': 1}
+    assert db.documents_read() == {'users': 1, 'subscriptions': 1}
+
+
+def test_consumers_fall_back_to_reads_without_listeners():
+    class Unlistenable(FakeCollection):
+        def on_snapshot(self, callback):
+            raise RuntimeError('listeners are not supported here')
+
+    db = seeded_db()
+    db.collections['subscriptions'] = Unlistenable('subscriptions', db.collection('subscriptions').docs)
+    client = restart_watches(db)
+    assert app.collection_watches == {}
+    assert not any(consumer.live_sources for consumer in CONSUMERS)
+    assert db.collection('users').callback is None
+
+    rebuilt = client.get('/api/users/changes?refresh=true').get_json()
+    assert rebuilt['success']
+    assert db.documents_read()['users'] == 40
+
+
+if __name__ == "__main__":
+    test_one_listener_per_collection_feeds_every_consumer()
+    test_user_changes_are_fed_by_the_listeners()
+    test_usage_listener_follows_the_month()
+    test_distinct_users_are_counted_without_reads_on_the_request_path()
+    test_consumers_fall_back_to_reads_without_listeners()
+    print("All collection watch tests passed")
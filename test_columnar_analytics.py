@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tests for the columnar analytics engine (analytics/columnar.py).
+
+The vectorised panels must return exactly what the old row-by-row loops
+returned, so they are checked against the reference implementations kept in
+analytics/benchmarks.py as well as a few hand-computed cases.
+"""
+
+import sys
+import os
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics import benchmarks, columnar
+from analytics.columnar import SubscriptionColumns, UserColumns
+from firestore_fakes import FakeSnapshot
+
+NOW = datetime(2025, 8, 15, 10, 30, 0)
+
+
+def test_mixed_timestamp_formats():
+    users = UserColumns.from_snapshots([
+        FakeSnapshot('a', {'createdAt': '2025-08-01T00:00:00Z', 'lastLoginAt': datetime(2025, 8, 9, 1, 0)}),
+        FakeSnapshot('b', {'createdAt': datetime(2025, 7, 3, 12, 0), 'lastLoginAt': None}),
+        FakeSnapshot('c', {'createdAt': 'not a date', 'emailVerified': True}),
+    ])
+
+    assert users.ids == ['a', 'b', 'c']
+    assert users.created_at[2] == columnar.MISSING
+    assert users.last_login[1] == columnar.MISSING
+    assert users.email_verified.tolist() == [False, False, True]
+
+
+def test_cohort_analysis_by_hand():
+    users = UserColumns.from_snapshots([
+        FakeSnapshot('a', {'createdAt': datetime(2025, 7, 1), 'lastLoginAt': datetime(2025, 7, 9)}),
+        FakeSnapshot('b', {'createdAt': datetime(2025, 7, 20)}),
+        FakeSnapshot('c', {'createdAt': datetime(2025, 8, 1), 'lastLoginAt': datetime(2025, 8, 2, 0, 0, 1)}),
+    ])
+
+    result = columnar.cohort_analysis(users, NOW)
+
+    assert result['total_cohorts'] == 2
+    july, august = result['cohorts']
+    assert july['cohort_month'] == '2025-07'
+    assert july['total_users'] == 2
+    assert july['retention_1_day'] == 50.0
+    assert july['retention_7_day'] == 50.0
+    assert july['retention_30_day'] == 0.0
+    assert july['months_since_launch'] == 1
+    assert august['retention_1_day'] == 100.0
+    assert result['average_retention_1_day'] == 75.0
+
+
+def test_subscription_trends_by_hand():
+    subscriptions = SubscriptionColumns.from_snapshots([
+        FakeSnapshot('s1', {'startDate': datetime(2025, 8, 2), 'isActive': True, 'status': 'active'}),
+        FakeSnapshot('s2', {'startDate': datetime(2025, 6, 10), 'isActive': False, 'cancelled': True,
+                            'willExpireAt': datetime(2025, 8, 10), 'status': 'cancelled'}),
+    ])
+
+    growth = columnar.subscription_growth_trends(subscriptions, NOW)
+    assert growth[-1] == {'month': '2025-08', 'new_subscriptions': 1, 'cancelled_subscriptions': 1, 'net_growth': 0}
+
+    revenue = columnar.revenue_trends(subscriptions, NOW)
+    assert revenue[-1]['active_subscriptions'] == 1
+    assert revenue[-1]['revenue'] == 3.0
+    assert subscriptions.status_is('cancelled').tolist() == [False, True]
+
+
+def test_matches_rowwise_reference():
+    records = benchmarks.synthetic_records(5000, NOW, seed=7)
+    users = UserColumns.from_records(records['users'])
+    subscriptions = SubscriptionColumns.from_records(records['subscriptions'])
+    created = benchmarks.column(records['users'], 'createdAt')
+    last_login = benchmarks.column(records['users'], 'lastLoginAt')
+    starts = benchmarks.column(records['subscriptions'], 'startDate')
+    will_expire = benchmarks.column(records['subscriptions'], 'willExpireAt')
+    prices = subscriptions.price.tolist()
+
+    assert columnar.cohort_analysis(users, NOW) == benchmarks.rowwise_cohort_analysis(created, last_login, NOW)
+    assert columnar.retention_metrics(users, NOW) == benchmarks.rowwise_retention_metrics(last_login, NOW)
+    assert columnar.weekly_trend_report(users, subscriptions, NOW) == \
+        benchmarks.rowwise_weekly_trend_report(created, starts, prices, NOW)
+    assert columnar.revenue_trends(subscriptions, NOW) == \
+        benchmarks.rowwise_revenue_trends(starts, subscriptions.is_active.tolist(), prices, NOW)
+    assert columnar.subscription_growth_trends(subscriptions, NOW) == \
+        benchmarks.rowwise_subscription_growth_trends(
+            starts, subscriptions.cancelled.tolist(), will_expire, NOW)
+
+
+def test_empty_collections():
+    users = UserColumns.from_snapshots([])
+    subscriptions = SubscriptionColumns.from_snapshots([])
+
+    assert columnar.cohort_analysis(users, NOW)['cohorts'] == []
+    assert columnar.retention_metrics(users, NOW) == {'retention_7_day': 0, 'retention_30_day': 0, 'retention_90_day': 0}
+    assert all(day['new_users'] == 0 for day in columnar.weekly_trend_report(users, subscriptions, NOW))
+
+
+if __name__ == "__main__":
+    test_mixed_timestamp_formats()
+    test_cohort_analysis_by_hand()
+    test_subscription_trends_by_hand()
+    test_matches_rowwise_reference()
+    test_empty_collections()
+    print("All columnar analytics tests passed")
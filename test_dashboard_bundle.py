@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Tests for the one-request dashboard bundle (/api/dashboard/bundle in app.py).
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app_fixture import app, seeded_db, use_db
+
+
+def test_bundle_returns_every_panel():
+    client = use_db(seeded_db())
+    body = client.get('/api/dashboard/bundle').get_json()
+
+    assert body['success']
+    assert set(body['panels']) == set(app.DASHBOARD_PANELS) == set(body['timings_ms'])
+    assert all(panel['success'] for panel in body['panels'].values()), body['panels']
+    assert body['panels']['stats']['stats']['total_users'] == 40
+    assert body['panels']['users']['total_users'] == 40
+    # A bundled panel is what its own endpoint returns
+    assert body['panels']['stats'] == client.get('/api/stats').get_json()
+    assert body['panels']['cohort'] == client.get('/api/analytics/cohort').get_json()
+    assert {'total_ms', 'generated_at', 'reads_ms'} <= set(body)
+
+
+def test_panels_filter_and_unknown_panels():
+    client = use_db(seeded_db())
+    body = client.get('/api/dashboard/bundle?panels=stats, cohort').get_json()
+    assert set(body['panels']) == {'stats', 'cohort'}
+
+    response = client.get('/api/dashboard/bundle?panels=stats,nope')
+    assert response.status_code == 400
+    body = response.get_json()
+    assert not body['success'] and 'nope' in body['error']
+    assert body['available_panels'] == list(app.DASHBOARD_PANELS)
+
+
+def test_bundle_reads_each_collection_once():
+    db = seeded_db()
+    client = use_db(db)
+    body = client.get('/api/dashboard/bundle?panels=stats,users,revenue,retention,cohort,user-behavior').get_json()
+    assert all(panel['success'] for panel in body['panels'].values()), body['panels']
+
+    # Every panel read the same snapshot: each document was read once, whatever the number of panels
+    assert db.documents_read() == {name: len(collection.docs) for name, collection in db.collections.items()}
+    assert set(body['reads_ms']) == {'users', 'trials', 'subscriptions', 'current_token_usage'}
+
+
+if __name__ == "__main__":
+    test_bundle_returns_every_panel()
+    test_panels_filter_and_unknown_panels()
+    test_bundle_reads_each_collection_once()
+    print("All dashboard bundle tests passed")
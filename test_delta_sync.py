@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Tests for the delta-sync change journal (analytics/changes.py).
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics.changes import ChangeJournal
+
+
+def journeys(count, **overrides):
+    rows = {f'uid{i:03d}': {'user_id': f'uid{i:03d}', 'status': 'Free User', 'tokens': 0} for i in range(count)}
+    for user_id, changes in overrides.items():
+        rows[user_id] = {**rows[user_id], **changes}
+    return rows
+
+
+def apply(copy, delta):
+    """What a client does with a response"""
+    if delta['reset']:
+        copy.clear()
+    for row in delta['changes']:
+        copy[row['user_id']] = row
+    for user_id in delta['deleted']:
+        copy.pop(user_id, None)
+
+
+def test_only_changed_records_are_returned():
+    journal = ChangeJournal()
+    assert journal.sync(journeys(50).items()) == 50
+    token = journal.token()
+
+    # A rebuild that changes nothing records nothing
+    assert journal.sync(journeys(50).items()) == 0
+    assert journal.changes(token) == {'changes': [], 'deleted': [], 'token': token, 'reset': False,
+                                      'has_more': False}
+
+    rows = journeys(50, uid003={'status': 'Trial User'}, uid010={'tokens': 1200})
+    del rows['uid020']
+    assert journal.sync(rows.items()) == 3
+    delta = journal.changes(token)
+    assert [row['user_id'] for row in delta['changes']] == ['uid003', 'uid010']
+    assert delta['deleted'] == ['uid020']
+    assert not delta['reset'] and delta['token'] != token
+
+    # The new token is caught up; a user coming back is an upsert again
+    assert journal.changes(delta['token'])['changes'] == []
+    journal.sync(journeys(50, uid003={'status': 'Trial User'}, uid010={'tokens': 1200}).items())
+    again = journal.changes(delta['token'])
+    assert [row['user_id'] for row in again['changes']] == ['uid020'] and again['deleted'] == []
+
+
+def test_clients_converge_through_deltas():
+    journal = ChangeJournal()
+    journal.sync(journeys(30).items())
+    client = {}
+    apply(client, journal.changes(None))
+    token = journal.token()
+
+    for step in range(1, 6):
+        rows = journeys(30 + step, **{f'uid{step:03d}': {'status': 'Premium Subscriber'}})
+        for gone in range(step):
+            rows.pop(f'uid{20 + gone:03d}', None)
+        journal.sync(rows.items())
+        delta = journal.changes(token)
+        apply(client, delta)
+        token = delta['token']
+        assert client == rows
+
+
+def test_paging_with_limit():
+    journal = ChangeJournal()
+    journal.sync(journeys(10).items())
+    token = journal.token()
+    journal.sync(journeys(10, **{f'uid{i:03d}': {'tokens': i} for i in range(1, 8)}).items())
+
+    seen = []
+    while True:
+        page = journal.changes(token, limit=3)
+        seen += [row['user_id'] for row in page['changes']]
+        token = page['token']
+        if not page['has_more']:
+            break
+    assert seen == [f'uid{i:03d}' for i in range(1, 8)]
+
+
+def test_unusable_tokens_get_a_reset():
+    journal = ChangeJournal(tombstone_limit=2)
+    journal.sync(journeys(10).items())
+    old = journal.token()
+
+    for token in (None, '', 'garbage', f'{journal.epoch}.999', 'ffff.1', ChangeJournal().token()):
+        delta = journal.changes(token)
+        assert delta['reset'] and len(delta['changes']) == 10
+
+    # Forgetting a tombstone a token has not seen forces that token to reset
+    rows = journeys(10)
+    for user_id in ('uid000', 'uid001', 'uid002'):
+        del rows[user_id]
+        journal.sync(rows.items())
+    stale = journal.changes(old)
+    assert stale['reset'] and len(stale['changes']) == 7 and stale['deleted'] == []
+    assert journal.status()['tombstones'] == 2
+
+
+if __name__ == "__main__":
+    test_only_changed_records_are_returned()
+    test_clients_converge_through_deltas()
+    test_paging_with_limit()
+    test_unusable_tokens_get_a_reset()
+    print("All delta sync tests passed")
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Tests for background export jobs (analytics/export_jobs.py).
+"""
+
+import sys
+import os
+import csv
+import json
+import tempfile
+import time
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics import export
+from analytics.export_jobs import ExportJobManager, ExportSource
+from firestore_fakes import FakeDb, FakeSnapshot
+
+
+class WorkerKilled(BaseException):
+    """Stands in for the process dying mid-export"""
+
+
+def make_docs(count):
+    return {f'u{i:06d}': {'email': f'user{i}@example.com', 'emailVerified': i % 3 == 0} for i in range(count)}
+
+
+def user_row(doc):
+    data = doc.to_dict()
+    return {'user_id': doc.id, 'email': data['email'], 'email_verified': data['emailVerified']}
+
+
+def wait_for(manager, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'job {job_id} did not finish')
+
+
+def make_manager(directory, docs, build_row=user_row, **options):
+    sources = {'users': ExportSource('users', ('email', 'emailVerified'), build_row)}
+    return ExportJobManager(FakeDb({'users': docs}), sources, directory=directory, **options)
+
+
+def test_job_writes_csv_artifact():
+    docs = make_docs(500)
+    with tempfile.TemporaryDirectory() as directory:
+        manager = make_manager(directory, docs)
+        job, deduplicated = manager.create('users', 'csv')
+        assert not deduplicated
+        assert job['status'] == 'queued'
+
+        job = wait_for(manager, job['id'])
+        assert job['status'] == 'done', job['error']
+        assert job['documents'] == 500
+        assert 'checkpoint' not in manager.public(job)
+
+        with open(manager.artifact_path(job), newline='') as f:
+            rows = list(csv.DictReader(f))
+        assert sorted(row['user_id'] for row in rows) == sorted(docs)
+        assert job['size'] == os.path.getsize(manager.artifact_path(job))
+
+
+def test_identical_exports_are_deduplicated():
+    with tempfile.TemporaryDirectory() as directory:
+        manager = make_manager(directory, make_docs(50))
+        first, _ = manager.create('users', 'ndjson')
+        wait_for(manager, first['id'])
+
+        again, deduplicated = manager.create('users', 'ndjson')
+        assert deduplicated and again['id'] == first['id']
+
+        other, deduplicated = manager.create('users', 'csv')
+        assert not deduplicated and other['id'] != first['id']
+
+        expired = make_manager(directory, make_docs(50), dedup_minutes=0)
+        time.sleep(0.01)
+        fresh, deduplicated = expired.create('users', 'ndjson')
+        assert not deduplicated and fresh['id'] != first['id']
+
+        wait_for(manager, other['id'])
+        wait_for(expired, fresh['id'])
+
+
+def test_unknown_type_and_format_are_rejected():
+    with tempfile.TemporaryDirectory() as directory:
+        manager = make_manager(directory, {})
+        for export_type, format_type in (('payments', 'csv'), ('users', 'xlsx')):
+            try:
+                manager.create(export_type, format_type)
+            except ValueError:
+                pass
+            else:
+                assert False, f'expected {export_type}/{format_type} to be rejected'
+        assert manager.get('../etc/passwd') is None
+
+
+def test_restarted_job_resumes_from_checkpoint():
+    docs = make_docs(30000)
+    built = []
+
+    def dying_row(doc):
+        built.append(doc.id)
+        if len(built) == 12000:
+            raise WorkerKilled()
+        return user_row(doc)
+
+    with tempfile.TemporaryDirectory() as directory:
+        first = make_manager(directory, docs, build_row=dying_row, progress_seconds=0)
+        job, _ = first.create('users', 'csv')
+        first._pool.shutdown(wait=True)
+
+        interrupted = first.get(job['id'])
+        assert interrupted['status'] == 'running'
+        assert 0 < interrupted['documents'] < len(docs)
+
+        restarted = make_manager(directory, docs, progress_seconds=0)
+        assert restarted.recover() == 1
+        job = wait_for(restarted, job['id'])
+        assert job['status'] == 'done', job['error']
+        assert job['attempts'] == 2
+
+        with open(restarted.artifact_path(job), newline='') as f:
+            lines = f.read().splitlines()
+        assert lines.count('user_id,email,email_verified') == 1
+        ids = [line.split(',')[0] for line in lines[1:]]
+        assert sorted(ids) == sorted(docs)
+
+
+def test_ndjson_artifact_matches_streamed_export():
+    docs = make_docs(200)
+    with tempfile.TemporaryDirectory() as directory:
+        manager = make_manager(directory, docs)
+        job, _ = manager.create('users', 'ndjson')
+        job = wait_for(manager, job['id'])
+        with open(manager.artifact_path(job)) as f:
+            written = sorted((json.loads(line) for line in f), key=lambda row: row['user_id'])
+
+    expected = [user_row(FakeSnapshot(doc_id, docs[doc_id])) for doc_id in sorted(docs)]
+    assert written == expected
+    assert ''.join(export.ndjson_chunks(iter(expected))).count('\n') == len(written)
+
+
+def test_expired_jobs_and_stray_files_are_deleted():
+    with tempfile.TemporaryDirectory() as directory:
+        manager = make_manager(directory, make_docs(20), ttl_hours=1)
+        job, _ = manager.create('users', 'csv')
+        job = wait_for(manager, job['id'])
+        stray = os.path.join(directory, 'users_export_0badf00d.csv.part')
+        open(stray, 'w').close()
+
+        assert manager.cleanup() == 0
+        assert manager.get(job['id']) is not None and os.path.exists(stray)
+
+        later = datetime.now() + timedelta(hours=2)
+        assert manager.cleanup(later) == 1
+        assert manager.get(job['id']) is None
+        assert not os.path.exists(manager.artifact_path(job)) and not os.path.exists(stray)
+        assert sorted(os.listdir(directory)) == ['.create.lock']
+
+
+if __name__ == "__main__":
+    test_job_writes_csv_artifact()
+    test_identical_exports_are_deduplicated()
+    test_unknown_type_and_format_are_rejected()
+    test_restarted_job_resumes_from_checkpoint()
+    test_ndjson_artifact_matches_streamed_export()
+    test_expired_jobs_and_stray_files_are_deleted()
+    print("All export job tests passed")
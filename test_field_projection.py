@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Tests for projected Firestore reads (analytics/fields.py, loader.project and
+the byte estimates reported per endpoint).
+"""
+
+import sys
+import os
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics import fields
+from analytics.loader import (endpoint_read_volume, estimate_document_bytes, estimate_read_bytes,
+                              project, record_endpoint_reads, ReadTiming)
+from analytics.snapshot import DashboardSnapshot
+from firestore_fakes import FakeCollection, FakeDb, FakeSnapshot
+
+
+def test_merge_unions_fields_in_order():
+    merged = fields.merge(
+        fields.ids_only('users', 'trials'),
+        fields.VERIFIED_USER_COUNT,
+        {'subscriptions': ('status', 'cancelled')},
+        {'subscriptions': ('cancelled', 'startDate')},
+    )
+
+    assert merged == {
+        'users': ('emailVerified',),
+        'trials': (),
+        'subscriptions': ('status', 'cancelled', 'startDate'),
+    }
+
+
+def test_empty_projection_fetches_names_only():
+    assert project(FakeCollection(), ()).selected == ['__name__']
+    assert project(FakeCollection(), ('email',)).selected == ['email']
+
+
+def test_snapshot_reads_only_manifest_fields():
+    db = FakeDb({
+        'users': {
+            'u1': {'email': 'a@example.com', 'emailVerified': True, 'fcmToken': 'x' * 500},
+            'u2': {'email': 'b@example.com', 'emailVerified': False, 'fcmToken': 'y' * 500},
+        },
+    })
+    snapshot = DashboardSnapshot(db, fields=fields.VERIFIED_USER_COUNT).prefetch('users')
+
+    assert [doc.to_dict() for doc in snapshot.users] == [{'emailVerified': True}, {'emailVerified': False}]
+    assert snapshot.verified_user_count == 1
+
+    full = DashboardSnapshot(FakeDb({'users': db.collection('users').docs})).prefetch('users')
+    assert snapshot.read_timings['users'].bytes < full.read_timings['users'].bytes / 5
+
+
+def test_document_size_estimate():
+    doc = FakeSnapshot('u1', {'email': 'a@b.co', 'emailVerified': True, 'createdAt': datetime(2025, 1, 1)})
+    # 32 + 16 + name 'u1' (3) + email (6 + 7) + emailVerified (14 + 1) + createdAt (10 + 8)
+    assert estimate_document_bytes(doc) == 97
+    assert estimate_read_bytes([doc] * 1000) == 97 * 1000
+    assert estimate_read_bytes([]) == 0
+
+
+def test_endpoint_read_volume_accumulates():
+    record_endpoint_reads('/api/test-volume', {'users': ReadTiming('users', 0.01, 10, 1000)})
+    record_endpoint_reads('/api/test-volume', {'users': ReadTiming('users', 0.01, 10, 3000)})
+
+    volume = endpoint_read_volume()['/api/test-volume']
+    assert volume['requests'] == 2
+    assert volume['documents'] == 20
+    assert volume['bytes'] == 4000
+    assert volume['last_bytes'] == 3000
+    assert volume['bytes_per_request'] == 2000
+
+
+if __name__ == "__main__":
+    test_merge_unions_fields_in_order()
+    test_empty_projection_fetches_names_only()
+    test_snapshot_reads_only_manifest_fields()
+    test_document_size_estimate()
+    test_endpoint_read_volume_accumulates()
+    print("All field projection tests passed")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tests for country classification and the per-country rollup (analytics/geo.py).
+"""
+
+import sys
+import os
+import random
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics.columnar import plan_price
+from analytics.geo import UNKNOWN, GeoRollup, classify_country, country_name, normalize_country
+
+COUNTRIES = ('Saudi Arabia', 'uae', 'JP', 'ph', None)
+
+
+def test_classification():
+    assert normalize_country(' United Arab Emirates ') == 'AE' and normalize_country('uk') == 'GB'
+    assert normalize_country('ph') == 'PH' and normalize_country('Atlantis') is None and normalize_country(3) is None
+    # The profile country wins over a stored code, which wins over the email domain
+    assert classify_country({'country': 'KSA', 'countryCode': 'JP'}) == 'SA'
+    assert classify_country({'countryCode': 'jp', 'email': 'a@gmail.com'}) == 'JP'
+    assert classify_country({'email': 'A@Gmail.com'}) == UNKNOWN and classify_country({}) == UNKNOWN
+    assert country_name('SA') == 'Saudi Arabia' and country_name('PH') == 'Other' and country_name(UNKNOWN) == 'Other'
+
+
+def expected_rollup(users, subscriptions):
+    """Per-country counts from scratch, joining subscriptions by uid document id"""
+    counts = {}
+    for uid, data in users.items():
+        row = counts.setdefault(classify_country(data), {'users': 0, 'verified': 0, 'subscribed': 0, 'mrr': 0.0})
+        subscription = subscriptions.get(uid, {})
+        row['users'] += 1
+        row['verified'] += bool(data.get('emailVerified'))
+        row['subscribed'] += bool(subscription.get('isActive'))
+        row['mrr'] += plan_price(subscription.get('plan')) if subscription.get('isActive') else 0.0
+    return dict(sorted(counts.items()))
+
+
+def test_incremental_rollup_matches_a_recount():
+    rng = random.Random(8)
+    users, subscriptions = {}, {}
+    rollup = GeoRollup()
+    for _ in range(2000):
+        uid = f'u{rng.randrange(80)}'
+        if rng.random() < 0.6:
+            if uid in users and rng.random() < 0.2:
+                del users[uid]
+                rollup.apply('users', [(uid, None)])
+            else:
+                users[uid] = {'email': f'{uid}@gmail.com', 'country': rng.choice(COUNTRIES),
+                              'emailVerified': rng.random() < 0.5}
+                rollup.apply('users', [(uid, users[uid])])
+        else:
+            if uid in subscriptions and rng.random() < 0.2:
+                del subscriptions[uid]
+                rollup.apply('subscriptions', [(uid, None)])
+            else:
+                subscriptions[uid] = {'userId': uid, 'isActive': rng.random() < 0.5,
+                                      'plan': rng.choice(('monthly', 'annual'))}
+                rollup.apply('subscriptions', [(uid, subscriptions[uid])])
+    assert rollup.rollup() == expected_rollup(users, subscriptions)
+
+    # A sync to a full read leaves the same counts as applying the differences
+    fresh = GeoRollup()
+    fresh.sync('subscriptions', subscriptions.items())
+    fresh.sync('users', list(users.items()) + [('ghost', {'country': 'JP'})])
+    fresh.sync('users', users.items())
+    assert fresh.rollup() == rollup.rollup()
+    assert fresh.status()['users'] == len(users) and not fresh.live
+
+
+if __name__ == "__main__":
+    test_classification()
+    test_incremental_rollup_matches_a_recount()
+    print("All geographic rollup tests passed")
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Tests for the ETag/304, Cache-Control and compression middleware
+(analytics/http_cache.py).
+"""
+
+import sys
+import os
+import gzip
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask, Response, jsonify
+
+from analytics.http_cache import ResponseCache
+
+app = Flask(__name__)
+# A rollup kept by listeners: the handler is only needed when its version moves
+rollup = {'version': 1, 'countries': {'PH': 10}, 'builds': 0}
+cache = ResponseCache(app, max_age={'/api/users': 30}, versions={'/api/rollup': lambda: rollup['version']},
+                      min_size=512)
+payload = {'users': [{'user_id': f'user_{i}', 'email': f'user{i}@example.com'} for i in range(200)]}
+
+
+@app.route('/api/users')
+def users():
+    return jsonify(payload)
+
+
+@app.route('/api/stats')
+def stats():
+    return jsonify({'total_users': len(payload['users'])})
+
+
+@app.route('/api/rollup')
+def rollup_panel():
+    rollup['builds'] += 1
+    return jsonify(rollup['countries'])
+
+
+@app.route('/api/export')
+def export():
+    return Response(iter([b'a,b\n'] * 1000), mimetype='text/csv', direct_passthrough=True)
+
+
+@app.route('/')
+def page():
+    return '<html>' + 'x' * 5000 + '</html>'
+
+
+client = app.test_client()
+
+
+def test_etag_and_not_modified():
+    first = client.get('/api/users')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert etag.startswith('W/"')
+    assert first.headers['Cache-Control'] == 'private, max-age=30'
+
+    again = client.get('/api/users', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+    assert again.headers['ETag'] == etag
+
+    stale = client.get('/api/users', headers={'If-None-Match': 'W/"something-else"'})
+    assert stale.status_code == 200
+
+
+def test_routes_without_max_age_revalidate():
+    response = client.get('/api/stats')
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+    assert 'Content-Encoding' not in response.headers  # below min_size
+
+
+def test_large_responses_are_gzipped():
+    plain = client.get('/api/users')
+    compressed = client.get('/api/users', headers={'Accept-Encoding': 'gzip, deflate'})
+
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert gzip.decompress(compressed.data) == plain.data
+    assert len(compressed.data) < len(plain.data) / 3
+    # The same content keeps the same ETag whatever the encoding
+    assert compressed.headers['ETag'] == plain.headers['ETag']
+
+
+def test_last_modified_follows_content_changes():
+    first = client.get('/api/users')
+    assert client.get('/api/users').headers['Last-Modified'] == first.headers['Last-Modified']
+    since = client.get('/api/users', headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert since.status_code == 304
+
+    payload['users'].append({'user_id': 'user_new', 'email': 'new@example.com'})
+    try:
+        changed = client.get('/api/users', headers={'If-None-Match': first.headers['ETag']})
+        assert changed.status_code == 200
+        assert changed.headers['ETag'] != first.headers['ETag']
+    finally:
+        payload['users'].pop()
+
+
+def test_versioned_routes_answer_304_before_the_handler():
+    first = client.get('/api/rollup')
+    assert first.status_code == 200 and rollup['builds'] == 1
+    not_modified = cache.stats['not_modified']
+
+    again = client.get('/api/rollup', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304 and again.headers['ETag'] == first.headers['ETag']
+    assert again.headers['Cache-Control'] == 'private, no-cache'
+    assert rollup['builds'] == 1 and cache.stats['not_modified'] == not_modified + 1
+
+    # A new version runs the handler; the same content still revalidates
+    rollup['version'] += 1
+    moved = client.get('/api/rollup', headers={'If-None-Match': first.headers['ETag']})
+    assert moved.status_code == 304 and rollup['builds'] == 2
+    rollup['countries']['AE'] = 3
+    rollup['version'] += 1
+    changed = client.get('/api/rollup', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200 and rollup['builds'] == 3
+    assert changed.headers['ETag'] != first.headers['ETag']
+
+
+def test_streamed_and_other_responses_are_untouched():
+    streamed = client.get('/api/export', headers={'Accept-Encoding': 'gzip'})
+    assert 'ETag' not in streamed.headers
+    assert 'Content-Encoding' not in streamed.headers
+    assert streamed.data.count(b'\n') == 1000
+
+    page_response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert 'ETag' not in page_response.headers
+
+    missing = client.get('/api/nope')
+    assert missing.status_code == 404 and 'ETag' not in missing.headers
+
+
+if __name__ == "__main__":
+    test_etag_and_not_modified()
+    test_routes_without_max_age_revalidate()
+    test_large_responses_are_gzipped()
+    test_last_modified_follows_content_changes()
+    test_versioned_routes_answer_304_before_the_handler()
+    test_streamed_and_other_responses_are_untouched()
+    print("All HTTP cache tests passed")
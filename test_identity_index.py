@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tests for the cross-collection identity index (analytics/identity.py).
+"""
+
+import sys
+import os
+import random
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics.identity import IdentityIndex
+
+USERS = [
+    ('u1', {'email': 'a@x.com'}),
+    ('u2', {'email': 'b@x.com'}),
+    ('u3', {'email': 'c@x.com'}),
+    ('u4', {}),
+]
+TRIALS = [
+    ('t1', {'userId': 'u1'}),
+    ('b@x.com', {}),                    # older trials are keyed by email
+    ('t0', {'userId': 'u2'}),           # userId wins over the email key
+    ('t9', {'email': 'c@x.com'}),
+]
+SUBSCRIPTIONS = [
+    ('u1', {'userId': 'u1', 'email': 'a@x.com'}),
+    ('s2', {'email': 'b@x.com'}),
+    ('c@x.com', {}),
+    ('s1', {'email': 'c@x.com'}),       # the email document id comes first
+]
+
+
+def test_joins_follow_the_resolution_order():
+    index = IdentityIndex.from_records(USERS, TRIALS, SUBSCRIPTIONS)
+    assert [index.trial_id(uid) for uid in ('u1', 'u2', 'u3', 'u4')] == ['t1', 't0', 't9', None]
+    assert [index.subscription_id(uid) for uid in ('u1', 'u2', 'u3', 'u4')] == ['u1', 's2', 'c@x.com', None]
+    assert index.email_of('u1') == 'a@x.com' and index.email_of('u4') is None
+    assert index.uids_for_email('b@x.com') == ['u2'] and len(index) == 4
+    # An explicit email overrides the indexed one (users read from elsewhere)
+    assert index.subscription_id('u9', 'b@x.com') == 's2'
+    assert index.owners('trials', 'b@x.com') == [] and index.owners('subscriptions', 's2') == ['u2']
+
+
+def test_incremental_updates_match_a_rebuild():
+    rng = random.Random(4)
+    emails = [f'{n}@x.com' for n in range(12)]
+    documents = {'users': {}, 'trials': {}, 'subscriptions': {}}
+    index = IdentityIndex()
+
+    def random_document(source):
+        data = {}
+        if rng.random() < 0.5:
+            data['userId'] = f'u{rng.randrange(15)}'
+        if rng.random() < 0.5 or source == 'users':
+            data['email'] = rng.choice(emails)
+        return data
+
+    for _ in range(1500):
+        source = rng.choice(tuple(documents))
+        doc_id = rng.choice((f'u{rng.randrange(15)}', f'd{rng.randrange(15)}', rng.choice(emails)))
+        if source == 'users':
+            doc_id = f'u{rng.randrange(15)}'
+        before = {uid: (index.trial_id(uid), index.subscription_id(uid)) for uid in documents['users']}
+        if doc_id in documents[source] and rng.random() < 0.3:
+            del documents[source][doc_id]
+            touched = index.apply(source, [(doc_id, None)])
+        else:
+            documents[source][doc_id] = random_document(source)
+            touched = index.apply(source, [(doc_id, documents[source][doc_id])])
+        # Every user whose join moved is reported
+        for uid in documents['users']:
+            if uid in before and before[uid] != (index.trial_id(uid), index.subscription_id(uid)):
+                assert uid in touched
+
+    rebuilt = IdentityIndex.from_records(*(documents[source].items() for source in ('users', 'trials', 'subscriptions')))
+    for uid in documents['users']:
+        assert index.trial_id(uid) == rebuilt.trial_id(uid)
+        assert index.subscription_id(uid) == rebuilt.subscription_id(uid)
+    assert index.users_by_email == rebuilt.users_by_email
+
+
+if __name__ == "__main__":
+    test_joins_follow_the_resolution_order()
+    test_incremental_updates_match_a_rebuild()
+    print("All identity index tests passed")
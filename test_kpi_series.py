@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Tests for the daily KPI time series (analytics/kpi.py).
+"""
+
+import sys
+import os
+import random
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics import columnar
+from analytics.columnar import SubscriptionColumns, UserColumns
+from analytics.kpi import (KpiSeries, backfill_daily_kpis, record_daily_kpis, revenue_trends,
+                           subscription_growth_trends, weekly_trends)
+from firestore_fakes import FakeSnapshot
+
+# Just after midnight, so the trend windows (which run to the 1st of the next
+# month at the time of day of "now") line up with calendar months
+NOW = datetime(2025, 6, 15, 0, 10)
+
+
+class KpiSnapshot:
+    """The parts of a DashboardSnapshot the KPI job reads"""
+
+    def __init__(self, users, subscriptions, trials, tokens, now):
+        self.user_columns = UserColumns.from_records(users.items())
+        self.subscription_columns = SubscriptionColumns.from_records(subscriptions.items())
+        self.trials = [FakeSnapshot(doc_id, data) for doc_id, data in trials.items()]
+        self.current_token_usage = [FakeSnapshot('usage', {'totalMonthlyTokens': tokens})]
+        self.now = now
+
+
+def fake_data(seed=5, users=400):
+    rng = random.Random(seed)
+    user_docs, subscription_docs, trial_docs = {}, {}, {}
+    for i in range(users):
+        created = NOW - timedelta(days=rng.randint(0, 200), hours=rng.randint(0, 23))
+        user_docs[f'u{i}'] = {
+            'createdAt': created,
+            'lastLoginAt': created + (NOW - created) * rng.random(),
+            'emailVerified': i % 3 != 0,
+            'emailVerifiedAt': created + timedelta(hours=1),
+        }
+        if i % 4 == 0:
+            trial_docs[f't{i}'] = {'trialStartDate': created + timedelta(hours=2)}
+        if i % 5 == 0:
+            start = created + timedelta(days=1)
+            if start > NOW:
+                continue
+            cancelled = i % 15 == 0
+            subscription_docs[f'u{i}'] = {
+                'status': 'cancelled' if cancelled else 'active',
+                'isActive': not cancelled,
+                'cancelled': cancelled,
+                'startDate': start,
+                # Only past expiries: the series only sees cancellations that have happened
+                'willExpireAt': start + (NOW - start) * rng.random(),
+            }
+    return user_docs, subscription_docs, trial_docs
+
+
+def test_append_only_series():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'kpi', 'daily.ndjson')
+        writer, reader = KpiSeries(path), KpiSeries(path)
+        assert reader.latest() is None and reader.range() == []
+
+        writer.append([{'date': '2025-06-02', 'mrr': 3.0}, {'date': '2025-06-01', 'mrr': 0.0}])
+        assert [row['date'] for row in reader.range()] == ['2025-06-01', '2025-06-02']
+
+        # A later row for a day supersedes the earlier one; readers only read the new tail
+        writer.append([{'date': '2025-06-02', 'mrr': 6.0}, {'date': '2025-06-03', 'mrr': 9.0}])
+        assert reader.get('2025-06-02')['mrr'] == 6.0
+        assert [row['mrr'] for row in reader.range('2025-06-02', '2025-06-05')] == [6.0, 9.0]
+        assert reader.latest()['date'] == '2025-06-03' and reader.first_day() == '2025-06-01'
+
+        # A partially written line is left for the next read
+        with open(path, 'a', encoding='utf-8') as handle:
+            handle.write('{"date": "2025-06-04"')
+        assert len(reader) == 3
+        with open(path, 'a', encoding='utf-8') as handle:
+            handle.write(', "mrr": 12.0}\n')
+        assert reader.get('2025-06-04')['mrr'] == 12.0
+
+        assert writer.compact() == 4
+        with open(path, encoding='utf-8') as handle:
+            assert len(handle.readlines()) == 4
+        assert [row['mrr'] for row in reader.range()] == [0.0, 6.0, 9.0, 12.0]
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_daily_rows_match_the_documents():
+    users, subscriptions, trials = fake_data()
+    directory = tempfile.mkdtemp()
+    try:
+        series = KpiSeries(os.path.join(directory, 'daily.ndjson'))
+        yesterday_noon = NOW - timedelta(hours=12)
+        record_daily_kpis(series, KpiSnapshot(users, subscriptions, trials, 1000, yesterday_noon))
+        partial = series.get((NOW - timedelta(days=1)).date())
+        assert partial['final'] is False and partial['tokens_month'] == 1000
+
+        today = record_daily_kpis(series, KpiSnapshot(users, subscriptions, trials, 1600, NOW))
+        final = series.get((NOW - timedelta(days=1)).date())
+        # Yesterday is closed with its last activity and token readings
+        assert final['final'] is True and final['dau'] == partial['dau'] and final['tokens_month'] == 1000
+        assert today['tokens_today'] == 600
+
+        day_start = datetime.combine(NOW.date(), datetime.min.time())
+        expected = {
+            'total_users': sum(1 for u in users.values() if u['createdAt'] <= NOW),
+            'new_users': sum(1 for u in users.values() if day_start <= u['createdAt'] <= NOW),
+            'verified_users': sum(1 for u in users.values() if u['emailVerified'] and u['emailVerifiedAt'] <= NOW),
+            'total_trials': sum(1 for t in trials.values() if t['trialStartDate'] <= NOW),
+            'active_subscriptions': sum(1 for s in subscriptions.values() if s['status'] == 'active'),
+            'cancelled_subscriptions': sum(1 for s in subscriptions.values() if s['cancelled']),
+            'mrr': sum(3.0 for s in subscriptions.values() if s['isActive']),
+            'dau': sum(1 for u in users.values() if day_start <= u['lastLoginAt'] <= NOW),
+            'wau': sum(1 for u in users.values() if day_start - timedelta(days=6) <= u['lastLoginAt'] <= NOW),
+        }
+        assert {field: today[field] for field in expected} == expected
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_trends_from_the_series_match_the_documents():
+    users, subscriptions, trials = fake_data()
+    snapshot = KpiSnapshot(users, subscriptions, trials, 0, NOW)
+    windows = columnar.trailing_month_windows(NOW)
+    directory = tempfile.mkdtemp()
+    try:
+        series = KpiSeries(os.path.join(directory, 'daily.ndjson'))
+        assert revenue_trends(series, windows, NOW) is None
+        assert subscription_growth_trends(series, windows, NOW) is None
+        assert weekly_trends(series, NOW) is None
+
+        assert backfill_daily_kpis(series, snapshot, 200) == 200
+        assert backfill_daily_kpis(series, snapshot, 200) == 0
+        record_daily_kpis(series, snapshot)
+
+        subscription_columns = snapshot.subscription_columns
+        assert revenue_trends(series, windows, NOW) == columnar.revenue_trends(subscription_columns, NOW)
+        assert subscription_growth_trends(series, windows, NOW) == \
+            columnar.subscription_growth_trends(subscription_columns, NOW)
+        assert weekly_trends(series, NOW) == \
+            columnar.weekly_trend_report(snapshot.user_columns, subscription_columns, NOW)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    test_append_only_series()
+    test_daily_rows_match_the_documents()
+    test_trends_from_the_series_match_the_documents()
+    print("All KPI series tests passed")
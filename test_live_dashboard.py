@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Tests for the listener-maintained live dashboard and its server-sent event
+stream (analytics/live.py).
+"""
+
+import sys
+import os
+import json
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics.live import LiveDashboard, format_event
+from firestore_fakes import FakeDb
+
+
+def build_row(user_id, user, trial, subscription):
+    return {
+        'user_id': user_id,
+        'email': user.get('email', ''),
+        'registration_date': user.get('createdAt'),
+        'verified': bool(user.get('emailVerified')),
+        'trial': bool(trial),
+        'premium': bool(subscription and subscription.get('isActive')),
+    }
+
+
+def build_stats(counters):
+    return {
+        'total_users': counters.get('users_total', 0),
+        'total_trials': counters.get('trials_total', 0),
+        'active_subscriptions': counters.get('subscriptions_active', 0),
+    }
+
+
+def loaded_dashboard(**kwargs):
+    db = FakeDb()
+    live = LiveDashboard(db, build_row, build_stats, sort_key=lambda row: row['registration_date'] or '',
+                         refresh_seconds=0, **kwargs)
+    try:
+        live.start(timeout=0)
+    except RuntimeError:
+        pass  # nothing has loaded yet
+    db.collections['users'].send(('ADDED', 'u1', {'email': 'a@x.com', 'createdAt': '2025-01-01', 'emailVerified': True}),
+                             ('ADDED', 'u2', {'email': 'b@x.com', 'createdAt': '2025-02-01'}),
+                             ('ADDED', 'u3', {'createdAt': '2025-03-01'}))
+    assert not live.ready.is_set()  # rows wait for every collection
+    db.collections['trial_history'].send(('ADDED', 'a@x.com', {'trialStartDate': '2025-01-02'}))
+    db.collections['subscriptions'].send(('ADDED', 'a@x.com', {'isActive': True}))
+    assert live.ready.is_set()
+    return db, live
+
+
+def test_snapshot_joins_the_collections():
+    db, live = loaded_dashboard()
+    snapshot = live.snapshot()
+
+    assert snapshot['version'] == 1
+    assert snapshot['stats'] == {'total_users': 3, 'total_trials': 1, 'active_subscriptions': 1}
+    assert [row['user_id'] for row in snapshot['users']] == ['u3', 'u2', 'u1']
+    assert snapshot['users'][2] == {'user_id': 'u1', 'email': 'a@x.com', 'registration_date': '2025-01-01',
+                                    'verified': True, 'trial': True, 'premium': True}
+    live.stop()
+
+
+def test_changes_publish_only_what_moved():
+    db, live = loaded_dashboard()
+    subscriber, initial = live.subscribe(1)
+    assert initial == []
+
+    # A trial for b@x.com touches u2's row and one stat
+    db.collections['trial_history'].send(('ADDED', 'b@x.com', {'trialStartDate': '2025-02-02'}))
+    version, event, diff = subscriber.queue.get_nowait()
+    assert (version, event) == (2, 'diff')
+    assert [row['user_id'] for row in diff['upserts']] == ['u2'] and diff['upserts'][0]['trial']
+    assert diff['stats'] == {'total_trials': 2}
+
+    # A field no row or stat shows publishes nothing
+    db.collections['users'].send(('MODIFIED', 'u1', {'email': 'a@x.com', 'createdAt': '2025-01-01',
+                                                 'emailVerified': True, 'fcmToken': 'new'}))
+    assert subscriber.queue.empty()
+
+    # Changing a user's email re-joins its row; removals are listed by id
+    db.collections['users'].send(('MODIFIED', 'u3', {'email': 'a@x.com', 'createdAt': '2025-03-01'}),
+                             ('REMOVED', 'u2'))
+    _, _, diff = subscriber.queue.get_nowait()
+    assert [row['user_id'] for row in diff['upserts']] == ['u3'] and diff['upserts'][0]['premium']
+    assert diff['removed'] == ['u2']
+    assert diff['stats'] == {'total_users': 2}
+    db.collections['subscriptions'].send(('MODIFIED', 'a@x.com', {'isActive': False}))
+    _, _, diff = subscriber.queue.get_nowait()
+    assert sorted(row['user_id'] for row in diff['upserts']) == ['u1', 'u3']
+    live.stop()
+
+
+def test_reconnecting_clients_are_replayed_or_resnapshotted():
+    db, live = loaded_dashboard(history_size=2)
+    for n in range(3):
+        db.collections['trial_history'].send(('ADDED', f't{n}@x.com', {}))
+    assert live.version == 4
+
+    _, initial = live.subscribe(3)
+    assert [(version, event) for version, event, _ in initial] == [(4, 'diff')]
+    _, initial = live.subscribe(1)  # version 2 is no longer buffered
+    assert [event for _, event, _ in initial] == ['snapshot']
+
+    # Ids carry the process epoch; an id from another process gets a snapshot
+    assert live.parse_event_id(live.event_id(3)) == 3
+    assert live.parse_event_id('0.3') is None and live.parse_event_id('garbage') is None
+    live.stop()
+
+
+def test_event_stream_frames_and_slow_clients():
+    db, live = loaded_dashboard(queue_size=2)
+    stream = live.events(heartbeat_seconds=0.01)
+    assert next(stream).startswith('retry:')
+    frame = next(stream)
+    assert frame.startswith(f'id: {live.event_id(1)}\nevent: snapshot\ndata: ')
+    assert json.loads(frame.split('data: ', 1)[1])['stats']['total_users'] == 3
+    assert next(stream) == ': keep-alive\n\n'
+
+    db.collections['users'].send(('ADDED', 'u4', {'createdAt': '2025-04-01'}))
+    frame = next(stream)
+    assert 'event: diff' in frame and '"u4"' in frame
+    assert live.clients == 1
+
+    # A client that stops reading is dropped once its queue is full
+    for n in range(5):
+        db.collections['trial_history'].send(('ADDED', f't{n}@x.com', {}))
+    assert live.clients == 0 and live.clients_dropped == 1
+    stream.close()
+
+    assert format_event('diff', {'a': 1}) == 'event: diff\ndata: {"a": 1}\n\n'
+    live.stop()
+
+
+if __name__ == "__main__":
+    test_snapshot_joins_the_collections()
+    test_changes_publish_only_what_moved()
+    test_reconnecting_clients_are_replayed_or_resnapshotted()
+    test_event_stream_frames_and_slow_clients()
+    print("All live dashboard tests passed")
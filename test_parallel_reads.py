@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Tests for concurrent collection reads (analytics/loader.py and
+DashboardSnapshot.prefetch).
+"""
+
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics.loader import fetch_parallel
+from analytics.snapshot import DashboardSnapshot
+from firestore_fakes import FakeCollection, FakeDb
+
+
+def slow_collection(name, count, delay=0.2):
+    """A collection whose stream() takes ``delay`` seconds"""
+    return FakeCollection(name, {f'{name}_{i}': {} for i in range(count)}, delay=delay)
+
+
+def test_fetch_parallel_overlaps_reads():
+    queries = {name: slow_collection(name, 2) for name in ('users', 'trials', 'subscriptions')}
+
+    started = time.perf_counter()
+    results, timings = fetch_parallel(queries)
+    elapsed = time.perf_counter() - started
+
+    assert [doc.id for doc in results['users']] == ['users_0', 'users_1']
+    assert timings['trials'].documents == 2
+    assert timings['trials'].to_dict()['ms'] >= 200
+    # Three 200 ms reads should take roughly one read's time, not three
+    assert elapsed < 0.45
+
+
+def test_fetch_parallel_reraises_failures():
+    class Broken:
+        def stream(self):
+            raise RuntimeError('quota exceeded')
+
+    try:
+        fetch_parallel({'users': slow_collection('users', 1, delay=0), 'broken': Broken()})
+    except RuntimeError as e:
+        assert 'quota' in str(e)
+    else:
+        assert False, 'expected the failing read to raise'
+
+
+def test_prefetch_reads_each_source_once():
+    db = FakeDb({name: {f'{name}_{i}': {} for i in range(3)} for name in ('users', 'subscriptions', 'trial_history')})
+    snapshot = DashboardSnapshot(db).prefetch('users', 'subscriptions', 'users')
+
+    assert set(snapshot.read_timings) == {'users', 'subscriptions'}
+    assert len(snapshot.users) == 3
+    assert len(snapshot.subscriptions) == 3
+    snapshot.prefetch('users', 'trials')
+    assert len(snapshot.trials) == 3
+
+    # The second prefetch must not scan users again
+    queries = {name: collection.queries for name, collection in db.collections.items()}
+    snapshot.prefetch('users', 'subscriptions', 'trials')
+    assert queries == {name: collection.queries for name, collection in db.collections.items()}
+    assert set(db.collections) == {'users', 'subscriptions', 'trial_history'}
+
+
+if __name__ == "__main__":
+    test_fetch_parallel_overlaps_reads()
+    test_fetch_parallel_reraises_failures()
+    test_prefetch_reads_each_source_once()
+    print("All parallel read tests passed")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Tests for parallel partitioned collection scans (analytics/scan.py).
+"""
+
+import sys
+import os
+import random
+import string
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics.scan import PartitionedScan, split_points
+from firestore_fakes import FakeCollection
+
+
+def users(doc_ids, **options):
+    return FakeCollection('users', {doc_id: {'n': position} for position, doc_id in enumerate(sorted(doc_ids))},
+                          **options)
+
+
+def random_ids(count, seed=1):
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits
+    ids = {''.join(rng.choice(alphabet) for _ in range(28)) for _ in range(count)}
+    # Email document ids (trial_history) fall outside the uid alphabet's ordering
+    ids.update(f'user{i}@example.com' for i in range(50))
+    return ids
+
+
+def test_split_points_are_sorted_and_distinct():
+    points = split_points(8)
+    assert len(points) == 7
+    assert points == sorted(points)
+    assert split_points(1) == []
+
+
+def test_scan_reads_every_document_once():
+    doc_ids = random_ids(3000)
+    scan = PartitionedScan(users(doc_ids), partitions=8, page_size=100)
+
+    streamed = [doc.id for doc in scan.stream()]
+
+    assert sorted(streamed) == sorted(doc_ids)
+    stats = scan.stats()
+    assert stats['documents'] == len(doc_ids)
+    assert stats['partitions'] == 8
+    assert stats['docs_per_second'] > 0
+    assert all(partition.done for partition in scan.partitions)
+
+
+def test_failed_pages_resume_from_cursor():
+    doc_ids = random_ids(2000, seed=2)
+    collection = users(doc_ids, flaky=True)
+    scan = PartitionedScan(collection, partitions=4, page_size=200, retries=2)
+
+    streamed = [doc.id for doc in scan.stream()]
+
+    assert sorted(streamed) == sorted(doc_ids)
+    assert scan.stats()['retries'] == scan.stats()['pages']
+
+
+def test_scan_fails_after_retries():
+    scan = PartitionedScan(users(random_ids(100), broken=True), partitions=2, retries=1)
+    try:
+        list(scan.stream())
+    except RuntimeError as e:
+        assert 'Deadline' in str(e)
+    else:
+        assert False, 'expected the scan to fail'
+
+
+def test_checkpoint_resumes_where_the_consumer_stopped():
+    doc_ids = random_ids(1500, seed=3)
+    collection = users(doc_ids)
+    first = PartitionedScan(collection, partitions=4, page_size=64)
+
+    seen = []
+    for doc in first.stream():
+        seen.append(doc.id)
+        if len(seen) == 700:
+            break
+
+    second = PartitionedScan(collection, page_size=64, checkpoint=first.checkpoint())
+    seen.extend(doc.id for doc in second.stream())
+
+    assert sorted(seen) == sorted(doc_ids)
+
+
+def test_projection_is_applied_to_pages():
+    collection = users(random_ids(10))
+    scan = PartitionedScan(collection, fields=(), partitions=2)
+    queries = [scan._page_query(partition, None) for partition in scan.partitions]
+    assert all(query.selected == ['__name__'] for query in queries)
+
+
+if __name__ == "__main__":
+    test_split_points_are_sorted_and_distinct()
+    test_scan_reads_every_document_once()
+    test_failed_pages_resume_from_cursor()
+    test_scan_fails_after_retries()
+    test_checkpoint_resumes_where_the_consumer_stopped()
+    test_projection_is_applied_to_pages()
+    print("All partitioned scan tests passed")
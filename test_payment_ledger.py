@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tests for the payment event ledger and its rollups (analytics/payments.py).
+"""
+
+import sys
+import os
+import random
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics.payments import (ACCOUNTS_COLLECTION, PaymentLedger, billing_history_event, payment_analysis,
+                               payment_event)
+from firestore_fakes import Duplicate, FakeDb, Increment, transactional
+
+
+def test_events_are_counted_once_in_their_rollups():
+    db = FakeDb()
+    ledger = PaymentLedger(db, Increment, transactional, (Duplicate,))
+    march, april = datetime(2025, 3, 5), datetime(2025, 4, 2)
+    assert ledger.record('e1', payment_event('u1', 9.99, status='failed', method='Credit Card',
+                                             failure_reason='Insufficient funds!', occurred_at=march))
+    assert ledger.record('e2', payment_event('u1', 9.99, method='credit_card', occurred_at=march))
+    assert ledger.record('e3', payment_event('u2', 9.99, method='paypal', occurred_at=april))
+    assert ledger.record('e4', payment_event('u2', 500, currency='PHP', method='paypal', occurred_at=april))
+    assert ledger.record('e5', payment_event('u2', 9.99, event_type='refund', method='paypal', occurred_at=april))
+    assert ledger.record('e6', payment_event('u3', 9.99, status='pending', occurred_at=april))
+    # Recording the same event again changes nothing
+    assert not ledger.record('e2', payment_event('u1', 9.99, method='credit_card', occurred_at=march))
+
+    analysis = payment_analysis(*ledger.rollups())
+    assert analysis['total_payment_attempts'] == 4
+    assert analysis['successful_payments'] == 3 and analysis['failed_payments'] == 1
+    assert analysis['success_rate'] == 75.0 and analysis['failure_rate'] == 25.0
+    assert analysis['failure_reasons'] == {'insufficient_funds': 1}
+    # u1's success after a failure is a recovery
+    assert analysis['recovery_rate'] == 100.0 and analysis['refunds'] == 1
+    assert analysis['payment_methods']['credit_card'] == {'attempts': 2, 'successes': 1, 'failures': 1,
+                                                          'success_rate': 50.0}
+    assert analysis['payment_methods']['paypal']['attempts'] == 2
+    trends = {trend['month']: trend for trend in analysis['monthly_trends']}
+    assert trends['2025-03']['revenue'] == 9.99 and trends['2025-04']['revenue'] == 0
+    assert trends['2025-04']['revenue_by_currency'] == {'php': 500.0, 'usd': 0.0}
+    assert len(db.collection('payment_events').docs) == 6
+    # Accounts are only read inside the recording transaction
+    assert db.collection(ACCOUNTS_COLLECTION).docs and db.collection(ACCOUNTS_COLLECTION).reads == 0
+
+
+def test_rollups_match_a_recount_of_the_events():
+    rng = random.Random(3)
+    db = FakeDb()
+    ledger = PaymentLedger(db, Increment, transactional, (Duplicate,))
+    for n in range(400):
+        event = payment_event(f'u{rng.randrange(20)}', rng.choice((4.99, 9.99)),
+                              status=rng.choice(('succeeded', 'succeeded', 'failed')),
+                              method=rng.choice(('card', 'paypal')), failure_reason=rng.choice(('declined', None)),
+                              occurred_at=datetime(2025, rng.randrange(1, 9), 1))
+        ledger.record(f'e{rng.randrange(300)}', event)
+
+    events = db.collection('payment_events').docs.values()
+    analysis = payment_analysis(*ledger.rollups(), recent_months=12)
+    assert analysis['total_payment_attempts'] == len(events)
+    assert analysis['successful_payments'] == sum(event['status'] == 'succeeded' for event in events)
+    assert sum(trend['attempts'] for trend in analysis['monthly_trends']) == len(events)
+    revenue = sum(event['amount'] for event in events if event['status'] == 'succeeded')
+    assert round(sum(trend['revenue'] for trend in analysis['monthly_trends']), 2) == round(revenue, 2)
+    assert sum(analysis['failure_reasons'].values()) == analysis['failed_payments']
+
+
+def test_billing_history_documents():
+    event_id, event = billing_history_event('b1', {
+        'userId': 'u1', 'amount': 9.99, 'currency': 'USD', 'status': 'failed',
+        'failureReason': 'Card declined', 'billingDate': datetime(2025, 5, 1),
+    })
+    assert event_id == 'billing_history-b1'
+    assert event['status'] == 'failed' and event['failureReason'] == 'card_declined' and event['currency'] == 'usd'
+    assert billing_history_event('b2', {'status': 'refunded', 'amount': 9.99})[1]['type'] == 'refund'
+    assert billing_history_event('b3', {'status': 'processing'})[1]['status'] == 'pending'
+
+
+if __name__ == "__main__":
+    test_events_are_counted_once_in_their_rollups()
+    test_rollups_match_a_recount_of_the_events()
+    test_billing_history_documents()
+    print("All payment ledger tests passed")
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Tests for scheduled reports and the report snapshot store (analytics/reports.py).
+"""
+
+import sys
+import os
+import tempfile
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics.reports import CronSchedule, ReportScheduler, ReportStore
+
+
+def test_cron_next_after():
+    at = datetime(2025, 3, 14, 10, 7, 30)  # a Friday
+
+    assert CronSchedule('*/15 * * * *').next_after(at) == datetime(2025, 3, 14, 10, 15)
+    assert CronSchedule('0 * * * *').next_after(at) == datetime(2025, 3, 14, 11, 0)
+    assert CronSchedule('30 6 * * *').next_after(at) == datetime(2025, 3, 15, 6, 30)
+    assert CronSchedule('0 9 * * 1').next_after(at) == datetime(2025, 3, 17, 9, 0)
+    assert CronSchedule('0 0 1 * *').next_after(at) == datetime(2025, 4, 1, 0, 0)
+    assert CronSchedule('0 0 1 1 *').next_after(at) == datetime(2026, 1, 1, 0, 0)
+    assert CronSchedule('0 8-18/5 * * 0,7').next_after(at) == datetime(2025, 3, 16, 8, 0)
+    # Both day fields restricted: either one matching is enough
+    assert CronSchedule('0 0 20 * 6').next_after(at) == datetime(2025, 3, 15, 0, 0)
+    # Strictly after, even when the time itself matches
+    assert CronSchedule('7 10 * * *').next_after(datetime(2025, 3, 14, 10, 7)) == datetime(2025, 3, 15, 10, 7)
+
+
+def test_cron_rejects_bad_expressions():
+    for expression in ('* * * *', '61 * * * *', '*/0 * * * *', '0 0 30 2 *'):
+        try:
+            CronSchedule(expression).next_after(datetime(2025, 1, 1))
+        except ValueError:
+            pass
+        else:
+            assert False, f"expected '{expression}' to be rejected"
+
+
+def test_store_versions_and_prunes_history():
+    with tempfile.TemporaryDirectory() as directory:
+        store = ReportStore(directory, history_limit=3)
+        assert store.latest('daily_summary') is None
+
+        for n in range(5):
+            store.save('daily_summary', {'new_users': n}, datetime(2025, 1, 1, n), 1.0, 'schedule')
+
+        assert store.versions('daily_summary') == [3, 4, 5]
+        assert store.latest('daily_summary')['data'] == {'new_users': 4}
+        assert [snapshot['version'] for snapshot in store.history('daily_summary')] == [5, 4, 3]
+        assert len(store.history('daily_summary', limit=1)) == 1
+
+        # Another process writing a newer version is picked up
+        ReportStore(directory).save('daily_summary', {'new_users': 9}, datetime(2025, 1, 2), 1.0, 'refresh')
+        assert store.latest('daily_summary')['version'] == 6
+
+
+def test_scheduler_builds_due_reports_once():
+    builds = []
+
+    def build():
+        builds.append(datetime.now())
+        return {'total_users': len(builds)}
+
+    with tempfile.TemporaryDirectory() as directory:
+        scheduler = ReportScheduler(ReportStore(directory))
+        scheduler.register('weekly_trends', '0 * * * *', build)
+
+        # Never built: due straight away, then not again until the next hour
+        assert scheduler.run_pending() == ['weekly_trends']
+        assert scheduler.run_pending() == []
+        latest = scheduler.latest('weekly_trends')
+        assert latest['version'] == 1 and latest['trigger'] == 'schedule'
+
+        next_hour = scheduler.next_run('weekly_trends')
+        assert next_hour.minute == 0 and next_hour > datetime.now()
+        assert scheduler.run_pending(now=next_hour) == ['weekly_trends']
+
+        refreshed = scheduler.refresh('weekly_trends')
+        assert refreshed['version'] == 3 and refreshed['trigger'] == 'refresh'
+        assert refreshed['data'] == {'total_users': 3}
+
+        # A second worker sharing the store sees the builds and has nothing to do
+        other = ReportScheduler(ReportStore(directory))
+        other.register('weekly_trends', '0 * * * *', build)
+        assert other.run_pending() == []
+        assert len(builds) == 3
+
+
+def test_failed_build_backs_off():
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise RuntimeError('Firestore unavailable')
+
+    with tempfile.TemporaryDirectory() as directory:
+        scheduler = ReportScheduler(ReportStore(directory), retry_seconds=60)
+        scheduler.register('monthly_business', '*/5 * * * *', broken)
+        now = datetime.now()
+
+        assert scheduler.run_pending(now) == []
+        assert scheduler.run_pending(now + timedelta(seconds=30)) == []
+        assert len(calls) == 1
+        assert scheduler.next_run('monthly_business', now) == now + timedelta(seconds=60)
+        assert scheduler.store.latest('monthly_business') is None
+
+
+def test_one_process_runs_the_schedule():
+    with tempfile.TemporaryDirectory() as directory:
+        first = ReportScheduler(ReportStore(directory))
+        second = ReportScheduler(ReportStore(directory))
+        try:
+            assert first.start() and first.running
+            assert not second.start() and not second.running
+        finally:
+            first.stop()
+        # Once the first stops, another can take over
+        assert second.start()
+        second.stop()
+        assert not second.running
+
+
+if __name__ == "__main__":
+    test_cron_next_after()
+    test_cron_rejects_bad_expressions()
+    test_store_versions_and_prunes_history()
+    test_scheduler_builds_due_reports_once()
+    test_failed_build_backs_off()
+    test_one_process_runs_the_schedule()
+    print("All report scheduler tests passed")
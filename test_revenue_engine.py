@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Tests for the interval-sweep revenue engine (analytics/revenue.py).
+"""
+
+import sys
+import os
+import random
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics import columnar, streaming
+from analytics.columnar import SubscriptionColumns, UserColumns
+from analytics.revenue import RevenueEngine, US_PER_MONTH, load_plan_prices, plan_price
+
+NOW = datetime(2025, 6, 15, 12, 0)
+PRICES = {'monthly': 3.0, 'family': 8.0}
+
+
+def fake_subscriptions(count=300, seed=4):
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        start = NOW - timedelta(days=rng.randint(0, 400), hours=rng.randint(0, 23))
+        data = {'plan': rng.choice(('monthly', 'family', 'legacy')), 'startDate': start}
+        kind = i % 4
+        if kind == 0:
+            data['subscriptionEndDate'] = start + timedelta(days=rng.randint(1, 200))
+        elif kind == 1:
+            data.update(cancelled=True, willExpireAt=start + timedelta(days=rng.randint(1, 90)))
+        data['status'] = 'active' if 'subscriptionEndDate' not in data or data['subscriptionEndDate'] > NOW else 'expired'
+        records.append((f's{i}', data))
+    records.append(('nostart', {'plan': 'monthly', 'status': 'active'}))
+    return records
+
+
+def interval(data):
+    end = data.get('subscriptionEndDate') or (data.get('willExpireAt') if data.get('cancelled') else None)
+    return data['startDate'], end
+
+
+def brute_mrr(records, moment):
+    total = 0.0
+    for _, data in records:
+        if 'startDate' not in data:
+            continue
+        start, end = interval(data)
+        if start <= moment and (end is None or moment < end):
+            total += plan_price(data['plan'], PRICES)
+    return total
+
+
+def brute_revenue(records, low, high):
+    total = 0.0
+    for _, data in records:
+        if 'startDate' not in data:
+            continue
+        start, end = interval(data)
+        overlap = (min(end or high, high) - max(start, low)) / timedelta(microseconds=1)
+        if overlap > 0:
+            total += plan_price(data['plan'], PRICES) * overlap / US_PER_MONTH
+    return total
+
+
+def test_point_and_range_queries_match_a_scan():
+    records = fake_subscriptions()
+    engine = RevenueEngine.from_records(records, PRICES, now=NOW)
+    rng = random.Random(9)
+    for _ in range(50):
+        moment = NOW - timedelta(days=rng.uniform(-30, 420))
+        assert abs(engine.mrr_at(moment) - brute_mrr(records, moment)) < 1e-6
+    for _ in range(30):
+        low = NOW - timedelta(days=rng.uniform(0, 420))
+        high = low + timedelta(days=rng.uniform(0, 200))
+        assert abs(engine.revenue(low, high) - brute_revenue(records, low, high)) < 1e-6
+        growth = engine.net_growth(low, high)
+        started = sum(1 for _, data in records if 'startDate' in data and low <= data['startDate'] <= high)
+        ended = sum(1 for _, data in records if 'startDate' in data and interval(data)[1] is not None
+                    and low <= max(interval(data)[1], data['startDate']) <= high)
+        assert (growth['new_subscriptions'], growth['ended_subscriptions']) == (started, ended)
+
+    first = min(data['startDate'] for _, data in records if 'startDate' in data)
+    assert abs(engine.lifetime_revenue() - brute_revenue(records, first, NOW)) < 1e-6
+    assert engine.first_start() == first
+    # Unpriced plans fall back to the default price; status decides the current MRR
+    assert engine.current_mrr == sum(plan_price(data.get('plan'), PRICES)
+                                     for _, data in records if data.get('status') == 'active')
+    assert engine.mrr_at(first - timedelta(days=1)) == 0.0 and engine.subscribers_at(first) >= 1
+
+
+def test_monthly_history():
+    records = fake_subscriptions()
+    engine = RevenueEngine.from_records(records, PRICES, now=NOW)
+    periods = engine.history(datetime(2025, 1, 1), NOW)
+    assert [period['period'] for period in periods] == ['2025-01', '2025-02', '2025-03', '2025-04', '2025-05',
+                                                        '2025-06']
+    may = periods[4]
+    assert may['mrr'] == round(brute_mrr(records, datetime(2025, 5, 31, 23, 59, 59, 999999)), 2)
+    assert may['revenue'] == round(brute_revenue(records, datetime(2025, 5, 1),
+                                                 datetime(2025, 5, 31, 23, 59, 59, 999999)), 2)
+    assert may['net_growth'] == may['new_subscriptions'] - may['ended_subscriptions']
+    # The current month closes now
+    assert periods[-1]['mrr'] == round(brute_mrr(records, NOW), 2)
+
+    empty = RevenueEngine.from_records([], now=NOW)
+    assert empty.lifetime_revenue() == 0.0 and empty.mrr_at(NOW) == 0.0 and empty.first_start() is None
+
+
+def test_plan_prices_configuration():
+    assert load_plan_prices('{"monthly": 3, "annual": "25.5"}') == {'monthly': 3.0, 'annual': 25.5}
+    for text in ('[1, 2]', '{"monthly": "free"}'):
+        try:
+            load_plan_prices(text)
+        except ValueError:
+            pass
+        else:
+            assert False, f'expected {text} to be rejected'
+
+
+def test_revenue_panels_price_each_plan():
+    records = fake_subscriptions()
+    for position, (_, data) in enumerate(records):
+        data['isActive'] = data['status'] == 'active'
+        if position % 50 == 0:
+            # Started today, for the weekly report
+            data['startDate'] = NOW - timedelta(hours=1)
+    configured = dict(columnar.PLAN_PRICES)
+    columnar.PLAN_PRICES.update(PRICES)
+    try:
+        subscriptions = SubscriptionColumns.from_records(records)
+        trends = columnar.revenue_trends(subscriptions, NOW)
+        last_window = columnar.trailing_month_windows(NOW)[0]
+        assert trends[-1]['revenue'] == round(sum(
+            plan_price(data['plan']) for _, data in records
+            if data['isActive'] and 'startDate' in data and data['startDate'] <= last_window[2]), 2)
+
+        accumulators = streaming.StreamingAggregation(
+            mrr=streaming.MonthlyRecurringRevenue(), trends=streaming.RevenueTrends(NOW))
+        accumulators.consume(records)
+        assert accumulators.results()['trends'] == trends
+        assert accumulators.results()['mrr'] == round(RevenueEngine.from_records(records, now=NOW).current_mrr, 2)
+
+        weekly = columnar.weekly_trend_report(UserColumns.from_records([]), subscriptions, NOW)
+        assert weekly[-1]['revenue'] == round(sum(
+            plan_price(data['plan']) for _, data in records
+            if 'startDate' in data and data['startDate'].date() == NOW.date()), 2) > 0
+    finally:
+        columnar.PLAN_PRICES.clear()
+        columnar.PLAN_PRICES.update(configured)
+
+
+if __name__ == "__main__":
+    test_point_and_range_queries_match_a_scan()
+    test_monthly_history()
+    test_plan_prices_configuration()
+    test_revenue_panels_price_each_plan()
+    print("All revenue engine tests passed")
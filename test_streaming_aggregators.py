@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Tests for the constant-memory streaming aggregators (analytics/streaming.py).
+
+Results must match the in-memory calculations, and peak memory for one pass
+must not grow with the number of documents streamed.
+"""
+
+import sys
+import os
+import tracemalloc
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics import benchmarks, columnar, streaming
+from analytics.streaming import StreamingAggregation
+from firestore_fakes import FakeCollection
+
+NOW = datetime(2025, 8, 15, 10, 30, 0)
+
+
+def user_records(count):
+    """Lazily generated user documents; nothing is retained between records"""
+    for i in range(count):
+        created = NOW - timedelta(days=i % 400, hours=i % 24)
+        yield f'user_{i}', {
+            'email': f'user{i}@example.com',
+            'createdAt': created,
+            'lastLoginAt': created + timedelta(days=i % 45) if i % 5 else None,
+            'emailVerified': i % 3 != 0,
+        }
+
+
+def subscription_records(count):
+    for i in range(count):
+        start = NOW - timedelta(days=i % 200, hours=i % 24)
+        cancelled = i % 4 == 0
+        yield f'user_{i}', {
+            'startDate': start,
+            'isActive': not cancelled,
+            'cancelled': cancelled,
+            'willExpireAt': start + timedelta(days=30 + i % 90) if cancelled else None,
+            'status': 'cancelled' if cancelled else 'active',
+        }
+
+
+def full_aggregation():
+    return StreamingAggregation(
+        total=streaming.Count(),
+        verified=streaming.Count(lambda data: data.get('emailVerified')),
+        active=streaming.Count(lambda data: data.get('isActive')),
+        churn=streaming.ChurnMetrics(NOW),
+        revenue=streaming.RevenueTrends(NOW),
+    )
+
+
+def peak_bytes(records):
+    aggregation = full_aggregation()
+    tracemalloc.start()
+    aggregation.consume(records)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def test_user_counts_match_columnar():
+    records = list(user_records(3000))
+    users = columnar.UserColumns.from_records(records)
+
+    aggregation = StreamingAggregation(
+        total=streaming.Count(),
+        verified=streaming.Count(lambda data: data.get('emailVerified')),
+    )
+    assert aggregation.consume(records) == 3000
+    assert aggregation.results() == {'total': 3000, 'verified': int(users.email_verified.sum())}
+
+
+def test_subscription_accumulators_match_columnar():
+    records = benchmarks.synthetic_records(2000, NOW, seed=3)['subscriptions']
+    subscriptions = columnar.SubscriptionColumns.from_records(records)
+
+    aggregation = StreamingAggregation(revenue=streaming.RevenueTrends(NOW))
+    aggregation.consume(records)
+
+    assert aggregation.results()['revenue'] == columnar.revenue_trends(subscriptions, NOW)
+
+
+def test_churn_metrics_by_hand():
+    churn = streaming.ChurnMetrics(NOW)
+    for record in [
+        ('a', {'startDate': datetime(2025, 7, 1), 'cancelled': True, 'willExpireAt': datetime(2025, 8, 12)}),
+        # Expired before the month started: not part of the base
+        ('b', {'startDate': datetime(2025, 6, 1), 'cancelled': True, 'willExpireAt': datetime(2025, 7, 1)}),
+        ('c', {'startDate': '2025-05-01T00:00:00Z'}),
+        ('d', {'startDate': datetime(2025, 8, 2)}),
+        # Cancelled but paid up until after now: not churned yet
+        ('e', {'startDate': datetime(2025, 6, 1), 'cancelled': True, 'willExpireAt': datetime(2025, 9, 1)}),
+        ('f', {'startDate': datetime(2025, 6, 1), 'subscriptionEndDate': datetime(2025, 8, 1)}),
+    ]:
+        churn.update(record)
+
+    assert churn.result() == {'overall_churn_rate': 50.0, 'monthly_churn_rate': 33.33}
+    assert streaming.ChurnMetrics(NOW).result() == {'overall_churn_rate': 0, 'monthly_churn_rate': 0}
+
+
+def test_run_streams_query_and_reports_volume():
+    aggregation = StreamingAggregation(total=streaming.Count())
+
+    timing = aggregation.run(FakeCollection('users', user_records(500)), 'users')
+
+    assert aggregation.results() == {'total': 500}
+    assert timing.documents == 500
+    assert timing.bytes > 500 * 50
+
+
+def test_peak_memory_is_flat():
+    small = peak_bytes(user_records(2_000))
+    large = peak_bytes(user_records(20_000))
+
+    # Ten times the documents must not mean noticeably more memory
+    assert large < small * 1.5 + 64 * 1024, (small, large)
+    assert large < 512 * 1024, large
+
+    subscriptions_small = peak_bytes(subscription_records(2_000))
+    subscriptions_large = peak_bytes(subscription_records(20_000))
+    assert subscriptions_large < subscriptions_small * 1.5 + 64 * 1024, (subscriptions_small, subscriptions_large)
+
+
+if __name__ == "__main__":
+    test_user_counts_match_columnar()
+    test_subscription_accumulators_match_columnar()
+    test_churn_metrics_by_hand()
+    test_run_streams_query_and_reports_volume()
+    test_peak_memory_is_flat()
+    print("All streaming aggregator tests passed")
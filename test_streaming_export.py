@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Tests for the streaming export writers (analytics/export.py).
+"""
+
+import sys
+import os
+import csv
+import gzip
+import io
+import json
+import tracemalloc
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+
+from analytics import export
+from analytics.export import export_response
+
+app = Flask(__name__)
+
+
+def rows(count):
+    for i in range(count):
+        yield {'user_id': f'user_{i}', 'email': f'user{i}@example.com', 'email_verified': i % 2 == 0}
+
+
+def collect(response):
+    return b''.join(response.response)
+
+
+def test_csv_matches_dictwriter():
+    generated = rows(5000)
+    body = ''.join(export.csv_chunks(next(generated), generated))
+
+    expected = io.StringIO()
+    writer = csv.DictWriter(expected, fieldnames=['user_id', 'email', 'email_verified'])
+    writer.writeheader()
+    for row in rows(5000):
+        writer.writerow(row)
+
+    assert body == expected.getvalue()
+
+
+def test_csv_is_written_in_chunks():
+    generated = rows(20000)
+    chunks = list(export.csv_chunks(next(generated), generated))
+    assert len(chunks) > 5
+    assert all(len(chunk) < export.CHUNK_SIZE * 2 for chunk in chunks)
+
+
+def test_json_and_ndjson_round_trip():
+    body = json.loads(''.join(export.json_chunks(rows(3000))))
+    assert body['success'] is True
+    assert body['count'] == 3000
+    assert body['data'] == list(rows(3000))
+    assert 'exported_at' in body
+
+    lines = ''.join(export.ndjson_chunks(rows(10))).splitlines()
+    assert [json.loads(line) for line in lines] == list(rows(10))
+
+    assert json.loads(''.join(export.json_chunks(iter([]))))['count'] == 0
+
+
+def test_gzip_response_decompresses_to_csv():
+    with app.test_request_context('/api/export/data'):
+        generated = rows(2000)
+        response = export_response(next(generated), generated, 'users_export', 'csv', compress=True)
+        assert response.is_streamed
+        assert response.mimetype == 'application/gzip'
+        assert response.headers['Content-Disposition'].endswith('.csv.gz')
+        text = gzip.decompress(collect(response)).decode('utf-8')
+
+    assert text.splitlines()[0] == 'user_id,email,email_verified'
+    assert len(text.splitlines()) == 2001
+
+
+def test_streaming_memory_is_flat():
+    def peak(count):
+        with app.test_request_context('/api/export/data'):
+            generated = rows(count)
+            response = export_response(next(generated), generated, 'users_export', 'ndjson')
+            tracemalloc.start()
+            for _ in response.response:
+                pass
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        return peak_bytes
+
+    small = peak(5_000)
+    large = peak(50_000)
+    assert large < small * 1.5 + 64 * 1024, (small, large)
+
+
+if __name__ == "__main__":
+    test_csv_matches_dictwriter()
+    test_csv_is_written_in_chunks()
+    test_json_and_ndjson_round_trip()
+    test_gzip_response_decompresses_to_csv()
+    test_streaming_memory_is_flat()
+    print("All streaming export tests passed")
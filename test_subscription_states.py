@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Tests for the point-in-time subscription state index (analytics/lifecycle.py).
+"""
+
+import sys
+import os
+import random
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics import streaming
+from analytics.lifecycle import STATES, SubscriptionStateIndex
+
+NOW = datetime(2025, 6, 15, 12, 0)
+
+
+def fake_records(count=400, seed=5):
+    rng = random.Random(seed)
+    subscriptions, trials = [], []
+    for i in range(count):
+        start = NOW - timedelta(days=rng.randint(0, 300), hours=rng.randint(0, 23))
+        data = {'startDate': start}
+        kind = i % 5
+        if kind == 0:
+            data['subscriptionEndDate'] = start + timedelta(days=rng.randint(1, 120))
+        elif kind == 1:
+            data.update(cancelled=True, willExpireAt=start + timedelta(days=rng.randint(30, 90)),
+                        cancelledAt=start + timedelta(days=rng.randint(0, 29)))
+        elif kind == 2:
+            # Cancellation time from the last write
+            data.update(cancelled=True, willExpireAt=start + timedelta(days=rng.randint(30, 90)),
+                        updatedAt=start + timedelta(days=rng.randint(0, 29)))
+        elif kind == 3:
+            data.update(cancelled=True, willExpireAt=start + timedelta(days=rng.randint(1, 90)))
+        subscriptions.append((f's{i:03d}', data))
+        trial_start = start - timedelta(days=7)
+        trial = {'trialStartDate': trial_start}
+        if i % 3:
+            trial['trialEndDate'] = trial_start + timedelta(days=7)
+        trials.append((f't{i:03d}', trial))
+    subscriptions.append(('undated', {'status': 'active'}))
+    return subscriptions, trials
+
+
+def brute_state(data, moment):
+    """State of one subscription at ``moment`` by walking its lifecycle"""
+    start = data['startDate']
+    if moment < start:
+        return None
+    expires = data.get('subscriptionEndDate') or (data.get('willExpireAt') if data.get('cancelled') else None)
+    if expires is not None and moment >= expires:
+        return 'expired'
+    if data.get('cancelled'):
+        cancelled_at = data.get('cancelledAt') or data.get('updatedAt') or expires
+        if moment >= cancelled_at:
+            return 'cancelled_pending'
+    return 'active'
+
+
+def test_counts_and_members_match_a_scan():
+    subscriptions, trials = fake_records()
+    index = SubscriptionStateIndex.from_records(subscriptions, trials, now=NOW)
+    assert index.undated == 1
+    rng = random.Random(3)
+    for _ in range(60):
+        moment = NOW - timedelta(days=rng.uniform(-20, 320))
+        expected = {state: [] for state in STATES}
+        for doc_id, data in subscriptions:
+            state = brute_state(data, moment) if 'startDate' in data else None
+            if state:
+                expected[state].append(doc_id)
+        for doc_id, data in trials:
+            end = data.get('trialEndDate')
+            if data['trialStartDate'] <= moment and (end is None or moment < end):
+                expected['trialing'].append(doc_id)
+
+        assert index.counts(moment) == {state: len(ids) for state, ids in expected.items()}
+        for state in STATES:
+            assert index.members(state, moment) == sorted(expected[state])
+        assert index.members('expired', moment, limit=3) == sorted(expected['expired'])[:3]
+
+    # Every dated subscription is in exactly one state once it has started
+    assert sum(index.counts().values()) - index.count('trialing') == len(subscriptions) - 1
+
+
+def test_monthly_churn_matches_streaming_export():
+    subscriptions, _ = fake_records()
+    index = SubscriptionStateIndex.from_records(subscriptions, now=NOW)
+    month_start = datetime(2025, 6, 1)
+    churn = index.churn(month_start, NOW)
+
+    paying = [data for _, data in subscriptions
+              if 'startDate' in data and brute_state(data, month_start) in ('active', 'cancelled_pending')]
+    expired = [data for _, data in subscriptions
+               if 'startDate' in data and brute_state(data, month_start) != 'expired'
+               and brute_state(data, NOW) == 'expired']
+    assert churn['paying_at_start'] == len(paying) and churn['churned'] == len(expired) > 0
+    assert churn['churn_rate'] == round(len(expired) / len(paying) * 100, 2)
+
+    accumulator = streaming.ChurnMetrics(NOW)
+    for record in subscriptions:
+        accumulator.update(record)
+    assert accumulator.result()['monthly_churn_rate'] == churn['churn_rate']
+
+    empty = SubscriptionStateIndex.from_records([], now=NOW)
+    assert empty.churn(month_start)['churn_rate'] == 0 and empty.counts() == dict.fromkeys(STATES, 0)
+
+
+def test_changes_keep_the_index_current():
+    subscriptions, trials = fake_records()
+    index = SubscriptionStateIndex(now=NOW)
+    index.sync('subscriptions', subscriptions[:200])
+    index.sync('trials', trials)
+
+    # Writes, a removal and a document losing its dates, then a full sync that drops the rest
+    rng = random.Random(8)
+    changed = [(doc_id, dict(data, subscriptionEndDate=NOW - timedelta(days=rng.randint(0, 30))))
+               for doc_id, data in subscriptions[:40] if 'startDate' in data]
+    index.apply('subscriptions', changed + subscriptions[200:] + [('s050', None), ('s060', {'status': 'active'})])
+    expected = dict(subscriptions)
+    expected.update(changed)
+    expected.pop('s050')
+    expected['s060'] = {'status': 'active'}
+    for moment in (NOW, NOW - timedelta(days=45), NOW - timedelta(days=200)):
+        assert index.counts(moment) == \
+            SubscriptionStateIndex.from_records(list(expected.items()), trials, now=NOW).counts(moment)
+    assert index.undated == 2
+
+    index.sync('subscriptions', subscriptions[:10])
+    assert index.counts() == SubscriptionStateIndex.from_records(subscriptions[:10], trials, now=NOW).counts()
+    assert index.undated == 0 and index.status()['subscriptions'] == 10 and not index.live
+
+
+if __name__ == "__main__":
+    test_counts_and_members_match_a_scan()
+    test_monthly_churn_matches_streaming_export()
+    test_changes_keep_the_index_current()
+    print("All subscription state tests passed")
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Tests for the synthetic dataset generator (analytics/synthetic.py).
+"""
+
+import sys
+import os
+import tempfile
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics import columnar
+from analytics.columnar import UserColumns
+from analytics.identity import IdentityIndex
+from analytics.lifecycle import SubscriptionStateIndex
+from analytics.synthetic import (COLLECTIONS, TOKEN_LIMITS, FileSink, MemoryStore, SyntheticDataset, load_profile,
+                                 read_files)
+
+NOW = datetime(2025, 6, 15)
+
+
+def generate(user_count, **kwargs):
+    store = MemoryStore()
+    SyntheticDataset(user_count, now=NOW, **kwargs).write(store)
+    return store
+
+
+def test_datasets_are_reproducible_and_shardable():
+    dataset = SyntheticDataset(300, seed=9, now=NOW)
+    whole = list(dataset.documents())
+    assert whole == list(SyntheticDataset(300, seed=9, now=NOW).documents())
+    assert whole != list(SyntheticDataset(300, seed=10, now=NOW).documents())
+    shards = [dataset.shard(number, 4) for number in range(4)]
+    assert shards[0][0] == 0 and shards[-1][1] == 300
+    assert [document for start, stop in shards for document in dataset.documents(start, stop)] == whole
+
+    try:
+        load_profile({'conversion_rat': 0.5})
+        assert False, "a misspelt setting must be rejected"
+    except ValueError:
+        pass
+
+
+def test_documents_are_consistent():
+    store = generate(3000, seed=2)
+    users = store.collections['users']
+    assert len(users) == 3000
+    assert all(user['createdAt'] < NOW for user in users.values())
+    assert all(not user['emailVerified'] or user['emailVerifiedAt'] >= user['createdAt'] for user in users.values())
+
+    # Every trial and subscription joins back to its user
+    index = IdentityIndex.from_records(store.records('users'), store.records('trial_history'),
+                                       store.records('subscriptions'))
+    trial_owners = {index.trial_id(uid) for uid in users} - {None}
+    assert trial_owners == set(store.collections['trial_history'])
+    assert {index.subscription_id(uid) for uid in users} - {None} == set(store.collections['subscriptions'])
+
+    # The lifecycle index agrees with the isActive flags
+    states = SubscriptionStateIndex.from_records(store.records('subscriptions'), now=NOW)
+    paying = states.count('active', NOW) + states.count('cancelled_pending', NOW)
+    assert paying == sum(sub['isActive'] for sub in store.collections['subscriptions'].values())
+
+    # Monthly token documents sum the days; the daily documents repeat the recent days
+    history = store.collections['token_usage_history']
+    for doc_id, day in store.collections['daily_token_usage'].items():
+        assert 0 < day['tokensUsed'] <= TOKEN_LIMITS[day['userType']] == day['tokenLimit']
+        year, month, date = day['date'].split('-')
+        assert history[f"{day['userId']}_{year}_{month}"]['dailyUsage'][date] == day['tokensUsed']
+    for month in history.values():
+        assert month['totalMonthlyTokens'] == sum(month['dailyUsage'].values())
+        assert month['peakUsageTokens'] == max(month['dailyUsage'].values())
+
+    report = columnar.cohort_analysis(UserColumns.from_records(store.records('users')), NOW)
+    assert sum(cohort['total_users'] for cohort in report['cohorts']) == 3000
+
+
+def test_distributions_follow_the_profile():
+    store = generate(4000, seed=3, profile={'conversion_rate': 0.5, 'verification_rate': 0.9})
+    users = store.collections['users'].values()
+    trials = store.collections['trial_history']
+    verified = sum(user['emailVerified'] for user in users) / 4000
+    assert 0.85 < verified < 0.92
+    assert 0.6 < len(trials) / 4000 < 0.7
+    assert 0.44 < len(store.collections['subscriptions']) / len(trials) < 0.52
+    # The signup curve grows: the last 90 days hold more signups than the first 90
+    days = [(NOW - user['createdAt']).days for user in users]
+    assert sum(day < 90 for day in days) > 1.5 * sum(day >= 450 for day in days)
+
+
+def test_file_sink_round_trip():
+    dataset = SyntheticDataset(200, seed=4, now=NOW)
+    with tempfile.TemporaryDirectory() as directory:
+        counts = dataset.write(FileSink(directory))
+        documents = list(read_files(directory))
+    assert sum(counts.values()) == len(documents)
+    assert sorted(documents, key=lambda document: (COLLECTIONS.index(document[0]), document[1])) == \
+        sorted(dataset.documents(), key=lambda document: (COLLECTIONS.index(document[0]), document[1]))
+
+
+if __name__ == "__main__":
+    test_datasets_are_reproducible_and_shardable()
+    test_documents_are_consistent()
+    test_distributions_follow_the_profile()
+    test_file_sink_round_trip()
+    print("All synthetic dataset tests passed")
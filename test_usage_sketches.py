@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Tests for the HyperLogLog distinct-user sketches (analytics/sketches.py).
+"""
+
+import sys
+import os
+import random
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics.sketches import HyperLogLog, SketchStore, precision_for
+
+TODAY = datetime(2025, 6, 30, 12, 0)
+
+
+def within(estimate, actual, error):
+    # Three standard errors
+    return abs(estimate - actual) <= 3 * error * actual + 2
+
+
+def test_estimates_and_merges():
+    assert precision_for(0.02) == 12 and precision_for(0.01) == 14
+    assert HyperLogLog(12).relative_error < 0.02
+
+    for actual in (0, 1, 50, 3000, 100000):
+        sketch = HyperLogLog(12)
+        for i in range(actual):
+            sketch.add(f'uid{i}')
+            sketch.add(f'uid{i}')  # duplicates do not count
+        assert within(len(sketch), actual, sketch.relative_error), (actual, len(sketch))
+
+    left, right = HyperLogLog(10), HyperLogLog(10)
+    for i in range(6000):
+        left.add(i)
+    for i in range(4000, 10000):
+        right.add(i)
+    union = HyperLogLog(10, left.registers).merge(right)
+    assert within(len(union), 10000, union.relative_error)
+    # Merging is idempotent and the compressed form round-trips
+    assert HyperLogLog(10, union.registers).merge(right).registers == union.registers
+    assert HyperLogLog.from_bytes(10, union.to_bytes()).registers == union.registers
+
+    try:
+        left.merge(HyperLogLog(11))
+    except ValueError:
+        pass
+    else:
+        assert False, 'expected sketches of different precision to be refused'
+
+
+def test_store_unions_days_and_dimensions_across_workers():
+    directory = tempfile.mkdtemp()
+    try:
+        rng = random.Random(2)
+        workers = [SketchStore(directory, precision=12, flush_seconds=3600) for _ in range(2)]
+        seen = {}
+        for offset in range(40):
+            day = TODAY - timedelta(days=offset)
+            for _ in range(300):
+                user = rng.randint(0, 2000)
+                dimensions = {'userType': 'subscribed' if user % 4 == 0 else 'trial', 'country': None}
+                rng.choice(workers).add('chat_users', f'uid{user}', dimensions, when=day)
+                seen.setdefault(day.date(), set()).add(user)
+        assert all(worker.flush() for worker in workers)
+
+        reader = SketchStore(directory, precision=12)
+        start = (TODAY - timedelta(days=29)).date()
+        month = set().union(*(users for day, users in seen.items() if day >= start))
+        error = reader.status()['relative_error']
+        assert within(reader.estimate('chat_users', start, TODAY), len(month), error)
+
+        by_type = reader.estimate('chat_users', start, TODAY, dimension='userType')
+        assert set(by_type) == {'subscribed', 'trial'}
+        assert within(by_type['subscribed'], sum(1 for user in month if user % 4 == 0), error)
+        assert reader.estimate('chat_users', start, TODAY, dimension='country') == {}
+        assert reader.estimate('token_users', start, TODAY) == 0
+
+        daily = reader.daily('chat_users', TODAY - timedelta(days=2), TODAY)
+        assert [row['date'] for row in daily][-1] == TODAY.date().isoformat()
+        for row in daily:
+            assert within(row['estimate'], len(seen[datetime.fromisoformat(row['date']).date()]), error)
+
+        status = reader.status()
+        assert status['days'] == 40 and status['bytes'] < 40 * 3 * 4096
+        try:
+            SketchStore(directory, precision=10).estimate('chat_users', TODAY, TODAY)
+        except ValueError:
+            pass
+        else:
+            assert False, 'expected a precision mismatch to be refused'
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    test_estimates_and_merges()
+    test_store_unions_days_and_dimensions_across_workers()
+    print("All usage sketch tests passed")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-memory user search index (analytics/search.py).
+"""
+
+import sys
+import os
+import random
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from analytics.changes import ChangeJournal
+from analytics.search import PrefixTrie, UserSearchIndex
+
+STATUSES = ('Free User', 'Trial User', 'Pro', 'Unverified')
+
+
+def journey(i, **overrides):
+    row = {
+        'user_id': f'uid{i:04d}',
+        'email': f'user{i}@{"gmail.com" if i % 2 else "example.org"}',
+        'registration_date': f'2025-01-01 00:00:{i % 60:02d}',
+        'current_status': STATUSES[i % len(STATUSES)],
+        'trial_status': 'Active Trial' if i % 4 == 1 else 'No Trial',
+        'subscription_status': 'Active' if i % 4 == 2 else 'No Subscription',
+        'email_verified': i % 4 != 3,
+        'is_premium': i % 4 == 2,
+    }
+    row.update(overrides)
+    return row
+
+
+def brute_force(rows, query='', filters=None):
+    query = query.lower()
+    matches = []
+    for row in rows:
+        text = row['email'].lower().startswith(query) or row['user_id'].lower().startswith(query)
+        wanted = all(str(row[field]).lower() == str(value).lower() for field, value in (filters or {}).items())
+        if text and wanted:
+            matches.append(row['user_id'])
+    return set(matches)
+
+
+def test_prefix_trie():
+    trie = PrefixTrie()
+    for word, key in (('ann', 1), ('anna', 2), ('anne', 3), ('bob', 4), ('ann', 5)):
+        trie.add(word, key)
+    assert list(trie.iter_prefix('ann')) == [1, 5, 2, 3]  # exact matches first
+    assert trie.count('an') == 4 and trie.count('x') == 0
+
+    nodes = trie.nodes
+    assert trie.remove('anna', 2)
+    assert not trie.remove('anna', 2)
+    assert trie.nodes == nodes - 1  # the emptied 'a' leaf is pruned
+    assert list(trie.iter_prefix('an')) == [1, 5, 3]
+
+
+def test_queries_match_a_linear_scan():
+    rows = [journey(i) for i in range(500)]
+    index = UserSearchIndex().build(rows)
+    assert index.build_ms is not None
+
+    for query, filters in (('user1', None), ('UID00', None), ('', {'current_status': 'pro'}),
+                           ('user', {'email_verified': 'false', 'trial_status': 'No Trial'}),
+                           ('nobody', None), ('user12', {'is_premium': True})):
+        result = index.search(query, filters, limit=1000)
+        assert {row['user_id'] for row in result['results']} == brute_force(rows, query, filters)
+
+    top = index.search('user1', limit=3)
+    assert [row['email'] for row in top['results']] == ['user1@gmail.com', 'user11@gmail.com',
+                                                        'user13@gmail.com']
+    assert top['has_more'] and top['total'] is None
+
+    newest = index.search(filters={'current_status': 'Trial User'}, limit=5)
+    assert newest['total'] == 125 and len(newest['results']) == 5
+    dates = [row['registration_date'] for row in newest['results']]
+    assert dates == sorted(dates, reverse=True)
+
+    try:
+        index.search('user', {'username': 'x'})
+    except ValueError:
+        pass
+    else:
+        assert False, 'expected a filter on an unindexed field to be rejected'
+
+
+def test_incremental_updates_from_the_change_journal():
+    rng = random.Random(3)
+    rows = {i: journey(i) for i in range(300)}
+    journal = ChangeJournal()
+    journal.sync((row['user_id'], row) for row in rows.values())
+    index = UserSearchIndex().catch_up(journal)
+    assert len(index.records) == 300
+
+    for _ in range(5):
+        for i in rng.sample(range(350), 40):
+            if i in rows and rng.random() < 0.3:
+                del rows[i]
+            else:
+                rows[i] = journey(i, current_status=rng.choice(STATUSES), email=f'new{i}@gmail.com')
+        journal.sync((row['user_id'], row) for row in rows.values())
+        index.catch_up(journal)
+
+    assert index.updates > 0
+    fresh = UserSearchIndex().build(rows.values())
+    for query, filters in (('new', None), ('user', {'current_status': 'Pro'}), ('uid01', None), ('', None)):
+        got = index.search(query, filters, limit=1000)
+        expected = fresh.search(query, filters, limit=1000)
+        assert got['results'] == expected['results']
+    assert index.stats()['trie_nodes'] == fresh.stats()['trie_nodes']
+    assert index.stats()['memory_bytes'] > 0
+
+
+if __name__ == "__main__":
+    test_prefix_trie()
+    test_queries_match_a_linear_scan()
+    test_incremental_updates_from_the_change_journal()
+    print("All user search tests passed")